@@ -0,0 +1,176 @@
+"""Load test for the local JSON API of finance_tracker.py (--serve).
+
+By default it starts its own server on a generated ledger in a temporary folder, so your
+data is never touched:
+
+    python api_load_test.py --rows 100000 --threads 16 --seconds 10
+
+To measure a server that is already running, pass its URL. Writes then add real
+transactions (0.01 "API load test" income), so they are off unless --write-ratio is given:
+
+    python api_load_test.py --url http://127.0.0.1:8765
+
+Every thread sends a random mix of balance, transaction-page and summary reads (and a share of
+writes) on its own keep-alive connection. Throughput and latency percentiles are reported per
+endpoint.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from urllib.parse import urlsplit, urlencode
+
+ACCOUNTS = ["Cash", "Bank", "E-wallet"]
+CATEGORIES = ["Uncategorized", "Food", "Food > Groceries", "Food > Dining", "Transport", "Rent", "Utilities"]
+
+
+def write_ledger(folder, rows):
+    """A single-file ledger with `rows` random transactions over the last three years."""
+    today = date.today()
+    transactions = []
+    for i in range(rows):
+        trans_type = "Income" if random.random() < 0.3 else "Expense"
+        transactions.append({
+            "date": (today - timedelta(days=random.randint(0, 3 * 365))).isoformat(),
+            "account": random.choice(ACCOUNTS), "description": f"Load test {i % 500}",
+            "amount": round(random.uniform(1, 2000 if trans_type == "Income" else 500), 2),
+            "type": trans_type, "category": random.choice(CATEGORIES) if trans_type == "Expense" else None,
+            "id": f"load_{i}",
+        })
+    with open(os.path.join(folder, "finance_data.json"), 'w', encoding='utf-8') as f:
+        json.dump({"accounts": ACCOUNTS, "categories": CATEGORIES, "transactions": transactions}, f)
+
+
+def start_server(folder, port):
+    """Starts `finance_tracker.py --serve` in `folder` and waits until it answers."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "finance_tracker.py")
+    process = subprocess.Popen([sys.executable, script, "--serve", "--port", str(port)], cwd=folder)
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The server exited with code {process.returncode}.")
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            connection.request("GET", "/balances")
+            connection.getresponse().read()
+            connection.close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("The server didn't start within 2 minutes.")
+
+
+def random_filters():
+    today = date.today()
+    filters = {}
+    if random.random() < 0.7:
+        start = today - timedelta(days=random.randint(0, 3 * 365))
+        filters["start"] = start.isoformat()
+        filters["end"] = min(today, start + timedelta(days=random.choice((7, 30, 90, 365)))).isoformat()
+    if random.random() < 0.3: filters["account"] = random.choice(ACCOUNTS)
+    if random.random() < 0.3: filters["category"] = random.choice(["Food", "Transport", "Rent"])
+    if random.random() < 0.2: filters["q"] = f"amount > {random.randint(10, 400)}"
+    return filters
+
+
+def next_request(write_ratio):
+    """(label, method, path, body) of a random request."""
+    if random.random() < write_ratio:
+        body = {"account": random.choice(ACCOUNTS), "amount": 0.01, "type": "Income", "description": "API load test"}
+        return "POST /transactions", "POST", "/transactions", body
+    kind = random.random()
+    if kind < 0.2:
+        as_of = random.choice(["", (date.today() - timedelta(days=random.randint(0, 3 * 365))).isoformat()])
+        return "GET /balances", "GET", "/balances" + (f"?as_of={as_of}" if as_of else ""), None
+    if kind < 0.7:
+        params = dict(random_filters(), offset=random.choice((0, 0, 100, 500)), limit=100)
+        return "GET /transactions", "GET", "/transactions?" + urlencode(params), None
+    return "GET /summary", "GET", "/summary?" + urlencode(random_filters()), None
+
+
+def worker(host, port, stop_at, write_ratio, results, lock):
+    connection = http.client.HTTPConnection(host, port, timeout=60)
+    latencies, errors = defaultdict(list), defaultdict(int)
+    while time.monotonic() < stop_at:
+        label, method, path, body = next_request(write_ratio)
+        started = time.perf_counter()
+        try:
+            payload = json.dumps(body).encode('utf-8') if body is not None else None
+            connection.request(method, path, body=payload, headers={"Content-Type": "application/json"} if payload else {})
+            response = connection.getresponse()
+            response.read()
+            if response.status >= 400: errors[label] += 1
+        except (OSError, http.client.HTTPException):
+            errors[label] += 1
+            connection.close()
+            connection = http.client.HTTPConnection(host, port, timeout=60)
+            continue
+        latencies[label].append(time.perf_counter() - started)
+    connection.close()
+    with lock:
+        for label, values in latencies.items(): results["latencies"][label].extend(values)
+        for label, count in errors.items(): results["errors"][label] += count
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def run(host, port, threads, seconds, write_ratio):
+    results = {"latencies": defaultdict(list), "errors": defaultdict(int)}
+    lock = threading.Lock()
+    stop_at = time.monotonic() + seconds
+    workers = [threading.Thread(target=worker, args=(host, port, stop_at, write_ratio, results, lock)) for _ in range(threads)]
+    started = time.monotonic()
+    for thread in workers: thread.start()
+    for thread in workers: thread.join()
+    elapsed = time.monotonic() - started
+
+    total = sum(len(values) for values in results["latencies"].values())
+    print(f"{threads} threads, {elapsed:.1f}s: {total} requests, {total / elapsed:,.0f}/s")
+    print(f"{'endpoint':<20}{'count':>8}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for label in sorted(set(results["latencies"]) | set(results["errors"])):
+        values = sorted(results["latencies"][label])
+        if values:
+            p50, p95, p99 = (percentile(values, fraction) * 1000 for fraction in (0.5, 0.95, 0.99))
+        else:
+            p50 = p95 = p99 = float("nan")
+        print(f"{label:<20}{len(values):>8}{results['errors'][label]:>8}{p50:>9.1f}{p95:>9.1f}{p99:>9.1f}")
+    return sum(results["errors"].values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test for the finance_tracker.py JSON API")
+    parser.add_argument("--url", help="Test a running server instead of starting one (e.g. http://127.0.0.1:8765)")
+    parser.add_argument("--rows", type=int, default=50_000, help="Transactions in the generated ledger (default 50000)")
+    parser.add_argument("--port", type=int, default=8799, help="Port for the server this script starts (default 8799)")
+    parser.add_argument("--threads", type=int, default=8, help="Concurrent clients (default 8)")
+    parser.add_argument("--seconds", type=float, default=10.0, help="Test duration (default 10)")
+    parser.add_argument("--write-ratio", type=float, default=None,
+                        help="Share of requests that add a transaction (default 0.05, or 0 with --url)")
+    args = parser.parse_args()
+
+    if args.url:
+        url = urlsplit(args.url)
+        errors = run(url.hostname, url.port or 80, args.threads, args.seconds, args.write_ratio or 0.0)
+    else:
+        with tempfile.TemporaryDirectory() as folder:
+            print(f"Generating a ledger of {args.rows} transactions...")
+            write_ledger(folder, args.rows)
+            server = start_server(folder, args.port)
+            try:
+                write_ratio = 0.05 if args.write_ratio is None else args.write_ratio
+                errors = run("127.0.0.1", args.port, args.threads, args.seconds, write_ratio)
+            finally:
+                server.terminate()
+                server.wait()
+    sys.exit(1 if errors else 0)
@@ -1,30 +1,96 @@
 import tkinter as tk
-from tkinter import ttk, messagebox, simpledialog, Listbox
+from tkinter import ttk, messagebox, simpledialog, filedialog, Listbox
 import ttkbootstrap as tb
 from ttkbootstrap.constants import *
 from ttkbootstrap.tooltip import ToolTip
 from ttkbootstrap.widgets import DateEntry
 import json
-from datetime import datetime, date # Keep datetime
+import re
+from datetime import datetime, date, timedelta # Keep datetime
 import os
-from collections import defaultdict
+import sys
+import calendar
+import csv
+import struct
+import gzip
+import lzma
+import mmap
+import zlib
+import time
+import math
+import heapq
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from bisect import bisect_left, bisect_right, insort
+import argparse
+from array import array
+from itertools import accumulate
+from collections import defaultdict, deque, OrderedDict
+try:
+    import fcntl # POSIX advisory locks
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
 
 # --- Configuration ---
-FINANCE_DATA_FILE = "finance_data.json"
+FINANCE_DATA_FILE = "finance_data.json"  # Default ledger; others can be opened as profiles
+PROFILES_FILE = "finance_profiles.json"  # Ledger files listed as profiles, and the one open last
+PROFILE_CACHE_MAX_ENTRIES = 3     # Ledgers switched away from whose loaded state is kept for switching back
+PROFILE_CACHE_MAX_BYTES = 512 * 1024 ** 2 # Upper bound on the estimated memory of those kept states
+PROFILE_STATE_OVERHEAD = 1.2      # Ledger memory per byte of its transaction rows' objects (indexes and caches share the rows)
 DEFAULT_THEME = "darkly"
 CURRENCY_SYMBOL = "₱"
+BASE_CURRENCY = "PHP"              # Currency of CURRENCY_SYMBOL; accounts without a currency use it
+CURRENCY_SYMBOLS = {"PHP": "₱", "USD": "$", "EUR": "€", "GBP": "£", "JPY": "¥"} # Others are shown by code
+FX_RATES_FILE = "finance_fx_rates.json" # Imported exchange rates
 TRANS_EXPENSE = "Expense"
 TRANS_INCOME = "Income"
 TRANSFER_OUT_DESC = "Transfer to {}"
 TRANSFER_IN_DESC = "Transfer from {}"
 UNCATEGORIZED = "Uncategorized" # Default category
+SPLIT_ROW_SEPARATOR = "::"        # History rows of a split expense's parts are "<transaction id>::<n>"
+CATEGORY_SEPARATOR = " > "        # "Food > Groceries" is the Groceries subcategory of Food
+PARTITION_DIR_SUFFIX = "_parts"   # Per-year transaction files live in e.g. finance_data_parts/
+ACTIVE_PARTITION_YEARS = 2        # Current and previous year are loaded at startup
+CLOSED_PERIOD_DIR_SUFFIX = "_closed" # Archives of closed periods live in e.g. finance_data_closed/
+CLOSED_PERIOD_SEARCH_LIMIT = 500  # Archived transactions listed per search under "Closed Periods"
+OPENING_BALANCE_DESCRIPTION = "Opening balance" # Rows that carry a closed period's balances forward
+MAX_ARCHIVED_ROWS_LOADED = 200_000 # Older years loaded on demand are evicted (LRU) above this
+LEDGER_FORMAT = "json"            # Partition file format: "json", "binary" (compact, faster) or "mmap" (fixed records, appendable)
+LEDGER_COMPRESSION = None         # Binary format only: None, "gzip" or "lzma"
+LEDGER_SCHEMA_VERSION = 1         # Bump when stored transactions change shape; files of other versions are re-validated on load
+CHECKSUM_MODULUS = 2 ** 64         # Ledger checksums are sums of per-transaction CRCs modulo this
+BALANCE_VERIFY_CHUNK = 20_000      # Transactions re-checked per idle callback after startup
+LEDGER_LOCK_SUFFIX = ".lock"       # Lock file next to the data file, shared by every instance
+LEDGER_LOCK_TIMEOUT = 10.0         # Seconds to wait for another program to release the ledger
+LEDGER_POLL_INTERVAL_MS = 3000     # How often to check the data file for changes saved elsewhere
+RECURRENCE_FREQUENCIES = ("Daily", "Weekly", "Monthly", "Yearly")
+RECURRENCE_UNITS = {"Daily": "days", "Weekly": "weeks", "Monthly": "months", "Yearly": "years"}
+SCHEDULE_CHECK_INTERVAL_MS = 60_000 # How often to check for a date change (new recurring transactions due)
+CHART_REFRESH_DELAY_MS = 300     # Open charts redraw this long after the last ledger change
+CHART_MAX_CATEGORIES = 6          # Categories charted separately; the rest are summed as "Other"
+NET_WORTH_STEPS = ("Daily", "Weekly", "Monthly") # Sample spacing of the net worth history (weeks end on Sunday)
+UNDO_HISTORY_LIMIT = 100          # Commands kept for undo (and as many for redo)
+AUTOCOMPLETE_SUGGESTIONS = 8      # Past descriptions listed under a description entry while typing
+AUTOCOMPLETE_HALF_LIFE_DAYS = 90  # A past use of a description counts half as much as one this many days newer
+STATEMENT_DATE_FORMATS = ('%Y-%m-%d', '%Y/%m/%d', '%m/%d/%Y', '%d.%m.%Y') # Tried in order when reading bank statements
+RECONCILE_DATE_TOLERANCE_DAYS = 3 # Default days a statement line's date may differ from the ledger's
+QUERY_CACHE_MAX_ENTRIES = 32      # Filter/summary results kept in the LRU query cache
+QUERY_CACHE_MAX_ROWS = 500_000    # Upper bound on the total number of cached transaction ids
+API_HOST = "127.0.0.1"            # The JSON API (--serve) only listens locally unless --host says otherwise
+API_PORT = 8765
+API_PAGE_SIZE = 100               # Transactions per page when a request doesn't give ?limit=
+API_MAX_PAGE_SIZE = 1000
 
 # --- Edit Transaction Dialog ---
 class EditTransactionDialog(simpledialog.Dialog):
     """Dialog window for editing an existing transaction."""
-    def __init__(self, parent, title, transaction_data, accounts, categories):
+    def __init__(self, parent, title, transaction_data, accounts, categories, suggest=None, describe_suggestion=None):
         self.transaction_data = transaction_data # Store the original data
         self.accounts = accounts
+        self.suggest = suggest # Description autocomplete, see DescriptionIndex.suggest
+        self.describe_suggestion = describe_suggestion
         self.categories = [UNCATEGORIZED] + sorted(list(categories)) # Add Uncategorized option
         # Data variables for the dialog's fields
         self.date_var = tk.StringVar(value=transaction_data.get('date', ''))
@@ -39,10 +105,7 @@ class EditTransactionDialog(simpledialog.Dialog):
              self.categories.append(current_category)
              self.categories.sort() # Keep sorted
         self.category_var = tk.StringVar(value=current_category or UNCATEGORIZED)
-
-        # Transfer check - disable editing if it's part of a transfer
-        self.is_transfer = (TRANSFER_IN_DESC.split('{}')[0] in self.description_var.get() or
-                            TRANSFER_OUT_DESC.split('{}')[0] in self.description_var.get())
+        self.splits = transaction_data.get('splits') # [[category, amount], ...] of a split expense
 
         super().__init__(parent, title)
 
@@ -52,11 +115,6 @@ class EditTransactionDialog(simpledialog.Dialog):
         frame.pack(fill=BOTH, expand=True)
         frame.columnconfigure(1, weight=1)
 
-        if self.is_transfer:
-            tb.Label(frame, text="Cannot edit transfers directly.\nPlease delete both parts and re-add if needed.",
-                     bootstyle=WARNING, wraplength=300).grid(row=0, column=0, columnspan=2, pady=10)
-            return frame # Stop building the form if it's a transfer
-
         # Date
         tb.Label(frame, text="Date:").grid(row=1, column=0, padx=5, pady=3, sticky=W)
         date_entry = DateEntry(frame, bootstyle=PRIMARY, dateformat='%Y-%m-%d', firstweekday=0)
@@ -72,6 +130,8 @@ class EditTransactionDialog(simpledialog.Dialog):
         tb.Label(frame, text="Description:").grid(row=3, column=0, padx=5, pady=3, sticky=W)
         desc_entry = tb.Entry(frame, textvariable=self.description_var, bootstyle=PRIMARY)
         desc_entry.grid(row=3, column=1, padx=5, pady=3, sticky=EW)
+        if self.suggest:
+            DescriptionAutocomplete(desc_entry, self.description_var, self.suggest, self.on_suggestion_picked, self.describe_suggestion)
 
         # Amount
         tb.Label(frame, text="Amount:").grid(row=4, column=0, padx=5, pady=3, sticky=W)
@@ -90,6 +150,9 @@ class EditTransactionDialog(simpledialog.Dialog):
 
         self.category_label.grid(row=6, column=0, padx=5, pady=3, sticky=W)
         self.category_combo.grid(row=6, column=1, padx=5, pady=3, sticky=EW)
+        self.split_button = tb.Button(frame, text="Split", command=self.edit_splits, bootstyle=(SECONDARY, OUTLINE))
+        self.split_button.grid(row=6, column=2, padx=(0, 5), pady=3)
+        self._show_splits()
         self.on_type_change() # Set initial visibility
 
         return desc_entry # Set initial focus
@@ -99,31 +162,46 @@ class EditTransactionDialog(simpledialog.Dialog):
         if self.type_var.get() == TRANS_EXPENSE:
             self.category_label.grid()
             self.category_combo.grid()
+            self.split_button.grid()
         else:
             self.category_label.grid_remove()
             self.category_combo.grid_remove()
+            self.split_button.grid_remove()
             self.category_var.set(UNCATEGORIZED) # Reset category if type changes to Income
+            self.splits = None
+            self._show_splits()
+
+    def on_suggestion_picked(self, description, usual):
+        """Takes the usual category of a picked description; the account and amount stay those of this transaction."""
+        trans_type, _, category, _ = usual
+        if trans_type == TRANS_EXPENSE and self.type_var.get() == TRANS_EXPENSE and not self.splits and category in self.categories:
+            self.category_var.set(category)
+
+    def edit_splits(self):
+        try: amount = self.amount_var.get()
+        except tk.TclError: amount = 0.0
+        dialog = SplitDialog(self, "Split Expense", self.categories, amount, self.splits or [[self.category_var.get(), amount]])
+        if dialog.result is None:
+            return
+        self.splits = dialog.result if len(dialog.result) > 1 else None
+        self.category_var.set(split_category(dialog.result))
+        self.amount_var.set(round(sum(split_amount for _, split_amount in dialog.result), 2))
+        self._show_splits()
+
+    def _show_splits(self):
+        """A split expense's category follows its splits, so it can only be changed in the split dialog."""
+        self.category_combo.config(state="disabled" if self.splits else "readonly")
+        self.split_button.config(text=f"Split ({len(self.splits)})" if self.splits else "Split")
 
     def buttonbox(self):
         """Creates Save and Cancel buttons."""
-        if self.is_transfer:
-             # Only show Cancel if it's a transfer
-            box = tb.Frame(self)
-            cancel_btn = tb.Button(box, text="Close", width=10, command=self.cancel, bootstyle=SECONDARY)
-            cancel_btn.pack(side=tk.RIGHT, padx=5, pady=5)
-            box.pack()
-        else:
-            # Default OK/Cancel if not a transfer
-            super().buttonbox()
-            # Rename "OK" to "Save"
-            self.ok_button = self.children['!frame'].children['!button'] # Fragile but common way
-            self.ok_button.config(text="Save Changes", bootstyle=SUCCESS)
+        super().buttonbox()
+        # Rename "OK" to "Save"
+        self.ok_button = self.children['!frame'].children['!button'] # Fragile but common way
+        self.ok_button.config(text="Save Changes", bootstyle=SUCCESS)
 
     def validate(self):
         """Validates the input before closing the dialog."""
-        if self.is_transfer: # Skip validation if it's a transfer (form is disabled)
-            return True
-
         try:
             date_str = self.date_var.get()
             account = self.account_var.get()
@@ -143,6 +221,7 @@ class EditTransactionDialog(simpledialog.Dialog):
                  self.category_var.set(UNCATEGORIZED)
                  category = UNCATEGORIZED
                  # Optionally: raise ValueError("Category is required for expenses.")
+            if self.splits: validated_splits(self.splits, amount) # The amount may have changed since splitting
 
             # Note: We don't re-check for sufficient funds on *edit* here,
             # as it might be correcting a past mistake or involve complex reversals.
@@ -158,11 +237,8 @@ class EditTransactionDialog(simpledialog.Dialog):
 
     def apply(self):
         """Processes the validated data and returns it."""
-        if self.is_transfer:
-            self.result = None # Indicate no changes made for transfers
-            return
-
-        updated_data = {
+        updated_data = dict(self.transaction_data) # Keep any extra fields (e.g. transfer_id)
+        updated_data.update({
             "date": self.date_var.get(),
             "account": self.account_var.get(),
             "description": self.description_var.get().strip(),
@@ -170,15 +246,159 @@ class EditTransactionDialog(simpledialog.Dialog):
             "type": self.type_var.get(),
             "category": self.category_var.get() if self.type_var.get() == TRANS_EXPENSE else None, # Store None if not expense
             "id": self.transaction_data.get('id') # Keep the original ID
-        }
+        })
+        if self.splits: updated_data['splits'] = self.splits
+        else: updated_data.pop('splits', None)
         self.result = updated_data # Store the result
 
+# --- Split Dialog ---
+class SplitDialog(simpledialog.Dialog):
+    """Dialog to divide one expense between several categories.
+
+    Result: [[category, amount], ...] with the amounts that were entered (empty lines are
+    dropped). A single line means the expense isn't split. The caller sets the transaction's
+    amount to the total.
+    """
+    def __init__(self, parent, title, categories, amount, splits):
+        self.categories = [UNCATEGORIZED] + sorted(c for c in categories if c != UNCATEGORIZED)
+        self.amount = amount
+        lines = [list(split) for split in splits] + [[UNCATEGORIZED, 0.0]] # One empty line to fill in
+        self.lines = [(tk.StringVar(value=category), tk.StringVar(value=f"{split_amount:.2f}" if split_amount else ""))
+                      for category, split_amount in lines]
+        self.total_var = tk.StringVar()
+        super().__init__(parent, title)
+
+    def body(self, master):
+        frame = tb.Frame(master, padding=10)
+        frame.pack(fill=BOTH, expand=True)
+        self.lines_frame = tb.Frame(frame)
+        self.lines_frame.pack(fill=X)
+        self.lines_frame.columnconfigure(0, weight=1)
+        for row, line in enumerate(self.lines):
+            self._grid_line(row, line)
+
+        bottom = tb.Frame(frame)
+        bottom.pack(fill=X, pady=(5, 0))
+        tb.Button(bottom, text="Add Line", command=self.add_line, bootstyle=(SECONDARY, OUTLINE)).pack(side=LEFT, padx=5)
+        tb.Label(bottom, textvariable=self.total_var).pack(side=RIGHT, padx=5)
+        self.update_total()
+        return None
+
+    def _grid_line(self, row, line):
+        category_var, amount_var = line
+        tb.Combobox(self.lines_frame, textvariable=category_var, values=self.categories, state="readonly", bootstyle=PRIMARY).grid(row=row, column=0, padx=5, pady=2, sticky=EW)
+        tb.Entry(self.lines_frame, textvariable=amount_var, width=10, bootstyle=PRIMARY).grid(row=row, column=1, padx=5, pady=2)
+        amount_var.trace_add("write", self.update_total)
+
+    def add_line(self):
+        line = (tk.StringVar(value=UNCATEGORIZED), tk.StringVar(value=""))
+        self.lines.append(line)
+        self._grid_line(len(self.lines) - 1, line)
+
+    def _entered_lines(self):
+        """[category, amount] of every line with an amount (raises ValueError)."""
+        entered = []
+        for category_var, amount_var in self.lines:
+            text = amount_var.get().strip()
+            if not text:
+                continue
+            try: split_amount = float(text)
+            except ValueError: raise ValueError(f"Invalid amount: '{text}'.")
+            if split_amount: entered.append([category_var.get() or UNCATEGORIZED, split_amount])
+        return entered
+
+    def update_total(self, *args):
+        try:
+            total = sum(split_amount for _, split_amount in self._entered_lines())
+        except ValueError:
+            self.total_var.set("Total: ?")
+            return
+        self.total_var.set(f"Total: {total:,.2f}" + (f" (was {self.amount:,.2f})" if self.amount and abs(total - self.amount) > 0.005 else ""))
+
+    def validate(self):
+        try:
+            entered = self._entered_lines()
+            if not entered: raise ValueError("Enter the amount of at least one category.")
+            if any(split_amount < 0 for _, split_amount in entered): raise ValueError("Amounts must be positive.")
+            self.result = validated_splits(entered, sum(split_amount for _, split_amount in entered)) if len(entered) > 1 \
+                else [[entered[0][0], round(entered[0][1], 2)]]
+            return True
+        except ValueError as e:
+            messagebox.showerror("Input Error", str(e), parent=self)
+            return False
+
+
+# --- Edit Transfer Dialog ---
+class EditTransferDialog(simpledialog.Dialog):
+    """Dialog window for editing both legs of a transfer at once."""
+    def __init__(self, parent, title, out_leg, in_leg, accounts):
+        self.accounts = accounts
+        self.date_var = tk.StringVar(value=out_leg.get('date', ''))
+        self.from_account_var = tk.StringVar(value=out_leg.get('account', ''))
+        self.to_account_var = tk.StringVar(value=in_leg.get('account', ''))
+        self.amount_var = tk.DoubleVar(value=out_leg.get('amount', 0.0))
+        super().__init__(parent, title)
+
+    def body(self, master):
+        """Creates the dialog body (widgets)."""
+        frame = tb.Frame(master, padding=10)
+        frame.pack(fill=BOTH, expand=True)
+        frame.columnconfigure(1, weight=1)
+
+        tb.Label(frame, text="Date:").grid(row=0, column=0, padx=5, pady=3, sticky=W)
+        date_entry = DateEntry(frame, bootstyle=PRIMARY, dateformat='%Y-%m-%d', firstweekday=0)
+        date_entry.entry.config(textvariable=self.date_var)
+        date_entry.grid(row=0, column=1, padx=5, pady=3, sticky=EW)
+
+        tb.Label(frame, text="From Account:").grid(row=1, column=0, padx=5, pady=3, sticky=W)
+        tb.Combobox(frame, textvariable=self.from_account_var, values=self.accounts, state="readonly", bootstyle=PRIMARY).grid(row=1, column=1, padx=5, pady=3, sticky=EW)
+
+        tb.Label(frame, text="To Account:").grid(row=2, column=0, padx=5, pady=3, sticky=W)
+        tb.Combobox(frame, textvariable=self.to_account_var, values=self.accounts, state="readonly", bootstyle=PRIMARY).grid(row=2, column=1, padx=5, pady=3, sticky=EW)
+
+        tb.Label(frame, text="Amount:").grid(row=3, column=0, padx=5, pady=3, sticky=W)
+        amount_entry = tb.Entry(frame, textvariable=self.amount_var, bootstyle=PRIMARY)
+        amount_entry.grid(row=3, column=1, padx=5, pady=3, sticky=EW)
+
+        tb.Label(frame, text="Both sides of the transfer will be updated.", bootstyle=INFO).grid(row=4, column=0, columnspan=2, padx=5, pady=(8, 0), sticky=W)
+        return amount_entry
+
+    def validate(self):
+        """Validates the input before closing the dialog."""
+        try:
+            date_str = self.date_var.get()
+            if not date_str: raise ValueError("Date is required.")
+            try: datetime.strptime(date_str, '%Y-%m-%d')
+            except ValueError: raise ValueError(f"Invalid date format: '{date_str}'. Use YYYY-MM-DD.")
+            if not self.from_account_var.get() or not self.to_account_var.get(): raise ValueError("Both accounts are required.")
+            if self.from_account_var.get() == self.to_account_var.get(): raise ValueError("'From' and 'To' accounts cannot be the same.")
+            if self.amount_var.get() <= 0: raise ValueError("Amount must be a positive number.")
+            return True
+        except ValueError as e:
+            messagebox.showerror("Input Error", str(e), parent=self)
+            return False
+        except Exception as e:
+            messagebox.showerror("Error", f"An unexpected error occurred during validation: {e}", parent=self)
+            return False
+
+    def apply(self):
+        """Returns the new transfer fields; the caller rewrites both legs."""
+        self.result = {
+            "date": self.date_var.get(),
+            "from_account": self.from_account_var.get(),
+            "to_account": self.to_account_var.get(),
+            "amount": self.amount_var.get(),
+        }
+
 # --- Category Manager Dialog ---
 class CategoryManagerDialog(simpledialog.Dialog):
-    """Dialog to add/delete expense categories."""
+    """Dialog to add/delete expense categories. A category can be nested under a parent."""
+    TOP_LEVEL = "(Top Level)"
+
     def __init__(self, parent, title, categories):
         self.categories = sorted(list(categories)) # Work with a sorted copy
         self.new_category_var = tk.StringVar()
+        self.parent_category_var = tk.StringVar(value=self.TOP_LEVEL)
         super().__init__(parent, title)
 
     def body(self, master):
@@ -205,6 +425,11 @@ class CategoryManagerDialog(simpledialog.Dialog):
         self.new_cat_entry.grid(row=0, column=0, padx=(0,5), pady=2, sticky=EW)
         ToolTip(self.new_cat_entry, text="Enter new category name", bootstyle=(INFO, INVERSE))
 
+        self.parent_combo = tb.Combobox(action_frame, textvariable=self.parent_category_var, state="readonly")
+        self.parent_combo.grid(row=1, column=0, padx=(0,5), pady=2, sticky=EW)
+        ToolTip(self.parent_combo, text="Parent category for the new one", bootstyle=(INFO, INVERSE))
+        self._update_parent_choices()
+
         add_btn = tb.Button(action_frame, text="Add", command=self.add_category, bootstyle=SUCCESS)
         add_btn.grid(row=0, column=1, padx=(0,5), pady=2)
 
@@ -224,12 +449,22 @@ class CategoryManagerDialog(simpledialog.Dialog):
         if new_cat == UNCATEGORIZED:
              messagebox.showwarning("Reserved", f"'{UNCATEGORIZED}' is a reserved name.", parent=self)
              return
+        parent_cat = self.parent_category_var.get()
+        if parent_cat != self.TOP_LEVEL:
+            new_cat = parent_cat + CATEGORY_SEPARATOR + new_cat
+            if new_cat in self.categories:
+                messagebox.showwarning("Duplicate", f"Category '{new_cat}' already exists.", parent=self)
+                return
 
-        self.categories.append(new_cat)
+        # A path typed as "A > B" brings in any missing ancestors too
+        added = [node for node in CategoryTree((new_cat,)).nodes if node not in self.categories]
+        self.categories.extend(added)
         self.categories.sort()
         # Update listbox
-        self.listbox.insert(tk.END, new_cat)
+        for cat in added:
+            self.listbox.insert(tk.END, cat)
         self._sort_listbox()
+        self._update_parent_choices()
         self.new_category_var.set("")
 
     def delete_category(self):
@@ -243,9 +478,19 @@ class CategoryManagerDialog(simpledialog.Dialog):
             messagebox.showwarning("Cannot Delete", f"Cannot delete the '{UNCATEGORIZED}' category.", parent=self)
             return
 
-        if messagebox.askyesno("Confirm Delete", f"Are you sure you want to delete the category '{selected_cat}'?\n(Existing transactions using it will remain, but you won't be able to select it for new ones)", parent=self):
-            self.categories.remove(selected_cat)
-            self.listbox.delete(selected_indices[0])
+        subtree = CategoryTree.of(self.categories).subtree(selected_cat)
+        also = f"\nIts {len(subtree) - 1} subcategories will be deleted too." if len(subtree) > 1 else ""
+        if messagebox.askyesno("Confirm Delete", f"Are you sure you want to delete the category '{selected_cat}'?{also}\n(Existing transactions using it will remain, but you won't be able to select it for new ones)", parent=self):
+            self.categories = [cat for cat in self.categories if cat not in subtree]
+            self.listbox.delete(0, tk.END)
+            for cat in self.categories:
+                self.listbox.insert(tk.END, cat)
+            self._update_parent_choices()
+
+    def _update_parent_choices(self):
+        self.parent_combo['values'] = [self.TOP_LEVEL] + [cat for cat in self.categories if cat != UNCATEGORIZED]
+        if self.parent_category_var.get() not in self.parent_combo['values']:
+            self.parent_category_var.set(self.TOP_LEVEL)
 
     def _sort_listbox(self):
         items = list(self.listbox.get(0, tk.END))
@@ -270,20 +515,2944 @@ class CategoryManagerDialog(simpledialog.Dialog):
         self.result = sorted(self.categories)
 
 
+# --- Recurring Schedules Dialog ---
+class RecurringScheduleDialog(simpledialog.Dialog):
+    """Dialog to review recurring schedules and stop the ones no longer needed."""
+    def __init__(self, parent, title, schedules, account_currency=lambda account: BASE_CURRENCY):
+        self.schedules = list(schedules) # Work with a copy
+        self.account_currency = account_currency
+        super().__init__(parent, title)
+
+    def body(self, master):
+        frame = tb.Frame(master, padding=10)
+        frame.pack(fill=BOTH, expand=True)
+
+        list_frame = tb.Frame(frame)
+        list_frame.pack(pady=5, fill=BOTH, expand=True)
+
+        self.listbox = Listbox(list_frame, selectmode=tk.SINGLE, height=8, width=60, relief="flat")
+        self.listbox.pack(side=LEFT, fill=BOTH, expand=True, padx=(0,5))
+        for schedule in self.schedules:
+            self.listbox.insert(tk.END, self._describe(schedule))
+
+        scrollbar = tb.Scrollbar(list_frame, orient=VERTICAL, command=self.listbox.yview, bootstyle="round-info")
+        scrollbar.pack(side=RIGHT, fill=Y)
+        self.listbox.config(yscrollcommand=scrollbar.set)
+
+        stop_btn = tb.Button(frame, text="Stop Selected", command=self.stop_schedule, bootstyle=DANGER)
+        stop_btn.pack(pady=5, anchor=E)
+        ToolTip(stop_btn, text="No more transactions will be created. Ones already added are kept.", bootstyle=(INFO, INVERSE))
+        return self.listbox
+
+    def _describe(self, schedule):
+        interval = schedule.get("interval", 1)
+        every = schedule["frequency"] if interval == 1 else f"Every {interval} {RECURRENCE_UNITS[schedule['frequency']]}"
+        next_date = next(schedule_occurrences(schedule, after=max(schedule.get("materialized_through") or "", date.today().isoformat())), None)
+        return (f"{every}: {schedule.get('description') or schedule['type']} ({schedule['type']} {format_money(schedule['amount'], self.account_currency(schedule['account']))}, "
+                f"{schedule['account']}) - next {next_date or 'none'}")
+
+    def stop_schedule(self):
+        selected_indices = self.listbox.curselection()
+        if not selected_indices:
+            messagebox.showwarning("Selection Error", "Please select a schedule to stop.", parent=self)
+            return
+        if messagebox.askyesno("Confirm Stop", "Stop this recurring transaction?\n(Transactions it already added will remain)", parent=self):
+            del self.schedules[selected_indices[0]]
+            self.listbox.delete(selected_indices[0])
+
+    def buttonbox(self):
+        box = tb.Frame(self)
+        w = tb.Button(box, text="Save & Close", width=15, command=self.ok, default=tk.ACTIVE, bootstyle=PRIMARY)
+        w.pack(side=tk.LEFT, padx=5, pady=5)
+        w = tb.Button(box, text="Cancel", width=10, command=self.cancel, bootstyle=SECONDARY)
+        w.pack(side=tk.LEFT, padx=5, pady=5)
+        self.bind("<Return>", self.ok)
+        self.bind("<Escape>", self.cancel)
+        box.pack()
+
+    def apply(self):
+        self.result = self.schedules
+
+
+# --- Budget Dialog ---
+class BudgetDialog(simpledialog.Dialog):
+    """Dialog to set monthly budgets per expense category, for every month or a single month."""
+    EVERY_MONTH = "Every month"
+
+    def __init__(self, parent, title, categories, budgets, budget_overrides, spent):
+        self.categories = sorted(categories)
+        self.budgets = dict(budgets) # category -> monthly amount (copies, applied on Save)
+        self.budget_overrides = {month: dict(amounts) for month, amounts in budget_overrides.items()} # 'YYYY-MM' -> {category: amount}
+        self.spent = spent           # spent(month, category) -> expenses so far
+        self.this_month = date.today().strftime('%Y-%m')
+        self.category_var = tk.StringVar(value=self.categories[0] if self.categories else "")
+        self.month_var = tk.StringVar(value=self.EVERY_MONTH)
+        self.amount_var = tk.DoubleVar(value=0.0)
+        super().__init__(parent, title)
+
+    def body(self, master):
+        frame = tb.Frame(master, padding=10)
+        frame.pack(fill=BOTH, expand=True)
+
+        tb.Label(frame, text=f"This month ({self.this_month}):").pack(anchor=W)
+        list_frame = tb.Frame(frame)
+        list_frame.pack(pady=5, fill=BOTH, expand=True)
+        self.listbox = Listbox(list_frame, selectmode=tk.SINGLE, height=8, width=55, relief="flat")
+        self.listbox.pack(side=LEFT, fill=BOTH, expand=True, padx=(0,5))
+        scrollbar = tb.Scrollbar(list_frame, orient=VERTICAL, command=self.listbox.yview, bootstyle="round-info")
+        scrollbar.pack(side=RIGHT, fill=Y)
+        self.listbox.config(yscrollcommand=scrollbar.set)
+        self._refresh_list()
+
+        form = tb.Frame(frame)
+        form.pack(pady=5, fill=X)
+        form.columnconfigure(1, weight=1)
+        tb.Label(form, text="Category:").grid(row=0, column=0, padx=5, pady=2, sticky=W)
+        category_combo = tb.Combobox(form, textvariable=self.category_var, values=self.categories, state="readonly")
+        category_combo.grid(row=0, column=1, padx=5, pady=2, sticky=EW)
+        tb.Label(form, text="Month:").grid(row=1, column=0, padx=5, pady=2, sticky=W)
+        month_combo = tb.Combobox(form, textvariable=self.month_var, values=[self.EVERY_MONTH, self.this_month])
+        month_combo.grid(row=1, column=1, padx=5, pady=2, sticky=EW)
+        ToolTip(month_combo, text="'Every month', or a single month as YYYY-MM", bootstyle=(INFO, INVERSE))
+        tb.Label(form, text="Amount:").grid(row=2, column=0, padx=5, pady=2, sticky=W)
+        amount_entry = tb.Entry(form, textvariable=self.amount_var)
+        amount_entry.grid(row=2, column=1, padx=5, pady=2, sticky=EW)
+
+        button_frame = tb.Frame(form)
+        button_frame.grid(row=3, column=0, columnspan=2, pady=(5, 0), sticky=E)
+        tb.Button(button_frame, text="Set", command=self.set_budget, bootstyle=SUCCESS).pack(side=LEFT, padx=5)
+        tb.Button(button_frame, text="Remove", command=self.remove_budget, bootstyle=DANGER).pack(side=LEFT, padx=5)
+        return amount_entry
+
+    def _refresh_list(self):
+        self.listbox.delete(0, tk.END)
+        month_budgets = dict(self.budgets, **self.budget_overrides.get(self.this_month, {}))
+        for category in sorted(month_budgets):
+            budget = month_budgets[category]
+            spent = self.spent(self.this_month, category)
+            self.listbox.insert(tk.END, f"{category}: {CURRENCY_SYMBOL}{spent:,.2f} of {CURRENCY_SYMBOL}{budget:,.2f} ({CURRENCY_SYMBOL}{budget - spent:,.2f} left)")
+
+    def _selected_month(self):
+        month = self.month_var.get().strip()
+        if month == self.EVERY_MONTH:
+            return None
+        try:
+            return datetime.strptime(month, '%Y-%m').strftime('%Y-%m')
+        except ValueError:
+            raise ValueError(f"Invalid month: '{month}'. Use YYYY-MM or '{self.EVERY_MONTH}'.")
+
+    def set_budget(self):
+        try:
+            category = self.category_var.get()
+            if not category: raise ValueError("Please select a category.")
+            month = self._selected_month()
+            try: amount = self.amount_var.get()
+            except tk.TclError: raise ValueError("Invalid amount. Please enter a number.")
+            if amount <= 0: raise ValueError("Budget must be a positive number.")
+        except ValueError as e:
+            messagebox.showerror("Input Error", str(e), parent=self)
+            return
+        if month is None: self.budgets[category] = amount
+        else: self.budget_overrides.setdefault(month, {})[category] = amount
+        self._refresh_list()
+
+    def remove_budget(self):
+        try:
+            month = self._selected_month()
+        except ValueError as e:
+            messagebox.showerror("Input Error", str(e), parent=self)
+            return
+        category = self.category_var.get()
+        if month is None:
+            self.budgets.pop(category, None)
+        elif category in self.budget_overrides.get(month, {}):
+            del self.budget_overrides[month][category]
+            if not self.budget_overrides[month]: del self.budget_overrides[month]
+        self._refresh_list()
+
+    def buttonbox(self):
+        box = tb.Frame(self)
+        w = tb.Button(box, text="Save & Close", width=15, command=self.ok, default=tk.ACTIVE, bootstyle=PRIMARY)
+        w.pack(side=tk.LEFT, padx=5, pady=5)
+        w = tb.Button(box, text="Cancel", width=10, command=self.cancel, bootstyle=SECONDARY)
+        w.pack(side=tk.LEFT, padx=5, pady=5)
+        self.bind("<Return>", self.ok)
+        self.bind("<Escape>", self.cancel)
+        box.pack()
+
+    def apply(self):
+        self.result = (self.budgets, self.budget_overrides)
+
+
+# --- Category Rules Dialog ---
+class CategoryRulesDialog(simpledialog.Dialog):
+    """Dialog to add, remove and order the rules that categorize expenses automatically."""
+    ANY_ACCOUNT = "Any account"
+
+    def __init__(self, parent, title, rules, accounts, categories):
+        self.rules = [dict(rule) for rule in rules] # Copies, applied on Save
+        self.accounts = accounts
+        self.categories = sorted(categories)
+        self.category_var = tk.StringVar(value=self.categories[0] if self.categories else "")
+        self.keywords_var = tk.StringVar()
+        self.pattern_var = tk.StringVar()
+        self.account_var = tk.StringVar(value=self.ANY_ACCOUNT)
+        self.min_amount_var = tk.StringVar()
+        self.max_amount_var = tk.StringVar()
+        super().__init__(parent, title)
+
+    def body(self, master):
+        frame = tb.Frame(master, padding=10)
+        frame.pack(fill=BOTH, expand=True)
+
+        tb.Label(frame, text="Rules (the first matching rule wins):").pack(anchor=W)
+        list_frame = tb.Frame(frame)
+        list_frame.pack(pady=5, fill=BOTH, expand=True)
+        self.listbox = Listbox(list_frame, selectmode=tk.SINGLE, height=8, width=70, relief="flat")
+        self.listbox.pack(side=LEFT, fill=BOTH, expand=True, padx=(0,5))
+        scrollbar = tb.Scrollbar(list_frame, orient=VERTICAL, command=self.listbox.yview, bootstyle="round-info")
+        scrollbar.pack(side=RIGHT, fill=Y)
+        self.listbox.config(yscrollcommand=scrollbar.set)
+        self._refresh_list()
+        order_frame = tb.Frame(frame)
+        order_frame.pack(fill=X)
+        tb.Button(order_frame, text="Move Up", command=lambda: self.move_rule(-1), bootstyle=(SECONDARY, OUTLINE)).pack(side=LEFT, padx=(0, 5))
+        tb.Button(order_frame, text="Move Down", command=lambda: self.move_rule(1), bootstyle=(SECONDARY, OUTLINE)).pack(side=LEFT, padx=5)
+        tb.Button(order_frame, text="Remove", command=self.remove_rule, bootstyle=DANGER).pack(side=RIGHT)
+
+        form = tb.LabelFrame(frame, text="New Rule", padding=5)
+        form.pack(pady=(10, 0), fill=X)
+        form.columnconfigure((1, 3), weight=1)
+        tb.Label(form, text="Keywords:").grid(row=0, column=0, padx=5, pady=2, sticky=W)
+        keywords_entry = tb.Entry(form, textvariable=self.keywords_var)
+        keywords_entry.grid(row=0, column=1, columnspan=3, padx=5, pady=2, sticky=EW)
+        ToolTip(keywords_entry, text="Comma-separated; matches if the description contains any of them (any case)", bootstyle=(INFO, INVERSE))
+        tb.Label(form, text="Regex:").grid(row=1, column=0, padx=5, pady=2, sticky=W)
+        pattern_entry = tb.Entry(form, textvariable=self.pattern_var)
+        pattern_entry.grid(row=1, column=1, columnspan=3, padx=5, pady=2, sticky=EW)
+        ToolTip(pattern_entry, text="Optional regular expression searched in the description (any case)", bootstyle=(INFO, INVERSE))
+        tb.Label(form, text="Account:").grid(row=2, column=0, padx=5, pady=2, sticky=W)
+        tb.Combobox(form, textvariable=self.account_var, values=[self.ANY_ACCOUNT] + list(self.accounts), state="readonly").grid(row=2, column=1, columnspan=3, padx=5, pady=2, sticky=EW)
+        tb.Label(form, text="Amount from:").grid(row=3, column=0, padx=5, pady=2, sticky=W)
+        tb.Entry(form, textvariable=self.min_amount_var, width=10).grid(row=3, column=1, padx=5, pady=2, sticky=EW)
+        tb.Label(form, text="to:").grid(row=3, column=2, padx=5, pady=2, sticky=W)
+        tb.Entry(form, textvariable=self.max_amount_var, width=10).grid(row=3, column=3, padx=5, pady=2, sticky=EW)
+        tb.Label(form, text="Category:").grid(row=4, column=0, padx=5, pady=2, sticky=W)
+        tb.Combobox(form, textvariable=self.category_var, values=self.categories, state="readonly").grid(row=4, column=1, columnspan=3, padx=5, pady=2, sticky=EW)
+        tb.Button(form, text="Add Rule", command=self.add_rule, bootstyle=SUCCESS).grid(row=5, column=3, padx=5, pady=(5, 0), sticky=E)
+        return keywords_entry
+
+    def _refresh_list(self, select=None):
+        self.listbox.delete(0, tk.END)
+        for number, rule in enumerate(self.rules, start=1):
+            self.listbox.insert(tk.END, f"{number}. {CategoryRules.describe(rule)}")
+        if select is not None:
+            self.listbox.selection_set(select)
+
+    def add_rule(self):
+        try:
+            amounts = []
+            for var in (self.min_amount_var, self.max_amount_var):
+                text = var.get().strip()
+                try: amounts.append(float(text) if text else None)
+                except ValueError: raise ValueError(f"Invalid amount: '{text}'. Please enter a number.")
+            account = self.account_var.get()
+            rule = {
+                "id": f"{datetime.now().timestamp():.6f}",
+                "category": self.category_var.get(),
+                "keywords": [keyword.strip() for keyword in self.keywords_var.get().split(",") if keyword.strip()],
+                "pattern": self.pattern_var.get().strip(),
+                "account": None if account == self.ANY_ACCOUNT else account,
+                "min_amount": amounts[0], "max_amount": amounts[1],
+            }
+            CategoryRules.validate(rule)
+        except ValueError as e:
+            messagebox.showerror("Input Error", str(e), parent=self)
+            return
+        self.rules.append(rule)
+        self._refresh_list(select=len(self.rules) - 1)
+        for var in (self.keywords_var, self.pattern_var, self.min_amount_var, self.max_amount_var):
+            var.set("")
+
+    def remove_rule(self):
+        selection = self.listbox.curselection()
+        if not selection:
+            messagebox.showwarning("No Selection", "Please select a rule to remove.", parent=self)
+            return
+        del self.rules[selection[0]]
+        self._refresh_list()
+
+    def move_rule(self, offset):
+        selection = self.listbox.curselection()
+        if not selection:
+            return
+        index = selection[0]
+        target = index + offset
+        if 0 <= target < len(self.rules):
+            self.rules[index], self.rules[target] = self.rules[target], self.rules[index]
+            self._refresh_list(select=target)
+
+    def buttonbox(self):
+        box = tb.Frame(self)
+        w = tb.Button(box, text="Save & Close", width=15, command=self.ok, default=tk.ACTIVE, bootstyle=PRIMARY)
+        w.pack(side=tk.LEFT, padx=5, pady=5)
+        w = tb.Button(box, text="Cancel", width=10, command=self.cancel, bootstyle=SECONDARY)
+        w.pack(side=tk.LEFT, padx=5, pady=5)
+        self.bind("<Escape>", self.cancel)
+        box.pack()
+
+    def apply(self):
+        self.result = self.rules
+
+
+# --- Bulk Edit Dialog ---
+class BulkEditDialog(simpledialog.Dialog):
+    """Dialog for changing several transactions at once. Only ticked fields are changed."""
+    def __init__(self, parent, title, count, accounts, categories):
+        self.count = count
+        self.accounts = accounts
+        self.categories = [UNCATEGORIZED] + sorted(c for c in categories if c != UNCATEGORIZED)
+        self.change_vars = {field: tk.BooleanVar(value=False) for field in ("category", "account", "type", "date_shift", "description")}
+        self.category_var = tk.StringVar(value=UNCATEGORIZED)
+        self.account_var = tk.StringVar(value=accounts[0] if accounts else "")
+        self.type_var = tk.StringVar(value=TRANS_EXPENSE)
+        self.date_shift_var = tk.IntVar(value=0)
+        self.find_var = tk.StringVar()
+        self.replace_var = tk.StringVar()
+        super().__init__(parent, title)
+
+    def body(self, master):
+        frame = tb.Frame(master, padding=10)
+        frame.pack(fill=BOTH, expand=True)
+        frame.columnconfigure(1, weight=1)
+        tb.Label(frame, text=f"Tick the fields to change in all {self.count} selected transaction(s).").grid(row=0, column=0, columnspan=4, padx=5, pady=(0, 8), sticky=W)
+
+        tb.Checkbutton(frame, text="Category:", variable=self.change_vars["category"], bootstyle=PRIMARY).grid(row=1, column=0, padx=5, pady=3, sticky=W)
+        tb.Combobox(frame, textvariable=self.category_var, values=self.categories, state="readonly", bootstyle=PRIMARY).grid(row=1, column=1, columnspan=3, padx=5, pady=3, sticky=EW)
+        tb.Checkbutton(frame, text="Account:", variable=self.change_vars["account"], bootstyle=PRIMARY).grid(row=2, column=0, padx=5, pady=3, sticky=W)
+        tb.Combobox(frame, textvariable=self.account_var, values=self.accounts, state="readonly", bootstyle=PRIMARY).grid(row=2, column=1, columnspan=3, padx=5, pady=3, sticky=EW)
+        tb.Checkbutton(frame, text="Type:", variable=self.change_vars["type"], bootstyle=PRIMARY).grid(row=3, column=0, padx=5, pady=3, sticky=W)
+        tb.Combobox(frame, textvariable=self.type_var, values=[TRANS_EXPENSE, TRANS_INCOME], state="readonly", bootstyle=PRIMARY).grid(row=3, column=1, columnspan=3, padx=5, pady=3, sticky=EW)
+        tb.Checkbutton(frame, text="Shift date by:", variable=self.change_vars["date_shift"], bootstyle=PRIMARY).grid(row=4, column=0, padx=5, pady=3, sticky=W)
+        tb.Spinbox(frame, from_=-3650, to=3650, textvariable=self.date_shift_var, width=7, bootstyle=PRIMARY).grid(row=4, column=1, padx=5, pady=3, sticky=W)
+        tb.Label(frame, text="days").grid(row=4, column=2, columnspan=2, padx=5, pady=3, sticky=W)
+        tb.Checkbutton(frame, text="Description:", variable=self.change_vars["description"], bootstyle=PRIMARY).grid(row=5, column=0, padx=5, pady=3, sticky=W)
+        find_entry = tb.Entry(frame, textvariable=self.find_var, bootstyle=PRIMARY)
+        find_entry.grid(row=5, column=1, padx=5, pady=3, sticky=EW)
+        ToolTip(find_entry, text="Text to replace. Leave empty to replace the whole description.", bootstyle=(INFO, INVERSE))
+        tb.Label(frame, text="→").grid(row=5, column=2, padx=2, pady=3)
+        tb.Entry(frame, textvariable=self.replace_var, bootstyle=PRIMARY).grid(row=5, column=3, padx=5, pady=3, sticky=EW)
+        frame.columnconfigure(3, weight=1)
+        tb.Label(frame, text="Category only applies to expenses. Transfers are never bulk edited.", bootstyle=SECONDARY).grid(row=6, column=0, columnspan=4, padx=5, pady=(8, 0), sticky=W)
+        return None
+
+    def buttonbox(self):
+        super().buttonbox()
+        self.ok_button = self.children['!frame'].children['!button'] # Fragile but common way
+        self.ok_button.config(text="Apply to All", bootstyle=SUCCESS)
+
+    def validate(self):
+        try:
+            if not any(var.get() for var in self.change_vars.values()):
+                raise ValueError("Tick at least one field to change.")
+            if self.change_vars["account"].get() and not self.account_var.get(): raise ValueError("Please select an account.")
+            if self.change_vars["date_shift"].get() and not self.date_shift_var.get(): raise ValueError("Enter a number of days other than 0 (negative = earlier).")
+            return True
+        except (ValueError, tk.TclError) as e:
+            messagebox.showerror("Input Error", str(e) if isinstance(e, ValueError) else "Days must be a whole number.", parent=self)
+            return False
+
+    def apply(self):
+        """Result: {field: new value} for the ticked fields ('description' is a (find, replace) pair)."""
+        values = {"category": self.category_var.get(), "account": self.account_var.get(), "type": self.type_var.get(),
+                  "date_shift": self.date_shift_var.get(), "description": (self.find_var.get(), self.replace_var.get().strip())}
+        self.result = {field: values[field] for field, var in self.change_vars.items() if var.get()}
+
+
+# --- Reconcile Dialogs ---
+class ReconcileDialog(simpledialog.Dialog):
+    """Asks for the account, bank statement file and date range to reconcile."""
+    def __init__(self, parent, title, accounts, account=""):
+        self.accounts = accounts
+        self.account_var = tk.StringVar(value=account if account in accounts else (accounts[0] if accounts else ""))
+        self.path_var = tk.StringVar()
+        self.start_var = tk.StringVar()
+        self.end_var = tk.StringVar()
+        self.tolerance_var = tk.IntVar(value=RECONCILE_DATE_TOLERANCE_DAYS)
+        self.closing_balance_var = tk.StringVar()
+        super().__init__(parent, title)
+
+    def body(self, master):
+        frame = tb.Frame(master, padding=10)
+        frame.pack(fill=BOTH, expand=True)
+        frame.columnconfigure(1, weight=1)
+        tb.Label(frame, text="Account:").grid(row=0, column=0, padx=5, pady=3, sticky=W)
+        tb.Combobox(frame, textvariable=self.account_var, values=self.accounts, state="readonly", bootstyle=PRIMARY).grid(row=0, column=1, columnspan=2, padx=5, pady=3, sticky=EW)
+        tb.Label(frame, text="Statement:").grid(row=1, column=0, padx=5, pady=3, sticky=W)
+        path_entry = tb.Entry(frame, textvariable=self.path_var, width=40, bootstyle=PRIMARY)
+        path_entry.grid(row=1, column=1, padx=5, pady=3, sticky=EW)
+        ToolTip(path_entry, text="CSV lines 'date,description,amount[,balance]'; money in positive, money out negative", bootstyle=(INFO, INVERSE))
+        tb.Button(frame, text="Browse...", command=self.browse, bootstyle=(SECONDARY, OUTLINE)).grid(row=1, column=2, padx=5, pady=3)
+        tb.Label(frame, text="From (YYYY-MM-DD):").grid(row=2, column=0, padx=5, pady=3, sticky=W)
+        start_entry = tb.Entry(frame, textvariable=self.start_var, bootstyle=PRIMARY)
+        start_entry.grid(row=2, column=1, columnspan=2, padx=5, pady=3, sticky=EW)
+        ToolTip(start_entry, text="Leave the dates empty to use the statement's first and last date", bootstyle=(INFO, INVERSE))
+        tb.Label(frame, text="To (YYYY-MM-DD):").grid(row=3, column=0, padx=5, pady=3, sticky=W)
+        tb.Entry(frame, textvariable=self.end_var, bootstyle=PRIMARY).grid(row=3, column=1, columnspan=2, padx=5, pady=3, sticky=EW)
+        tb.Label(frame, text="Date tolerance:").grid(row=4, column=0, padx=5, pady=3, sticky=W)
+        tb.Spinbox(frame, from_=0, to=31, textvariable=self.tolerance_var, width=5, bootstyle=PRIMARY).grid(row=4, column=1, padx=5, pady=3, sticky=W)
+        tb.Label(frame, text="days").grid(row=4, column=2, padx=5, pady=3, sticky=W)
+        tb.Label(frame, text="Closing balance:").grid(row=5, column=0, padx=5, pady=3, sticky=W)
+        balance_entry = tb.Entry(frame, textvariable=self.closing_balance_var, bootstyle=PRIMARY)
+        balance_entry.grid(row=5, column=1, columnspan=2, padx=5, pady=3, sticky=EW)
+        ToolTip(balance_entry, text="Optional; defaults to the balance column of the statement's last line", bootstyle=(INFO, INVERSE))
+        return path_entry
+
+    def browse(self):
+        path = filedialog.askopenfilename(parent=self, title="Bank Statement", filetypes=[("CSV files", "*.csv"), ("All files", "*.*")])
+        if path: self.path_var.set(path)
+
+    def validate(self):
+        try:
+            if not self.account_var.get(): raise ValueError("Please select an account.")
+            if not self.path_var.get().strip(): raise ValueError("Please choose a statement file.")
+            dates = []
+            for var in (self.start_var, self.end_var):
+                text = var.get().strip()
+                try: dates.append(datetime.strptime(text, '%Y-%m-%d').strftime('%Y-%m-%d') if text else None)
+                except ValueError: raise ValueError(f"Invalid date format: '{text}'. Use YYYY-MM-DD.")
+            tolerance = self.tolerance_var.get()
+            if tolerance < 0: raise ValueError("The date tolerance can't be negative.")
+            closing = self.closing_balance_var.get().strip()
+            try: closing_balance = _statement_amount(closing) if closing else None
+            except ValueError: raise ValueError(f"Invalid closing balance: '{closing}'. Please enter a number.")
+            try: lines = read_statement_csv(self.path_var.get().strip())
+            except OSError as e: raise ValueError(f"Could not read the statement:\n{e}")
+            if not lines: raise ValueError("The statement has no transactions.")
+        except (ValueError, tk.TclError) as e:
+            messagebox.showerror("Input Error", str(e) if isinstance(e, ValueError) else "Tolerance must be a whole number of days.", parent=self)
+            return False
+        start = dates[0] or min(line["date"] for line in lines)
+        end = dates[1] or max(line["date"] for line in lines)
+        if start > end:
+            messagebox.showerror("Input Error", "The start date is after the end date.", parent=self)
+            return False
+        self.result = {"account": self.account_var.get(), "lines": lines, "start": start, "end": end,
+                       "tolerance": tolerance, "closing_balance": closing_balance}
+        return True
+
+    def apply(self):
+        pass # self.result is set by validate()
+
+
+class ReconcileResultDialog(simpledialog.Dialog):
+    """Shows a reconciliation: the balance comparison and what is missing on either side."""
+    def __init__(self, parent, title, summary, ledger_only, statement_only, to_mark):
+        self.summary = summary
+        self.ledger_only = ledger_only
+        self.statement_only = statement_only
+        self.to_mark = to_mark
+        super().__init__(parent, title)
+
+    def body(self, master):
+        frame = tb.Frame(master, padding=10)
+        frame.pack(fill=BOTH, expand=True)
+        tb.Label(frame, text=self.summary, justify=LEFT).pack(anchor=W, pady=(0, 8))
+        for heading, lines in ((f"In the ledger only ({len(self.ledger_only)}):", self.ledger_only),
+                               (f"On the statement only ({len(self.statement_only)}):", self.statement_only)):
+            tb.Label(frame, text=heading).pack(anchor=W)
+            list_frame = tb.Frame(frame)
+            list_frame.pack(pady=(2, 8), fill=BOTH, expand=True)
+            listbox = Listbox(list_frame, height=7, width=70, relief="flat")
+            listbox.pack(side=LEFT, fill=BOTH, expand=True, padx=(0, 5))
+            scrollbar = tb.Scrollbar(list_frame, orient=VERTICAL, command=listbox.yview, bootstyle="round-info")
+            scrollbar.pack(side=RIGHT, fill=Y)
+            listbox.config(yscrollcommand=scrollbar.set)
+            for line in lines: listbox.insert(tk.END, line)
+        return None
+
+    def buttonbox(self):
+        box = tb.Frame(self)
+        if self.to_mark:
+            w = tb.Button(box, text=f"Mark {self.to_mark} Reconciled", width=20, command=self.ok, default=tk.ACTIVE, bootstyle=SUCCESS)
+            w.pack(side=tk.LEFT, padx=5, pady=5)
+        w = tb.Button(box, text="Close", width=10, command=self.cancel, bootstyle=SECONDARY)
+        w.pack(side=tk.LEFT, padx=5, pady=5)
+        self.bind("<Escape>", self.cancel)
+        box.pack()
+
+    def apply(self):
+        self.result = True
+
+
+# --- Closed Period Dialogs ---
+class ClosePeriodDialog(simpledialog.Dialog):
+    """Asks for the date to close the ledger before, and whether to keep per-category totals."""
+    def __init__(self, parent, title, default_cutoff, closed_through=None):
+        self.cutoff_var = tk.StringVar(value=default_cutoff)
+        self.totals_var = tk.BooleanVar(value=True)
+        self.closed_through = closed_through
+        super().__init__(parent, title)
+
+    def body(self, master):
+        frame = tb.Frame(master, padding=10)
+        frame.pack(fill=BOTH, expand=True)
+        tb.Label(frame, text="Close everything before (YYYY-MM-DD):").grid(row=0, column=0, padx=5, pady=3, sticky=W)
+        cutoff_entry = tb.Entry(frame, textvariable=self.cutoff_var, width=12, bootstyle=PRIMARY)
+        cutoff_entry.grid(row=0, column=1, padx=5, pady=3, sticky=W)
+        tb.Checkbutton(frame, text="Keep income and spending per category", variable=self.totals_var, bootstyle=PRIMARY).grid(row=1, column=0, columnspan=2, padx=5, pady=3, sticky=W)
+        tb.Label(frame, wraplength=380, justify=LEFT,
+                 text="Transactions before this date move to an archive file. Each account keeps its balance as one "
+                      "opening balance entry on that date. Archived transactions can still be searched under "
+                      "Closed Periods. This can't be undone.").grid(row=2, column=0, columnspan=2, padx=5, pady=(8, 3), sticky=W)
+        return cutoff_entry
+
+    def validate(self):
+        text = self.cutoff_var.get().strip()
+        try:
+            cutoff = datetime.strptime(text, '%Y-%m-%d').strftime('%Y-%m-%d')
+            if cutoff > date.today().isoformat(): raise ValueError("Only past transactions can be closed.")
+            if self.closed_through and cutoff <= self.closed_through:
+                raise ValueError(f"Transactions before {self.closed_through} are already closed. Choose a later date.")
+        except ValueError as e:
+            message = str(e) if "closed" in str(e) else f"Invalid date format: '{text}'. Use YYYY-MM-DD."
+            messagebox.showerror("Input Error", message, parent=self)
+            return False
+        self.result = {"cutoff": cutoff, "category_totals": self.totals_var.get()}
+        return True
+
+
+class ClosedPeriodsDialog(simpledialog.Dialog):
+    """Lists the closed periods and searches their archived transactions.
+
+    `search(periods, query, loaded)` returns the archived rows of `periods` matching a
+    FilterQuery (None = all); archives it reads are kept in `loaded` while the dialog is open.
+    Result: True to close another period.
+    """
+    def __init__(self, parent, title, periods, search):
+        self.periods = sorted(periods, key=lambda entry: entry["cutoff"], reverse=True) # Newest first
+        self.search_periods = search
+        self.loaded = {} # archive file -> transactions
+        self.query_var = tk.StringVar()
+        self.status_var = tk.StringVar(value="Select periods (none = all) and search with a filter query, or leave it empty to list them.")
+        super().__init__(parent, title)
+
+    def body(self, master):
+        frame = tb.Frame(master, padding=10)
+        frame.pack(fill=BOTH, expand=True)
+        tb.Label(frame, text="Closed periods:").pack(anchor=W)
+        self.period_list = self._listbox(frame, 5, tk.EXTENDED)
+        for entry in self.periods:
+            self.period_list.insert(tk.END, self._describe(entry))
+        if not self.periods:
+            self.period_list.insert(tk.END, "No periods have been closed yet.")
+        self.period_list.bind("<<ListboxSelect>>", self.show_category_totals)
+
+        search_frame = tb.Frame(frame)
+        search_frame.pack(fill=X, pady=5)
+        tb.Label(search_frame, text="Search:").pack(side=LEFT)
+        query_entry = tb.Entry(search_frame, textvariable=self.query_var, bootstyle=PRIMARY)
+        query_entry.pack(side=LEFT, fill=X, expand=True, padx=5)
+        query_entry.bind("<Return>", self.search)
+        ToolTip(query_entry, text="Same syntax as the Query filter, e.g. category = Food and amount > 50", bootstyle=(INFO, INVERSE))
+        tb.Button(search_frame, text="Search", command=self.search, bootstyle=(PRIMARY, OUTLINE)).pack(side=LEFT)
+
+        self.result_list = self._listbox(frame, 12, tk.BROWSE)
+        tb.Label(frame, textvariable=self.status_var).pack(anchor=W)
+        return query_entry
+
+    @staticmethod
+    def _listbox(frame, height, selectmode):
+        list_frame = tb.Frame(frame)
+        list_frame.pack(pady=(2, 5), fill=BOTH, expand=True)
+        listbox = Listbox(list_frame, selectmode=selectmode, height=height, width=90, relief="flat", exportselection=False)
+        listbox.pack(side=LEFT, fill=BOTH, expand=True, padx=(0, 5))
+        scrollbar = tb.Scrollbar(list_frame, orient=VERTICAL, command=listbox.yview, bootstyle="round-info")
+        scrollbar.pack(side=RIGHT, fill=Y)
+        listbox.config(yscrollcommand=scrollbar.set)
+        return listbox
+
+    @staticmethod
+    def _describe(entry):
+        text = (f"Before {entry['cutoff']}: {entry.get('count', 0):,} transactions "
+                f"({entry.get('first_date', '?')} to {entry.get('last_date', '?')})")
+        if "income" in entry:
+            currency = entry.get("currency", BASE_CURRENCY)
+            spent = sum(entry.get("expenses_by_category", {}).values())
+            text += f", income {format_money(entry['income'], currency)}, expenses {format_money(spent, currency)}"
+        return text
+
+    def _selected_periods(self):
+        return [self.periods[i] for i in self.period_list.curselection() if i < len(self.periods)]
+
+    def show_category_totals(self, event=None):
+        """One period selected: lists its spending per category (if it was kept)."""
+        selected = self._selected_periods()
+        if len(selected) != 1 or "expenses_by_category" not in selected[0]:
+            return
+        entry = selected[0]
+        currency = entry.get("currency", BASE_CURRENCY)
+        totals = sorted(CategoryTree.rollup(entry["expenses_by_category"]).items(), key=lambda item: (-item[1], item[0]))
+        self.result_list.delete(0, tk.END)
+        for category, amount in totals:
+            label = "    " * category.count(CATEGORY_SEPARATOR) + category.split(CATEGORY_SEPARATOR)[-1]
+            self.result_list.insert(tk.END, f"{label:<40} {format_money(amount, currency):>16}")
+        self.status_var.set(f"Spending by category before {entry['cutoff']} (subcategories included).")
+
+    def search(self, event=None):
+        text = self.query_var.get().strip()
+        try:
+            query = FilterQuery.get(text) if text else None
+        except ValueError as e:
+            messagebox.showerror("Query Error", f"Invalid query: {e}", parent=self)
+            return "break"
+        found = self.search_periods(self._selected_periods() or self.periods, query, self.loaded)
+        shown = heapq.nlargest(CLOSED_PERIOD_SEARCH_LIMIT, found, key=lambda trans: str(trans.get('date', '')))
+        self.result_list.delete(0, tk.END)
+        for trans in shown:
+            category = trans.get('category') or (UNCATEGORIZED if trans.get('type') == TRANS_EXPENSE else "")
+            self.result_list.insert(tk.END, f"{trans.get('date', '')}  {trans.get('type', ''):<8}{trans.get('amount', 0.0):>12,.2f}  "
+                                            f"{trans.get('account', '')}  {category}  {trans.get('description', '')}")
+        status = f"{len(found):,} matching transaction(s)"
+        if len(found) > len(shown): status += f", showing the newest {len(shown):,}"
+        self.status_var.set(status + ".")
+        return "break" # Enter searches instead of closing the dialog
+
+    def buttonbox(self):
+        box = tb.Frame(self)
+        w = tb.Button(box, text="Close Period...", width=15, command=self.ok, bootstyle=WARNING)
+        w.pack(side=tk.LEFT, padx=5, pady=5)
+        w = tb.Button(box, text="Close", width=10, command=self.cancel, default=tk.ACTIVE, bootstyle=SECONDARY)
+        w.pack(side=tk.LEFT, padx=5, pady=5)
+        self.bind("<Escape>", self.cancel)
+        box.pack()
+
+    def apply(self):
+        self.result = True
+
+
+# --- Charts Window ---
+class ChartsWindow(tk.Toplevel):
+    """Balance and spending charts drawn on plain canvases (all transactions, not just the filtered ones).
+
+    Only the visible chart is drawn, and only once the ledger, the reporting currency or the
+    canvas size changed since it was last drawn. Line series are reduced to about one point
+    per pixel first, so ten years of daily balances draw as fast as a few months.
+    """
+    TABS = (("balances", "Balances"), ("income_expense", "Income vs Expense"), ("categories", "Spending by Category"),
+            ("net_worth", "Net Worth"))
+    MARGINS = (75, 15, 150, 30) # Left, top, right (legend), bottom, in pixels
+
+    def __init__(self, app):
+        super().__init__(app.window)
+        self.app = app
+        self.title("Charts")
+        self.geometry("860x460")
+        try:
+            colors = app.style.colors
+            self.background, self.foreground, self.grid_color = colors.bg, colors.fg, colors.border
+            self.income_color, self.expense_color = colors.success, colors.danger
+            self.palette = (colors.primary, colors.info, colors.warning, colors.success, colors.danger, colors.secondary, colors.light)
+        except Exception as e:
+            print(f"Warning: Could not read chart colors from the theme: {e}")
+            self.background, self.foreground, self.grid_color = '#222222', '#ffffff', '#444444'
+            self.income_color, self.expense_color = 'green', 'red'
+            self.palette = ('#375a7f', '#3498db', '#f39c12', '#00bc8c', '#e74c3c', '#888888', '#adb5bd')
+        self.configure(background=self.background)
+
+        self.notebook = tb.Notebook(self, bootstyle=SECONDARY)
+        self.notebook.pack(fill=BOTH, expand=True, padx=5, pady=5)
+        self.canvases = {}
+        for name, title in self.TABS:
+            if name == "net_worth": # Has its own range controls above the chart
+                tab = tb.Frame(self.notebook)
+                self._build_net_worth_controls(tab)
+                canvas = tk.Canvas(tab, background=self.background, highlightthickness=0)
+                canvas.pack(fill=BOTH, expand=True)
+            else:
+                tab = canvas = tk.Canvas(self.notebook, background=self.background, highlightthickness=0)
+            canvas.bind("<Configure>", lambda event: self.schedule_redraw())
+            self.notebook.add(tab, text=title)
+            self.canvases[name] = canvas
+        self.notebook.bind("<<NotebookTabChanged>>", lambda event: self.schedule_redraw())
+        self.drawn_for = {}         # Tab -> (series, width, height) it was last drawn for
+        self.redraw_pending = None  # after() id of the scheduled redraw
+        self.protocol("WM_DELETE_WINDOW", self.close)
+
+    def _build_net_worth_controls(self, tab):
+        today = date.today()
+        self.net_worth_start_var = tk.StringVar(value=today.replace(year=today.year - 1, day=1).isoformat())
+        self.net_worth_end_var = tk.StringVar(value=today.isoformat())
+        self.net_worth_step_var = tk.StringVar(value="Monthly")
+        controls = tb.Frame(tab, padding=(5, 5, 5, 0))
+        controls.pack(fill=X)
+        tb.Label(controls, text="From:").pack(side=LEFT, padx=(0, 2))
+        for var in (self.net_worth_start_var, self.net_worth_end_var):
+            entry = tb.Entry(controls, textvariable=var, width=11, bootstyle=INFO)
+            entry.pack(side=LEFT, padx=(0, 5))
+            entry.bind("<Return>", lambda event: self.schedule_redraw())
+            entry.bind("<FocusOut>", lambda event: self.schedule_redraw())
+            if var is self.net_worth_start_var: tb.Label(controls, text="to").pack(side=LEFT, padx=(0, 5))
+        step_combo = tb.Combobox(controls, textvariable=self.net_worth_step_var, values=NET_WORTH_STEPS, state="readonly", width=9, bootstyle=INFO)
+        step_combo.pack(side=LEFT, padx=5)
+        step_combo.bind("<<ComboboxSelected>>", lambda event: self.schedule_redraw())
+        tb.Button(controls, text="Export CSV...", command=self.export_net_worth, bootstyle=(INFO, OUTLINE)).pack(side=RIGHT)
+
+    def _net_worth_series(self):
+        return self.app.net_worth_history(self.net_worth_start_var.get().strip(), self.net_worth_end_var.get().strip(),
+                                          self.net_worth_step_var.get())
+
+    def export_net_worth(self):
+        try:
+            series = self._net_worth_series()
+        except ValueError as e:
+            messagebox.showerror("Export", str(e), parent=self)
+            return
+        path = filedialog.asksaveasfilename(parent=self, title="Export Net Worth", defaultextension=".csv",
+                                            initialfile=f"net_worth_{series['dates'][0]}_{series['dates'][-1]}.csv",
+                                            filetypes=[("CSV files", "*.csv"), ("All files", "*.*")])
+        if not path:
+            return
+        try:
+            self.app.export_net_worth(path, series)
+        except OSError as e:
+            messagebox.showerror("Export", f"Could not write {path}:\n{e}", parent=self)
+            return
+        messagebox.showinfo("Export", f"Exported {len(series['dates'])} date(s) to {path}.", parent=self)
+
+    def close(self):
+        self.app.charts_window = None
+        self.destroy()
+
+    def schedule_redraw(self):
+        """Redraws the visible chart once changes have stopped for CHART_REFRESH_DELAY_MS."""
+        if self.redraw_pending is not None:
+            self.after_cancel(self.redraw_pending)
+        self.redraw_pending = self.after(CHART_REFRESH_DELAY_MS, self.redraw)
+
+    def redraw(self):
+        self.redraw_pending = None
+        name = self.TABS[self.notebook.index(self.notebook.select())][0]
+        canvas = self.canvases[name]
+        width, height = canvas.winfo_width(), canvas.winfo_height()
+        try: # Both cached by the app until the ledger changes
+            series = self._net_worth_series() if name == "net_worth" else self.app.chart_series()
+        except ValueError as e:
+            self.drawn_for.pop(name, None)
+            canvas.delete("all")
+            self._draw_message(canvas, width, height, str(e))
+            return
+        drawn = self.drawn_for.get(name)
+        if drawn and drawn[0] is series and drawn[1:] == (width, height):
+            return # Nothing changed since this chart was drawn
+        self.drawn_for[name] = (series, width, height)
+        canvas.delete("all")
+        if width < 250 or height < 120:
+            return # Not laid out yet (or too small to draw anything useful)
+        getattr(self, f"_draw_{name}")(canvas, series, width, height)
+        if series["missing_rates"]:
+            canvas.create_text(width - 5, height - 5, anchor=SE, fill=self.foreground, font=("Helvetica", 8),
+                               text=f"Left out (no exchange rate): {', '.join(series['missing_rates'])}")
+
+    # --- Charts ---
+    def _draw_balances(self, canvas, series, width, height):
+        plot_width = width - self.MARGINS[0] - self.MARGINS[2]
+        lines = {account: lttb_downsample(points, plot_width) for account, points in series["balances"].items()}
+        self._draw_lines(canvas, lines, width, height, series["currency"],
+                         lambda x: date.fromordinal(int(round(x))).strftime('%Y-%m-%d'))
+
+    def _draw_net_worth(self, canvas, series, width, height):
+        plot_width = width - self.MARGINS[0] - self.MARGINS[2]
+        ordinals = [date.fromisoformat(day).toordinal() for day in series["dates"]]
+        lines = {"Total": lttb_downsample(list(zip(ordinals, series["total"])), plot_width)}
+        lines.update((account, lttb_downsample(points, plot_width)) for account, points in sorted(series["converted"].items()))
+        self._draw_lines(canvas, lines, width, height, series["currency"],
+                         lambda x: date.fromordinal(int(round(x))).strftime('%Y-%m-%d'))
+
+    def _draw_categories(self, canvas, series, width, height):
+        plot_width = width - self.MARGINS[0] - self.MARGINS[2]
+        months = series["months"]
+        lines = {category: lttb_downsample(list(enumerate(amounts)), plot_width)
+                 for category, amounts in series["categories"].items()}
+        self._draw_lines(canvas, lines, width, height, series["currency"], lambda x: months[int(round(x))])
+
+    def _draw_income_expense(self, canvas, series, width, height):
+        left, top, right, bottom = self.MARGINS
+        plot_width = width - left - right
+        months = series["months"]
+        if not months:
+            self._draw_message(canvas, width, height)
+            return
+        # Months are merged into wider bars when there isn't room for a bar pair per month
+        per_bar = -(-len(months) // max(1, plot_width // 8))
+        bars = [(months[i], sum(series["income"][i:i + per_bar]), sum(series["expense"][i:i + per_bar]))
+                for i in range(0, len(months), per_bar)]
+        to_y = self._draw_value_axis(canvas, width, height, 0.0, max(max(b[1], b[2]) for b in bars), series["currency"])
+        slot = plot_width / len(bars)
+        bar_width = max(1.0, slot * 0.4)
+        for index, (month, income, expense) in enumerate(bars):
+            x = left + index * slot + slot * 0.1
+            canvas.create_rectangle(x, to_y(income), x + bar_width, to_y(0), fill=self.income_color, width=0)
+            canvas.create_rectangle(x + bar_width, to_y(expense), x + 2 * bar_width, to_y(0), fill=self.expense_color, width=0)
+        label_every = max(1, len(bars) // 6)
+        for index in range(0, len(bars), label_every):
+            canvas.create_text(left + (index + 0.5) * slot, height - bottom + 12, text=bars[index][0],
+                               fill=self.foreground, font=("Helvetica", 8))
+        self._draw_legend(canvas, width, [("Income", self.income_color), ("Expense", self.expense_color)]
+                          + ([(f"{per_bar} months per bar", None)] if per_bar > 1 else []))
+
+    # --- Drawing Helpers ---
+    def _draw_lines(self, canvas, lines, width, height, currency, x_label):
+        """Draws {label: [(x, y), ...]} as lines on shared axes; x_label(x) gives an x tick's text."""
+        left, top, right, bottom = self.MARGINS
+        points = [point for line in lines.values() for point in line]
+        if not points:
+            self._draw_message(canvas, width, height)
+            return
+        x_low, x_high = min(x for x, _ in points), max(x for x, _ in points)
+        x_span = (x_high - x_low) or 1
+        to_y = self._draw_value_axis(canvas, width, height, min(y for _, y in points), max(y for _, y in points), currency)
+        plot_width = width - left - right
+
+        def to_x(x):
+            return left + (x - x_low) / x_span * plot_width
+
+        legend = []
+        for index, (label, line) in enumerate(lines.items()):
+            color = self.palette[index % len(self.palette)]
+            coords = [value for x, y in line for value in (to_x(x), to_y(y))]
+            if len(line) > 1:
+                canvas.create_line(*coords, fill=color, width=2)
+            elif line:
+                canvas.create_oval(coords[0] - 2, coords[1] - 2, coords[0] + 2, coords[1] + 2, fill=color, outline=color)
+            legend.append((label, color))
+        for tick in range(6):
+            x = x_low + x_span * tick / 5
+            canvas.create_text(to_x(x), height - bottom + 12, text=x_label(x), fill=self.foreground, font=("Helvetica", 8))
+        self._draw_legend(canvas, width, legend)
+
+    def _draw_value_axis(self, canvas, width, height, low, high, currency):
+        """Draws horizontal grid lines with amount labels and returns the value -> y pixel mapping."""
+        left, top, right, bottom = self.MARGINS
+        ticks = self._nice_ticks(min(low, 0.0), max(high, 0.0))
+        plot_height = height - top - bottom
+        span = ticks[-1] - ticks[0]
+
+        def to_y(value):
+            return top + (ticks[-1] - value) / span * plot_height
+
+        symbol = CURRENCY_SYMBOLS.get(currency, f"{currency} ")
+        for value in ticks:
+            y = to_y(value)
+            canvas.create_line(left, y, width - right, y, fill=self.grid_color, dash=() if value == 0 else (2, 4))
+            canvas.create_text(left - 5, y, anchor=E, fill=self.foreground, font=("Helvetica", 8),
+                               text=f"{'-' if value < 0 else ''}{symbol}{abs(value):,.0f}")
+        return to_y
+
+    @staticmethod
+    def _nice_ticks(low, high, count=5):
+        """Round tick values (steps of 1, 2 or 5 times a power of ten) covering [low, high]."""
+        if high <= low:
+            high = low + 1.0
+        raw_step = (high - low) / count
+        magnitude = 10 ** math.floor(math.log10(raw_step))
+        step = next(m * magnitude for m in (1, 2, 5, 10) if m * magnitude >= raw_step)
+        first, last = math.floor(low / step), math.ceil(high / step)
+        return [tick * step for tick in range(first, last + 1)]
+
+    def _draw_legend(self, canvas, width, entries):
+        x, y = width - self.MARGINS[2] + 15, self.MARGINS[1] + 5
+        for label, color in entries:
+            if color:
+                canvas.create_rectangle(x, y - 4, x + 10, y + 6, fill=color, width=0)
+            canvas.create_text(x + (15 if color else 0), y + 1, anchor=W, text=label, fill=self.foreground, font=("Helvetica", 9))
+            y += 18
+
+    def _draw_message(self, canvas, width, height, text="No transactions to chart yet."):
+        canvas.create_text(width / 2, height / 2, text=text, fill=self.foreground, font=("Helvetica", 11))
+
+
+# --- Ledger Helpers ---
+def transaction_checksum(trans):
+    """CRC of the fields that affect balances. Ledger checksums are sums of these, so order doesn't matter."""
+    key = f"{trans.get('id')}|{trans.get('date')}|{trans.get('account')}|{trans.get('type')}|{trans.get('amount')!r}"
+    return zlib.crc32(key.encode('utf-8'))
+
+
+def category_amounts(trans):
+    """(category, amount) pairs an expense counts towards: one per split, or its whole amount."""
+    splits = trans.get('splits')
+    if splits:
+        return [(category or UNCATEGORIZED, split_amount) for category, split_amount in splits]
+    return [(trans.get('category') or UNCATEGORIZED, trans.get('amount', 0.0))]
+
+
+def split_category(splits):
+    """The category a split expense is listed under: that of its largest split."""
+    return max(splits, key=lambda split: split[1])[0]
+
+
+def validated_splits(splits, amount):
+    """Checks [[category, amount], ...] (at least two, all positive, adding up to `amount`).
+    Returns them with amounts rounded to cents; raises ValueError."""
+    if not isinstance(splits, (list, tuple)) or len(splits) < 2:
+        raise ValueError("A split expense needs at least two categories.")
+    cleaned = []
+    for split in splits:
+        if not (isinstance(split, (list, tuple)) and len(split) == 2 and isinstance(split[0], str) and _is_plain_number(split[1])):
+            raise ValueError(f"Invalid split {split!r}. Use [category, amount].")
+        if split[1] <= 0: raise ValueError("Split amounts must be positive.")
+        cleaned.append([split[0] or UNCATEGORIZED, round(float(split[1]), 2)])
+    total = sum(split_amount for _, split_amount in cleaned)
+    if abs(total - amount) > 0.005:
+        raise ValueError(f"The splits add up to {total:,.2f}, not the amount of {amount:,.2f}.")
+    return cleaned
+
+
+def month_key(date_str):
+    """'YYYY-MM' for an ISO date string, or None if it doesn't look like one."""
+    if isinstance(date_str, str) and len(date_str) >= 7 and date_str[4] == '-' and date_str[:4].isdigit() and date_str[5:7].isdigit():
+        return date_str[:7]
+    return None
+
+
+def next_month(month):
+    year, mon = int(month[:4]), int(month[5:7])
+    return f"{year + mon // 12:04d}-{mon % 12 + 1:02d}"
+
+
+def previous_month(month):
+    year, mon = int(month[:4]), int(month[5:7])
+    return f"{year - 1:04d}-12" if mon == 1 else f"{year:04d}-{mon - 1:02d}"
+
+
+def sample_dates(start, end, step):
+    """Dates (date objects) at every day, week (Sunday) or month end in [start, end], always ending with `end`."""
+    if step not in NET_WORTH_STEPS:
+        raise ValueError(f"Unknown step '{step}'.")
+    samples = []
+    if step == "Monthly":
+        day = date(start.year, start.month, calendar.monthrange(start.year, start.month)[1])
+        while day < end:
+            samples.append(day)
+            following = day + timedelta(days=1)
+            day = date(following.year, following.month, calendar.monthrange(following.year, following.month)[1])
+    else:
+        day = start if step == "Daily" else start + timedelta(days=6 - start.weekday()) # First Sunday on or after start
+        stride = timedelta(days=1 if step == "Daily" else 7)
+        while day < end:
+            samples.append(day)
+            day += stride
+    samples.append(end)
+    return samples
+
+
+# --- Recurring Schedules ---
+def _nth_occurrence(start, frequency, n):
+    """Date of the n-th step of `frequency` after `start`; month ends are clamped (Jan 31 -> Feb 28)."""
+    if frequency == "Daily": return start + timedelta(days=n)
+    if frequency == "Weekly": return start + timedelta(weeks=n)
+    months = n if frequency == "Monthly" else 12 * n
+    year, month_index = divmod(start.month - 1 + months, 12)
+    year += start.year
+    return date(year, month_index + 1, min(start.day, calendar.monthrange(year, month_index + 1)[1]))
+
+
+def schedule_occurrences(schedule, after=None, until=None):
+    """Yields the ISO dates of a schedule's occurrences in (after, until]. Bounds are ISO strings or None.
+
+    A schedule repeats every `interval` days/weeks/months/years from its `start`, up to its
+    optional `end`. Without `until` or `end` the generator never stops.
+    """
+    frequency = schedule["frequency"]
+    if frequency not in RECURRENCE_FREQUENCIES:
+        raise ValueError(f"Unknown frequency: {frequency}")
+    start = date.fromisoformat(schedule["start"])
+    interval = max(1, int(schedule.get("interval", 1)))
+    last = date.fromisoformat(until) if until else None
+    if schedule.get("end"):
+        end = date.fromisoformat(schedule["end"])
+        last = end if last is None or end < last else last
+    after = date.fromisoformat(after) if after else None
+
+    n = 0
+    if after is not None and after >= start: # Jump to just before `after` instead of stepping from the start
+        if frequency == "Daily": n = (after - start).days // interval
+        elif frequency == "Weekly": n = (after - start).days // (7 * interval)
+        elif frequency == "Monthly": n = ((after.year - start.year) * 12 + after.month - start.month) // interval
+        else: n = (after.year - start.year) // interval
+        n = max(0, n - 1)
+    while True:
+        occurrence = _nth_occurrence(start, frequency, n * interval)
+        n += 1
+        if after is not None and occurrence <= after:
+            continue
+        if last is not None and occurrence > last:
+            return
+        yield occurrence.isoformat()
+
+
+# --- Currencies & Exchange Rates ---
+def format_money(amount, currency=BASE_CURRENCY):
+    """Formats an amount with its currency's symbol (or code), e.g. '₱1,234.50' or 'CHF 12.00'."""
+    symbol = CURRENCY_SYMBOLS.get(currency, f"{currency} ")
+    return f"{'-' if amount < 0 else ''}{symbol}{abs(amount):,.2f}"
+
+
+class FxRates:
+    """Exchange rates by date, stored as the value of one unit of each currency in BASE_CURRENCY.
+
+    A lookup uses the latest rate on or before the date (or the earliest rate for dates before
+    it) and is cached per (currency, date). Totals are converted per (currency, date) group,
+    never per transaction.
+    """
+
+    def __init__(self):
+        self.dates = {}  # currency -> sorted ISO dates
+        self.values = {} # currency -> rates, parallel to self.dates
+        self._cache = {}
+
+    def currencies(self):
+        return set(self.dates) | {BASE_CURRENCY}
+
+    def set_rates(self, currency, dated_rates):
+        """Merges (iso_date, rate) pairs into a currency's table."""
+        merged = dict(zip(self.dates.get(currency, []), self.values.get(currency, [])))
+        merged.update(dated_rates)
+        self.dates[currency] = sorted(merged)
+        self.values[currency] = [merged[day] for day in self.dates[currency]]
+        self._cache.clear()
+
+    def rate(self, currency, on_date):
+        """Value of one unit of `currency` in BASE_CURRENCY on an ISO date. Raises KeyError without rates."""
+        if currency == BASE_CURRENCY:
+            return 1.0
+        key = (currency, on_date)
+        cached = self._cache.get(key)
+        if cached is None:
+            dates = self.dates.get(currency)
+            if not dates:
+                raise KeyError(f"No exchange rate for {currency}.")
+            cached = self._cache[key] = self.values[currency][max(0, bisect_right(dates, on_date) - 1)]
+        return cached
+
+    def convert(self, amount, from_currency, to_currency, on_date):
+        if from_currency == to_currency:
+            return amount
+        return amount * self.rate(from_currency, on_date) / self.rate(to_currency, on_date)
+
+    def convert_groups(self, groups, to_currency):
+        """Total of {currency: {iso_date: amount}} in `to_currency`, one rate lookup per group."""
+        total = 0.0
+        for currency, amounts_by_date in groups.items():
+            if currency == to_currency:
+                total += sum(amounts_by_date.values())
+            else:
+                for on_date, amount in amounts_by_date.items():
+                    total += amount * self.rate(currency, on_date) / self.rate(to_currency, on_date)
+        return total
+
+    def import_csv(self, path):
+        """Imports 'date,currency,rate' lines (rate = value of one unit in BASE_CURRENCY). Returns the count."""
+        imported = defaultdict(dict)
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            for line_number, row in enumerate(csv.reader(f), start=1):
+                if not row or row[0].strip().lower() == "date": continue # Blank line or header
+                try:
+                    on_date = datetime.strptime(row[0].strip(), '%Y-%m-%d').strftime('%Y-%m-%d')
+                    currency, rate = row[1].strip().upper(), float(row[2])
+                    if rate <= 0: raise ValueError("rate must be positive")
+                except (IndexError, ValueError) as e:
+                    raise ValueError(f"{path}, line {line_number}: expected 'YYYY-MM-DD,CUR,rate' ({e})")
+                imported[currency][on_date] = rate
+        for currency, dated_rates in imported.items():
+            if currency != BASE_CURRENCY: self.set_rates(currency, dated_rates)
+        return sum(len(dated_rates) for dated_rates in imported.values())
+
+    @classmethod
+    def load(cls, path):
+        fx_rates = cls()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            for currency, pairs in data.get("rates", {}).items():
+                fx_rates.set_rates(currency, [(day, float(rate)) for day, rate in pairs])
+        return fx_rates
+
+    def save(self, path):
+        data = {"base": BASE_CURRENCY,
+                "rates": {currency: [[day, rate] for day, rate in zip(self.dates[currency], self.values[currency])]
+                          for currency in sorted(self.dates)}}
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=1)
+
+
+# --- Category Tree ---
+def category_parent(category):
+    """'Food' for 'Food > Groceries'; None for a top-level category."""
+    return category.rsplit(CATEGORY_SEPARATOR, 1)[0] if CATEGORY_SEPARATOR in category else None
+
+
+class CategoryTree:
+    """Parent/child structure of the category paths in self.categories.
+
+    Ancestors that only appear as a prefix of another category are nodes too. Each node's
+    subtree (itself plus all descendants) is precomputed, so filtering by a parent is one
+    set lookup per row. The tree for the current categories is built once and reused.
+    """
+    _cached = None # (frozenset of categories, CategoryTree)
+
+    @classmethod
+    def of(cls, categories):
+        key = frozenset(categories)
+        cached = cls._cached # Read once; another thread may replace it
+        if cached is None or cached[0] != key:
+            cached = cls._cached = (key, cls(key))
+        return cached[1]
+
+    def __init__(self, categories):
+        nodes = set()
+        for category in categories:
+            while category is not None and category not in nodes:
+                nodes.add(category)
+                category = category_parent(category)
+        self.nodes = sorted(nodes)
+        self.children = defaultdict(list) # parent path (None = top level) -> child paths, sorted
+        for node in self.nodes:
+            self.children[category_parent(node)].append(node)
+        self.subtrees = {}
+        for node in sorted(self.nodes, key=lambda node: -node.count(CATEGORY_SEPARATOR)): # Deepest first
+            self.subtrees[node] = frozenset((node,)).union(*(self.subtrees[child] for child in self.children.get(node, ())))
+
+    def subtree(self, category):
+        return self.subtrees.get(category, frozenset((category,)))
+
+    @staticmethod
+    def rollup(totals):
+        """{category: own total} -> {node: total of its whole subtree}. Each category adds into
+        its ancestors once, so the cost is per category, not per transaction."""
+        rolled = defaultdict(float)
+        for category, amount in totals.items():
+            node = category
+            while node is not None:
+                rolled[node] += amount
+                node = category_parent(node)
+        return rolled
+
+
+# --- Categorization Rules ---
+# Escapes in a rule's regex, one at a time (so "\\1" is an escaped backslash and a "1").
+# Group 1 is set for a numbered backreference (\1 to \99; three octal digits are a character)
+# and group 2 for a conditional on a group number, (?(1)...).
+_RULE_GROUP_NUMBER = re.compile(r"\\(?:[0-7]{3}|([1-9])|.)|\(\?\((\d)", re.DOTALL)
+
+
+class CategoryRules:
+    """User rules that pick an expense's category, compiled into one regex per account.
+
+    A rule is a dict: "category", and optional "keywords" (any of them in the description),
+    "pattern" (a regex searched in the description), "account" and "min_amount"/"max_amount".
+    Text matching ignores case. The first rule in list order whose conditions all hold wins.
+
+    The text conditions of all rules that can apply to an account are merged into a single
+    regex, one named alternative per rule in priority order, so one match() call finds the
+    first rule whose text matches. Only if that rule's amount range rejects the row is the
+    regex for the rules after it tried, so most rows cost one regex call however many rules
+    there are.
+    """
+    def __init__(self, rules=()):
+        self.rules = [rule for rule in rules if isinstance(rule, dict) and rule.get("category")]
+        self._compiled = {} # (account, first rule index) -> merged regex, or None when no rule applies
+        self._results = {}  # (account, description) -> category, where the amount can't change it
+        self._unusable = set() # Indexes of rules that can't be merged (saved before validate checked them)
+        for index, rule in enumerate(self.rules):
+            try:
+                self.validate(rule)
+            except ValueError as e:
+                print(f"Warning: Ignoring category rule {self.describe(rule)}: {e}")
+                self._unusable.add(index)
+
+    @staticmethod
+    def text_pattern(rule):
+        """Regex source for a rule's description condition ('' when it has none)."""
+        alternatives = [re.escape(keyword) for keyword in rule.get("keywords") or () if keyword]
+        if rule.get("pattern"):
+            alternatives.append(f"(?:{rule['pattern']})")
+        return f".*?(?:{'|'.join(alternatives)})" if alternatives else ""
+
+    @classmethod
+    def validate(cls, rule):
+        """Raises ValueError if a rule can't be used."""
+        if not rule.get("category"): raise ValueError("A rule needs a category.")
+        if not (rule.get("keywords") or rule.get("pattern") or rule.get("account") or
+                rule.get("min_amount") is not None or rule.get("max_amount") is not None):
+            raise ValueError("A rule needs at least one condition.")
+        try:
+            compiled = re.compile(cls.text_pattern(rule), re.IGNORECASE | re.DOTALL)
+        except re.error as e:
+            raise ValueError(f"Invalid regular expression '{rule.get('pattern')}': {e}")
+        if compiled.groupindex: # Would clash with the rule names in the merged regex
+            raise ValueError("Named groups (?P<name>...) aren't supported in rule expressions.")
+        if any(match.group(1) or match.group(2) for match in _RULE_GROUP_NUMBER.finditer(rule.get("pattern") or "")):
+            # Group numbers shift by every group before the rule in the merged regex
+            raise ValueError("References to group numbers (\\1, (?(1)...)) aren't supported in rule expressions.")
+        low, high = rule.get("min_amount"), rule.get("max_amount")
+        if low is not None and high is not None and low > high:
+            raise ValueError("The minimum amount is larger than the maximum.")
+
+    def _pattern(self, account, start):
+        key = (account, start)
+        if key not in self._compiled:
+            alternatives = [f"(?P<r{index}>{self.text_pattern(rule)})"
+                            for index, rule in enumerate(self.rules[start:], start)
+                            if index not in self._unusable and (not rule.get("account") or rule["account"] == account)]
+            try:
+                self._compiled[key] = re.compile("|".join(alternatives), re.IGNORECASE | re.DOTALL) if alternatives else None
+            except re.error as e: # Each rule compiles alone (see validate), so this shouldn't happen
+                print(f"Warning: Category rules can't be applied: {e}")
+                self._compiled[key] = None
+        return self._compiled[key]
+
+    def category_for(self, trans):
+        """The category the first matching rule assigns to `trans`, or None."""
+        account, amount = trans.get('account'), trans.get('amount', 0.0)
+        description = trans.get('description') or ""
+        result_key = (account, description)
+        if result_key in self._results: # Descriptions repeat a lot (same shop, same bill)
+            return self._results[result_key]
+        start = 0
+        while True:
+            pattern = self._pattern(account, start)
+            match = pattern.match(description) if pattern else None
+            if match is None:
+                category = None
+                break
+            index = int(match.lastgroup[1:])
+            rule = self.rules[index]
+            if rule.get("min_amount") is None and rule.get("max_amount") is None:
+                category = rule["category"]
+                break
+            if ((rule.get("min_amount") is None or amount >= rule["min_amount"]) and
+                    (rule.get("max_amount") is None or amount <= rule["max_amount"])):
+                return rule["category"] # Depends on the amount, not cached
+            start = index + 1 # Amount didn't fit: try the rules after it
+        if start == 0: # No amount range was involved
+            if len(self._results) >= 100_000: self._results.clear()
+            self._results[result_key] = category
+        return category
+
+    @staticmethod
+    def describe(rule):
+        conditions = []
+        if rule.get("keywords"): conditions.append("contains " + " or ".join(f"'{k}'" for k in rule["keywords"]))
+        if rule.get("pattern"): conditions.append(f"matches /{rule['pattern']}/")
+        if rule.get("account"): conditions.append(f"account {rule['account']}")
+        if rule.get("min_amount") is not None: conditions.append(f">= {rule['min_amount']:,.2f}")
+        if rule.get("max_amount") is not None: conditions.append(f"<= {rule['max_amount']:,.2f}")
+        return f"{', '.join(conditions)} → {rule['category']}"
+
+
+# --- Statement Reconciliation ---
+def _statement_date(text):
+    text = text.strip()
+    for date_format in STATEMENT_DATE_FORMATS:
+        try: return datetime.strptime(text, date_format).date()
+        except ValueError: pass
+    raise ValueError(f"unrecognized date '{text}'")
+
+
+def _statement_amount(text):
+    """Parses amounts such as '-1,234.50', '₱1,234.50' or '(1,234.50)' (negative)."""
+    text = text.strip()
+    amount = float(re.sub(r"[^0-9.+-]", "", text))
+    return -abs(amount) if text.startswith("(") and text.endswith(")") else amount
+
+
+def read_statement_csv(path):
+    """Reads 'date,description,amount[,balance]' lines; amounts are signed (money in > 0).
+
+    Returns dicts with ISO 'date', 'description', 'amount' and 'balance' (None if not given).
+    """
+    lines = []
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        for line_number, row in enumerate(csv.reader(f), start=1):
+            if not row or not any(cell.strip() for cell in row) or row[0].strip().lower() == "date": continue # Blank line or header
+            try:
+                lines.append({"date": _statement_date(row[0]).isoformat(), "description": row[1].strip(),
+                              "amount": _statement_amount(row[2]),
+                              "balance": _statement_amount(row[3]) if len(row) > 3 and row[3].strip() else None})
+            except (IndexError, ValueError) as e:
+                raise ValueError(f"{path}, line {line_number}: expected 'date,description,amount[,balance]' ({e})")
+    return lines
+
+
+def reconcile_statement(ledger_entries, statement_entries, tolerance_days=0):
+    """Pairs ledger and statement entries, each a (signed amount, ISO date) tuple.
+
+    Entries pair up when their amounts are equal to the cent and their dates are at most
+    `tolerance_days` apart. Both sides are sorted by (cents, date) and merged in one pass
+    (a sort-merge join), so this is O(n log n) rather than comparing every pair. Within an
+    amount the earliest unpaired entries are paired first, which pairs as many as possible.
+    Returns (matches, ledger_only, statement_only): (ledger index, statement index) pairs
+    and the indexes left unpaired on each side.
+    """
+    def sort_keys(entries):
+        return sorted((round(amount * 100), date.fromisoformat(day).toordinal(), i)
+                      for i, (amount, day) in enumerate(entries))
+
+    ledger, statement = sort_keys(ledger_entries), sort_keys(statement_entries)
+    matches, ledger_only, statement_only = [], [], []
+    i = j = 0
+    while i < len(ledger) and j < len(statement):
+        ledger_cents, ledger_day, ledger_index = ledger[i]
+        statement_cents, statement_day, statement_index = statement[j]
+        if ledger_cents < statement_cents or (ledger_cents == statement_cents and ledger_day < statement_day - tolerance_days):
+            ledger_only.append(ledger_index); i += 1
+        elif ledger_cents > statement_cents or ledger_day > statement_day + tolerance_days:
+            statement_only.append(statement_index); j += 1
+        else:
+            matches.append((ledger_index, statement_index)); i += 1; j += 1
+    ledger_only.extend(index for _, _, index in ledger[i:])
+    statement_only.extend(index for _, _, index in statement[j:])
+    return matches, ledger_only, statement_only
+
+
+# --- Chart Downsampling ---
+def lttb_downsample(points, threshold):
+    """Reduces (x, y) points sorted by x to `threshold` points with Largest-Triangle-Three-Buckets.
+
+    The first and last points are kept. Every other bucket contributes the point forming the
+    largest triangle with the previously kept point and the average of the next bucket, which
+    keeps peaks and dips that plain decimation would drop.
+    """
+    count = len(points)
+    if threshold >= count or threshold < 3:
+        return list(points)
+    sampled = [points[0]]
+    bucket_size = (count - 2) / (threshold - 2)
+    kept = 0
+    for bucket in range(threshold - 2):
+        start = int(bucket * bucket_size) + 1
+        end = int((bucket + 1) * bucket_size) + 1
+        next_end = min(int((bucket + 2) * bucket_size) + 1, count)
+        next_points = points[end:next_end]
+        avg_x = sum(x for x, _ in next_points) / len(next_points)
+        avg_y = sum(y for _, y in next_points) / len(next_points)
+        kept_x, kept_y = points[kept]
+        best, best_area = start, -1.0
+        for index in range(start, end):
+            x, y = points[index]
+            area = abs((kept_x - avg_x) * (y - kept_y) - (kept_x - x) * (avg_y - kept_y))
+            if area > best_area:
+                best, best_area = index, area
+        sampled.append(points[best])
+        kept = best
+    sampled.append(points[-1])
+    return sampled
+
+
+# --- Binary Ledger Format ---
+# A compact alternative to the JSON files: an 8-byte header (magic, version, compression) and a
+# body of counts, a string table holding every distinct string once, fixed-width transaction
+# records, and a JSON blob for any top-level keys other than "transactions".
+# encode_binary_ledger/decode_binary_ledger round-trip exactly with the JSON structure.
+
+BINARY_LEDGER_MAGIC = b"FTLB"
+BINARY_LEDGER_VERSION = 2
+BINARY_LEDGER_EXT = ".ftl"
+_BINARY_COMPRESSION = {None: 0, "gzip": 1, "lzma": 2}
+_BINARY_HEADER = struct.Struct('<4sBBH')  # magic, version, compression code, reserved
+_BINARY_COUNTS = struct.Struct('<IIII')   # strings, string table bytes, records, meta bytes
+# date ordinal, flags, type code, amount, id, account, description, category+1, extras+1,
+# text id+1, transfer_id+1 (the +1 fields use 0 for None so the decoder can index a table
+# with None in slot 0)
+BINARY_RECORD = struct.Struct('<iHBxddIIIIII')
+_BINARY_RECORD_V1 = struct.Struct('<iHBxddIIII') # Version 1: text ids in the id slot, transfer_id in the extras
+_BINARY_ID_OFFSET = 16                    # Byte offset of the id field inside a record
+_ID_AS_DOUBLE = struct.Struct('<d')
+_ID_AS_INT = struct.Struct('<q')
+_TYPE_CODES = {TRANS_EXPENSE: 0, TRANS_INCOME: 1}
+_TYPE_NAMES = (TRANS_EXPENSE, TRANS_INCOME)
+# Record flags
+_F_DATE_TEXT = 0x01        # date is a string index (text that isn't a canonical YYYY-MM-DD date)
+_F_AMOUNT_INT = 0x02       # amount was an int in the source
+_F_ID_INT = 0x04           # id field holds int64 bits
+_F_ID_TEXT = 0x08          # id is a string (its index is in the text id field; version 1: in the id slot as int64 bits)
+_F_ID_MISSING = 0x10
+_F_CATEGORY_MISSING = 0x20 # no 'category' key at all
+_F_RAW_RECORD = 0x40       # record doesn't fit the layout; extras holds the whole record as JSON
+_CORE_KEYS = frozenset(('date', 'account', 'description', 'amount', 'type', 'category', 'id'))
+
+
+class _DateStrings(dict):
+    """Ordinal -> 'YYYY-MM-DD', filled on first use (ledgers repeat the same dates a lot)."""
+    def __missing__(self, ordinal):
+        text = self[ordinal] = date.fromordinal(ordinal).isoformat()
+        return text
+
+
+def _is_plain_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _packable_transaction(trans):
+    """True if a transaction fits the fixed-width record layout."""
+    if type(trans) is not dict: return False
+    amount, trans_id, category = trans.get('amount'), trans.get('id'), trans.get('category')
+    return (type(trans.get('date')) is str and type(trans.get('account')) is str
+            and type(trans.get('description')) is str and trans.get('type') in _TYPE_CODES
+            and (type(amount) is float or (type(amount) is int and float(amount) == amount))
+            and (category is None or type(category) is str)
+            and (trans_id is None and 'id' not in trans or type(trans_id) in (float, str)
+                 or (type(trans_id) is int and -2**63 <= trans_id < 2**63)))
+
+
+def _pack_transaction(trans, intern, date_ordinals):
+    """Maps a transaction onto BINARY_RECORD fields.
+
+    `intern(text)` returns the reference to store for a string. Returns (fields, id_bits);
+    id_bits is not None when an int id must be written over the id slot as int64.
+    """
+    if not _packable_transaction(trans):
+        return (0, _F_RAW_RECORD, 0, 0.0, 0.0, 0, 0, 0, intern(json.dumps(trans, ensure_ascii=False)) + 1, 0, 0), None
+
+    flags = 0
+    date_str = trans['date']
+    ordinal = date_ordinals.get(date_str)
+    if ordinal is None:
+        try:
+            parsed = date.fromisoformat(date_str)
+            ordinal = parsed.toordinal() if parsed.isoformat() == date_str else -1
+        except ValueError:
+            ordinal = -1
+        date_ordinals[date_str] = ordinal
+    if ordinal < 0:
+        flags |= _F_DATE_TEXT
+        ordinal = intern(date_str)
+
+    amount = trans['amount']
+    if type(amount) is int: flags |= _F_AMOUNT_INT
+
+    core_keys = 5 # date, account, description, amount, type
+    category_ref = 0
+    if 'category' in trans:
+        core_keys += 1
+        if trans['category'] is not None: category_ref = intern(trans['category']) + 1
+    else:
+        flags |= _F_CATEGORY_MISSING
+
+    id_value, id_bits, id_ref = 0.0, None, 0
+    if 'id' in trans:
+        core_keys += 1
+        trans_id = trans['id']
+        if type(trans_id) is float: id_value = trans_id
+        elif type(trans_id) is int: flags |= _F_ID_INT; id_bits = trans_id
+        else: flags |= _F_ID_TEXT; id_ref = intern(trans_id) + 1
+    else:
+        flags |= _F_ID_MISSING
+
+    transfer_ref = 0
+    if type(trans.get('transfer_id')) is str:
+        core_keys += 1
+        transfer_ref = intern(trans['transfer_id']) + 1
+
+    extras_ref = 0
+    if len(trans) > core_keys:
+        extras = {key: value for key, value in trans.items()
+                  if key not in _CORE_KEYS and not (key == 'transfer_id' and transfer_ref)}
+        extras_ref = intern(json.dumps(extras, ensure_ascii=False)) + 1
+
+    return (ordinal, flags, _TYPE_CODES[trans['type']], amount, id_value, intern(trans['account']),
+            intern(trans['description']), category_ref, extras_ref, id_ref, transfer_ref), id_bits
+
+
+def _unpack_transaction(fields, text, optional_text, date_strings, read_id_bits, extras_of=None):
+    """Builds a transaction dict from BINARY_RECORD fields (the inverse of _pack_transaction).
+
+    `text(ref)` / `optional_text(ref)` resolve string references; `read_id_bits()` returns
+    the id slot as int64 for records with an int id (or a version 1 string id).
+    `extras_of(ref)`, if given, returns the parsed extra keys (e.g. from a cache).
+    """
+    ordinal, flags, type_code, amount, id_value, account, description, category, extras, id_text, transfer = fields
+    if flags & _F_RAW_RECORD:
+        return json.loads(optional_text(extras))
+    trans = {"date": text(ordinal) if flags & _F_DATE_TEXT else date_strings[ordinal],
+             "account": text(account), "description": text(description),
+             "amount": int(amount) if flags & _F_AMOUNT_INT else amount, "type": _TYPE_NAMES[type_code]}
+    if not flags & _F_CATEGORY_MISSING:
+        trans["category"] = optional_text(category)
+    if not flags & _F_ID_MISSING:
+        if id_text:
+            trans["id"] = optional_text(id_text)
+        elif flags & (_F_ID_INT | _F_ID_TEXT):
+            bits = read_id_bits()
+            trans["id"] = text(bits) if flags & _F_ID_TEXT else bits
+        else:
+            trans["id"] = id_value
+    if transfer:
+        trans["transfer_id"] = optional_text(transfer)
+    if extras:
+        trans.update(extras_of(extras) if extras_of else json.loads(optional_text(extras)))
+    return trans
+
+
+def encode_binary_ledger(data, compression=None):
+    """Packs a ledger ({"transactions": [...], ...} or a bare list) into the binary format."""
+    if compression not in _BINARY_COMPRESSION:
+        raise ValueError(f"Unknown compression '{compression}'. Use one of: none, gzip, lzma.")
+    strings = {} # text -> index, in first-seen order
+    def intern(text):
+        return strings.setdefault(text, len(strings))
+
+    if isinstance(data, list):
+        transactions, meta = data, None
+    else:
+        transactions = data.get("transactions", [])
+        # Keep key order and presence; the transaction list itself goes in the records
+        meta = {key: (None if key == "transactions" else value) for key, value in data.items()}
+
+    size = BINARY_RECORD.size
+    records = bytearray(size * len(transactions))
+    pack_into = BINARY_RECORD.pack_into
+    date_ordinals = {}
+    for n, trans in enumerate(transactions):
+        fields, id_bits = _pack_transaction(trans, intern, date_ordinals)
+        pack_into(records, n * size, *fields)
+        if id_bits is not None:
+            _ID_AS_INT.pack_into(records, n * size + _BINARY_ID_OFFSET, id_bits)
+
+    string_list = list(strings)
+    lengths = array('I', [len(text) for text in string_list]) # In characters, for slicing after one decode
+    if sys.byteorder == 'big': lengths.byteswap()
+    string_bytes = "".join(string_list).encode('utf-8')
+    meta_bytes = json.dumps(meta, ensure_ascii=False).encode('utf-8')
+    body = b"".join((
+        _BINARY_COUNTS.pack(len(string_list), len(string_bytes), len(transactions), len(meta_bytes)),
+        lengths.tobytes(), string_bytes, records, meta_bytes,
+    ))
+    if compression == "gzip": body = gzip.compress(body, compresslevel=6)
+    elif compression == "lzma": body = lzma.compress(body)
+    return _BINARY_HEADER.pack(BINARY_LEDGER_MAGIC, BINARY_LEDGER_VERSION, _BINARY_COMPRESSION[compression], 0) + body
+
+
+def is_binary_ledger(blob):
+    return blob[:len(BINARY_LEDGER_MAGIC)] == BINARY_LEDGER_MAGIC
+
+
+def decode_binary_ledger(blob):
+    """Unpacks bytes produced by encode_binary_ledger back into the original structure."""
+    if len(blob) < _BINARY_HEADER.size or not is_binary_ledger(blob):
+        raise ValueError("Not a binary ledger file.")
+    _, version, compression, _ = _BINARY_HEADER.unpack_from(blob)
+    if version not in (1, BINARY_LEDGER_VERSION):
+        raise ValueError(f"Unsupported binary ledger version {version}.")
+    record = BINARY_RECORD if version == BINARY_LEDGER_VERSION else _BINARY_RECORD_V1
+    body = memoryview(blob)[_BINARY_HEADER.size:]
+    if compression == _BINARY_COMPRESSION["gzip"]: body = memoryview(gzip.decompress(body))
+    elif compression == _BINARY_COMPRESSION["lzma"]: body = memoryview(lzma.decompress(body))
+    elif compression != 0: raise ValueError(f"Unknown compression code {compression}.")
+
+    string_count, string_bytes, record_count, meta_bytes = _BINARY_COUNTS.unpack_from(body)
+    pos = _BINARY_COUNTS.size
+    lengths = array('I')
+    lengths.frombytes(body[pos:pos + 4 * string_count])
+    if sys.byteorder == 'big': lengths.byteswap()
+    pos += 4 * string_count
+    text = str(body[pos:pos + string_bytes], 'utf-8')
+    pos += string_bytes
+    ends = list(accumulate(lengths))
+    strings = [text[start:end] for start, end in zip([0] + ends, ends)]
+    optional = [None] + strings # category/extras are stored as index + 1, with 0 meaning None
+    records = body[pos:pos + record_count * record.size]
+    pos += record_count * record.size
+    meta = json.loads(str(body[pos:pos + meta_bytes], 'utf-8'))
+
+    date_strings = _DateStrings()
+    type_names = _TYPE_NAMES
+    fields = record.iter_unpack(records)
+    if record is _BINARY_RECORD_V1:
+        fields = (row + (0, 0) for row in fields)
+    # Fast path: canonical date, float or string id, category key present, no extra keys but transfer_id
+    transactions = [
+        ({"date": date_strings[ordinal], "account": strings[account], "description": strings[description],
+          "amount": amount, "type": type_names[type_code], "category": optional[category],
+          "id": optional[id_text] if id_text else id_value, "transfer_id": optional[transfer]}
+         if transfer else
+         {"date": date_strings[ordinal], "account": strings[account], "description": strings[description],
+          "amount": amount, "type": type_names[type_code], "category": optional[category],
+          "id": optional[id_text] if id_text else id_value})
+        if not extras and (not flags or flags == _F_ID_TEXT and id_text) else None
+        for ordinal, flags, type_code, amount, id_value, account, description, category, extras, id_text, transfer
+        in fields
+    ]
+    # Slow path for everything else
+    shared_extras = {} # extras index -> parsed extras of plain values only (e.g. "reconciled": true), safe to reuse
+    def extras_of(ref):
+        parsed = shared_extras.get(ref)
+        if parsed is None:
+            parsed = json.loads(optional[ref])
+            if not any(isinstance(value, (list, dict)) for value in parsed.values()): shared_extras[ref] = parsed
+        return parsed
+    for n, trans in enumerate(transactions):
+        if trans is None:
+            offset = n * record.size
+            row = record.unpack_from(records, offset)
+            if record is _BINARY_RECORD_V1: row += (0, 0)
+            transactions[n] = _unpack_transaction(
+                row, strings.__getitem__, optional.__getitem__, date_strings,
+                lambda: _ID_AS_INT.unpack_from(records, offset + _BINARY_ID_OFFSET)[0], extras_of)
+
+    if meta is None:
+        return transactions
+    if "transactions" in meta:
+        meta["transactions"] = transactions
+    return meta
+
+
+def _ledger_format_for_path(path):
+    """Returns 'binary', 'mmap' or 'json' based on a ledger file's extension."""
+    lower_path = path.lower()
+    if lower_path.endswith(BINARY_LEDGER_EXT): return "binary"
+    if lower_path.endswith(MAPPED_LEDGER_EXT): return "mmap"
+    return "json"
+
+
+def read_ledger_file(path, with_checksum=False):
+    """Reads a ledger file in the JSON, binary or memory-mapped format (detected from its header).
+
+    With `with_checksum`, returns (data, CRC-32 of the file's bytes); for memory-mapped files,
+    which are appended to in place, the checksum is MappedLedger.content_crc().
+    """
+    with open(path, 'rb') as f:
+        blob = f.read(len(MAPPED_LEDGER_MAGIC))
+        if blob == MAPPED_LEDGER_MAGIC:
+            is_mapped = True
+        else:
+            is_mapped = False
+            blob += f.read()
+    if is_mapped:
+        with MappedLedger(path) as ledger:
+            data = ledger.to_ledger()
+            content_crc = ledger.content_crc() if with_checksum else None
+        return (data, content_crc) if with_checksum else data
+    data = decode_binary_ledger(blob) if is_binary_ledger(blob) else json.loads(blob.decode('utf-8'))
+    return (data, zlib.crc32(blob)) if with_checksum else data
+
+
+def write_ledger_file(path, data, fmt="json", compression=None):
+    """Writes a ledger file atomically as pretty-printed JSON, binary ('binary') or memory-mapped ('mmap').
+
+    Returns the CRC-32 of the bytes written (for memory-mapped files, MappedLedger.content_crc()).
+    """
+    if fmt == "mmap":
+        return MappedLedger.create(path, data)
+    if fmt == "binary":
+        blob = encode_binary_ledger(data, compression)
+    else:
+        blob = json.dumps(data, indent=4, ensure_ascii=False).encode('utf-8')
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(blob)
+    os.replace(temp_path, path) # Don't leave a half-written file behind
+    return zlib.crc32(blob)
+
+
+def remove_ledger_file(path):
+    """Deletes a ledger file (and the string heap of a memory-mapped one)."""
+    for file_path in (path, path + MAPPED_HEAP_SUFFIX):
+        if os.path.exists(file_path): os.remove(file_path)
+
+
+def convert_ledger_file(source_path, target_path, compression=None):
+    """Converts between formats. The target format follows its extension (.ftl = binary, .ftm = mmap)."""
+    data = read_ledger_file(source_path)
+    target_format = _ledger_format_for_path(target_path)
+    write_ledger_file(target_path, data, fmt=target_format, compression=compression if target_format == "binary" else None)
+    return data
+
+
+# --- Memory-Mapped Ledger ---
+# Fixed-size BINARY_RECORD rows in a file opened with mmap, plus a separate string heap
+# (<file>.heap) of length-prefixed UTF-8 strings that records point into by byte offset.
+# Rows are read straight out of the mapped buffer, so opening the file costs the same for
+# any ledger size and scans/sums never build dicts for rows nobody asked for. The content
+# checksum is a CRC-32 of the records and one of the heap, which appends extend in place.
+
+MAPPED_LEDGER_MAGIC = b"FTMR"
+MAPPED_LEDGER_VERSION = 2 # Version 1 files (BINARY_RECORD version 1) are still read, and rewritten on append
+MAPPED_LEDGER_EXT = ".ftm"
+MAPPED_HEAP_SUFFIX = ".heap"
+_MAPPED_HEADER = struct.Struct('<4sHHQQB7x') # magic, version, record size, count, meta ref (+1), sorted flag
+_HEAP_LENGTH = struct.Struct('<I')
+_RECORD_ORDINAL = struct.Struct('<i')          # First field of every record
+
+
+def _mapped_crc(records_crc, heap_crc):
+    return records_crc << 32 | heap_crc
+
+
+class MappedLedger:
+    """Random access to a fixed-record ledger file through mmap/memoryview."""
+    def __init__(self, path):
+        self.path = path
+        self.heap_path = path + MAPPED_HEAP_SUFFIX
+        self._strings = {}       # heap offset -> decoded text
+        self._heap_index = None  # text -> heap offset, only built when appending
+        self._date_strings = _DateStrings()
+        self._open()
+
+    def _open(self):
+        with open(self.path, 'rb') as f:
+            self._record_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        heap_size = os.path.getsize(self.heap_path) if os.path.exists(self.heap_path) else 0
+        if heap_size:
+            with open(self.heap_path, 'rb') as f:
+                self._heap_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._heap_map = None # mmap can't map an empty file
+        self._view = memoryview(self._record_map)
+        magic, self.version, record_size, self.count, self.meta_ref, sorted_flag = _MAPPED_HEADER.unpack_from(self._view)
+        self._record = BINARY_RECORD if self.version == MAPPED_LEDGER_VERSION else _BINARY_RECORD_V1
+        if magic != MAPPED_LEDGER_MAGIC or self.version not in (1, MAPPED_LEDGER_VERSION) or record_size != self._record.size:
+            self.close()
+            raise ValueError(f"{self.path} is not a supported memory-mapped ledger file.")
+        self.sorted_by_date = bool(sorted_flag)
+        self.heap_size = heap_size
+
+    def close(self):
+        if getattr(self, '_view', None) is not None:
+            self._view.release() # Must go before the map itself can close
+            self._view = None
+            self._record_map.close()
+            if self._heap_map is not None: self._heap_map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def content_crc(self):
+        """Checksum of the rows and strings in the file (the header isn't included)."""
+        return _mapped_crc(zlib.crc32(self._records_view()), zlib.crc32(self._heap_map) if self._heap_map is not None else 0)
+
+    # --- Reading ---
+    def _text(self, offset):
+        text = self._strings.get(offset)
+        if text is None:
+            length = _HEAP_LENGTH.unpack_from(self._heap_map, offset)[0]
+            start = offset + _HEAP_LENGTH.size
+            text = self._strings[offset] = str(self._heap_map[start:start + length], 'utf-8')
+        return text
+
+    def _optional_text(self, ref):
+        return None if ref == 0 else self._text(ref - 1)
+
+    def _offset(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return _MAPPED_HEADER.size + index * self._record.size
+
+    def record(self, index):
+        """Raw BINARY_RECORD fields of one row, without building a dict."""
+        fields = self._record.unpack_from(self._view, self._offset(index))
+        return fields if self._record is BINARY_RECORD else fields + (0, 0)
+
+    def row(self, index):
+        """Materializes a single row as a transaction dict."""
+        offset = self._offset(index)
+        return _unpack_transaction(
+            self.record(index), self._text, self._optional_text, self._date_strings,
+            lambda: _ID_AS_INT.unpack_from(self._view, offset + _BINARY_ID_OFFSET)[0])
+
+    def rows(self, indices):
+        return [self.row(index) for index in indices]
+
+    def _records_view(self, start=0, stop=None):
+        stop = self.count if stop is None else stop
+        return self._view[_MAPPED_HEADER.size + start * self._record.size:_MAPPED_HEADER.size + stop * self._record.size]
+
+    @staticmethod
+    def _to_ordinal(value, default):
+        if value is None: return default
+        if isinstance(value, str): value = date.fromisoformat(value)
+        return value.toordinal()
+
+    def date_range(self, start=None, end=None):
+        """Indices of rows dated within [start, end] (dates or ISO strings; None = open-ended).
+
+        Sorted files are searched with a binary search on the date field; others are scanned.
+        """
+        low = self._to_ordinal(start, -2**31)
+        high = self._to_ordinal(end, 2**31 - 1)
+        if self.sorted_by_date:
+            ordinal_at = lambda i: _RECORD_ORDINAL.unpack_from(self._view, _MAPPED_HEADER.size + i * self._record.size)[0]
+            first, last = 0, self.count
+            while first < last: # First row with ordinal >= low
+                middle = (first + last) // 2
+                if ordinal_at(middle) < low: first = middle + 1
+                else: last = middle
+            stop, last = first, self.count
+            while stop < last: # First row with ordinal > high
+                middle = (stop + last) // 2
+                if ordinal_at(middle) <= high: stop = middle + 1
+                else: last = middle
+            return range(first, stop)
+
+        low_text = date.fromordinal(max(low, 1)).isoformat() if start is not None else None
+        high_text = date.fromordinal(min(high, date.max.toordinal())).isoformat() if end is not None else None
+        matches = []
+        for index, (ordinal, flags, *_rest) in enumerate(self._record.iter_unpack(self._records_view())):
+            if flags & (_F_DATE_TEXT | _F_RAW_RECORD):
+                trans = self.row(index)
+                date_str = str(trans.get('date', '')) if isinstance(trans, dict) else ''
+                if not date_str: continue
+                if (low_text is None or date_str >= low_text) and (high_text is None or date_str <= high_text):
+                    matches.append(index)
+            elif low <= ordinal <= high:
+                matches.append(index)
+        return matches
+
+    def _selected_records(self, selected):
+        """(index, fields) of the rows at `selected` (a range is read in one sweep)."""
+        if isinstance(selected, range) and selected.step == 1:
+            return enumerate(self._record.iter_unpack(self._records_view(selected.start, selected.stop)), selected.start)
+        return ((index, self.record(index)) for index in selected)
+
+    def balance_sums(self, start=None, end=None):
+        """Per-account net (income - expense) over a date range, read directly from the mapped records."""
+        if start is None and end is None:
+            selected = range(self.count)
+        else:
+            selected = self.date_range(start, end)
+        by_account_ref = defaultdict(float)
+        by_account_name = defaultdict(float)
+        for index, (ordinal, flags, type_code, amount, _id, account, *_rest) in self._selected_records(selected):
+            if flags & _F_RAW_RECORD:
+                trans = self.row(index)
+                if isinstance(trans, dict) and trans.get('type') in _TYPE_CODES and _is_plain_number(trans.get('amount')):
+                    sign = 1 if trans['type'] == TRANS_INCOME else -1
+                    by_account_name[trans.get('account')] += sign * trans['amount']
+            else:
+                by_account_ref[account] += amount if type_code == 1 else -amount
+        for ref, amount in by_account_ref.items():
+            by_account_name[self._text(ref)] += amount
+        return dict(by_account_name)
+
+    def balance_sums_through(self, ends, start=None):
+        """balance_sums of consecutive date windows in one pass: the i-th window runs from the day
+        after ends[i - 1] (the first from `start`) through ends[i]. `ends` are ascending ISO dates."""
+        if not ends:
+            return []
+        bounds = [date.fromisoformat(end).toordinal() for end in ends]
+        by_account_ref = [defaultdict(float) for _ in ends]
+        by_account_name = [defaultdict(float) for _ in ends]
+        for index, (ordinal, flags, type_code, amount, _id, account, *_rest) in self._selected_records(self.date_range(start, ends[-1])):
+            if flags & (_F_RAW_RECORD | _F_DATE_TEXT):
+                trans = self.row(index)
+                if isinstance(trans, dict) and trans.get('type') in _TYPE_CODES and _is_plain_number(trans.get('amount')):
+                    sign = 1 if trans['type'] == TRANS_INCOME else -1
+                    by_account_name[bisect_left(ends, str(trans.get('date', '')))][trans.get('account')] += sign * trans['amount']
+            else:
+                by_account_ref[bisect_left(bounds, ordinal)][account] += amount if type_code == 1 else -amount
+        for refs, names in zip(by_account_ref, by_account_name):
+            for ref, amount in refs.items():
+                names[self._text(ref)] += amount
+        return [dict(names) for names in by_account_name]
+
+    def to_ledger(self):
+        """Materializes every row, returning the structure the file was created from."""
+        transactions = self.rows(range(self.count))
+        if self.meta_ref == 0:
+            return transactions
+        meta = json.loads(self._text(self.meta_ref - 1))
+        if "transactions" in meta:
+            meta["transactions"] = transactions
+        return meta
+
+    # --- Writing ---
+    @staticmethod
+    def _pack_rows(transactions, intern):
+        size = BINARY_RECORD.size
+        records = bytearray(size * len(transactions))
+        date_ordinals = {}
+        all_canonical = True
+        ordinals = []
+        for n, trans in enumerate(transactions):
+            fields, id_bits = _pack_transaction(trans, intern, date_ordinals)
+            BINARY_RECORD.pack_into(records, n * size, *fields)
+            if id_bits is not None:
+                _ID_AS_INT.pack_into(records, n * size + _BINARY_ID_OFFSET, id_bits)
+            if fields[1] & (_F_DATE_TEXT | _F_RAW_RECORD): all_canonical = False
+            ordinals.append(fields[0])
+        in_order = all_canonical and all(a <= b for a, b in zip(ordinals, ordinals[1:]))
+        return records, in_order, (ordinals[0] if ordinals else None), (ordinals[-1] if ordinals else None)
+
+    @classmethod
+    def create(cls, path, data, sort_by_date=False):
+        """Writes a new mapped ledger from {"transactions": [...], ...} or a bare list. Returns its content_crc()."""
+        if isinstance(data, list):
+            transactions, meta = data, None
+        else:
+            transactions = data.get("transactions", [])
+            meta = {key: (None if key == "transactions" else value) for key, value in data.items()}
+        if sort_by_date:
+            transactions = sorted(transactions, key=lambda t: str(t.get('date', '')) if isinstance(t, dict) else '')
+
+        heap = bytearray()
+        heap_index = {}
+        def intern(text):
+            offset = heap_index.get(text)
+            if offset is None:
+                encoded = text.encode('utf-8')
+                offset = heap_index[text] = len(heap)
+                heap.extend(_HEAP_LENGTH.pack(len(encoded)))
+                heap.extend(encoded)
+            return offset
+
+        records, in_order, _, _ = cls._pack_rows(transactions, intern)
+        meta_ref = intern(json.dumps(meta, ensure_ascii=False)) + 1 if meta is not None else 0
+        header = _MAPPED_HEADER.pack(MAPPED_LEDGER_MAGIC, MAPPED_LEDGER_VERSION, BINARY_RECORD.size,
+                                     len(transactions), meta_ref, 1 if in_order else 0)
+        # Heap first: records are only replaced once everything they point to is on disk
+        for file_path, content in ((path + MAPPED_HEAP_SUFFIX, heap), (path, header + records)):
+            with open(file_path + ".tmp", 'wb') as f:
+                f.write(content)
+            os.replace(file_path + ".tmp", file_path)
+        return _mapped_crc(zlib.crc32(records), zlib.crc32(heap))
+
+    def append(self, transactions, content_crc=None):
+        """Appends rows in place, adding only strings the heap doesn't already hold.
+
+        Given the file's content_crc() before the append, returns the one after it (else None).
+        """
+        if not transactions:
+            return content_crc
+        if self.version != MAPPED_LEDGER_VERSION: # Older record layout: rewrite the file in the current one
+            data = self.to_ledger()
+            rows = (data if isinstance(data, list) else data.get("transactions", [])) + list(transactions)
+            if isinstance(data, dict): data["transactions"] = rows
+            self.close()
+            content_crc = self.create(self.path, data if isinstance(data, dict) else rows, sort_by_date=self.sorted_by_date)
+            self._strings.clear()
+            self._open()
+            return content_crc
+        if self._heap_index is None: # One pass over the heap, only needed by writers
+            self._heap_index = {}
+            offset = 0
+            while offset < self.heap_size:
+                self._heap_index[self._text(offset)] = offset
+                offset += _HEAP_LENGTH.size + _HEAP_LENGTH.unpack_from(self._heap_map, offset)[0]
+        heap_index = self._heap_index
+        new_heap = bytearray()
+        heap_end = self.heap_size
+        def intern(text):
+            offset = heap_index.get(text)
+            if offset is None:
+                encoded = text.encode('utf-8')
+                offset = heap_index[text] = heap_end + len(new_heap)
+                new_heap.extend(_HEAP_LENGTH.pack(len(encoded)))
+                new_heap.extend(encoded)
+            return offset
+
+        records, in_order, first_ordinal, _ = self._pack_rows(transactions, intern)
+        still_sorted = self.sorted_by_date and in_order and (
+            self.count == 0 or _RECORD_ORDINAL.unpack_from(self._view, self._offset(self.count - 1))[0] <= first_ordinal)
+        new_count = self.count + len(transactions)
+        meta_ref, old_count = self.meta_ref, self.count
+
+        self.close()
+        with open(self.heap_path, 'ab') as f:
+            f.write(new_heap)
+        with open(self.path, 'r+b') as f:
+            f.seek(_MAPPED_HEADER.size + old_count * BINARY_RECORD.size)
+            f.write(records)
+            f.truncate()
+            f.flush()
+            # The header is updated last, so a crash mid-append leaves the old row count intact
+            f.seek(0)
+            f.write(_MAPPED_HEADER.pack(MAPPED_LEDGER_MAGIC, MAPPED_LEDGER_VERSION, BINARY_RECORD.size,
+                                        new_count, meta_ref, 1 if still_sorted else 0))
+        self._open()
+        if content_crc is None:
+            return None
+        return _mapped_crc(zlib.crc32(records, content_crc >> 32), zlib.crc32(new_heap, content_crc & 0xFFFFFFFF))
+
+
+# --- File Locking ---
+class LedgerLock:
+    """Advisory lock on a ledger, held on a side file so the data files themselves can be replaced.
+
+    Shared for reading, exclusive for writing (Windows only has exclusive locks). Re-entrant
+    within a process: taking a lock that is already held only upgrades it if needed.
+    """
+    _held = {} # lock path -> [depth, open lock file, exclusive]
+
+    def __init__(self, path, exclusive=True, timeout=LEDGER_LOCK_TIMEOUT):
+        self.lock_path = os.path.abspath(path) + LEDGER_LOCK_SUFFIX
+        self.exclusive = exclusive
+        self.timeout = timeout
+
+    def __enter__(self):
+        held = LedgerLock._held.get(self.lock_path)
+        if held:
+            if self.exclusive and not held[2]:
+                self._acquire(held[1], exclusive=True) # Upgrade shared -> exclusive
+                held[2] = True
+            held[0] += 1
+            return self
+        lock_file = open(self.lock_path, 'a+b')
+        try:
+            self._acquire(lock_file, self.exclusive)
+        except BaseException:
+            lock_file.close()
+            raise
+        LedgerLock._held[self.lock_path] = [1, lock_file, self.exclusive or fcntl is None]
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        held = LedgerLock._held[self.lock_path]
+        held[0] -= 1
+        if held[0] == 0:
+            del LedgerLock._held[self.lock_path]
+            try:
+                if fcntl is not None: fcntl.flock(held[1].fileno(), fcntl.LOCK_UN)
+                else: held[1].seek(0); msvcrt.locking(held[1].fileno(), msvcrt.LK_UNLCK, 1)
+            finally:
+                held[1].close()
+
+    def _acquire(self, lock_file, exclusive):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | fcntl.LOCK_NB)
+                else:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+                return
+            except OSError:
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"The ledger is locked by another program ({self.lock_path}). Try again in a moment.")
+                time.sleep(0.05)
+
+
+class ReadWriteLock:
+    """In-process lock for threads sharing one ledger: any number of readers, or one writer.
+
+    Waiting writers go first, so a steady stream of reads can't hold a write off forever.
+    Use `with lock.read():` / `with lock.write():`; neither is re-entrant.
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    def read(self):
+        return _HeldLock(self._acquire_read, self._release_read)
+
+    def write(self):
+        return _HeldLock(self._acquire_write, self._release_write)
+
+    def _acquire_read(self):
+        with self._condition:
+            while self._writing or self._writers_waiting:
+                self._condition.wait()
+            self._readers += 1
+
+    def _release_read(self):
+        with self._condition:
+            self._readers -= 1
+            if self._readers == 0:
+                self._condition.notify_all()
+
+    def _acquire_write(self):
+        with self._condition:
+            self._writers_waiting += 1
+            try:
+                while self._writing or self._readers:
+                    self._condition.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writing = True
+
+    def _release_write(self):
+        with self._condition:
+            self._writing = False
+            self._condition.notify_all()
+
+
+class _HeldLock:
+    def __init__(self, acquire, release):
+        self._acquire, self._release = acquire, release
+
+    def __enter__(self):
+        self._acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._release()
+        return False
+
+
+# --- Filter Queries ---
+# A small query language for the filter box, e.g.
+#     amount > 500 and category in (Rent, Utilities) and account != Cash and desc ~ "grab"
+# Fields: date, account, desc (description), category, type, amount, transfer, reconciled.
+# Text comparisons ignore case; `~` / `!~` search with a regular expression. Dates may be a
+# year, month or day (`date = 2026-03`, `date >= 2025`). `transfer`, `reconciled` and `opening`
+# are yes/no flags and can be used on their own (`not transfer`). Combine with and, or, not, ( ).
+
+_QUERY_TOKEN = re.compile(r"""\s*(?:(?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')|(?P<op>!=|>=|<=|==|!~|[=<>~(),])|(?P<word>[^\s"'=!<>~(),]+))""")
+_QUERY_KEYWORDS = ("and", "or", "not", "in")
+_QUERY_FIELD_ALIASES = {"desc": "description"}
+# field -> (kind, expression reading it from transaction `t`; text is lower-cased)
+_QUERY_FIELDS = {
+    "date": ("date", "t.get('date', '')"),
+    "account": ("text", "(t.get('account') or '').lower()"),
+    "description": ("text", "(t.get('description') or '').lower()"),
+    "category": ("text", "((t.get('category') or UNCATEGORIZED) if t.get('type') == TRANS_EXPENSE else '').lower()"),
+    "type": ("text", "(t.get('type') or '').lower()"),
+    "amount": ("amount", "t.get('amount', 0.0)"),
+    "transfer": ("flag", "bool(t.get('transfer_id'))"),
+    "reconciled": ("flag", "bool(t.get('reconciled'))"),
+    "opening": ("flag", "bool(t.get('opening_balance'))"),
+}
+_QUERY_SPLIT_CATEGORIES = "[(c or UNCATEGORIZED).lower() for c, _ in t['splits']]"
+_QUERY_OPERATORS = {"date": ("=", "!=", "<", "<=", ">", ">=", "in", "~", "!~"), "text": ("=", "!=", "in", "~", "!~"),
+                    "amount": ("=", "!=", "<", "<=", ">", ">=", "in"), "flag": ("=", "!=")}
+_QUERY_FLAG_VALUES = {"yes": True, "true": True, "1": True, "no": False, "false": False, "0": False}
+
+
+def _query_period(text):
+    """(first day, last day) of a 'YYYY', 'YYYY-MM' or 'YYYY-MM-DD' value."""
+    try:
+        if re.fullmatch(r"\d{4}", text):
+            return date(int(text), 1, 1), date(int(text), 12, 31)
+        if re.fullmatch(r"\d{4}-\d{2}", text):
+            year, month = int(text[:4]), int(text[5:])
+            return date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+        day = date.fromisoformat(text)
+        return day, day
+    except ValueError:
+        raise ValueError(f"'{text}' is not a date (use YYYY, YYYY-MM or YYYY-MM-DD).")
+
+
+def _query_literal(value):
+    if isinstance(value, float): return str(int(value)) if value.is_integer() else repr(value)
+    if re.fullmatch(r"[^\s\"'=!<>~(),]+", value) and value.lower() not in _QUERY_KEYWORDS: return value
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+class FilterQuery:
+    """A parsed filter query, compiled into one Python function over a transaction.
+
+    `text` is the normalized query (the cache key), `date_range` the (start, end) ISO dates a
+    row must fall in for the query to match (None = open), so callers can read only those
+    months, and `matches(trans)` the compiled predicate. Queries are parsed once and cached.
+    """
+    _cache = OrderedDict() # query text -> FilterQuery, most recently used last
+    _cache_lock = threading.Lock() # API requests compile queries from several threads
+    CACHE_SIZE = 64
+
+    @classmethod
+    def get(cls, text):
+        """The compiled query for `text` (raises ValueError with a readable message if it's invalid)."""
+        with cls._cache_lock:
+            query = cls._cache.get(text)
+            if query is None:
+                query = cls(text)
+                cls._cache[text] = cls._cache[query.text] = query
+                while len(cls._cache) > cls.CACHE_SIZE: cls._cache.popitem(last=False)
+            cls._cache.move_to_end(text)
+            return query
+
+    def __init__(self, text):
+        self.tokens = self._tokenize(text)
+        self.position = 0
+        tree = self._parse_or()
+        if self.position < len(self.tokens):
+            raise ValueError(f"Unexpected '{self.tokens[self.position][1]}'.")
+        del self.tokens
+        self.text = self._to_text(tree)
+        self.date_range = tuple(day.isoformat() if day else None for day in self._date_bounds(tree))
+        constants = {"UNCATEGORIZED": UNCATEGORIZED, "TRANS_EXPENSE": TRANS_EXPENSE, "__builtins__": {"bool": bool, "any": any}}
+        source = self._compile(tree, constants)
+        self.matches = eval(compile(f"lambda t: {source}", "<filter query>", "eval"), constants)
+
+    # --- Parsing ---
+    # Tree nodes: ("and"/"or", [nodes]), ("not", node), ("cmp", field, op, value); for "in" the
+    # value is a tuple. Values are already converted: floats, lower-cased text, date periods.
+
+    @staticmethod
+    def _tokenize(text):
+        tokens, position = [], 0
+        text = text.rstrip()
+        while position < len(text):
+            match = _QUERY_TOKEN.match(text, position)
+            if not match or match.end() == position:
+                raise ValueError(f"Unexpected '{text[position:].strip()[:1]}' at position {position + 1}.")
+            position = match.end()
+            if match.group("string") is not None:
+                tokens.append(("value", re.sub(r"\\(.)", r"\1", match.group("string")[1:-1])))
+            elif match.group("op") is not None:
+                tokens.append(("op", match.group("op")))
+            elif match.group("word").lower() in _QUERY_KEYWORDS:
+                tokens.append(("keyword", match.group("word").lower()))
+            else:
+                tokens.append(("word", match.group("word")))
+        if not tokens: raise ValueError("The query is empty.")
+        return tokens
+
+    def _peek(self, kind=None, text=None):
+        if self.position >= len(self.tokens): return None
+        token = self.tokens[self.position]
+        if (kind is None or token[0] == kind) and (text is None or token[1] == text): return token
+        return None
+
+    def _expect(self, kind, text):
+        if not self._peek(kind, text):
+            found = f"'{self.tokens[self.position][1]}'" if self.position < len(self.tokens) else "the end"
+            raise ValueError(f"Expected '{text}' but found {found}.")
+        self.position += 1
+
+    def _parse_or(self):
+        nodes = [self._parse_and()]
+        while self._peek("keyword", "or"):
+            self.position += 1
+            nodes.append(self._parse_and())
+        return nodes[0] if len(nodes) == 1 else ("or", nodes)
+
+    def _parse_and(self):
+        nodes = [self._parse_not()]
+        while self._peek("keyword", "and"):
+            self.position += 1
+            nodes.append(self._parse_not())
+        return nodes[0] if len(nodes) == 1 else ("and", nodes)
+
+    def _parse_not(self):
+        if self._peek("keyword", "not"):
+            self.position += 1
+            return ("not", self._parse_not())
+        if self._peek("op", "("):
+            self.position += 1
+            node = self._parse_or()
+            self._expect("op", ")")
+            return node
+        return self._parse_comparison()
+
+    def _parse_comparison(self):
+        token = self._peek("word")
+        if not token:
+            raise ValueError(f"Expected a field name but found {repr(self.tokens[self.position][1]) if self._peek() else 'the end'}.")
+        self.position += 1
+        field = _QUERY_FIELD_ALIASES.get(token[1].lower(), token[1].lower())
+        if field not in _QUERY_FIELDS:
+            raise ValueError(f"Unknown field '{token[1]}'. Use one of: {', '.join(['desc'] + [f for f in _QUERY_FIELDS if f != 'description'])}.")
+        kind = _QUERY_FIELDS[field][0]
+        if self._peek("keyword", "not"):
+            self.position += 1
+            self._expect("keyword", "in")
+            op = "not in"
+        elif self._peek("keyword", "in"):
+            self.position += 1
+            op = "in"
+        elif self._peek("op") and self._peek()[1] not in "(),":
+            op = self._peek()[1].replace("==", "=")
+            self.position += 1
+        elif kind == "flag":
+            return ("cmp", field, "=", True) # Bare flag: `reconciled`
+        else:
+            raise ValueError(f"Expected an operator after '{token[1]}'.")
+        if op.replace("not ", "") not in _QUERY_OPERATORS[kind]:
+            raise ValueError(f"'{op}' can't be used with {field}.")
+        if op.endswith("in"):
+            self._expect("op", "(")
+            values = [self._parse_value(field, kind, op)]
+            while self._peek("op", ","):
+                self.position += 1
+                values.append(self._parse_value(field, kind, op))
+            self._expect("op", ")")
+            return ("cmp", field, op, tuple(values))
+        return ("cmp", field, op, self._parse_value(field, kind, op))
+
+    def _parse_value(self, field, kind, op):
+        """Reads one value; unquoted values may be several words (`category = Eating Out`)."""
+        if self._peek("value"):
+            text = self._peek()[1]
+            self.position += 1
+        else:
+            words = []
+            while self._peek("word"):
+                words.append(self._peek()[1])
+                self.position += 1
+            if not words: raise ValueError(f"Expected a value for {field}.")
+            text = " ".join(words)
+        if op in ("~", "!~"):
+            try: return re.compile(text, re.IGNORECASE)
+            except re.error as e: raise ValueError(f"Invalid regular expression '{text}': {e}")
+        if kind == "amount":
+            try: return float(text.replace(",", ""))
+            except ValueError: raise ValueError(f"'{text}' is not an amount.")
+        if kind == "date":
+            return _query_period(text)
+        if kind == "flag":
+            if text.lower() not in _QUERY_FLAG_VALUES: raise ValueError(f"{field} is yes or no, not '{text}'.")
+            return _QUERY_FLAG_VALUES[text.lower()]
+        return text.lower()
+
+    # --- Planning & Compiling ---
+
+    def _to_text(self, node):
+        kind = node[0]
+        if kind in ("and", "or"):
+            return f" {kind} ".join(f"({self._to_text(child)})" if child[0] in ("and", "or") else self._to_text(child) for child in node[1])
+        if kind == "not":
+            inner = self._to_text(node[1])
+            return f"not ({inner})" if node[1][0] in ("and", "or") else f"not {inner}"
+        _, field, op, value = node
+        if _QUERY_FIELDS[field][0] == "flag":
+            return field if value == (op == "=") else f"not {field}"
+        def literal(item):
+            if isinstance(item, re.Pattern): return _query_literal(item.pattern)
+            if isinstance(item, tuple): # Date period: shortest form that names it
+                first, last = item
+                if first == last: return first.isoformat()
+                if first.month == 1 and first.day == 1 and last.month == 12 and last.day == 31 and first.year == last.year: return f"{first.year:04d}"
+                return first.isoformat()[:7]
+            return _query_literal(item)
+        if op.endswith("in"):
+            return f"{field} {op} ({', '.join(literal(item) for item in value)})"
+        return f"{field} {op} {literal(value)}"
+
+    def _date_bounds(self, node):
+        """(first, last) dates any matching row must lie within, from the query's date conditions."""
+        kind = node[0]
+        if kind in ("and", "or"):
+            bounds = [self._date_bounds(child) for child in node[1]]
+            firsts, lasts = [b[0] for b in bounds], [b[1] for b in bounds]
+            if kind == "and":
+                return (max((d for d in firsts if d), default=None), min((d for d in lasts if d), default=None))
+            return (None if None in firsts else min(firsts), None if None in lasts else max(lasts))
+        if kind != "cmp" or node[1] != "date":
+            return None, None
+        _, _, op, value = node
+        if op == "=": return value
+        if op == "in": return min(first for first, _ in value), max(last for _, last in value)
+        if op == ">=": return value[0], None
+        if op == ">": return value[1] + timedelta(days=1), None
+        if op == "<=": return None, value[1]
+        if op == "<": return None, value[0] - timedelta(days=1)
+        return None, None
+
+    def _compile(self, node, constants):
+        """Python source for the node; values are passed in as constants (c0, c1, ...), never pasted in."""
+        kind = node[0]
+        if kind in ("and", "or"):
+            return f" {kind} ".join(f"({self._compile(child, constants)})" for child in node[1])
+        if kind == "not":
+            return f"not ({self._compile(node[1], constants)})"
+        _, field, op, value = node
+        field_kind, getter = _QUERY_FIELDS[field]
+        def constant(item):
+            name = f"c{len(constants)}"
+            constants[name] = item
+            return name
+        source = self._compile_comparison(getter, field_kind, op, value, constant)
+        if field == "category": # A split expense matches if any of its categories does (!=, !~, not in: if none does)
+            positive_op = {"!=": "=", "!~": "~", "not in": "in"}.get(op)
+            any_split = f"any({self._compile_comparison('s', field_kind, positive_op or op, value, constant)} for s in {_QUERY_SPLIT_CATEGORIES})"
+            source = f"(({'not ' if positive_op else ''}{any_split}) if t.get('splits') else ({source}))"
+        return source
+
+    @staticmethod
+    def _compile_comparison(getter, field_kind, op, value, constant):
+        if op in ("~", "!~"):
+            return f"{constant(value.search)}({getter}) is {'not ' if op == '~' else ''}None"
+        if field_kind == "date": # Periods compare as ISO strings
+            first, last = value if op not in ("in", "not in") else (None, None)
+            if op == "=": return f"{constant(first.isoformat())} <= {getter} <= {constant(last.isoformat())}"
+            if op == "!=": return f"not ({constant(first.isoformat())} <= {getter} <= {constant(last.isoformat())})"
+            if op in (">", "<="): return f"{getter} {op} {constant(last.isoformat())}"
+            if op in ("<", ">="): return f"{getter} {op} {constant(first.isoformat())}"
+            periods = " or ".join(f"{constant(a.isoformat())} <= d <= {constant(b.isoformat())}" for a, b in value)
+            return f"{'not ' if op == 'not in' else ''}(lambda d: {periods})({getter})"
+        if op in ("in", "not in"):
+            return f"{getter} {op} {constant(frozenset(value))}"
+        return f"{getter} {'==' if op == '=' else op} {constant(value)}"
+
+
+# --- Query Result Cache ---
+class QueryCache:
+    """LRU cache of filter results and report aggregates, validated against a ledger version.
+
+    Every entry remembers the ledger version it was computed at and the date range it covers.
+    When the ledger changes, entries whose range contains one of the changed dates are dropped
+    and all others are re-stamped with the new version, so they stay valid.
+    """
+    def __init__(self, max_entries=QUERY_CACHE_MAX_ENTRIES, max_rows=QUERY_CACHE_MAX_ROWS):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self._entries = OrderedDict() # key -> [version, value, (start, end), size]
+        self._total_rows = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, version):
+        """Returns the cached value for `key` if it is valid at `version`, else None."""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != version:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, version, value, date_range=(None, None), size=1):
+        """Stores `value`; `date_range` is the (start, end) ISO date span it depends on (None = open)."""
+        if size > self.max_rows:
+            return # Never worth evicting everything else for one huge result
+        self._drop(key)
+        self._entries[key] = [version, value, date_range, size]
+        self._total_rows += size
+        while len(self._entries) > self.max_entries or self._total_rows > self.max_rows:
+            oldest_key = next(iter(self._entries))
+            self._drop(oldest_key)
+            self.evictions += 1
+
+    def invalidate(self, old_version, new_version, dates=None):
+        """Called after a mutation. Keeps entries that were current and don't cover `dates` (None = all)."""
+        for key, entry in list(self._entries.items()):
+            start, end = entry[2]
+            if entry[0] == old_version and dates is not None and not any(
+                    (start is None or d >= start) and (end is None or d <= end) for d in dates):
+                entry[0] = new_version # Unaffected by this change, still valid
+            else:
+                self._drop(key)
+                self.invalidations += 1
+
+    def invalidate_range(self, old_version, new_version, start, end):
+        """Like invalidate(), but drops entries whose range overlaps [start, end] (ISO dates)."""
+        for key, entry in list(self._entries.items()):
+            entry_start, entry_end = entry[2]
+            overlaps = (entry_start is None or entry_start <= end) and (entry_end is None or entry_end >= start)
+            if entry[0] == old_version and not overlaps:
+                entry[0] = new_version
+            else:
+                self._drop(key)
+                self.invalidations += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._total_rows = 0
+
+    def stats(self):
+        """Returns hit/miss counters and current size, for diagnostics."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries), "rows": self._total_rows,
+            "hits": self.hits, "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            "evictions": self.evictions, "invalidations": self.invalidations,
+        }
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_rows -= entry[3]
+
+
+# --- Undo History ---
+class UndoHistory:
+    """Bounded undo/redo stacks of ledger commands.
+
+    A command is (label, operations). Each operation is ("add", rows), ("remove", rows) or
+    ("replace", old, new) and holds the transaction dicts it moved in or out of the ledger, so
+    recording costs nothing beyond the change itself and no copy of the ledger is ever taken.
+    The index funnel records operations while a command is open (`with history.command(label):`);
+    changes made outside one (loading, merging, recurring entries) aren't undoable.
+    """
+    def __init__(self, limit=UNDO_HISTORY_LIMIT):
+        self.undo_stack = deque(maxlen=limit)
+        self.redo_stack = deque(maxlen=limit)
+        self._label = None
+        self._recording = None # Operations of the open command
+
+    def command(self, label):
+        self._label = label
+        return self
+
+    def __enter__(self):
+        self._recording = []
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        operations, self._recording = self._recording, None
+        if operations: # Even after an error, what was applied can be undone
+            self.undo_stack.append((self._label, operations))
+            self.redo_stack.clear()
+        return False
+
+    def record(self, operation):
+        if self._recording is not None:
+            self._recording.append(operation)
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+
+    @staticmethod
+    def inverse(operations):
+        """The operations that undo `operations`, in the order they must be applied."""
+        inverted = []
+        for operation in reversed(operations):
+            if operation[0] == "add": inverted.append(("remove", operation[1]))
+            elif operation[0] == "remove": inverted.append(("add", operation[1]))
+            else: inverted.append(("replace", operation[2], operation[1]))
+        return inverted
+
+
+# --- History Sorting ---
+# Sort keys for the history columns. Every key ends with (date, id) so ties keep the
+# default chronological order and no two transactions compare equal.
+HISTORY_SORT_KEYS = {
+    "date": lambda t: (t.get('date', '0'), str(t.get('id', 0))),
+    "account": lambda t: (str(t.get('account', '')).casefold(), t.get('date', '0'), str(t.get('id', 0))),
+    "description": lambda t: (str(t.get('description', '')).casefold(), t.get('date', '0'), str(t.get('id', 0))),
+    "category": lambda t: (str(t.get('category') or (UNCATEGORIZED if t.get('type') == TRANS_EXPENSE else "")).casefold(),
+                           t.get('date', '0'), str(t.get('id', 0))),
+    "type": lambda t: (str(t.get('type', '')), t.get('date', '0'), str(t.get('id', 0))),
+    "amount": lambda t: (t.get('amount', 0.0), t.get('date', '0'), str(t.get('id', 0))),
+}
+
+
+class SortedHistoryViews:
+    """Sort permutations of one filtered transaction set, one per column, patched in place on changes.
+
+    A view holds its rows in ascending order (descending is the same list read backwards) and,
+    once it has been patched, the matching sort keys, so a changed transaction is moved with
+    two bisections instead of re-sorting the whole set.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self, filter_key=None, version=None):
+        self.filter_key = filter_key
+        self.version = version
+        self.views = {} # column -> [sort keys or None (not built yet), ascending rows]
+
+    def is_current(self, filter_key, version):
+        return filter_key is not None and self.filter_key == filter_key and self.version == version
+
+    def seed(self, column, ascending_rows):
+        """Adopts rows that are already in ascending `column` order."""
+        self.views[column] = [None, ascending_rows]
+
+    def rows(self, column, transactions):
+        """Ascending rows for `column`; `transactions` is only sorted the first time."""
+        if column not in self.views:
+            self.views[column] = [None, sorted(transactions, key=HISTORY_SORT_KEYS[column])]
+        return self.views[column][1]
+
+    def _keys(self, column):
+        view = self.views[column]
+        if view[0] is None:
+            view[0] = [HISTORY_SORT_KEYS[column](t) for t in view[1]]
+        return view[0]
+
+    def discard(self, trans):
+        """Removes `trans` (the exact object) from every view it is in."""
+        for column, view in self.views.items():
+            keys, key = self._keys(column), HISTORY_SORT_KEYS[column](trans)
+            position = bisect_left(keys, key)
+            while position < len(keys) and keys[position] == key:
+                if view[1][position] is trans:
+                    del keys[position]
+                    del view[1][position]
+                    break
+                position += 1
+
+    def insert(self, trans):
+        for column, view in self.views.items():
+            keys, key = self._keys(column), HISTORY_SORT_KEYS[column](trans)
+            position = bisect_right(keys, key)
+            keys.insert(position, key)
+            view[1].insert(position, trans)
+
+
+# --- Description Autocomplete ---
+# Past descriptions are kept as a sorted list of case-folded keys, so the ones starting with
+# what was typed are a range found with two bisections. Each ranks by a recency-weighted use
+# count: a use dated d days after AUTOCOMPLETE_EPOCH adds 2 ** (d / AUTOCOMPLETE_HALF_LIFE_DAYS),
+# so older uses weigh less, and since all weights grow alike nothing needs refreshing as days pass.
+# A short prefix can match most of the ledger, so a second list holds every key by weight:
+# for a wide range, walking it from the top usually finds the best matches after a few keys.
+# If they rank low (e.g. only old descriptions match), the walk stops and the range is ranked.
+AUTOCOMPLETE_EPOCH = date(2000, 1, 1).toordinal()
+AUTOCOMPLETE_MAX_DAYS = 36_500   # Dates past 2099 weigh as 2099 (keeps the weights finite)
+AUTOCOMPLETE_RANGE_SCAN = 2_000  # Matches ranked directly; wider ranges walk the list by weight, skipping at most this many
+AUTOCOMPLETE_RESORT = 1_000      # Pending changes above which the lists are re-sorted instead of patched
+
+
+class DescriptionIndex:
+    """Past descriptions by prefix, ranked by frequency and recency, with their usual details.
+
+    Maintained by the index funnel (transfers and opening balances aren't included). Changes
+    are applied to the sorted lists on the next lookup, patched in one by one or, after a bulk
+    change such as loading a year, by sorting again. Suggestions are cached per prefix until
+    the next change.
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.entries = {}   # key -> [description as last used, weight, latest date, {(type, account, category, amount): uses}]
+        self.keys = None    # Sorted keys, None until the next lookup sorts them all
+        self.added = set()  # Keys of new entries not in self.keys yet
+        self.dropped = set() # Keys in self.keys whose entry is gone
+        self.ranked = None  # (-weight, key) of every entry, sorted, None until the next lookup sorts them
+        self.moved = {}     # key -> its weight in self.ranked (None if not in it), for keys changed since
+        self.results = {}   # (prefix, limit) -> suggestions
+
+    @staticmethod
+    def _weight(day):
+        try: days = date.fromisoformat(day).toordinal() - AUTOCOMPLETE_EPOCH
+        except ValueError: days = 0
+        return 2.0 ** (max(-AUTOCOMPLETE_MAX_DAYS, min(days, AUTOCOMPLETE_MAX_DAYS)) / AUTOCOMPLETE_HALF_LIFE_DAYS)
+
+    def update(self, trans, sign=1):
+        """Adds (sign=1) or removes (sign=-1) one use of a transaction's description."""
+        description = str(trans.get('description') or '').strip()
+        if not description or trans.get('transfer_id') or trans.get('opening_balance'):
+            return
+        key, day = description.casefold(), str(trans.get('date', ''))[:10]
+        details = (trans.get('type'), trans.get('account'), trans.get('category'), trans.get('amount'))
+        entry = self.entries.get(key)
+        if sign < 0 and (entry is None or details not in entry[3]):
+            return
+        if self.ranked is not None and key not in self.moved:
+            self.moved[key] = entry[1] if entry is not None else None
+        if sign > 0:
+            if entry is None:
+                entry = self.entries[key] = [description, 0.0, day, {}]
+                if self.keys is not None:
+                    if key in self.dropped: self.dropped.discard(key)
+                    else: self.added.add(key)
+            elif day >= entry[2]:
+                entry[0], entry[2] = description, day # Show it as most recently typed
+            entry[1] += self._weight(day)
+            entry[3][details] = entry[3].get(details, 0) + 1
+        else:
+            if entry[3][details] > 1: entry[3][details] -= 1
+            else: del entry[3][details]
+            if entry[3]:
+                entry[1] -= self._weight(day)
+            else: # Last use gone
+                del self.entries[key]
+                if key in self.added: self.added.discard(key)
+                elif self.keys is not None: self.dropped.add(key)
+        self.results.clear()
+
+    def sorted_keys(self):
+        """Brings both sorted lists up to date and returns the keys in order."""
+        if self.keys is None or len(self.added) + len(self.dropped) > AUTOCOMPLETE_RESORT:
+            self.keys = sorted(self.entries)
+        else:
+            for key in self.dropped:
+                del self.keys[bisect_left(self.keys, key)]
+            for key in self.added:
+                insort(self.keys, key)
+        self.added.clear()
+        self.dropped.clear()
+        if self.ranked is None or len(self.moved) > AUTOCOMPLETE_RESORT:
+            self.ranked = sorted((-entry[1], key) for key, entry in self.entries.items())
+        else:
+            for key, old_weight in self.moved.items():
+                if old_weight is not None:
+                    del self.ranked[bisect_left(self.ranked, (-old_weight, key))]
+                if key in self.entries:
+                    insort(self.ranked, (-self.entries[key][1], key))
+        self.moved.clear()
+        return self.keys
+
+    def suggest(self, text, limit=AUTOCOMPLETE_SUGGESTIONS):
+        """Up to `limit` (description, (type, account, category, amount)) pairs for descriptions
+        starting with `text`, best first. The details are the combination used most with it."""
+        prefix = text.strip().casefold()
+        if not prefix:
+            return []
+        results = self.results.get((prefix, limit))
+        if results is None:
+            keys, entries = self.sorted_keys(), self.entries
+            start = bisect_left(keys, prefix)
+            end = bisect_left(keys, prefix + "\U0010ffff", start)
+            matches = None
+            if end - start > AUTOCOMPLETE_RANGE_SCAN: # Many keys match, so the best ones usually come up early in weight order
+                matches, misses = [], 0
+                for _, key in self.ranked:
+                    if key.startswith(prefix):
+                        matches.append(key)
+                        if len(matches) == limit: break
+                    else:
+                        misses += 1
+                        if misses > AUTOCOMPLETE_RANGE_SCAN: # They rank low (e.g. only old ones match): rank the range instead
+                            matches = None
+                            break
+            if matches is None:
+                matches = heapq.nlargest(limit, keys[start:end], key=lambda key: entries[key][1])
+            results = self.results[(prefix, limit)] = [
+                (entries[key][0], max(entries[key][3].items(), key=lambda item: item[1])[0]) for key in matches]
+        return results
+
+
+class DescriptionAutocomplete:
+    """Suggestion list under a description entry, filled while typing.
+
+    `suggest(text)` gives the suggestions (see DescriptionIndex.suggest) and
+    `describe(description, details)` their text. Down/Up move through the list; Enter, Tab or a
+    click takes one and calls `on_pick(description, details)`; Escape closes it.
+    """
+    IGNORED_KEYS = {"Up", "Down", "Return", "KP_Enter", "Tab", "Escape", "Left", "Right", "Home", "End",
+                    "Shift_L", "Shift_R", "Control_L", "Control_R", "Alt_L", "Alt_R"}
+
+    def __init__(self, entry, variable, suggest, on_pick, describe=None):
+        self.entry = entry
+        self.variable = variable
+        self.suggest = suggest
+        self.on_pick = on_pick
+        self.describe = describe or (lambda description, details: description)
+        self.popup = None
+        self.listbox = None
+        self.suggestions = []
+        entry.bind("<KeyRelease>", self.refresh, add="+")
+        entry.bind("<Down>", lambda event: self.move(1), add="+")
+        entry.bind("<Up>", lambda event: self.move(-1), add="+")
+        entry.bind("<Return>", self.accept, add="+")
+        entry.bind("<KP_Enter>", self.accept, add="+")
+        entry.bind("<Tab>", self.accept, add="+")
+        entry.bind("<Escape>", self.dismiss, add="+")
+        entry.bind("<FocusOut>", lambda event: entry.after(200, self._close_unless_focused), add="+")
+
+    def refresh(self, event=None):
+        if event is not None and event.keysym in self.IGNORED_KEYS:
+            return
+        self.suggestions = self.suggest(self.variable.get())
+        if not self.suggestions:
+            self.close()
+            return
+        if self.popup is None:
+            self.popup = tk.Toplevel(self.entry)
+            self.popup.wm_overrideredirect(True) # No title bar; a drop-down
+            self.listbox = Listbox(self.popup, width=60, exportselection=False, activestyle="none", relief="flat")
+            self.listbox.pack(fill=BOTH, expand=True)
+            self.listbox.bind("<ButtonRelease-1>", self._click)
+        self.listbox.delete(0, tk.END)
+        for description, details in self.suggestions:
+            self.listbox.insert(tk.END, self.describe(description, details))
+        self.listbox.config(height=len(self.suggestions))
+        self.popup.wm_geometry(f"+{self.entry.winfo_rootx()}+{self.entry.winfo_rooty() + self.entry.winfo_height()}")
+        self.popup.lift()
+
+    def move(self, step):
+        if self.popup is None:
+            return None
+        selected = self.listbox.curselection()
+        index = max(0, min(len(self.suggestions) - 1, selected[0] + step if selected else (0 if step > 0 else len(self.suggestions) - 1)))
+        self.listbox.selection_clear(0, tk.END)
+        self.listbox.selection_set(index)
+        self.listbox.see(index)
+        return "break"
+
+    def accept(self, event=None):
+        """Takes the highlighted suggestion. Without one, the key does what it normally does."""
+        selected = self.listbox.curselection() if self.popup is not None else ()
+        self.close()
+        if not selected:
+            return None
+        self.pick(selected[0])
+        return None if event is not None and event.keysym == "Tab" else "break" # Tab still moves on
+
+    def pick(self, index):
+        description, details = self.suggestions[index]
+        self.close()
+        self.variable.set(description)
+        self.entry.icursor(tk.END)
+        self.on_pick(description, details)
+
+    def _click(self, event):
+        if self.suggestions:
+            self.pick(self.listbox.nearest(event.y))
+            self.entry.focus_set()
+
+    def dismiss(self, event=None):
+        if self.popup is None:
+            return None
+        self.close()
+        return "break" # Don't also close the dialog
+
+    def _close_unless_focused(self):
+        if self.popup is not None and self.entry.focus_get() not in (self.entry, self.listbox):
+            self.close()
+
+    def close(self):
+        if self.popup is not None:
+            self.popup.destroy()
+            self.popup = self.listbox = None
+
+
+# --- Ledger Profiles ---
+# Each profile is a ledger file (with its own year, closed-period and lock files next to it).
+# The list is kept in PROFILES_FILE. Switching saves the ledger being left and keeps its
+# loaded state in a LedgerStateCache, so switching back only merges what was saved elsewhere
+# in the meantime instead of reading and indexing every file again.
+
+class LedgerProfiles:
+    """Ledger files opened as profiles (absolute paths, in the order they were added) and the current one."""
+    def __init__(self, paths=(), current=None):
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.current = os.path.abspath(current) if current else None
+
+    @classmethod
+    def load(cls, path):
+        """Reads the profile list; a missing or unreadable file gives an empty one."""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            paths = [p for p in data.get("profiles", []) if isinstance(p, str) and p]
+            current = data.get("current")
+            return cls(paths, current if isinstance(current, str) and current else None)
+        except FileNotFoundError:
+            return cls()
+        except (OSError, ValueError, AttributeError) as e:
+            print(f"Warning: Could not read the ledger profiles from {path}: {e}")
+            return cls()
+
+    def save(self, path):
+        temp_file = path + ".tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump({"profiles": self.paths, "current": self.current}, f, indent=4, ensure_ascii=False)
+        os.replace(temp_file, path)
+
+    def add(self, ledger_path):
+        """Lists a ledger file (once). Returns its absolute path."""
+        ledger_path = os.path.abspath(ledger_path)
+        if ledger_path not in self.paths:
+            self.paths.append(ledger_path)
+        return ledger_path
+
+    def remove(self, ledger_path):
+        ledger_path = os.path.abspath(ledger_path)
+        if ledger_path in self.paths:
+            self.paths.remove(ledger_path)
+
+    @staticmethod
+    def label(ledger_path):
+        """How a profile is shown: relative to the working directory if it's inside it."""
+        relative = os.path.relpath(ledger_path)
+        return ledger_path if relative.startswith(os.pardir) else relative
+
+
+class LedgerStateCache:
+    """LRU cache of the in-memory state of ledgers switched away from (see FinanceTrackerApp.LEDGER_STATE).
+
+    Bounded by the number of ledgers and by their estimated memory. The states are saved
+    before they're put here, so evicting one only drops it; opening it again reads it from disk.
+    """
+    def __init__(self, max_entries=PROFILE_CACHE_MAX_ENTRIES, max_bytes=PROFILE_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # ledger path -> (state, estimated bytes)
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, ledger_path):
+        return ledger_path in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def take(self, ledger_path):
+        """Removes and returns the kept state of a ledger, or None."""
+        entry = self._entries.pop(ledger_path, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._total_bytes -= entry[1]
+        self.hits += 1
+        return entry[0]
+
+    def put(self, ledger_path, state, size):
+        self.discard(ledger_path)
+        if size > self.max_bytes or self.max_entries <= 0:
+            return # Too large to keep; it's read again when needed
+        self._entries[ledger_path] = (state, size)
+        self._total_bytes += size
+        while len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes:
+            self.discard(next(iter(self._entries)))
+            self.evictions += 1
+
+    def discard(self, ledger_path):
+        entry = self._entries.pop(ledger_path, None)
+        if entry is not None:
+            self._total_bytes -= entry[1]
+
+
 # --- Main Application Class ---
 class FinanceTrackerApp:
-    def __init__(self, window):
+    # Attributes holding one ledger's data, indexes and caches; switching profiles swaps them as a whole
+    LEDGER_STATE = (
+        "data_file", "accounts", "categories", "account_currencies", "reporting_currency", "budgets", "budget_overrides",
+        "category_rules", "saved_views", "schedules", "closed_periods", "stopped_schedule_ids", "removed_rule_ids",
+        "transactions", "transactions_by_id", "transfer_groups", "rows_by_month", "ledger_version", "query_cache",
+        "current_filter_key", "history_views", "description_index", "undo_history", "category_spend", "chart_days",
+        "chart_cache", "net_worth_cache", "archived_chart_days", "partitions", "loaded_partitions", "dirty_partitions",
+        "partition_appends", "partition_rewrites", "archive_lru", "synced_rows", "disk_revision", "disk_signature",
+        "running_balances", "ledger_count", "ledger_checksum", "checkpoint_months", "checkpoints",
+        "checkpoints_need_verification", "_verification",
+    )
+
+    def __init__(self, window, repair=False, data_file=None):
+        """`window` is the main Tk window, or None for the ledger alone without any UI (see serve_api).
+
+        `data_file` is the ledger to open (FINANCE_DATA_FILE by default).
+        """
         self.window = window
-        self.window.title("Multi-Account Finance Tracker")
+        self.data_file = data_file or FINANCE_DATA_FILE
+        self._reset_ledger_state()
+        self.sort_column = "date"      # History sort column and direction
+        self.sort_descending = True
+        self.displayed_rows = []       # Transactions in the treeview, in display order
+        self.displayed_key = None      # (filter key, ledger version) the treeview was filled for
+        self.stripe_shift = 0          # 1 while the even/odd stripe colours are swapped (see sort_history_by)
+        self.charts_window = None      # Open ChartsWindow, if any
+        try:
+            self.fx_rates = FxRates.load(FX_RATES_FILE) # Needed while indexing (budgets are in BASE_CURRENCY)
+        except (OSError, ValueError, TypeError) as e:
+            print(f"Warning: Could not load exchange rates from {FX_RATES_FILE}: {e}")
+            self.fx_rates = FxRates()
+        self.load_data(repair=repair) # Load accounts, categories, transactions
+        self.materialize_due_schedules() # Catch up on recurring transactions due since the last run
+        if window is None: # Headless: no widgets, timers or dialogs
+            if repair:
+                self._save_to_disk()
+            if self.checkpoints_need_verification:
+                self._start_balance_verification() # Runs to the end right away without a window
+            return
 
+        self.profiles = LedgerProfiles.load(PROFILES_FILE)
+        self.profile_states = LedgerStateCache() # Ledgers switched away from, for switching back
         self.style = tb.Style(theme=DEFAULT_THEME)
         self.window.configure(background=self.style.colors.bg)
 
-        self.accounts = []
-        self.categories = set([UNCATEGORIZED]) # Use a set for efficient add/check, convert to list for UI
-        self.transactions = []
-        self.load_data() # Load accounts, categories, transactions
-
         # --- Tkinter Variables ---
         # Transaction Entry
         self.date_var = tk.StringVar(value=datetime.now().strftime('%Y-%m-%d'))
@@ -292,8 +3461,11 @@ class FinanceTrackerApp:
         self.type_var = tk.StringVar(value=TRANS_EXPENSE)
         self.transaction_account_var = tk.StringVar()
         self.transaction_category_var = tk.StringVar(value=UNCATEGORIZED) # Add category var
+        self.pending_splits = None # [[category, amount], ...] for the expense being entered, see SplitDialog
+        self.budget_remaining_var = tk.StringVar(value="")
         # Account Management
         self.new_account_name_var = tk.StringVar()
+        self.new_account_currency_var = tk.StringVar(value=BASE_CURRENCY)
         self.delete_account_var = tk.StringVar()
         # Transfers
         self.transfer_date_var = tk.StringVar(value=datetime.now().strftime('%Y-%m-%d'))
@@ -303,12 +3475,22 @@ class FinanceTrackerApp:
         # Balances
         self.total_balance_var = tk.StringVar(value=f"Total Balance: {CURRENCY_SYMBOL}0.00")
         self.account_balance_labels = {}
+        # Recurring
+        self.repeat_var = tk.StringVar(value="Never")
+        self.repeat_interval_var = tk.IntVar(value=1)
+        self.balance_as_of_var = tk.StringVar(value="") # Empty = current balances
+        self.reporting_currency_var = tk.StringVar(value=self.reporting_currency) # Totals and reports are shown in this
         # Filtering / Reporting
         self.filter_start_date_var = tk.StringVar(value="") # Init empty
         self.filter_end_date_var = tk.StringVar(value="")   # Init empty
         self.filter_account_var = tk.StringVar(value="All Accounts")
         self.filter_category_var = tk.StringVar(value="All Categories")
         self.filter_type_var = tk.StringVar(value="All Types")
+        self.filter_exclude_transfers_var = tk.BooleanVar(value=False)
+        self.filter_query_var = tk.StringVar(value="") # Optional query, see FilterQuery
+        self.saved_view_var = tk.StringVar(value="")
+        # Profiles
+        self.profile_var = tk.StringVar(value="")
 
         # Set default filter dates (e.g., start of current month)
         today = date.today()
@@ -320,14 +3502,42 @@ class FinanceTrackerApp:
         self.create_widgets()
         self.update_account_comboboxes()
         self.update_category_comboboxes() # New: Update category lists
+        self.update_currency_choices()
+        self.update_saved_view_choices()
+        self._remember_profile()          # Lists this ledger and sets the title
         self.update_transaction_list()    # Populate treeview (initial full view)
         self.update_balances()
         self.update_report_summary()      # New: Update report area
         self.apply_filters()              # Apply default filters on startup
 
+        if repair:
+            self.save_data() # Rewrite every year with a fresh checksum
+            messagebox.showinfo("Repair", f"Checked {len(self.transactions)} transaction(s) and rewrote {len(self.partitions)} year file(s).", parent=self.window)
+        if self.checkpoints_need_verification:
+            self._start_balance_verification() # Saved balances were shown as-is; double-check them when idle
+        self.window.after(LEDGER_POLL_INTERVAL_MS, self._poll_external_changes) # Pick up saves from other instances
+        self.window.after(SCHEDULE_CHECK_INTERVAL_MS, self._check_schedules)     # New recurring transactions after midnight
+
         # --- Window Closing Behavior ---
         self.window.protocol("WM_DELETE_WINDOW", self.on_closing)
 
+    def _reset_ledger_state(self):
+        """Empty data, indexes and caches for a ledger about to be loaded (see LEDGER_STATE)."""
+        self.accounts = []
+        self.categories = set([UNCATEGORIZED]) # Use a set for efficient add/check, convert to list for UI
+        self.transactions = []
+        self.transactions_by_id = {} # str(id) -> transaction dict, kept in sync with self.transactions
+        self.transfer_groups = {}    # transfer_id -> [out_leg, in_leg]
+        self.ledger_version = 0      # Bumped on every change to self.transactions
+        self.query_cache = QueryCache()
+        self.current_filter_key = None # Normalized key of the filters currently applied
+        self.history_views = SortedHistoryViews() # Sort orders of the current filtered set
+        self.description_index = DescriptionIndex() # Past descriptions for autocomplete, kept by the index funnel
+        self.undo_history = UndoHistory() # Filled by the index funnel while a command is open
+        self.archived_chart_days = {}  # year -> (manifest signature, chart totals) of years not loaded
+        self.stopped_schedule_ids = set() # Stopped here; don't bring them back when merging external changes
+        self.removed_rule_ids = set()     # Category rules removed here, likewise
+
     def _on_mousewheel(self, event):
         """Scrolls the left canvas vertically with the mouse wheel."""
         # Determine scroll amount based on platform and event delta
@@ -399,6 +3609,20 @@ class FinanceTrackerApp:
 
         # --- Widgets previously in left_panel are now placed in self.left_inner_frame ---
 
+        # --- Ledger (Profile) Frame ---
+        ledger_frame = tb.LabelFrame(self.left_inner_frame, text="Ledger", padding=10, bootstyle=SECONDARY)
+        ledger_frame.pack(fill=X, pady=(0, 10), padx=5)
+        for column in range(3): ledger_frame.columnconfigure(column, weight=1)
+        self.profile_combo = tb.Combobox(ledger_frame, textvariable=self.profile_var, state="readonly", bootstyle=PRIMARY)
+        self.profile_combo.grid(row=0, column=0, columnspan=3, padx=5, pady=3, sticky=EW)
+        self.profile_combo.bind("<<ComboboxSelected>>", self.switch_to_selected_profile)
+        ToolTip(self.profile_combo, text="Switch to another ledger (e.g. personal or business books). The one you leave is saved.", bootstyle=(INFO, INVERSE))
+        tb.Button(ledger_frame, text="Open...", command=self.open_profile, bootstyle=(INFO, OUTLINE)).grid(row=1, column=0, padx=5, pady=3, sticky=EW)
+        tb.Button(ledger_frame, text="New...", command=self.new_profile, bootstyle=(INFO, OUTLINE)).grid(row=1, column=1, padx=5, pady=3, sticky=EW)
+        remove_profile_button = tb.Button(ledger_frame, text="Remove", command=self.remove_profile, bootstyle=(SECONDARY, OUTLINE))
+        remove_profile_button.grid(row=1, column=2, padx=5, pady=3, sticky=EW)
+        ToolTip(remove_profile_button, text="Take this ledger off the list (its files are kept) and switch to another one", bootstyle=(INFO, INVERSE))
+
         # --- Input Frame ---
         # Change parent to self.left_inner_frame
         input_frame = tb.LabelFrame(self.left_inner_frame, text="Add Transaction", padding=10, bootstyle=SECONDARY)
@@ -418,7 +3642,9 @@ class FinanceTrackerApp:
         tb.Label(input_frame, text="Description:").grid(row=2, column=0, padx=5, pady=3, sticky=W)
         self.desc_entry = tb.Entry(input_frame, textvariable=self.description_var, bootstyle=PRIMARY)
         self.desc_entry.grid(row=2, column=1, padx=5, pady=3, sticky=EW)
-        ToolTip(self.desc_entry, text="Description (e.g., Groceries, Salary) - Optional", bootstyle=(INFO, INVERSE))
+        ToolTip(self.desc_entry, text="Description (e.g., Groceries, Salary) - Optional. Past descriptions are suggested as you type (Down to choose, Enter to take one).", bootstyle=(INFO, INVERSE))
+        DescriptionAutocomplete(self.desc_entry, self.description_var, lambda text: self.description_index.suggest(text),
+                                self.fill_from_suggestion, self.describe_suggestion) # The index changes with the profile
 
         tb.Label(input_frame, text="Amount:").grid(row=3, column=0, padx=5, pady=3, sticky=W)
         self.amount_entry = tb.Entry(input_frame, textvariable=self.amount_var, bootstyle=PRIMARY)
@@ -435,10 +3661,30 @@ class FinanceTrackerApp:
         self.category_label.grid(row=5, column=0, padx=5, pady=3, sticky=W)
         self.category_combo.grid(row=5, column=1, padx=5, pady=3, sticky=EW)
         ToolTip(self.category_combo, text="Select expense category", bootstyle=(INFO, INVERSE))
+        self.budget_remaining_label = tb.Label(input_frame, textvariable=self.budget_remaining_var, bootstyle=SUCCESS)
+        self.budget_remaining_label.grid(row=5, column=2, padx=(0, 5), pady=3, sticky=W)
+        ToolTip(self.budget_remaining_label, text="Budget left for this category in the selected month", bootstyle=(INFO, INVERSE))
+        self.split_button = tb.Button(input_frame, text="Split", command=self.split_new_transaction, bootstyle=(SECONDARY, OUTLINE))
+        self.split_button.grid(row=5, column=3, padx=(0, 5), pady=3)
+        ToolTip(self.split_button, text="Divide this expense between several categories (e.g. one receipt for groceries and household items)", bootstyle=(INFO, INVERSE))
+        for var in (self.transaction_category_var, self.date_var, self.type_var):
+            var.trace_add("write", self.update_budget_remaining)
         self.toggle_category_input() # Set initial state based on default type
 
+        tb.Label(input_frame, text="Repeat:").grid(row=6, column=0, padx=5, pady=3, sticky=W)
+        repeat_frame = tb.Frame(input_frame)
+        repeat_frame.grid(row=6, column=1, padx=5, pady=3, sticky=EW)
+        repeat_frame.columnconfigure(0, weight=1)
+        self.repeat_combo = tb.Combobox(repeat_frame, textvariable=self.repeat_var, values=["Never", *RECURRENCE_FREQUENCIES], state="readonly", width=9, bootstyle=PRIMARY)
+        self.repeat_combo.grid(row=0, column=0, sticky=EW)
+        tb.Label(repeat_frame, text="every").grid(row=0, column=1, padx=(5, 2))
+        self.repeat_interval_spin = tb.Spinbox(repeat_frame, textvariable=self.repeat_interval_var, from_=1, to=99, width=3, bootstyle=PRIMARY)
+        self.repeat_interval_spin.grid(row=0, column=2)
+        ToolTip(self.repeat_combo, text="Repeat this transaction automatically from its date onwards (e.g. rent, salary)", bootstyle=(INFO, INVERSE))
+        ToolTip(self.repeat_interval_spin, text="Repeat every N days/weeks/months/years", bootstyle=(INFO, INVERSE))
+
         self.add_button = tb.Button(input_frame, text="Add Transaction", command=self.add_transaction, bootstyle=SUCCESS)
-        self.add_button.grid(row=6, column=0, columnspan=2, pady=8, sticky=EW)
+        self.add_button.grid(row=7, column=0, columnspan=2, pady=8, sticky=EW)
 
 
         # --- Account & Category Management Frame ---
@@ -453,18 +3699,40 @@ class FinanceTrackerApp:
         ToolTip(self.new_account_entry, text="Enter name for a new account", bootstyle=(INFO, INVERSE))
         self.add_account_button = tb.Button(mgmt_frame, text="Add Acct", command=self.add_account, bootstyle=INFO, width=9)
         self.add_account_button.grid(row=0, column=2, padx=5, pady=(5,2))
+        tb.Label(mgmt_frame, text="Currency:").grid(row=1, column=0, padx=5, pady=2, sticky=W)
+        self.new_account_currency_combo = tb.Combobox(mgmt_frame, textvariable=self.new_account_currency_var, bootstyle=PRIMARY)
+        self.new_account_currency_combo.grid(row=1, column=1, padx=5, pady=2, sticky=EW)
+        ToolTip(self.new_account_currency_combo, text="Currency of the new account (3-letter code, e.g. USD)", bootstyle=(INFO, INVERSE))
 
-        tb.Label(mgmt_frame, text="Delete Acct:").grid(row=1, column=0, padx=5, pady=(2,5), sticky=W)
+        tb.Label(mgmt_frame, text="Delete Acct:").grid(row=2, column=0, padx=5, pady=(2,5), sticky=W)
         self.delete_account_combo = tb.Combobox(mgmt_frame, textvariable=self.delete_account_var, state="readonly", bootstyle=PRIMARY)
-        self.delete_account_combo.grid(row=1, column=1, padx=5, pady=(2,5), sticky=EW)
+        self.delete_account_combo.grid(row=2, column=1, padx=5, pady=(2,5), sticky=EW)
         ToolTip(self.delete_account_combo, text="Select account to delete (must have no transactions)", bootstyle=(INFO, INVERSE))
         self.delete_account_button = tb.Button(mgmt_frame, text="Delete Acct", command=self.delete_account, bootstyle=DANGER, width=9)
-        self.delete_account_button.grid(row=1, column=2, padx=5, pady=(2,5))
+        self.delete_account_button.grid(row=2, column=2, padx=5, pady=(2,5))
 
-        ttk.Separator(mgmt_frame, orient=HORIZONTAL).grid(row=2, column=0, columnspan=3, sticky='ew', pady=8)
+        ttk.Separator(mgmt_frame, orient=HORIZONTAL).grid(row=3, column=0, columnspan=3, sticky='ew', pady=8)
 
         self.manage_categories_button = tb.Button(mgmt_frame, text="Manage Categories", command=self.open_category_manager, bootstyle=INFO)
-        self.manage_categories_button.grid(row=3, column=0, columnspan=3, pady=(5, 0), sticky=EW)
+        self.manage_categories_button.grid(row=4, column=0, columnspan=3, pady=(5, 0), sticky=EW)
+        self.manage_schedules_button = tb.Button(mgmt_frame, text="Recurring Transactions", command=self.open_schedule_manager, bootstyle=INFO)
+        self.manage_schedules_button.grid(row=5, column=0, columnspan=3, pady=(5, 0), sticky=EW)
+        self.manage_budgets_button = tb.Button(mgmt_frame, text="Budgets", command=self.open_budget_manager, bootstyle=INFO)
+        self.manage_budgets_button.grid(row=6, column=0, columnspan=3, pady=(5, 0), sticky=EW)
+        self.import_fx_button = tb.Button(mgmt_frame, text="Import Exchange Rates", command=self.import_fx_rates, bootstyle=INFO)
+        self.import_fx_button.grid(row=7, column=0, columnspan=3, pady=(5, 0), sticky=EW)
+        ToolTip(self.import_fx_button, text=f"CSV lines 'YYYY-MM-DD,CUR,rate', rate = value of 1 CUR in {BASE_CURRENCY}", bootstyle=(INFO, INVERSE))
+        self.manage_rules_button = tb.Button(mgmt_frame, text="Category Rules", command=self.open_rules_manager, bootstyle=INFO)
+        self.manage_rules_button.grid(row=8, column=0, columnspan=3, pady=(5, 0), sticky=EW)
+        ToolTip(self.manage_rules_button, text="Rules that pick the category of expenses added as Uncategorized", bootstyle=(INFO, INVERSE))
+        self.apply_rules_button = tb.Button(mgmt_frame, text="Apply Rules to History", command=self.apply_rules_to_history, bootstyle=(INFO, OUTLINE))
+        self.apply_rules_button.grid(row=9, column=0, columnspan=3, pady=(5, 0), sticky=EW)
+        self.reconcile_button = tb.Button(mgmt_frame, text="Reconcile Statement", command=self.reconcile_statement, bootstyle=INFO)
+        self.reconcile_button.grid(row=10, column=0, columnspan=3, pady=(5, 0), sticky=EW)
+        ToolTip(self.reconcile_button, text="Match a bank statement (CSV) against an account and mark the matched transactions reconciled (✓)", bootstyle=(INFO, INVERSE))
+        self.closed_periods_button = tb.Button(mgmt_frame, text="Closed Periods", command=self.open_closed_periods, bootstyle=INFO)
+        self.closed_periods_button.grid(row=11, column=0, columnspan=3, pady=(5, 0), sticky=EW)
+        ToolTip(self.closed_periods_button, text="Archive old transactions behind opening balances, and search the archives", bootstyle=(INFO, INVERSE))
 
 
         # --- Transfer Funds Frame ---
@@ -519,6 +3787,25 @@ class FinanceTrackerApp:
         tb.Label(filter_frame, text="Type:").grid(row=0, column=4, padx=5, pady=3, sticky=W)
         self.filter_type_combo = tb.Combobox(filter_frame, textvariable=self.filter_type_var, values=["All Types", TRANS_INCOME, TRANS_EXPENSE], state="readonly", bootstyle=INFO)
         self.filter_type_combo.grid(row=0, column=5, padx=(2,10), pady=3, sticky=EW)
+        self.exclude_transfers_check = tb.Checkbutton(filter_frame, text="Exclude internal transfers", variable=self.filter_exclude_transfers_var, bootstyle="info-round-toggle")
+        self.exclude_transfers_check.grid(row=2, column=0, columnspan=4, padx=5, pady=3, sticky=W)
+        ToolTip(self.exclude_transfers_check, text="Hide transfers between your own accounts so income/expense totals aren't inflated", bootstyle=(INFO, INVERSE))
+        tb.Label(filter_frame, text="Query:").grid(row=3, column=0, padx=5, pady=3, sticky=W)
+        self.filter_query_entry = tb.Entry(filter_frame, textvariable=self.filter_query_var, bootstyle=INFO)
+        self.filter_query_entry.grid(row=3, column=1, columnspan=5, padx=(2, 10), pady=3, sticky=EW)
+        self.filter_query_entry.bind("<Return>", lambda event: self.apply_filters())
+        ToolTip(self.filter_query_entry, text='e.g. amount > 500 and category in (Rent, Utilities) and account != Cash and desc ~ "grab"\n'
+                'Fields: date, account, desc, category, type, amount, transfer, reconciled. Operators: = != < <= > >= in, not in, ~ (regex), !~. '
+                'Combine with and, or, not and parentheses. Dates can be a year, month or day.', bootstyle=(INFO, INVERSE))
+        tb.Label(filter_frame, text="View:").grid(row=4, column=0, padx=5, pady=3, sticky=W)
+        self.saved_view_combo = tb.Combobox(filter_frame, textvariable=self.saved_view_var, state="readonly", bootstyle=INFO)
+        self.saved_view_combo.grid(row=4, column=1, columnspan=3, padx=2, pady=3, sticky=EW)
+        self.saved_view_combo.bind("<<ComboboxSelected>>", self.open_saved_view)
+        ToolTip(self.saved_view_combo, text="Saved queries; pick one to apply it", bootstyle=(INFO, INVERSE))
+        view_button_frame = tb.Frame(filter_frame)
+        view_button_frame.grid(row=4, column=4, columnspan=2, padx=5, pady=3, sticky=E)
+        tb.Button(view_button_frame, text="Save View", command=self.save_view, bootstyle=(INFO, OUTLINE)).pack(side=LEFT, padx=(0, 5))
+        tb.Button(view_button_frame, text="Delete View", command=self.delete_view, bootstyle=(DANGER, OUTLINE)).pack(side=LEFT)
         filter_button_frame = tb.Frame(filter_frame)
         filter_button_frame.grid(row=1, column=4, columnspan=2, padx=5, pady=3, sticky=E)
         self.apply_filter_button = tb.Button(filter_button_frame, text="Apply Filters", command=self.apply_filters, bootstyle=PRIMARY)
@@ -529,35 +3816,45 @@ class FinanceTrackerApp:
         ToolTip(self.clear_filter_button, text="Reset filters and show all transactions", bootstyle=(INFO, INVERSE))
         report_frame = tb.LabelFrame(filter_report_frame, text="Filtered Summary", padding=5, bootstyle=SECONDARY)
         report_frame.pack(side=LEFT, fill=BOTH, padx=(5,0))
-        self.report_text = tk.Text(report_frame, height=4, width=35, wrap="word", relief="flat", font=("Consolas", 9) if os.name == 'nt' else ("monospace", 9))
-        self.report_text.pack(fill=BOTH, expand=True)
+        self.report_text = tk.Text(report_frame, height=3, width=35, wrap="word", relief="flat", font=("Consolas", 9) if os.name == 'nt' else ("monospace", 9))
+        self.report_text.pack(fill=X)
         self.report_text.configure(state='disabled')
+        # Expenses by category as a collapsible tree; each row shows its whole subtree's total
+        self.category_report_tree = tb.Treeview(report_frame, columns=("amount",), show="tree", height=4, bootstyle=INFO)
+        self.category_report_tree.column("#0", width=150, stretch=True)
+        self.category_report_tree.column("amount", width=95, anchor=E, stretch=False)
+        self.category_report_tree.pack(fill=BOTH, expand=True)
 
         # --- Transaction List Frame ---
         # ... (Keep this section as it was) ...
         list_frame = tb.LabelFrame(right_panel, text="Filtered Transactions (Double-click to Edit)", padding=10, bootstyle=SECONDARY)
         list_frame.pack(fill=BOTH, expand=True, pady=(0, 10))
         columns = ("date", "account", "description", "category", "type", "amount")
-        self.tree = tb.Treeview(list_frame, columns=columns, show='headings', bootstyle=PRIMARY)
-        self.tree.heading("date", text="Date"); self.tree.heading("account", text="Account")
-        self.tree.heading("description", text="Description"); self.tree.heading("category", text="Category")
-        self.tree.heading("type", text="Type"); self.tree.heading("amount", text="Amount")
+        self.tree = tb.Treeview(list_frame, columns=columns, show='tree headings', bootstyle=PRIMARY) # Tree column: split breakdowns
+        self.history_headings = {"date": "Date", "account": "Account", "description": "Description",
+                                 "category": "Category", "type": "Type", "amount": "Amount"}
+        for column in columns: # Click a heading to sort by it, again to reverse
+            self.tree.heading(column, text=self.history_headings[column], command=lambda c=column: self.sort_history_by(c))
+        self._update_sort_headings()
         self.tree.column("date", width=90, anchor=CENTER); self.tree.column("account", width=100, anchor=W)
         self.tree.column("description", width=180, anchor=W); self.tree.column("category", width=100, anchor=W)
         self.tree.column("type", width=70, anchor=CENTER); self.tree.column("amount", width=90, anchor=E)
+        self.tree.column("#0", width=22, minwidth=22, stretch=False)
         tree_scrollbar = tb.Scrollbar(list_frame, orient=VERTICAL, command=self.tree.yview, bootstyle=ROUND)
         self.tree.configure(yscrollcommand=tree_scrollbar.set)
         tree_scrollbar.pack(side=RIGHT, fill=Y)
         self.tree.pack(side=LEFT, fill=BOTH, expand=True)
         self.tree.bind("<Double-1>", self.on_transaction_double_click)
+        self.tree.bind("<<TreeviewSelect>>", self._select_split_parents)
         try:
             dark_row_color = self.style.colors.get('dark') or "#303030"; bg_color = self.style.colors.bg or "#343a40"
             if dark_row_color == bg_color: dark_row_color = self.style.colors.inputbg or "#404040"
+            self.stripe_colors = (bg_color, dark_row_color) # Even, odd row backgrounds
             self.tree.tag_configure('oddrow', background=dark_row_color); self.tree.tag_configure('evenrow', background=bg_color)
             self.tree.tag_configure('income', foreground=self.style.colors.success); self.tree.tag_configure('expense', foreground=self.style.colors.danger)
             self.tree.tag_configure('transfer', foreground=self.style.colors.warning)
         except Exception as e:
-            print(f"Warning: Could not configure treeview colors: {e}"); self.tree.tag_configure('oddrow', background='#333333'); self.tree.tag_configure('evenrow', background='#272727'); self.tree.tag_configure('income', foreground='green'); self.tree.tag_configure('expense', foreground='red'); self.tree.tag_configure('transfer', foreground='orange')
+            print(f"Warning: Could not configure treeview colors: {e}"); self.stripe_colors = ('#272727', '#333333'); self.tree.tag_configure('oddrow', background='#333333'); self.tree.tag_configure('evenrow', background='#272727'); self.tree.tag_configure('income', foreground='green'); self.tree.tag_configure('expense', foreground='red'); self.tree.tag_configure('transfer', foreground='orange')
 
         # --- Balances Frame ---
         # ... (Keep this section as it was) ...
@@ -567,6 +3864,19 @@ class FinanceTrackerApp:
         self.account_balances_display_frame.pack(fill=X, pady=(0, 5))
         self.total_balance_label = tb.Label(balances_frame, textvariable=self.total_balance_var, font=("Helvetica", 14, "bold"), anchor=E, bootstyle=PRIMARY)
         self.total_balance_label.pack(fill=X, padx=5, pady=(5, 0))
+        as_of_frame = tb.Frame(balances_frame)
+        as_of_frame.pack(fill=X, pady=(5, 0))
+        tb.Label(as_of_frame, text="As of:").pack(side=LEFT, padx=(5, 2))
+        self.balance_as_of_entry = DateEntry(as_of_frame, bootstyle=SECONDARY, firstweekday=0, dateformat='%Y-%m-%d')
+        self.balance_as_of_entry.entry.config(textvariable=self.balance_as_of_var)
+        self.balance_as_of_entry.pack(side=LEFT, padx=2)
+        tb.Button(as_of_frame, text="Show", command=self.update_balances, bootstyle=(SECONDARY, OUTLINE)).pack(side=LEFT, padx=2)
+        tb.Button(as_of_frame, text="Today", command=self.show_current_balances, bootstyle=(SECONDARY, OUTLINE)).pack(side=LEFT, padx=2)
+        ToolTip(self.balance_as_of_entry, text="Show balances at the end of this date. Leave empty for current balances.", bootstyle=(INFO, INVERSE))
+        self.reporting_currency_combo = tb.Combobox(as_of_frame, textvariable=self.reporting_currency_var, state="readonly", width=5, bootstyle=SECONDARY)
+        self.reporting_currency_combo.pack(side=RIGHT, padx=2)
+        self.reporting_currency_combo.bind("<<ComboboxSelected>>", self.change_reporting_currency)
+        tb.Label(as_of_frame, text="Totals in:").pack(side=RIGHT, padx=(5, 2))
 
         # --- Bottom Bar ---
         # ... (Keep this section as it was) ...
@@ -575,6 +3885,21 @@ class FinanceTrackerApp:
         self.delete_transaction_button = tb.Button(bottom_bar, text="Delete Selected Transaction", command=self.delete_selected_transaction, bootstyle=(DANGER, OUTLINE))
         self.delete_transaction_button.pack(side=LEFT, padx=5)
         ToolTip(self.delete_transaction_button, text="Select a transaction in the list above and click here to delete it.", bootstyle=(INFO, INVERSE))
+        self.bulk_edit_button = tb.Button(bottom_bar, text="Bulk Edit Selected", command=self.bulk_edit_selected, bootstyle=(PRIMARY, OUTLINE))
+        self.bulk_edit_button.pack(side=LEFT, padx=5)
+        ToolTip(self.bulk_edit_button, text="Change the category, account, type, date or description of all selected transactions at once (Ctrl/Shift+click to select several).", bootstyle=(INFO, INVERSE))
+        self.undo_button = tb.Button(bottom_bar, text="Undo", command=self.undo, state=DISABLED, bootstyle=(SECONDARY, OUTLINE))
+        self.undo_button.pack(side=LEFT, padx=5)
+        ToolTip(self.undo_button, text="Undo the last add, edit, delete or transfer (Ctrl+Z)", bootstyle=(INFO, INVERSE))
+        self.redo_button = tb.Button(bottom_bar, text="Redo", command=self.redo, state=DISABLED, bootstyle=(SECONDARY, OUTLINE))
+        self.redo_button.pack(side=LEFT, padx=5)
+        ToolTip(self.redo_button, text="Redo what was undone (Ctrl+Y)", bootstyle=(INFO, INVERSE))
+        self.window.bind("<Control-z>", self.undo)
+        self.window.bind("<Control-y>", self.redo)
+        self.window.bind("<Control-Z>", self.redo) # Ctrl+Shift+Z
+        self.charts_button = tb.Button(bottom_bar, text="Charts", command=self.open_charts, bootstyle=(INFO, OUTLINE))
+        self.charts_button.pack(side=RIGHT, padx=5)
+        ToolTip(self.charts_button, text="Balances over time, income vs expense per month and spending by category", bootstyle=(INFO, INVERSE))
 
         # --- Final step: Update canvas scroll region after everything is packed ---
         # Call this once after initial packing to set the initial scroll region
@@ -589,10 +3914,51 @@ class FinanceTrackerApp:
         if self.type_var.get() == TRANS_EXPENSE:
             self.category_label.grid()
             self.category_combo.grid()
+            self.split_button.grid()
         else:
             self.category_label.grid_remove()
             self.category_combo.grid_remove()
+            self.split_button.grid_remove()
             self.transaction_category_var.set(UNCATEGORIZED) # Reset category if not expense
+            self._set_pending_splits(None)
+
+    def split_new_transaction(self):
+        """Opens the split dialog for the expense being entered."""
+        try: amount = self.amount_var.get()
+        except tk.TclError: amount = 0.0
+        dialog = SplitDialog(self.window, "Split Expense", self.categories, amount,
+                             self.pending_splits or [[self.transaction_category_var.get(), amount]])
+        if dialog.result is not None:
+            self.amount_var.set(round(sum(split_amount for _, split_amount in dialog.result), 2))
+            self.transaction_category_var.set(split_category(dialog.result))
+            self._set_pending_splits(dialog.result if len(dialog.result) > 1 else None)
+
+    def describe_suggestion(self, description, details):
+        """A suggestion's line in the autocomplete list, e.g. 'Jollibee   Food · Cash · ₱245.00'."""
+        trans_type, account, category, amount = details
+        kind = (category or UNCATEGORIZED) if trans_type == TRANS_EXPENSE else trans_type
+        amount_text = format_money(amount, self.account_currency(account)) if isinstance(amount, (int, float)) else ""
+        return f"{description}   {kind} · {account} · {amount_text}"
+
+    def fill_from_suggestion(self, description, details):
+        """Fills in the usual type, account, category and amount of a picked description."""
+        trans_type, account, category, amount = details
+        if trans_type in (TRANS_EXPENSE, TRANS_INCOME):
+            self.type_var.set(trans_type)
+            self.toggle_category_input()
+        if account in self.accounts:
+            self.transaction_account_var.set(account)
+        if trans_type == TRANS_EXPENSE:
+            self._set_pending_splits(None) # The usual amount replaces a split one
+            self.transaction_category_var.set(category if category in self.categories else UNCATEGORIZED)
+        if isinstance(amount, (int, float)) and amount > 0:
+            self.amount_var.set(amount)
+
+    def _set_pending_splits(self, splits):
+        """The category of a split expense follows its splits, so the combobox is locked meanwhile."""
+        self.pending_splits = splits
+        self.category_combo.config(state="disabled" if splits else "readonly")
+        self.split_button.config(text=f"Split ({len(splits)})" if splits else "Split")
 
     def update_account_comboboxes(self):
         """Updates the values in ALL account selection comboboxes."""
@@ -621,7 +3987,8 @@ class FinanceTrackerApp:
         # Ensure UNCATEGORIZED is always first if it exists
         sorted_categories = sorted(list(self.categories - {UNCATEGORIZED}))
         display_categories = [UNCATEGORIZED] + sorted_categories
-        filter_categories = ["All Categories"] + display_categories
+        # Sorted paths list each subcategory right under its parent; implied parents can be filtered on too
+        filter_categories = ["All Categories", UNCATEGORIZED] + [node for node in CategoryTree.of(self.categories).nodes if node != UNCATEGORIZED]
 
         self.category_combo['values'] = display_categories
         self.filter_category_combo['values'] = filter_categories
@@ -643,10 +4010,7 @@ class FinanceTrackerApp:
                  self.categories = updated_categories
                  self.update_category_comboboxes()
                  self.save_data() # Save changes to categories immediately
-                 # Optionally re-apply filters if categories changed significantly
-                 # self.apply_filters()
-                 # May need to update displayed transactions if a category was deleted?
-                 # self.update_transaction_list(self.get_filtered_transactions()) # Refresh view
+                 self.apply_filters() # A parent category filter covers a different subtree now
 
 
     # --- Filtering and Reporting ---
@@ -661,6 +4025,7 @@ class FinanceTrackerApp:
             filter_account = self.filter_account_var.get()
             filter_category = self.filter_category_var.get()
             filter_type = self.filter_type_var.get()
+            exclude_transfers = self.filter_exclude_transfers_var.get()
 
             # Validate and parse dates
             start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date() if start_date_str else None
@@ -668,51 +4033,146 @@ class FinanceTrackerApp:
 
             if start_date and end_date and start_date > end_date:
                  messagebox.showwarning("Filter Error", "Start date cannot be after end date.", parent=self.window)
+                 self.current_filter_key = None
                  return self.transactions # Return all if dates are invalid
 
-            for trans in self.transactions:
-                # Date check
-                trans_date = datetime.strptime(trans.get('date', '1900-01-01'), '%Y-%m-%d').date()
-                if start_date and trans_date < start_date: continue
-                if end_date and trans_date > end_date: continue
-
-                # Account check
-                if filter_account != "All Accounts" and trans.get('account') != filter_account:
-                    continue
-
-                # Type Check
-                if filter_type != "All Types" and trans.get('type') != filter_type:
-                    continue
-
-                # Category Check (Only apply if type is Expense or All Types)
-                # Important: Check the *transaction's* type, not the filter type here
-                trans_type_actual = trans.get('type')
-                if trans_type_actual == TRANS_EXPENSE and filter_category != "All Categories":
-                     # Handle cases where old transactions might have None category
-                     trans_category = trans.get('category') or UNCATEGORIZED
-                     if trans_category != filter_category:
-                         continue
-                elif filter_type == TRANS_EXPENSE and filter_category != "All Categories" and trans_type_actual != TRANS_EXPENSE:
-                    # If filtering specifically for Expenses AND a category, skip non-expenses
-                    continue
-
-                filtered_list.append(trans)
-
+            try:
+                filter_key = self._make_filter_key(
+                    start_date, end_date,
+                    filter_account if filter_account != "All Accounts" else None,
+                    filter_category if filter_category != "All Categories" else None,
+                    filter_type if filter_type != "All Types" else None,
+                    exclude_transfers, self.filter_query_var.get().strip())
+            except ValueError as e:
+                self.current_filter_key = None
+                messagebox.showerror("Query Error", f"Invalid query:\n{e}", parent=self.window)
+                return self.transactions
+            start_date, end_date = self._filter_key_dates(filter_key)
+
+            # Bring in any archived years the date range reaches into
+            self._ensure_partitions_loaded(start_date, end_date)
+            self.current_filter_key = filter_key
+            cached_ids = self.query_cache.get(("ids",) + filter_key, self.ledger_version)
+            if cached_ids is not None:
+                filtered_list = [self.transactions_by_id[i] for i in cached_ids]
+                if not self.history_views.is_current(filter_key, self.ledger_version):
+                    self.history_views.clear(filter_key, self.ledger_version)
+                    self.history_views.seed("date", filtered_list[::-1])
+                return filtered_list
+
+            matches = self._filter_matcher(filter_key)
+            filtered_list = [trans for trans in self._rows_between(start_date, end_date) if matches(trans)]
+
+            # Cache in display order so a cache hit skips both the filter and the sort
+            filtered_list.sort(key=self._history_sort_key, reverse=True)
+            self.query_cache.put(("ids",) + filter_key, self.ledger_version,
+                                 tuple(str(t.get('id')) for t in filtered_list),
+                                 date_range=filter_key[:2], size=len(filtered_list))
+            self.history_views.clear(filter_key, self.ledger_version)
+            self.history_views.seed("date", filtered_list[::-1])
             return filtered_list
 
         except ValueError as e:
+            self.current_filter_key = None
             messagebox.showerror("Filter Error", f"Invalid date format in filters. Please use YYYY-MM-DD.\n({e})", parent=self.window)
             return self.transactions # Return all on date parse error
         except Exception as e:
+            self.current_filter_key = None
             messagebox.showerror("Filter Error", f"An unexpected error occurred while filtering: {e}", parent=self.window)
             print(f"Filter Error: {e}")
             return self.transactions # Return all on other errors
 
+    def _make_filter_key(self, start_date, end_date, account=None, category=None, trans_type=None,
+                         exclude_transfers=False, query_text=""):
+        """Normalized filter tuple, also the query cache key (None = no filter on that field).
+
+        The query's own date conditions narrow the date range. Raises ValueError for an invalid query.
+        """
+        query = FilterQuery.get(query_text) if query_text else None
+        if query:
+            query_start, query_end = (date.fromisoformat(day) if day else None for day in query.date_range)
+            if query_start and (start_date is None or query_start > start_date): start_date = query_start
+            if query_end and (end_date is None or query_end < end_date): end_date = query_end
+        return (
+            start_date.isoformat() if start_date else None,
+            end_date.isoformat() if end_date else None,
+            account,
+            CategoryTree.of(self.categories).subtree(category) if category is not None else None, # Includes subcategories
+            trans_type,
+            bool(exclude_transfers),
+            query.text if query else None,
+        )
+
+    @staticmethod
+    def _filter_key_dates(filter_key):
+        return tuple(date.fromisoformat(day) if day else None for day in filter_key[:2])
+
+    def _rows_between(self, start_date=None, end_date=None):
+        """Loaded transactions that can fall in [start_date, end_date]: only the months in range, via rows_by_month."""
+        if start_date is None and end_date is None:
+            return self.transactions
+        first_month = start_date.isoformat()[:7] if start_date else ""
+        last_month = end_date.isoformat()[:7] if end_date else "9999-12"
+        return [trans for month in sorted(month for month in self.rows_by_month if month and first_month <= month <= last_month)
+                for trans in self.rows_by_month[month]]
+
+    @staticmethod
+    def _filter_matcher(filter_key):
+        """Returns a predicate telling whether a transaction passes the filters in `filter_key`."""
+        start_iso, end_iso, filter_account, filter_category, filter_type, exclude_transfers, query_text = filter_key
+        start_date = date.fromisoformat(start_iso) if start_iso else None
+        end_date = date.fromisoformat(end_iso) if end_iso else None
+        query_matches = FilterQuery.get(query_text).matches if query_text else None
+        parsed_dates = {} # Each distinct date string is parsed once
+
+        def matches(trans):
+            # Date check
+            day = trans.get('date', '1900-01-01')
+            trans_date = parsed_dates.get(day)
+            if trans_date is None:
+                trans_date = parsed_dates[day] = datetime.strptime(day, '%Y-%m-%d').date()
+            if start_date and trans_date < start_date: return False
+            if end_date and trans_date > end_date: return False
+
+            # Account check
+            if filter_account is not None and trans.get('account') != filter_account:
+                return False
+
+            # Type Check
+            if filter_type is not None and trans.get('type') != filter_type:
+                return False
+
+            # Category Check (Only apply if type is Expense or All Types)
+            # Important: Check the *transaction's* type, not the filter type here
+            trans_type_actual = trans.get('type')
+            if trans_type_actual == TRANS_EXPENSE and filter_category is not None:
+                 # Handle cases where old transactions might have None category
+                 splits = trans.get('splits')
+                 if splits: # Split expense: any of its categories
+                     if not any((category or UNCATEGORIZED) in filter_category for category, _ in splits):
+                         return False
+                 elif (trans.get('category') or UNCATEGORIZED) not in filter_category: # The category or one of its subcategories
+                     return False
+            elif filter_type == TRANS_EXPENSE and filter_category is not None and trans_type_actual != TRANS_EXPENSE:
+                # If filtering specifically for Expenses AND a category, skip non-expenses
+                return False
+
+            # Internal transfer check (both legs carry the same transfer_id)
+            if exclude_transfers and trans.get('transfer_id'):
+                return False
+
+            # Query box (compiled once, see FilterQuery)
+            if query_matches is not None and not query_matches(trans):
+                return False
+            return True
+        return matches
+
     def apply_filters(self):
         """Gets filtered transactions and updates the list view and report."""
         filtered_data = self.get_filtered_transactions()
-        self.update_transaction_list(filtered_data) # Update Treeview
-        self.update_report_summary(filtered_data)  # Update Text Summary
+        filter_key = self.current_filter_key
+        self.update_transaction_list(filtered_data, presorted=filter_key is not None) # Update Treeview
+        self.update_report_summary(filtered_data, cache_key=filter_key)  # Update Text Summary
 
     def clear_filters(self):
         """Resets filters to defaults and updates the view."""
@@ -723,53 +4183,352 @@ class FinanceTrackerApp:
         self.filter_account_var.set("All Accounts")
         self.filter_category_var.set("All Categories")
         self.filter_type_var.set("All Types")
+        self.filter_exclude_transfers_var.set(False)
+        self.filter_query_var.set("")
+        self.saved_view_var.set("")
         self.apply_filters() # Re-apply cleared filters
 
-    def update_report_summary(self, transactions_to_summarize=None):
-        """Calculates and displays a summary based on the provided transactions."""
-        if transactions_to_summarize is None:
-             # If called without specific list, use all transactions (e.g., initial load)
-             # Or perhaps better: use currently filtered transactions? Let's use filtered.
-             transactions_to_summarize = self.get_filtered_transactions()
-
-        total_income = 0.0
-        total_expense = 0.0
-        expenses_by_category = defaultdict(float)
+    def update_saved_view_choices(self):
+        self.saved_view_combo['values'] = sorted(self.saved_views, key=str.lower)
+
+    def open_saved_view(self, event=None):
+        """Puts the selected saved view's query in the query box and applies it."""
+        name = self.saved_view_var.get()
+        if name in self.saved_views:
+            self.filter_query_var.set(self.saved_views[name])
+            self.apply_filters()
+
+    def save_view(self):
+        """Saves the query in the query box under a name."""
+        query_text = self.filter_query_var.get().strip()
+        if not query_text:
+            messagebox.showwarning("Save View", "Type a query in the Query box first.", parent=self.window)
+            return
+        try:
+            FilterQuery.get(query_text)
+        except ValueError as e:
+            messagebox.showerror("Query Error", f"Invalid query:\n{e}", parent=self.window)
+            return
+        name = simpledialog.askstring("Save View", "Name for this view:", initialvalue=self.saved_view_var.get(), parent=self.window)
+        name = (name or "").strip()
+        if not name:
+            return
+        if name in self.saved_views and self.saved_views[name] != query_text and not messagebox.askyesno(
+                "Save View", f"Replace the saved view '{name}'?", parent=self.window):
+            return
+        self.saved_views[name] = query_text
+        self.update_saved_view_choices()
+        self.saved_view_var.set(name)
+        self.save_data()
+
+    def delete_view(self):
+        name = self.saved_view_var.get()
+        if name not in self.saved_views:
+            messagebox.showwarning("Delete View", "Please select a saved view to delete.", parent=self.window)
+            return
+        if not messagebox.askyesno("Delete View", f"Delete the saved view '{name}'?", parent=self.window):
+            return
+        del self.saved_views[name]
+        self.saved_view_var.set("")
+        self.update_saved_view_choices()
+        self.save_data()
+
+    def summarize_transactions(self, transactions_to_summarize, cache_key=None, only_categories=None):
+        """Returns (total_income, total_expense, expenses_by_category) in the reporting currency.
+
+        The per-(currency, date) sums are cached per filter key, so switching the reporting
+        currency only re-converts the groups. With `only_categories` (the category filter),
+        expenses count only the splits in those categories.
+        """
+        groups = self._summary_groups(transactions_to_summarize, cache_key, only_categories)
+        income_groups, expense_groups, category_groups = groups
+        convert = self.fx_rates.convert_groups
+        return (convert(income_groups, self.reporting_currency), convert(expense_groups, self.reporting_currency),
+                {category: convert(by_currency, self.reporting_currency) for category, by_currency in category_groups.items()})
+
+    def _summary_groups(self, transactions_to_summarize, cache_key=None, only_categories=None):
+        """Income, expense and per-category expense sums as {currency: {date: amount}}, cached per filter key."""
+        if cache_key is not None:
+            cached = self.query_cache.get(("summary",) + cache_key, self.ledger_version)
+            if cached is not None:
+                return cached
+
+        income_groups = defaultdict(lambda: defaultdict(float))
+        expense_groups = defaultdict(lambda: defaultdict(float))
+        category_groups = defaultdict(lambda: defaultdict(lambda: defaultdict(float)))
+        account_currency = self.account_currency
 
         for trans in transactions_to_summarize:
+            if trans.get('opening_balance'):
+                continue # Carries a closed period's balance forward, neither earned nor spent
             amount = trans.get('amount', 0.0)
             trans_type = trans.get('type')
             if trans_type == TRANS_INCOME:
-                total_income += amount
+                income_groups[account_currency(trans.get('account'))][trans.get('date', '')] += amount
             elif trans_type == TRANS_EXPENSE:
-                total_expense += amount
-                category = trans.get('category') or UNCATEGORIZED
-                expenses_by_category[category] += amount
+                currency, day = account_currency(trans.get('account')), trans.get('date', '')
+                if 'splits' not in trans:
+                    expense_groups[currency][day] += amount
+                    category_groups[trans.get('category') or UNCATEGORIZED][currency][day] += amount
+                    continue
+                for category, split_amount in category_amounts(trans):
+                    if only_categories is not None and category not in only_categories:
+                        continue # Another category's share of a split expense
+                    expense_groups[currency][day] += split_amount
+                    category_groups[category][currency][day] += split_amount
+
+        summary = (income_groups, expense_groups, category_groups)
+        if cache_key is not None:
+            self.query_cache.put(("summary",) + cache_key, self.ledger_version, summary, date_range=cache_key[:2])
+        return summary
+
+    def update_report_summary(self, transactions_to_summarize=None, cache_key=None):
+        """Calculates and displays a summary based on the provided transactions."""
+        if transactions_to_summarize is None:
+             # If called without specific list, use the currently filtered transactions
+             transactions_to_summarize = self.get_filtered_transactions()
+             cache_key = self.current_filter_key
+
+        try:
+            total_income, total_expense, expenses_by_category = self.summarize_transactions(
+                transactions_to_summarize, cache_key, only_categories=cache_key[3] if cache_key else None)
+        except KeyError as e: # A currency in the filtered set has no exchange rate
+            self.report_text.configure(state='normal')
+            self.report_text.delete(1.0, tk.END)
+            self.report_text.insert(tk.END, f"Can't convert to {self.reporting_currency}:\n{e.args[0]}\nImport exchange rates to see totals.")
+            self.report_text.configure(state='disabled')
+            self.category_report_tree.delete(*self.category_report_tree.get_children())
+            return
+        symbol = CURRENCY_SYMBOLS.get(self.reporting_currency, f"{self.reporting_currency} ")
 
         # Prepare report string
-        report_str = f"Income:  {CURRENCY_SYMBOL}{total_income:,.2f}\n"
-        report_str += f"Expense: {CURRENCY_SYMBOL}{total_expense:,.2f}\n"
+        report_str = f"Income:  {symbol}{total_income:,.2f}\n"
+        report_str += f"Expense: {symbol}{total_expense:,.2f}\n"
         net_change = total_income - total_expense
         sign = "+" if net_change >= 0 else ""
-        report_str += f"Net:     {sign}{CURRENCY_SYMBOL}{net_change:,.2f}\n"
-        report_str += "-" * 25 + "\n" # Separator
-
-        if expenses_by_category:
-            report_str += "Expenses by Category:\n"
-            # Sort categories by amount descending for the report
-            sorted_categories = sorted(expenses_by_category.items(), key=lambda item: item[1], reverse=True)
-            max_cat_len = max(len(cat) for cat in expenses_by_category.keys()) if expenses_by_category else 10
-            for category, amount in sorted_categories:
-                report_str += f"  {category:<{max_cat_len}} : {CURRENCY_SYMBOL}{amount:>10,.2f}\n" # Align amounts
-        else:
-             report_str += "(No expenses in filtered period)\n"
-
+        report_str += f"Net:     {sign}{symbol}{net_change:,.2f}"
 
         # Update the text widget
         self.report_text.configure(state='normal') # Enable writing
         self.report_text.delete(1.0, tk.END) # Clear previous content
         self.report_text.insert(tk.END, report_str)
         self.report_text.configure(state='disabled') # Disable writing
+        self.update_category_report(expenses_by_category, symbol)
+
+    def update_category_report(self, expenses_by_category, symbol):
+        """Fills the Expenses by Category tree. Subtree totals are rolled up once per category
+        here, so expanding or collapsing a node is purely a view change."""
+        tree = self.category_report_tree
+        opened = {iid for iid in self._all_tree_items(tree) if tree.item(iid, 'open')}
+        tree.delete(*tree.get_children())
+        if not expenses_by_category:
+            tree.insert("", tk.END, text="(No expenses in filtered period)", values=("",))
+            return
+
+        rolled = CategoryTree.rollup(expenses_by_category)
+        children = defaultdict(list)
+        for node in rolled:
+            children[category_parent(node)].append(node)
+        pending = [(None, "")]
+        while pending:
+            parent, parent_iid = pending.pop()
+            # Largest first within each level
+            for node in sorted(children[parent], key=lambda node: rolled[node], reverse=True):
+                tree.insert(parent_iid, tk.END, iid=node, text=node.rsplit(CATEGORY_SEPARATOR, 1)[-1],
+                            values=(f"{symbol}{rolled[node]:,.2f}",), open=node in opened)
+                if node in children:
+                    pending.append((node, node))
+
+    @staticmethod
+    def _all_tree_items(tree, parent=""):
+        for iid in tree.get_children(parent):
+            yield iid
+            yield from FinanceTrackerApp._all_tree_items(tree, iid)
+
+
+    # --- Transaction Index ---
+    # All changes to self.transactions go through _add_transactions/_remove_transactions/
+    # _replace_transaction so the lookup indexes and running balances never go stale. They
+    # also record each change for undo while a command is open (see Undo / Redo).
+
+    def _rebuild_indexes(self):
+        """Rebuilds the id, transfer-group, month, budget and chart indexes from self.transactions."""
+        self.transactions_by_id = {}
+        self.transfer_groups = {}
+        self.rows_by_month = defaultdict(list)
+        self.category_spend = defaultdict(float) # (month, category) -> expenses, see Budgets
+        self.chart_days = {}                     # ISO day -> chart totals, see Charts
+        self.chart_cache = None
+        self.net_worth_cache = None
+        self.ledger_version += 1
+        self.query_cache.clear()
+        self.history_views.clear()
+        self.description_index.clear()
+        for trans in self.transactions:
+            self._index_transaction(trans)
+        self.description_index.sorted_keys() # Sorted once now rather than on the first keystroke
+        self.refresh_charts()
+
+    @staticmethod
+    def _migrate_transfer_id(trans):
+        """Adds transfer_id to transfers saved before it existed (ids 'tf_out_<ts>' / 'tf_in_<ts>')."""
+        if not trans.get('transfer_id'):
+            trans_id = str(trans.get('id', ''))
+            for prefix in ("tf_out_", "tf_in_"):
+                if trans_id.startswith(prefix):
+                    trans['transfer_id'] = "tf_" + trans_id[len(prefix):]
+                    break
+
+    def _index_transaction(self, trans):
+        """Adds a single transaction to the lookup indexes."""
+        self.transactions_by_id[str(trans.get('id'))] = trans
+        self.rows_by_month[month_key(trans.get('date'))].append(trans)
+        for budget_key, amount in self._budget_amounts(trans):
+            self.category_spend[budget_key] += amount
+        self._add_chart_effects(self.chart_days, trans, 1)
+        self.description_index.update(trans, 1)
+        transfer_id = trans.get('transfer_id')
+        if transfer_id:
+            legs = self.transfer_groups.setdefault(transfer_id, [])
+            # Keep the outgoing (expense) leg first
+            if trans.get('type') == TRANS_EXPENSE: legs.insert(0, trans)
+            else: legs.append(trans)
+
+    def _unindex_transactions(self, rows):
+        """Removes transactions from the lookup indexes, filtering each month's row list only once."""
+        dropped_by_month = defaultdict(set)
+        for trans in rows:
+            trans_id = str(trans.get('id'))
+            if self.transactions_by_id.get(trans_id) is trans:
+                del self.transactions_by_id[trans_id]
+            for budget_key, amount in self._budget_amounts(trans):
+                self.category_spend[budget_key] -= amount
+            self._add_chart_effects(self.chart_days, trans, -1)
+            self.description_index.update(trans, -1)
+            dropped_by_month[month_key(trans.get('date'))].add(id(trans))
+            transfer_id = trans.get('transfer_id')
+            if transfer_id and transfer_id in self.transfer_groups:
+                legs = [leg for leg in self.transfer_groups[transfer_id] if leg is not trans]
+                if legs: self.transfer_groups[transfer_id] = legs
+                else: del self.transfer_groups[transfer_id]
+        for month, dropped in dropped_by_month.items():
+            month_rows = self.rows_by_month.get(month)
+            if not month_rows:
+                continue
+            if len(dropped) == 1:
+                for i, row in enumerate(month_rows):
+                    if id(row) in dropped:
+                        del month_rows[i]
+                        break
+            else:
+                month_rows[:] = [row for row in month_rows if id(row) not in dropped]
+
+    def get_transfer_legs(self, trans):
+        """Returns all legs of the transfer `trans` belongs to (empty list if it isn't a transfer)."""
+        transfer_id = trans.get('transfer_id')
+        return list(self.transfer_groups.get(transfer_id, [])) if transfer_id else []
+
+    def _on_ledger_changed(self, changed_transactions):
+        """Marks the ledger as changed; cached queries outside the changed dates stay valid."""
+        for trans in changed_transactions:
+            self.dirty_partitions.add(self._partition_key(trans))
+        dates = set()
+        for day in {trans.get('date', '') for trans in changed_transactions}: # Parse each distinct date once
+            try:
+                dates.add(datetime.strptime(day, '%Y-%m-%d').date().isoformat())
+            except (ValueError, TypeError):
+                dates = None # Unparseable date, so we can't tell which entries are safe
+                break
+        old_version = self.ledger_version
+        self.ledger_version += 1
+        self.query_cache.invalidate(old_version, self.ledger_version, dates)
+        self._patch_history_views(changed_transactions, old_version)
+        self.refresh_charts()
+
+    def _patch_history_views(self, changed_transactions, old_version):
+        """Moves changed transactions within the cached sort orders instead of dropping them."""
+        views = self.history_views
+        if views.filter_key is None or views.version != old_version:
+            views.clear()
+            return
+        matches = self._filter_matcher(views.filter_key)
+        try:
+            for trans in changed_transactions:
+                views.discard(trans)
+            for trans in changed_transactions:
+                if self.transactions_by_id.get(str(trans.get('id'))) is trans and matches(trans):
+                    views.insert(trans)
+        except ValueError: # Unparseable date, the filter can't place it
+            views.clear()
+            return
+        views.version = self.ledger_version
+        # The patched date order is the filtered list, so apply_filters needn't filter again
+        filtered_list = views.rows("date", ())[::-1]
+        self.query_cache.put(("ids",) + views.filter_key, self.ledger_version,
+                             tuple(str(t.get('id')) for t in filtered_list),
+                             date_range=views.filter_key[:2], size=len(filtered_list))
+
+    def _add_transactions(self, new_transactions):
+        """Appends transactions to the ledger and indexes them. Raises ValueError if a year they belong to couldn't be read."""
+        self._require_loaded_years(self._partition_key(trans) for trans in new_transactions) # Before anything changes
+        for trans in new_transactions:
+            year = self._partition_key(trans)
+            self.transactions.append(trans)
+            self.partition_appends.setdefault(year, []).append(trans)
+            self._index_transaction(trans)
+            self._apply_balance_delta(trans, 1)
+        self.undo_history.record(("add", list(new_transactions)))
+        self._on_ledger_changed(new_transactions)
+
+    def _remove_transactions(self, ids_to_remove):
+        """Removes transactions whose str(id) is in `ids_to_remove`. Returns the removed dicts."""
+        ids_to_remove = set(ids_to_remove)
+        removed = [self.transactions_by_id[i] for i in ids_to_remove if i in self.transactions_by_id]
+        if removed:
+            if len(removed) <= 64: # A few rows (e.g. undoing an add): delete in place, searching from the newest
+                remaining = {id(trans) for trans in removed}
+                for i in range(len(self.transactions) - 1, -1, -1):
+                    if id(self.transactions[i]) in remaining:
+                        remaining.discard(id(self.transactions[i]))
+                        del self.transactions[i]
+                        if not remaining: break
+            else:
+                self.transactions = [t for t in self.transactions if str(t.get('id')) not in ids_to_remove]
+            self._unindex_transactions(removed)
+            for trans in removed:
+                self._apply_balance_delta(trans, -1)
+                self.partition_rewrites.add(self._partition_key(trans))
+            self.undo_history.record(("remove", removed))
+            self._on_ledger_changed(removed)
+        return removed
+
+    def _replace_transaction(self, old_trans, new_trans):
+        """Swaps `old_trans` for `new_trans` in place, keeping its position in the ledger."""
+        self._replace_transactions([(old_trans, new_trans)])
+
+    def _replace_transactions(self, replacements):
+        """Swaps every (old, new) pair in place with one pass over the ledger and a single change notification."""
+        self._require_loaded_years(self._partition_key(new_trans) for _, new_trans in replacements) # The edit may move it into an archived year
+        new_by_old = {id(old_trans): new_trans for old_trans, new_trans in replacements}
+        positions = [i for i, trans in enumerate(self.transactions) if id(trans) in new_by_old]
+        if len(positions) < len(new_by_old):
+            found = {id(self.transactions[i]) for i in positions}
+            missing = next(old_trans for old_trans, _ in replacements if id(old_trans) not in found)
+            raise ValueError(f"Transaction {missing.get('id')} is not in the ledger.")
+        for i in positions:
+            self.transactions[i] = new_by_old[id(self.transactions[i])]
+        changed = []
+        self._unindex_transactions([old_trans for old_trans, _ in replacements])
+        for old_trans, new_trans in replacements:
+            self._index_transaction(new_trans)
+            if (self._balance_effect(old_trans) != self._balance_effect(new_trans) or
+                    transaction_checksum(old_trans) != transaction_checksum(new_trans)): # Not for e.g. a new category
+                self._apply_balance_delta(old_trans, -1)
+                self._apply_balance_delta(new_trans, 1)
+            self.partition_rewrites.update((self._partition_key(old_trans), self._partition_key(new_trans)))
+            self.undo_history.record(("replace", old_trans, new_trans))
+            changed += (old_trans, new_trans)
+        self._on_ledger_changed(changed)
 
 
     # --- Transaction Handling (Add, Edit, Delete) ---
@@ -786,18 +4545,9 @@ class FinanceTrackerApp:
             category = self.transaction_category_var.get() if trans_type == TRANS_EXPENSE else None # Store None if not expense
 
             # --- Validation ---
-            if not date_str: raise ValueError("Please select a valid date.")
-            try: datetime.strptime(date_str, '%Y-%m-%d')
-            except ValueError: raise ValueError(f"Invalid date format: '{date_str}'. Use YYYY-MM-DD.")
-            if not account: raise ValueError("Please select an account.")
-            if amount <= 0: raise ValueError("Amount must be a positive number.")
-            if not trans_type: raise ValueError("Please select a transaction type.")
-            if trans_type == TRANS_EXPENSE and not category:
-                 # This should be handled by defaulting, but double-check
-                 self.transaction_category_var.set(UNCATEGORIZED)
-                 category = UNCATEGORIZED
-                 # raise ValueError("Please select a category for the expense.") # Or just default
-
+            category = self._validated_entry(date_str, account, description, amount, trans_type, category)
+            splits = self._checked_splits(trans_type, self.pending_splits, amount)
+            if splits: category = split_category(splits)
 
             # --- Insufficient Funds Check ---
             if trans_type == TRANS_EXPENSE:
@@ -806,25 +4556,54 @@ class FinanceTrackerApp:
                 if current_balance < amount:
                     if not messagebox.askyesno( # Make it a warning confirmation
                         "Insufficient Funds",
-                        f"This expense of {CURRENCY_SYMBOL}{amount:,.2f} exceeds the current balance of {CURRENCY_SYMBOL}{current_balance:,.2f} in account '{account}'.\n\nDo you want to add it anyway?",
+                        f"This expense of {format_money(amount, self.account_currency(account))} exceeds the current balance of {format_money(current_balance, self.account_currency(account))} in account '{account}'.\n\nDo you want to add it anyway?",
                         icon='warning', parent=self.window):
                          return # Stop if user clicks No
 
+            # --- Budget Check ---
+            if splits:
+                if not self.confirm_batch_within_budget([], [{"date": date_str, "account": account, "amount": amount,
+                                                               "type": trans_type, "splits": splits}]):
+                    return
+            elif trans_type == TRANS_EXPENSE and not self.confirm_within_budget(
+                    date_str[:7], category, self._amount_in_base({"account": account, "date": date_str, "amount": amount})):
+                return
+
             # --- Add Transaction ---
-            transaction = {
-                "date": date_str, "account": account, "description": description,
-                "amount": amount, "type": trans_type, "category": category, # Add category
-                "id": datetime.now().timestamp() # Unique ID
-            }
-            self.transactions.append(transaction)
+            repeat = self.repeat_var.get()
+            if repeat in RECURRENCE_FREQUENCIES:
+                # Recurring: the schedule adds this and every later occurrence as it comes due
+                interval = self.repeat_interval_var.get()
+                if interval < 1: raise ValueError("Repeat interval must be at least 1.")
+                self.schedules.append({
+                    "id": f"{datetime.now().timestamp():.6f}", "description": description, "account": account,
+                    "amount": amount, "type": trans_type, "category": category,
+                    "frequency": repeat, "interval": interval, "start": date_str, "end": None,
+                    "materialized_through": None,
+                })
+                if splits: self.schedules[-1]["splits"] = splits
+                self.materialize_due_schedules()
+                self.repeat_var.set("Never")
+                self.repeat_interval_var.set(1)
+            else:
+                transaction = {
+                    "date": date_str, "account": account, "description": description,
+                    "amount": amount, "type": trans_type, "category": category, # Add category
+                    "id": datetime.now().timestamp() # Unique ID
+                }
+                if splits: transaction["splits"] = splits
+                with self.undo_history.command("Add Transaction"):
+                    self._add_transactions([transaction])
             self.apply_filters() # Update view based on filters
             self.update_balances()
+            self.update_undo_buttons()
             # self.save_data() # Consider saving more frequently or just on close
 
             # Reset relevant fields
             self.description_var.set("")
             self.amount_var.set(0.0)
             self.transaction_category_var.set(UNCATEGORIZED) # Reset category dropdown
+            self._set_pending_splits(None)
             self.desc_entry.focus_set()
 
         except ValueError as e:
@@ -833,6 +4612,38 @@ class FinanceTrackerApp:
             messagebox.showerror("Error", f"An unexpected error occurred: {e}", parent=self.window)
             print(f"Error adding transaction: {e}")
 
+    def _validated_entry(self, date_str, account, description, amount, trans_type, category):
+        """Checks the fields of a new income/expense (raises ValueError) and returns its category:
+        None for income, otherwise the given one, or a rule's pick if it's uncategorized."""
+        if not date_str: raise ValueError("Please select a valid date.")
+        try: datetime.strptime(date_str, '%Y-%m-%d')
+        except ValueError: raise ValueError(f"Invalid date format: '{date_str}'. Use YYYY-MM-DD.")
+        if not account: raise ValueError("Please select an account.")
+        if account not in self.accounts: raise ValueError(f"Unknown account: '{account}'.")
+        if amount <= 0: raise ValueError("Amount must be a positive number.")
+        if not trans_type: raise ValueError("Please select a transaction type.")
+        if trans_type not in (TRANS_EXPENSE, TRANS_INCOME): raise ValueError(f"Invalid transaction type: '{trans_type}'.")
+        if trans_type != TRANS_EXPENSE:
+            return None
+        category = category or UNCATEGORIZED
+        if category != UNCATEGORIZED and category not in self.categories:
+            raise ValueError(f"Unknown category: '{category}'.")
+        if category == UNCATEGORIZED: # Let the rules pick one
+            ruled_category = self.category_rules.category_for({"account": account, "description": description, "amount": amount})
+            if ruled_category in self.categories: category = ruled_category
+        return category
+
+    def _checked_splits(self, trans_type, splits, amount):
+        """Validated splits for a new expense, or None if it isn't split (raises ValueError)."""
+        if not splits:
+            return None
+        if trans_type != TRANS_EXPENSE: raise ValueError("Only expenses can be split between categories.")
+        splits = validated_splits(splits, amount)
+        for category, _ in splits:
+            if category != UNCATEGORIZED and category not in self.categories:
+                raise ValueError(f"Unknown category: '{category}'.")
+        return splits
+
     def on_transaction_double_click(self, event):
         """Handles double-click event on the transaction list."""
         selected_item = self.tree.focus() # Get the item that has focus
@@ -852,39 +4663,37 @@ class FinanceTrackerApp:
         """Opens the edit dialog for the transaction with the given treeview IID."""
         try:
             # Find the original transaction dictionary using the IID (which stores the transaction's unique ID)
-            transaction_to_edit = None
-            original_index = -1
-            for i, trans in enumerate(self.transactions):
-                if str(trans.get('id')) == str(item_iid): # Compare IDs as strings just in case
-                    transaction_to_edit = trans
-                    original_index = i
-                    break
+            transaction_to_edit = self.transactions_by_id.get(str(item_iid))
 
             if not transaction_to_edit:
                 messagebox.showerror("Error", "Could not find the selected transaction data to edit.", parent=self.window)
                 print(f"Edit error: Could not find transaction with ID {item_iid}")
                 return
 
+            transfer_legs = self.get_transfer_legs(transaction_to_edit)
+            if len(transfer_legs) == 2:
+                self.edit_transfer(transfer_legs)
+                return
+
             # Open the dialog
             dialog = EditTransactionDialog(self.window, "Edit Transaction",
-                                         transaction_to_edit, self.accounts, self.categories)
+                                         transaction_to_edit, self.accounts, self.categories,
+                                         suggest=self.description_index.suggest,
+                                         describe_suggestion=self.describe_suggestion)
 
             # If the dialog returns valid data (user clicked Save)
             if dialog.result:
-                updated_data = dialog.result
+                updated_data = self._unreconciled_if_changed(transaction_to_edit, dialog.result)
                 # --- Insufficient Funds Check (on changing to Expense or increasing amount) ---
                 is_new_expense = (updated_data['type'] == TRANS_EXPENSE and
                                  transaction_to_edit.get('type') != TRANS_EXPENSE)
                 is_increased_expense = (updated_data['type'] == TRANS_EXPENSE and
                                       transaction_to_edit.get('type') == TRANS_EXPENSE and
                                       updated_data['amount'] > transaction_to_edit.get('amount', 0))
-                is_new_transfer_out = (updated_data['type'] == TRANS_EXPENSE and
-                                       TRANSFER_OUT_DESC.split('{}')[0] in updated_data['description']) # Could refine check
 
-                if is_new_expense or is_increased_expense or is_new_transfer_out:
+                if is_new_expense or is_increased_expense:
                     # Calculate potential impact *without* the old transaction but *with* the new
-                    temp_transactions = self.transactions[:original_index] + self.transactions[original_index+1:] + [updated_data]
-                    account_balances, _ = self.calculate_balances(transactions_list=temp_transactions) # Calc with hypothetical change
+                    account_balances = self._balances_after_replacing([transaction_to_edit], [updated_data]) # Hypothetical change
                     target_account = updated_data['account']
                     new_balance = account_balances.get(target_account, 0.0)
 
@@ -892,118 +4701,455 @@ class FinanceTrackerApp:
                          # Use askyesno warning similar to add_transaction
                          if not messagebox.askyesno(
                              "Potential Insufficient Funds",
-                             f"Editing this transaction might result in a negative balance ({CURRENCY_SYMBOL}{new_balance:,.2f}) for account '{target_account}'.\n\nDo you want to save the changes anyway?",
+                             f"Editing this transaction might result in a negative balance ({format_money(new_balance, self.account_currency(target_account))}) for account '{target_account}'.\n\nDo you want to save the changes anyway?",
                              icon='warning', parent=self.window):
                               return # Stop if user clicks No
 
+                # --- Budget Check (only the extra spending this edit adds to each month/category) ---
+                if not self.confirm_batch_within_budget([transaction_to_edit], [updated_data]):
+                    return
+
                 # Replace the old transaction with the updated data in the main list
-                self.transactions[original_index] = updated_data
+                with self.undo_history.command("Edit Transaction"):
+                    self._replace_transaction(transaction_to_edit, updated_data)
                 self.apply_filters()   # Update Treeview and report
                 self.update_balances() # Update balance displays
+                self.update_undo_buttons()
                 # self.save_data()       # Optional: save immediately
 
         except Exception as e:
             messagebox.showerror("Error", f"An error occurred while trying to edit: {e}", parent=self.window)
             print(f"Edit Transaction Error: {e}")
 
+    def edit_transfer(self, transfer_legs):
+        """Edits both legs of a transfer together so they can never drift apart."""
+        out_leg, in_leg = transfer_legs
+        dialog = EditTransferDialog(self.window, "Edit Transfer", out_leg, in_leg, self.accounts)
+        if not dialog.result:
+            return
+        changes = dialog.result
+        from_account, to_account, amount = changes['from_account'], changes['to_account'], changes['amount']
+        try:
+            amount_in = self._transfer_amount_in(amount, from_account, to_account, changes['date'])
+        except ValueError as e:
+            messagebox.showerror("Edit Transfer", str(e), parent=self.window)
+            return
+
+        new_out = dict(out_leg, date=changes['date'], account=from_account, amount=amount,
+                       description=TRANSFER_OUT_DESC.format(to_account))
+        new_in = dict(in_leg, date=changes['date'], account=to_account, amount=amount_in,
+                      description=TRANSFER_IN_DESC.format(from_account))
+        new_out, new_in = self._unreconciled_if_changed(out_leg, new_out), self._unreconciled_if_changed(in_leg, new_in)
+
+        # --- Insufficient Funds Check (only if more money now leaves the source account) ---
+        if from_account != out_leg.get('account') or amount > out_leg.get('amount', 0):
+            account_balances = self._balances_after_replacing([out_leg, in_leg], [new_out, new_in])
+            new_balance = account_balances.get(from_account, 0.0)
+            if new_balance < 0:
+                if not messagebox.askyesno(
+                    "Potential Insufficient Funds",
+                    f"Editing this transfer might result in a negative balance ({format_money(new_balance, self.account_currency(from_account))}) for account '{from_account}'.\n\nDo you want to save the changes anyway?",
+                    icon='warning', parent=self.window):
+                    return
 
-    def delete_selected_transaction(self):
-        """Deletes the selected transaction(s) from the list."""
-        selected_items = self.tree.selection() # Get selected IIDs
-        if not selected_items:
-            messagebox.showwarning("No Selection", "Please select transaction(s) to delete.", parent=self.window)
+        try:
+            with self.undo_history.command("Edit Transfer"): # Both legs are undone together
+                self._replace_transactions([(out_leg, new_out), (in_leg, new_in)]) # One batch: the legs never disagree
+        except ValueError as e:
+            messagebox.showerror("Edit Transfer", str(e), parent=self.window)
+            return
+        self.apply_filters()
+        self.update_balances()
+        self.update_undo_buttons()
+
+
+    def bulk_edit_selected(self):
+        """Applies one set of changes to every selected transaction as a single validated batch."""
+        selected = [self.transactions_by_id.get(str(item_iid)) for item_iid in self.tree.selection()]
+        selected = [trans for trans in selected if trans]
+        if not selected:
+            messagebox.showwarning("No Selection", "Please select the transactions to edit.", parent=self.window)
+            return
+        editable = [trans for trans in selected if not trans.get('transfer_id')] # Legs must stay paired
+        skipped = len(selected) - len(editable)
+        if not editable:
+            messagebox.showinfo("Bulk Edit", "Transfers can't be bulk edited. Double-click a transfer to edit it.", parent=self.window)
+            return
+        dialog = BulkEditDialog(self.window, "Bulk Edit", len(editable), self.accounts, self.categories)
+        if not dialog.result:
+            return
+
+        try:
+            replacements = [(trans, self._unreconciled_if_changed(trans, self._bulk_edited(trans, dialog.result))) for trans in editable]
+        except ValueError as e:
+            messagebox.showerror("Bulk Edit", str(e), parent=self.window)
+            return
+        replacements = [(old_trans, new_trans) for old_trans, new_trans in replacements if new_trans != old_trans]
+        if not replacements:
+            messagebox.showinfo("Bulk Edit", "Nothing to change: the selected transactions already match.", parent=self.window)
+            return
+        old_rows = [old_trans for old_trans, _ in replacements]
+        new_rows = [new_trans for _, new_trans in replacements]
+
+        # --- Insufficient Funds Check (once for the whole batch) ---
+        current_balances, _ = self.calculate_balances()
+        new_balances = self._balances_after_replacing(old_rows, new_rows)
+        overdrawn = [account for account, balance in new_balances.items()
+                     if balance < 0 and balance < current_balances.get(account, 0.0) - 0.005]
+        if overdrawn and not messagebox.askyesno(
+                "Potential Insufficient Funds",
+                "These changes would leave a negative balance in:\n" +
+                "\n".join(f"  {account}: {format_money(new_balances[account], self.account_currency(account))}" for account in sorted(overdrawn)) +
+                "\n\nDo you want to save the changes anyway?",
+                icon='warning', parent=self.window):
             return
 
-        if not messagebox.askyesno("Confirm Delete", f"Are you sure you want to permanently delete the selected {len(selected_items)} transaction(s)?\n(Deleting one part of a transfer will require manually deleting the other)", parent=self.window):
+        # --- Budget Check (once for the whole batch) ---
+        if not self.confirm_batch_within_budget(old_rows, new_rows):
             return
 
-        deleted_count = 0
-        found_transfer = False
-        ids_to_delete = set(selected_items) # Use a set for faster lookup
+        try:
+            with self.undo_history.command(f"Bulk Edit of {len(replacements)}"):
+                self._replace_transactions(replacements)
+        except ValueError as e:
+            messagebox.showerror("Bulk Edit", str(e), parent=self.window)
+            return
+        self.apply_filters()   # One refresh for the whole batch
+        self.update_balances()
+        self.update_undo_buttons()
+        message = f"{len(replacements)} transaction(s) updated."
+        if skipped: message += f"\n{skipped} transfer leg(s) were left unchanged."
+        messagebox.showinfo("Success", message, parent=self.window)
+
+    @staticmethod
+    def _bulk_edited(trans, changes):
+        """A copy of `trans` with BulkEditDialog's `changes` applied."""
+        edited = dict(trans)
+        if "date_shift" in changes:
+            try:
+                shifted = datetime.strptime(trans.get('date', ''), '%Y-%m-%d') + timedelta(days=changes["date_shift"])
+            except (ValueError, OverflowError):
+                raise ValueError(f"Can't shift the date of '{trans.get('description', '')}' ({trans.get('date', '')}).")
+            edited['date'] = shifted.strftime('%Y-%m-%d')
+        if "account" in changes:
+            edited['account'] = changes["account"]
+        if "type" in changes:
+            edited['type'] = changes["type"]
+        if edited.get('type') == TRANS_EXPENSE:
+            edited['category'] = changes.get("category") or trans.get('category') or UNCATEGORIZED
+        elif edited.get('category') is not None:
+            edited['category'] = None # Income has no category
+        if "category" in changes or edited.get('type') != TRANS_EXPENSE:
+            edited.pop('splits', None) # One category for the whole amount now
+        if "description" in changes:
+            find, replacement = changes["description"]
+            description = trans.get('description', '')
+            edited['description'] = description.replace(find, replacement).strip() if find else replacement
+        return edited
 
-        # Iterate backwards through the main list to avoid index issues during deletion
-        indices_to_delete = []
-        for i in range(len(self.transactions) - 1, -1, -1):
-            trans_id = str(self.transactions[i].get('id'))
-            if trans_id in ids_to_delete:
-                indices_to_delete.append(i)
-                desc = self.transactions[i].get('description', '')
-                if TRANSFER_IN_DESC.split('{}')[0] in desc or TRANSFER_OUT_DESC.split('{}')[0] in desc:
-                     found_transfer = True
+    def delete_selected_transaction(self):
+        """Deletes the selected transaction(s) from the list. Transfers are always deleted as a pair."""
+        selected_items = self.tree.selection() # Get selected IIDs
+        if not selected_items:
+            messagebox.showwarning("No Selection", "Please select transaction(s) to delete.", parent=self.window)
+            return
 
-        if not indices_to_delete:
+        # Expand the selection so that deleting either side of a transfer removes both legs
+        ids_to_delete = set()
+        transfer_count = 0
+        for item_iid in selected_items:
+            trans = self.transactions_by_id.get(str(item_iid))
+            if not trans:
+                continue
+            legs = self.get_transfer_legs(trans)
+            if legs:
+                new_ids = {str(leg.get('id')) for leg in legs} - ids_to_delete
+                if new_ids: transfer_count += 1
+                ids_to_delete |= new_ids
+            else:
+                ids_to_delete.add(str(item_iid))
+
+        if not ids_to_delete:
              messagebox.showerror("Error", "Could not find the selected transaction data to delete. It might have already been deleted.", parent=self.window)
              print("Delete Error: No matching IDs found in self.transactions for selected IIDs:", selected_items)
              return
 
+        confirm_msg = f"Are you sure you want to delete {len(ids_to_delete)} transaction(s)?"
+        if transfer_count:
+            confirm_msg += f"\n(Includes both legs of {transfer_count} transfer(s))"
+        if not messagebox.askyesno("Confirm Delete", confirm_msg, parent=self.window):
+            return
+
         # Perform deletions
-        for index in sorted(indices_to_delete, reverse=True): # Delete from end to start
-             del self.transactions[index]
-             deleted_count += 1
+        with self.undo_history.command(f"Delete {len(ids_to_delete)} Transaction(s)"):
+            deleted_count = len(self._remove_transactions(ids_to_delete))
 
         if deleted_count > 0:
             self.apply_filters()   # Update view
             self.update_balances() # Update balances
+            self.update_undo_buttons()
             # self.save_data()       # Optional: save immediately
             messagebox.showinfo("Success", f"{deleted_count} transaction(s) deleted.", parent=self.window)
-            if found_transfer:
-                 messagebox.showwarning("Transfer Deleted", "You deleted one part of a transfer. You may need to manually delete the corresponding transaction in the other account for balances to be correct.", parent=self.window)
         else:
             # This case should be less likely now with the check above
             messagebox.showerror("Error", "Failed to delete the selected transaction(s).", parent=self.window)
 
 
+    # --- Undo / Redo ---
+    # Undo applies a command's inverse operations through the index funnel, so balances,
+    # checkpoints, caches and the sorted history views are patched as for any other change,
+    # in time proportional to the command. Operations are checked against the ledger first;
+    # if something changed them since (e.g. a merged external save), the history is dropped.
+
+    def undo(self, event=None):
+        self._step_history(self.undo_history.undo_stack, self.undo_history.redo_stack, "Undo")
+
+    def redo(self, event=None):
+        self._step_history(self.undo_history.redo_stack, self.undo_history.undo_stack, "Redo")
+
+    def _step_history(self, source, target, action):
+        """Pops a command from `source`, applies it (inverted for undo) and pushes it onto `target`."""
+        if not source:
+            return
+        label, operations = source.pop()
+        to_apply = UndoHistory.inverse(operations) if action == "Undo" else operations
+        problem = self._check_operations(to_apply)
+        if problem:
+            self.undo_history.clear()
+            self.update_undo_buttons()
+            messagebox.showerror(action, f"Can't {action.lower()} '{label}': {problem}\nThe undo history has been cleared.", parent=self.window)
+            return
+        replacements = [] # Consecutive replaces (e.g. a bulk edit) are applied as one batch
+        for kind, *rows in to_apply + [("end",)]:
+            if replacements and (kind != "replace" or any(
+                    str(rows[0].get('id')) == str(new_trans.get('id')) for _, new_trans in replacements)):
+                self._replace_transactions(replacements)
+                replacements = []
+            if kind == "add":
+                self._add_transactions(rows[0])
+            elif kind == "remove":
+                self._remove_transactions({str(trans.get('id')) for trans in rows[0]})
+            elif kind == "replace": # The ledger's copy may be a different (equal) dict if its year was reloaded
+                replacements.append((self.transactions_by_id[str(rows[0].get('id'))], rows[1]))
+        target.append((label, operations))
+        self.apply_filters()
+        self.update_balances()
+        self.update_undo_buttons()
+
+    @staticmethod
+    def _operation_rows(operation):
+        """(rows the operation takes out of the ledger, rows it puts in)."""
+        if operation[0] == "add": return [], operation[1]
+        if operation[0] == "remove": return operation[1], []
+        return [operation[1]], [operation[2]]
+
+    def _check_operations(self, operations):
+        """Returns why `operations` can't be applied to the ledger as it is now, or None if they can."""
+        try: # Archived years must be in memory
+            self._require_loaded_years(self._partition_key(trans) for operation in operations
+                                       for rows in self._operation_rows(operation) for trans in rows)
+        except ValueError as e:
+            return str(e)
+        pending = {} # str(id) -> row (None = gone) after the operations checked so far
+        for operation in operations:
+            removed, added = self._operation_rows(operation)
+            for trans in removed:
+                trans_id = str(trans.get('id'))
+                if (pending[trans_id] if trans_id in pending else self.transactions_by_id.get(trans_id)) != trans:
+                    return "the transaction has been changed or deleted since."
+                pending[trans_id] = None
+            for trans in added:
+                trans_id = str(trans.get('id'))
+                if (pending[trans_id] if trans_id in pending else self.transactions_by_id.get(trans_id)) is not None:
+                    return "a transaction with the same ID has been added since."
+                if trans.get('account') not in self.accounts:
+                    return f"account '{trans.get('account')}' no longer exists."
+                pending[trans_id] = trans
+        return None
+
+    def update_undo_buttons(self):
+        """Enables the Undo/Redo buttons and names the command each would apply."""
+        for button, stack, action in ((self.undo_button, self.undo_history.undo_stack, "Undo"),
+                                      (self.redo_button, self.undo_history.redo_stack, "Redo")):
+            if stack: button.configure(text=f"{action} {stack[-1][0]}", state=NORMAL)
+            else: button.configure(text=action, state=DISABLED)
+
+
     # --- Display Updates ---
-    def update_transaction_list(self, transactions_to_display=None):
-        """Clears and repopulates the transaction treeview with given data."""
+    @staticmethod
+    def _history_sort_key(trans):
+        """Sort key for the history view: date, then timestamp ID for same-day order."""
+        return (trans.get('date', '0'), str(trans.get('id', 0)))
+
+    def _history_row_tags(self, trans, index):
+        """Treeview tags for a row: zebra stripe, income/expense colour, transfer marker."""
+        row_tag = 'evenrow' if (index + self.stripe_shift) % 2 == 0 else 'oddrow'
+        type_tag = 'income' if trans.get('type', TRANS_EXPENSE) == TRANS_INCOME else 'expense'
+        # Transfers are linked through their shared transfer_id
+        return (row_tag, type_tag, 'transfer') if trans.get('transfer_id') else (row_tag, type_tag)
+
+    def _update_sort_headings(self):
+        """Marks the sort column's heading with the sort direction."""
+        for column, title in self.history_headings.items():
+            if column == self.sort_column:
+                title += " ▼" if self.sort_descending else " ▲"
+            self.tree.heading(column, text=title)
+
+    def sort_history_by(self, column):
+        """Sorts the history by `column`; clicking the current sort column reverses the order."""
+        if column == self.sort_column:
+            self.sort_descending = not self.sort_descending
+        else:
+            self.sort_column = column
+            self.sort_descending = column in ("date", "amount") # Newest / largest first
+        self._update_sort_headings()
+
+        view_key = (self.current_filter_key, self.ledger_version)
+        if self.displayed_key != view_key or not self.history_views.is_current(*view_key):
+            self.apply_filters() # Treeview doesn't hold the current filtered set, fill it normally
+            return
+        # Same rows, new order: reorder the existing items instead of re-creating them
+        ascending = self.history_views.rows(self.sort_column, self.displayed_rows)
+        new_rows = ascending[::-1] if self.sort_descending else ascending
+        self.tree.set_children('', *[str(trans.get('id')) for trans in new_rows])
+        self._retag_history_rows(self._restripe_history(new_rows))
+        self.displayed_rows = new_rows
+
+    def _restripe_history(self, new_rows):
+        """Rows (index, trans) of self.displayed_rows whose stripe is wrong at their index in `new_rows`.
+
+        If that's most of them (e.g. an even-length list reversed, or a row added at the top), the
+        two stripe colours are swapped instead and the rows it makes wrong are returned.
+        Rows not displayed yet are left out.
+        """
+        old_parity = {id(trans): i % 2 for i, trans in enumerate(self.displayed_rows)}
+        moved = [(i, trans, old_parity[id(trans)] != i % 2) for i, trans in enumerate(new_rows) if id(trans) in old_parity]
+        if 2 * sum(changed for _, _, changed in moved) > len(moved):
+            self.stripe_shift ^= 1
+            self.tree.tag_configure('evenrow', background=self.stripe_colors[self.stripe_shift])
+            self.tree.tag_configure('oddrow', background=self.stripe_colors[1 - self.stripe_shift])
+            return [(i, trans) for i, trans, changed in moved if not changed]
+        return [(i, trans) for i, trans, changed in moved if changed]
+
+    def _retag_history_rows(self, rows):
+        for i, trans in rows:
+            item_iid = str(trans.get('id'))
+            tags = self._history_row_tags(trans, i)
+            for iid in (item_iid, *self.tree.get_children(item_iid)): self.tree.item(iid, tags=tags)
+
+    def _patch_transaction_list(self, new_rows):
+        """Turns the treeview from self.displayed_rows into `new_rows` by deleting and inserting only the
+        rows that changed (an edit is both). Returns False, changing nothing, if the other rows aren't in
+        the same order or so much changed that refilling the treeview is cheaper."""
+        old_rows = self.displayed_rows
+        old_ids, new_ids = {id(trans) for trans in old_rows}, {id(trans) for trans in new_rows}
+        removed = [trans for trans in old_rows if id(trans) not in new_ids]
+        added = [(i, trans) for i, trans in enumerate(new_rows) if id(trans) not in old_ids]
+        if 2 * (len(removed) + len(added)) > len(new_rows):
+            return False
+        if any(a is not b for a, b in zip((t for t in old_rows if id(t) in new_ids), (t for t in new_rows if id(t) in old_ids))):
+            return False # Sorted differently
+        restripe = self._restripe_history(new_rows) # First, so added rows get the final stripes
+        for trans in removed:
+            self.tree.delete(str(trans.get('id')))
+        for i, trans in added: # In display order, so every row above is in place when one goes in
+            self._insert_history_row(trans, i, index=i)
+        self._retag_history_rows(restripe)
+        return True
+
+    def update_transaction_list(self, transactions_to_display=None, presorted=False):
+        """Fills the transaction treeview with the given data.
+
+        After a change to the displayed filter's rows, only the changed rows are deleted and
+        inserted (at their positions in the patched sort order) instead of refilling the list.
+        """
         if transactions_to_display is None:
             transactions_to_display = self.transactions # Default to all if none provided
 
-        for item in self.tree.get_children(): self.tree.delete(item)
-
-        # Sort by date (descending), then by timestamp ID for same-day order
-        sorted_transactions = sorted(transactions_to_display, key=lambda x: (x.get('date', '0'), str(x.get('id', 0))), reverse=True)
+        # Sort by the selected column; ties fall back to date, then timestamp ID
+        if presorted and self.history_views.is_current(self.current_filter_key, self.ledger_version):
+            # From get_filtered_transactions: reuse (or build once) this filter's cached sort order
+            ascending = self.history_views.rows(self.sort_column, transactions_to_display)
+            sorted_transactions = ascending[::-1] if self.sort_descending else ascending
+            view_key = (self.current_filter_key, self.ledger_version)
+        else:
+            sorted_transactions = sorted(transactions_to_display, key=HISTORY_SORT_KEYS[self.sort_column], reverse=self.sort_descending)
+            view_key = None
+        patched = (view_key is not None and self.displayed_key is not None and self.displayed_key[0] == view_key[0]
+                   and self._patch_transaction_list(sorted_transactions))
+        self.displayed_key = view_key
+        self.displayed_rows = sorted_transactions
+        if patched:
+            return
 
+        for item in self.tree.get_children(): self.tree.delete(item)
         for i, trans in enumerate(sorted_transactions):
-            amount = trans.get('amount', 0.0)
-            amount_str = f"{amount:,.2f}"
-            row_tag = 'evenrow' if i % 2 == 0 else 'oddrow'
-            trans_type = trans.get('type', TRANS_EXPENSE)
-            type_tag = 'income' if trans_type == TRANS_INCOME else 'expense'
-
-            # Get category, default if None or missing
-            category_str = trans.get('category') or (UNCATEGORIZED if trans_type == TRANS_EXPENSE else "")
-
-            # Check for transfer for optional highlighting
-            desc = trans.get('description', '')
-            is_transfer = (TRANSFER_IN_DESC.split('{}')[0] in desc or
-                           TRANSFER_OUT_DESC.split('{}')[0] in desc)
-            tags = (row_tag, type_tag)
-            if is_transfer:
-                 tags += ('transfer',) # Add transfer tag
-
-            values = (
-                trans.get('date', '[No Date]'),
-                trans.get('account', '[No Account]'),
-                desc,
-                category_str, # Added category value
-                trans_type,
-                amount_str
-            )
-            # Use the transaction's unique ID as the Treeview item ID (iid)
-            # This makes finding the transaction later for editing/deletion reliable
-            item_iid = str(trans.get('id'))
-            self.tree.insert('', tk.END, iid=item_iid, values=values, tags=tags)
+            self._insert_history_row(trans, i)
+
+    def _insert_history_row(self, trans, i, index=tk.END):
+        """Inserts a transaction (and its collapsed split rows) as row `i` of the treeview, at `index` (default: last)."""
+        amount = trans.get('amount', 0.0)
+        amount_str = f"{amount:,.2f}" + (" ✓" if trans.get('reconciled') else "")
+        trans_type = trans.get('type', TRANS_EXPENSE)
+
+        # Get category, default if None or missing
+        category_str = trans.get('category') or (UNCATEGORIZED if trans_type == TRANS_EXPENSE else "")
+
+        desc = trans.get('description', '')
+        tags = self._history_row_tags(trans, i)
+
+        values = (
+            trans.get('date', '[No Date]'),
+            trans.get('account', '[No Account]'),
+            desc,
+            category_str, # Added category value
+            trans_type,
+            amount_str
+        )
+        # Use the transaction's unique ID as the Treeview item ID (iid)
+        # This makes finding the transaction later for editing/deletion reliable
+        item_iid = str(trans.get('id'))
+        self.tree.insert('', index, iid=item_iid, values=values, tags=tags)
+        for k, (category, split_amount) in enumerate(trans.get('splits') or ()): # Collapsed breakdown
+            self.tree.insert(item_iid, tk.END, iid=f"{item_iid}{SPLIT_ROW_SEPARATOR}{k}", tags=tags,
+                             values=("", "", "", category, "", f"{split_amount:,.2f}"))
+
+    def _select_split_parents(self, event=None):
+        """Clicking a split's row selects its transaction, so edit/delete never see a split row."""
+        selection = self.tree.selection()
+        parents = [self.tree.parent(iid) or iid for iid in selection]
+        if parents != list(selection):
+            focused = self.tree.focus()
+            self.tree.selection_set(list(dict.fromkeys(parents)))
+            if focused: self.tree.focus(self.tree.parent(focused) or focused)
 
     def update_balances(self):
         """Calculates and updates all balance displays. Uses ALL transactions."""
         # IMPORTANT: Balance calculation should ALWAYS use the full transaction list,
         # regardless of filters applied to the view.
-        account_balances, total_balance = self.calculate_balances(transactions_list=self.transactions) # Pass the full list explicitly
-
+        as_of = self.balance_as_of_var.get().strip()
+        if as_of:
+            try:
+                as_of = datetime.strptime(as_of, '%Y-%m-%d').strftime('%Y-%m-%d')
+                account_balances, total_balance = self.balances_as_of(as_of) # From the nearest checkpoint
+            except ValueError:
+                messagebox.showerror("Invalid Date", f"Invalid 'as of' date: '{as_of}'. Use YYYY-MM-DD.", parent=self.window)
+                self.balance_as_of_var.set("")
+                as_of = ""
+        if not as_of:
+            account_balances, total_balance = self.calculate_balances() # Running balances of the full ledger
+        self.update_budget_remaining() # Spending may have changed too
+
+        # Accounts may hold different currencies: convert the total into the reporting currency
+        as_of_text = f" (as of {as_of})" if as_of else ""
+        try:
+            total_balance = self.convert_balances(account_balances, as_of or date.today().isoformat())
+            total_text = format_money(total_balance, self.reporting_currency)
+        except KeyError as e:
+            total_balance, total_text = 0.0, f"n/a ({e.args[0]})"
         total_balance_color = SUCCESS if total_balance >= 0 else DANGER
         self.total_balance_label.config(bootstyle=total_balance_color)
-        self.total_balance_var.set(f"Total Balance: {CURRENCY_SYMBOL}{total_balance:,.2f}")
+        self.total_balance_var.set(f"Total Balance{as_of_text}: {total_text}")
 
         for widget in self.account_balances_display_frame.winfo_children(): widget.destroy()
         self.account_balance_labels.clear()
@@ -1011,7 +5157,7 @@ class FinanceTrackerApp:
         for account_name in sorted(self.accounts): # Use the globally known accounts
             balance = account_balances.get(account_name, 0.0)
             balance_color = SUCCESS if balance >= 0 else DANGER
-            label_text = f"{account_name}: {CURRENCY_SYMBOL}{balance:,.2f}"
+            label_text = f"{account_name}: {format_money(balance, self.account_currency(account_name))}"
             label = tb.Label(self.account_balances_display_frame, text=label_text, bootstyle=balance_color)
             label.grid(row=row_num, column=col_count, padx=5, pady=2, sticky=W)
             self.account_balance_labels[account_name] = label
@@ -1022,14 +5168,36 @@ class FinanceTrackerApp:
              no_accounts_label.grid(row=0, column=0, padx=5, pady=2, sticky=W)
 
 
-    def calculate_balances(self, transactions_list=None):
-        """Calculates balances based on a specific list of transactions."""
-        if transactions_list is None:
-             transactions_list = self.transactions # Default to the main list
+    def show_current_balances(self):
+        """Clears the 'as of' date and shows current balances."""
+        self.balance_as_of_var.set("")
+        self.update_balances()
 
+    def calculate_balances(self, transactions_list=None, include_unloaded=True):
+        """Calculates balances based on a specific list of transactions.
+
+        Without a list, the incrementally maintained running balances of the whole ledger are
+        used. For an explicit list, archived years that aren't loaded are added from their
+        manifest totals unless include_unloaded is False.
+        """
         account_balances = defaultdict(float); total_balance = 0.0
         valid_accounts_set = set(self.accounts) # Use the globally known accounts
 
+        if transactions_list is None:
+            for account, amount in self.running_balances.items():
+                if account in valid_accounts_set:
+                    account_balances[account] += amount
+                    total_balance += amount
+            for acc in self.accounts:
+                account_balances[acc] += 0.0 # Ensure all known accounts have an entry
+            return account_balances, total_balance
+
+        if include_unloaded:
+            for account, amount in self._unloaded_partition_balances().items():
+                if account in valid_accounts_set:
+                    account_balances[account] += amount
+                    total_balance += amount
+
         for trans in transactions_list:
             account = trans.get('account'); amount = trans.get('amount', 0.0)
             trans_type = trans.get('type')
@@ -1054,122 +5222,1830 @@ class FinanceTrackerApp:
 
         return account_balances, total_balance
 
+    # --- Balance Checkpoints ---
+    # Per-account running balances are kept up to date on every change. Checkpoints hold the
+    # cumulative balances at each month end. Both are saved in the manifest with a row count
+    # and an order-independent checksum of the transactions they cover. On startup the saved
+    # head is shown right away and checked against the data in the background.
+
+    @staticmethod
+    def _balance_effect(trans):
+        """Returns (account, signed amount) for how a transaction moves its account's balance."""
+        trans_type = trans.get('type')
+        amount = trans.get('amount', 0.0)
+        if trans_type == TRANS_INCOME: return trans.get('account'), amount
+        if trans_type == TRANS_EXPENSE: return trans.get('account'), -amount
+        return trans.get('account'), 0.0
+
+    def _reset_balance_state(self):
+        self.running_balances = defaultdict(float) # account -> net of the whole ledger (all partitions)
+        self.ledger_count = 0
+        self.ledger_checksum = 0
+        self.checkpoint_months = []  # Sorted 'YYYY-MM' keys of self.checkpoints, contiguous
+        self.checkpoints = {}        # month -> {"balances", "count", "checksum"} through that month's end
+
+    def _balances_after_replacing(self, old_transactions, new_transactions):
+        """Running balances as they would be if `old_transactions` were replaced by `new_transactions`."""
+        account_balances, _ = self.calculate_balances()
+        for sign, transactions in ((-1, old_transactions), (1, new_transactions)):
+            for trans in transactions:
+                account, amount = self._balance_effect(trans)
+                account_balances[account] += sign * amount
+        return account_balances
+
+    def _apply_balance_delta(self, trans, sign):
+        """Adds (sign=1) or removes (sign=-1) a transaction from the running balances and checkpoints."""
+        account, amount = self._balance_effect(trans)
+        checksum = transaction_checksum(trans)
+        self.running_balances[account] += sign * amount
+        self.ledger_count += sign
+        self.ledger_checksum = (self.ledger_checksum + sign * checksum) % CHECKSUM_MODULUS
+
+        month = month_key(trans.get('date'))
+        if month is None:
+            return # Unparseable date: only the head can account for it
+        self._ensure_checkpoint_month(month)
+        for checkpoint_month in self.checkpoint_months[bisect_left(self.checkpoint_months, month):]:
+            checkpoint = self.checkpoints[checkpoint_month]
+            checkpoint["balances"][account] += sign * amount
+            checkpoint["count"] += sign
+            checkpoint["checksum"] = (checkpoint["checksum"] + sign * checksum) % CHECKSUM_MODULUS
+
+    def _ensure_checkpoint_month(self, month):
+        """Extends the contiguous checkpoint range so that it includes `month`."""
+        if not self.checkpoint_months:
+            self.checkpoint_months = [month]
+            self.checkpoints[month] = {"balances": defaultdict(float), "count": 0, "checksum": 0}
+            return
+        while month < self.checkpoint_months[0]: # Nothing happened before the first month yet
+            earlier = previous_month(self.checkpoint_months[0])
+            self.checkpoint_months.insert(0, earlier)
+            self.checkpoints[earlier] = {"balances": defaultdict(float), "count": 0, "checksum": 0}
+        while month > self.checkpoint_months[-1]: # Later months start from the last month's totals
+            last = self.checkpoints[self.checkpoint_months[-1]]
+            later = next_month(self.checkpoint_months[-1])
+            self.checkpoint_months.append(later)
+            self.checkpoints[later] = {"balances": defaultdict(float, last["balances"]),
+                                       "count": last["count"], "checksum": last["checksum"]}
+
+    def _rebuild_balance_checkpoints(self):
+        """Recomputes running balances and checkpoints with one sweep over the whole ledger.
+
+        Archived years that aren't loaded are read once for the sweep but not kept in memory.
+        """
+        self._reset_balance_state()
+        month_deltas = {}
+        partition_checksums = defaultdict(int)
+
+        def sweep(rows):
+            for trans in rows:
+                account, amount = self._balance_effect(trans)
+                checksum = transaction_checksum(trans)
+                self.running_balances[account] += amount
+                self.ledger_count += 1
+                self.ledger_checksum = (self.ledger_checksum + checksum) % CHECKSUM_MODULUS
+                year = self._partition_key(trans)
+                partition_checksums[year] = (partition_checksums[year] + checksum) % CHECKSUM_MODULUS
+                month = month_key(trans.get('date'))
+                if month is not None:
+                    delta = month_deltas.setdefault(month, [defaultdict(float), 0, 0])
+                    delta[0][account] += amount
+                    delta[1] += 1
+                    delta[2] = (delta[2] + checksum) % CHECKSUM_MODULUS
+
+        sweep(self.transactions)
+        for year, entry in sorted(self.partitions.items()):
+            if year in self.loaded_partitions:
+                continue
+            rows = self._read_partition(year)
+            if rows is not None:
+                sweep(rows)
+            else: # Unreadable: only its manifest totals are known, and not by month
+                for account, amount in entry.get("balances", {}).items():
+                    self.running_balances[account] += amount
+                self.ledger_count += entry.get("count", 0)
+                partition_checksums.pop(year, None)
+
+        if month_deltas:
+            balances, count, checksum = defaultdict(float), 0, 0
+            month, last_month = min(month_deltas), max(month_deltas)
+            while month <= last_month:
+                if month in month_deltas:
+                    delta_balances, delta_count, delta_checksum = month_deltas[month]
+                    for account, amount in delta_balances.items(): balances[account] += amount
+                    count += delta_count
+                    checksum = (checksum + delta_checksum) % CHECKSUM_MODULUS
+                self.checkpoint_months.append(month)
+                self.checkpoints[month] = {"balances": defaultdict(float, balances), "count": count, "checksum": checksum}
+                month = next_month(month)
+        # Partitions written before checksums existed get one in the manifest on the next save
+        for year, entry in self.partitions.items():
+            if year in partition_checksums and year not in self.dirty_partitions:
+                entry["checksum"] = partition_checksums[year]
+
+    def _load_balance_checkpoints(self, checkpoint_data):
+        """Restores running balances and checkpoints from the manifest. Returns False if unusable."""
+        self._reset_balance_state()
+        try:
+            head = checkpoint_data["head"]
+            self.running_balances = defaultdict(float, head["balances"])
+            self.ledger_count = int(head["count"])
+            self.ledger_checksum = int(head["checksum"])
+            for month in sorted(checkpoint_data.get("monthly", {})):
+                entry = checkpoint_data["monthly"][month]
+                self.checkpoints[month] = {"balances": defaultdict(float, entry["balances"]),
+                                           "count": int(entry["count"]), "checksum": int(entry["checksum"])}
+                self.checkpoint_months.append(month)
+            return True
+        except (TypeError, KeyError, ValueError, AttributeError):
+            self._reset_balance_state()
+            return False
+
+    def _balance_checkpoints_for_save(self):
+        """The checkpoint section of the manifest."""
+        def as_entry(balances, count, checksum):
+            return {"balances": {account: amount for account, amount in balances.items() if account is not None},
+                    "count": count, "checksum": checksum}
+        return {
+            "head": as_entry(self.running_balances, self.ledger_count, self.ledger_checksum),
+            "monthly": {month: as_entry(**self.checkpoints[month]) for month in self.checkpoint_months},
+        }
 
-    # --- Data Persistence ---
-    def load_data(self):
-        """Loads accounts, categories, and transactions from the JSON data file."""
-        if os.path.exists(FINANCE_DATA_FILE):
+    def balances_as_of(self, as_of_date):
+        """Per-account balances at the end of `as_of_date` (ISO string), starting from the nearest checkpoint.
+
+        Only the transactions of the as-of month are looked at, never the whole history. Future
+        dates include the recurring transactions due by then.
+        """
+        month = month_key(as_of_date)
+        if month is None:
+            raise ValueError(f"Invalid date: '{as_of_date}'. Use YYYY-MM-DD.")
+        balances = defaultdict(float)
+        if self.checkpoint_months and month > self.checkpoint_months[-1]:
+            balances.update(self.checkpoints[self.checkpoint_months[-1]]["balances"]) # Nothing newer exists
+        else:
+            position = bisect_left(self.checkpoint_months, month)
+            if position > 0: # Checkpoint at the end of the previous month
+                balances.update(self.checkpoints[self.checkpoint_months[position - 1]]["balances"])
+            year = month[:4]
+            month_start = f"{month}-01"
+            if self._mapped_archives_between(date.fromisoformat(month_start), date.fromisoformat(month_start)):
+                # Archived year kept on disk: sum straight from the mapped file
+                with MappedLedger(self._partition_path(year)) as ledger:
+                    for account, amount in ledger.balance_sums(month_start, as_of_date).items():
+                        balances[account] += amount
+            else:
+                self._load_partition(year)
+                for trans in self.rows_by_month.get(month, ()):
+                    if trans.get('date', '') <= as_of_date:
+                        account, amount = self._balance_effect(trans)
+                        balances[account] += amount
+        for trans in self.projected_transactions(as_of_date): # Recurring occurrences not added yet
+            account, amount = self._balance_effect(trans)
+            balances[account] += amount
+
+        valid_accounts_set = set(self.accounts)
+        account_balances = defaultdict(float, {account: amount for account, amount in balances.items() if account in valid_accounts_set})
+        for acc in self.accounts:
+            account_balances[acc] += 0.0
+        return account_balances, sum(account_balances.values())
+
+    def _start_balance_verification(self):
+        """Starts re-checking the saved head checkpoint against the data, a chunk at a time when idle."""
+        unloaded_balances = self._unloaded_partition_balances()
+        unloaded = [entry for year, entry in self.partitions.items() if year not in self.loaded_partitions]
+        self._verification = {
+            "version": self.ledger_version,
+            "rows": list(self.transactions), # Snapshot, so edits during the check can be detected
+            "position": 0,
+            "balances": defaultdict(float, unloaded_balances),
+            "count": sum(entry.get("count", 0) for entry in unloaded),
+            "checksum": sum(entry.get("checksum", 0) for entry in unloaded) % CHECKSUM_MODULUS,
+            "checksum_known": all("checksum" in entry for entry in unloaded),
+        }
+        if self.window is None:
+            while self._verification is not None:
+                self._verify_balances_step()
+        else:
+            self.window.after_idle(self._verify_balances_step, self._verification)
+
+    def _verify_balances_step(self, state=None):
+        """Checks the next chunk. Steps scheduled for a check that was replaced (or whose ledger was switched away) stop."""
+        if state is None:
+            state = self._verification
+        if state is None or state is not self._verification:
+            return
+        if state["version"] != self.ledger_version:
+            self._start_balance_verification() # Ledger changed underneath us, start over
+            return
+        rows = state["rows"]
+        end = min(state["position"] + BALANCE_VERIFY_CHUNK, len(rows))
+        for trans in rows[state["position"]:end]:
+            account, amount = self._balance_effect(trans)
+            state["balances"][account] += amount
+            state["count"] += 1
+            state["checksum"] = (state["checksum"] + transaction_checksum(trans)) % CHECKSUM_MODULUS
+        state["position"] = end
+        if end < len(rows):
+            if self.window is not None:
+                self.window.after(1, self._verify_balances_step, state) # Let the UI breathe between chunks
+            return
+
+        self._verification = None
+        accounts = set(state["balances"]) | set(self.running_balances)
+        balances_match = all(abs(state["balances"].get(a, 0.0) - self.running_balances.get(a, 0.0)) < 0.005 for a in accounts)
+        checksum_match = not state["checksum_known"] or (
+            state["count"] == self.ledger_count and state["checksum"] == self.ledger_checksum)
+        if not (balances_match and checksum_match):
+            print("Warning: Saved balance checkpoints don't match the transactions. Recalculating.")
+            self._rebuild_balance_checkpoints()
+            if self.window is not None: self.update_balances()
+
+
+    # --- Currencies ---
+    # Amounts are stored in their account's currency. Totals and reports are converted into
+    # the reporting currency with the rate of each transaction's date (per-account balances
+    # with the rate of the balance date), grouped so each (currency, date) is looked up once.
+
+    def account_currency(self, account):
+        return self.account_currencies.get(account, BASE_CURRENCY)
+
+    def _amount_in_base(self, trans):
+        """A transaction's amount in BASE_CURRENCY (unconverted if there is no rate for its currency)."""
+        amount = trans.get('amount', 0.0)
+        currency = self.account_currency(trans.get('account'))
+        if currency == BASE_CURRENCY:
+            return amount
+        try:
+            return amount * self.fx_rates.rate(currency, trans.get('date', ''))
+        except KeyError:
+            return amount
+
+    def convert_balances(self, account_balances, on_date):
+        """Total of per-account balances in the reporting currency, at the rates of `on_date` (ISO)."""
+        groups = defaultdict(dict)
+        for account, balance in account_balances.items():
+            currency = self.account_currency(account)
+            groups[currency][on_date] = groups[currency].get(on_date, 0.0) + balance
+        return self.fx_rates.convert_groups(groups, self.reporting_currency)
+
+    def change_reporting_currency(self, event=None):
+        self.reporting_currency = self.reporting_currency_var.get() or BASE_CURRENCY
+        self.update_balances()
+        self.update_report_summary(self.get_filtered_transactions(), cache_key=self.current_filter_key)
+        self.refresh_charts()
+
+    def update_currency_choices(self):
+        """Refreshes the currency lists (account currencies plus those with exchange rates)."""
+        currencies = sorted(self.fx_rates.currencies() | set(self.account_currencies.values()))
+        self.reporting_currency_combo['values'] = currencies
+        self.new_account_currency_combo['values'] = currencies
+
+    def import_fx_rates(self):
+        """Imports exchange rates from a CSV file into the local rate table."""
+        path = filedialog.askopenfilename(parent=self.window, title="Import Exchange Rates",
+                                          filetypes=[("CSV files", "*.csv"), ("All files", "*.*")])
+        if not path:
+            return
+        try:
+            count = self.fx_rates.import_csv(path)
+            self.fx_rates.save(FX_RATES_FILE)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Import Error", f"Could not import exchange rates:\n{e}", parent=self.window)
+            return
+        # Budget spending is kept in BASE_CURRENCY, so it depends on the rates
+        self.category_spend = defaultdict(float)
+        for trans in self.transactions:
+            for budget_key, amount in self._budget_amounts(trans): # Per split, as in the index funnel
+                self.category_spend[budget_key] += amount
+        self.chart_cache = self.net_worth_cache = None # Same ledger version, new rates
+        self.refresh_charts()
+        self.update_currency_choices()
+        self.update_balances()
+        self.update_report_summary(self.get_filtered_transactions(), cache_key=self.current_filter_key)
+        messagebox.showinfo("Success", f"Imported {count} exchange rate(s).", parent=self.window)
+
+
+    # --- Charts ---
+    # The index funnel keeps per-day totals (self.chart_days) keyed by (kind, name, currency):
+    # ("balance", account, cur) for balance changes, (TRANS_INCOME, None, cur) and
+    # (TRANS_EXPENSE, category, cur) for income and spending other than transfers and opening
+    # balances. Unloaded years are read once and their day totals kept until their file
+    # changes. Chart series are built from the day totals, not the transactions.
+
+    def _add_chart_effects(self, chart_days, trans, sign):
+        """Adds (sign=1) or removes (sign=-1) a transaction from per-day chart totals."""
+        day = str(trans.get('date', ''))[:10]
+        if month_key(day) is None:
+            return
+        totals = chart_days.get(day)
+        if totals is None:
+            totals = chart_days[day] = defaultdict(float)
+        account, amount = self._balance_effect(trans)
+        currency = self.account_currency(account)
+        totals[("balance", account, currency)] += sign * amount
+        if not trans.get('transfer_id') and not trans.get('opening_balance'):
+            trans_type = trans.get('type')
+            if trans_type == TRANS_INCOME:
+                totals[(TRANS_INCOME, None, currency)] += sign * trans.get('amount', 0.0)
+            elif trans_type == TRANS_EXPENSE:
+                for category, amount in category_amounts(trans):
+                    totals[(TRANS_EXPENSE, category, currency)] += sign * amount
+
+    def _archived_chart_days(self, year):
+        """Per-day chart totals of a year that isn't loaded, read once and reused until its file changes."""
+        entry = self.partitions[year]
+        signature = (entry.get("file"), entry.get("count"), entry.get("checksum"), entry.get("last_date"))
+        cached = self.archived_chart_days.get(year)
+        if cached and cached[0] == signature:
+            return cached[1]
+        chart_days = {}
+        rows = self._read_partition(year)
+        if rows is not None:
+            for trans in rows:
+                self._add_chart_effects(chart_days, trans, 1)
+        else: # Unreadable: its manifest balances still count, as one change on its last date
+            totals = chart_days[entry.get("last_date") or f"{year}-12-31"] = defaultdict(float)
+            for account, amount in entry.get("balances", {}).items():
+                totals[("balance", account, self.account_currency(account))] += amount
+        self.archived_chart_days[year] = (signature, chart_days)
+        return chart_days
+
+    def chart_series(self):
+        """Chart data in the reporting currency, cached until the ledger or the currency changes.
+
+        Returns a dict with "balances" ({account: [(date ordinal, balance)]}, one point per day
+        the balance changed), "months" (every 'YYYY-MM' from the first to the last transaction),
+        "income"/"expense" (totals per month) and "categories" ({category: totals per month}).
+        """
+        cache_key = (self.ledger_version, self.reporting_currency)
+        if self.chart_cache and self.chart_cache[0] == cache_key:
+            return self.chart_cache[1]
+
+        sources = [self.chart_days] + [self._archived_chart_days(year) for year in sorted(self.partitions)
+                                       if year not in self.loaded_partitions]
+        days = sorted({day for chart_days in sources for day in chart_days})
+        convert, target = self.fx_rates.convert, self.reporting_currency
+        valid_accounts = set(self.accounts)
+        balances = defaultdict(float)
+        balance_points = defaultdict(list)
+        income, expense = defaultdict(float), defaultdict(float)
+        by_category = defaultdict(lambda: defaultdict(float))
+        missing_rates = set()
+        for day in days:
+            try:
+                ordinal = date.fromisoformat(day).toordinal()
+            except ValueError:
+                continue
+            month = day[:7]
+            changed_accounts = {}
+            for chart_days in sources:
+                for (kind, name, currency), amount in chart_days.get(day, {}).items():
+                    if not amount:
+                        continue
+                    if kind == "balance":
+                        if name in valid_accounts:
+                            balances[name] += amount
+                            changed_accounts[name] = currency
+                        continue
+                    try:
+                        amount = convert(amount, currency, target, day)
+                    except KeyError:
+                        missing_rates.add(currency)
+                        continue
+                    if kind == TRANS_INCOME:
+                        income[month] += amount
+                    else:
+                        expense[month] += amount
+                        by_category[name][month] += amount
+            for account, currency in changed_accounts.items():
+                try: # Balances are converted at each day's rate
+                    balance = convert(balances[account], currency, target, day)
+                except KeyError:
+                    missing_rates.add(currency)
+                    continue
+                balance_points[account].append((ordinal, balance))
+
+        months = []
+        if days and month_key(days[0]) and month_key(days[-1]):
+            month = days[0][:7]
+            while month <= days[-1][:7]:
+                months.append(month)
+                month = next_month(month)
+        last_ordinal = max((points[-1][0] for points in balance_points.values()), default=None)
+        for account, points in balance_points.items():
+            if points[-1][0] < last_ordinal:
+                points.append((last_ordinal, points[-1][1])) # Flat until the end of the chart
+        ranked = sorted(by_category, key=lambda category: -sum(by_category[category].values()))
+        categories = {category: [by_category[category].get(month, 0.0) for month in months]
+                      for category in ranked[:CHART_MAX_CATEGORIES]}
+        if len(ranked) > CHART_MAX_CATEGORIES:
+            categories["Other"] = [sum(by_category[category].get(month, 0.0) for category in ranked[CHART_MAX_CATEGORIES:])
+                                   for month in months]
+
+        series = {"currency": target, "balances": dict(sorted(balance_points.items())), "months": months,
+                  "income": [income.get(month, 0.0) for month in months],
+                  "expense": [expense.get(month, 0.0) for month in months],
+                  "categories": categories, "missing_rates": sorted(missing_rates)}
+        self.chart_cache = (cache_key, series)
+        return series
+
+    def net_worth_history(self, start, end, step="Monthly"):
+        """Per-account and total balances at every `step` end from `start` to `end` (ISO dates).
+
+        The balances before `start` come from the nearest checkpoint (balances_as_of); then the
+        range's transactions are sorted by date and walked once, taking a snapshot at each
+        sample date. Like calculate_balances, deleted or unknown accounts are left out.
+        Returns a dict with "dates", "balances" ({account: [balance in its currency]}),
+        "converted" ({account: [(date ordinal, balance in the reporting currency)]}) and
+        "total" (in the reporting currency, without accounts that had no exchange rate).
+        """
+        try:
+            first, last = date.fromisoformat(start), date.fromisoformat(end)
+        except ValueError:
+            raise ValueError("Use YYYY-MM-DD dates.")
+        if first > last:
+            raise ValueError("The start date is after the end date.")
+        before = first - timedelta(days=1)
+        mapped_years = self._mapped_archives_between(before, last) # Summed in place, see below
+        self._ensure_partitions_loaded(before, last, skip=mapped_years) # Loading archived years bumps the ledger version
+        cache_key = (self.ledger_version, self.reporting_currency, start, end, step)
+        if self.net_worth_cache and self.net_worth_cache[0] == cache_key:
+            return self.net_worth_cache[1]
+
+        samples = [day.isoformat() for day in sample_dates(first, last, step)]
+        opening, _ = self.balances_as_of(before.isoformat())
+        # Archived memory-mapped years: per-sample sums read from the records, no rows built
+        mapped_sums = [defaultdict(float) for _ in samples]
+        if mapped_years:
+            with LedgerLock(self.data_file, exclusive=False):
+                for year in mapped_years:
+                    with MappedLedger(self._partition_path(year)) as ledger:
+                        for sums, year_sums in zip(mapped_sums, ledger.balance_sums_through(samples, start)):
+                            for account, amount in year_sums.items(): sums[account] += amount
+        rows = [trans for trans in self._rows_between(first, last) if start <= trans.get('date', '') <= end]
+        rows += [trans for trans in self.projected_transactions(end) if trans['date'] >= start] # Recurring, not added yet
+        rows.sort(key=lambda trans: trans['date'])
+
+        valid_accounts = set(self.accounts)
+        running = defaultdict(float, opening)
+        history = {account: [] for account in self.accounts}
+        position = 0
+        for sample, sums in zip(samples, mapped_sums): # One pass: apply everything up to each sample date, then snapshot
+            while position < len(rows) and rows[position]['date'] <= sample:
+                account, amount = self._balance_effect(rows[position])
+                if account in valid_accounts: running[account] += amount
+                position += 1
+            for account, amount in sums.items():
+                if account in valid_accounts: running[account] += amount
+            for account in self.accounts:
+                history[account].append(running[account])
+
+        convert, target = self.fx_rates.convert, self.reporting_currency
+        converted, totals, missing_rates = {}, [0.0] * len(samples), set()
+        for account, balances in history.items():
+            currency = self.account_currency(account)
+            points = []
+            for index, (sample, balance) in enumerate(zip(samples, balances)):
+                try:
+                    value = convert(balance, currency, target, sample)
+                except KeyError:
+                    missing_rates.add(currency)
+                    continue
+                points.append((date.fromisoformat(sample).toordinal(), value))
+                totals[index] += value
+            converted[account] = points
+        series = {"currency": target, "dates": samples, "balances": history, "converted": converted,
+                  "total": totals, "missing_rates": sorted(missing_rates)}
+        self.net_worth_cache = (cache_key, series)
+        return series
+
+    def export_net_worth(self, path, series):
+        """Writes a net worth history (see net_worth_history) as CSV: date, one column per account, total."""
+        accounts = list(series["balances"])
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["Date"] + [f"{account} ({self.account_currency(account)})" for account in accounts]
+                            + [f"Total ({series['currency']})"])
+            for index, day in enumerate(series["dates"]):
+                writer.writerow([day] + [f"{series['balances'][account][index]:.2f}" for account in accounts]
+                                + [f"{series['total'][index]:.2f}"])
+
+    def open_charts(self):
+        if self.charts_window is not None and self.charts_window.winfo_exists():
+            self.charts_window.lift()
+            return
+        self.charts_window = ChartsWindow(self)
+
+    def refresh_charts(self):
+        """Schedules a redraw of the open charts (they don't redraw while nothing changed)."""
+        if self.charts_window is not None:
+            self.charts_window.schedule_redraw()
+
+
+    # --- Budgets ---
+    # Monthly expense per (month, category) is kept in self.category_spend and updated by the
+    # index funnel, so a budget check is a dict lookup. It covers loaded years, which always
+    # include the current ones; changing an archived year loads it first. Budgets and
+    # spending are in BASE_CURRENCY.
+
+    @staticmethod
+    def _budget_key(trans):
+        """(month, category) a transaction counts towards, or None (income, transfers, opening balances, bad dates)."""
+        if trans.get('type') != TRANS_EXPENSE or trans.get('transfer_id') or trans.get('opening_balance'):
+            return None
+        month = month_key(trans.get('date'))
+        return (month, trans.get('category') or UNCATEGORIZED) if month else None
+
+    def _budget_amounts(self, trans):
+        """[((month, category), amount in BASE_CURRENCY)] a transaction adds to budgets: one per split."""
+        budget_key = self._budget_key(trans)
+        if not budget_key:
+            return []
+        base_amount = self._amount_in_base(trans)
+        if 'splits' not in trans:
+            return [(budget_key, base_amount)]
+        rate = base_amount / trans['amount'] if trans.get('amount') else 0.0
+        return [((budget_key[0], category), amount * rate) for category, amount in category_amounts(trans)]
+
+    def budget_for(self, month, category):
+        """The budget for a category in a month ('YYYY-MM'), or None if it has none."""
+        return self.budget_overrides.get(month, {}).get(category, self.budgets.get(category))
+
+    def budget_overrun(self, month, category, extra_amount):
+        """(spending, budget) if spending `extra_amount` (in BASE_CURRENCY) more would exceed the budget, else None."""
+        budget = self.budget_for(month, category)
+        if budget is None or extra_amount <= 0:
+            return None
+        spent = self.category_spend.get((month, category), 0.0) + extra_amount
+        return (spent, budget) if spent > budget else None
+
+    def confirm_within_budget(self, month, category, extra_amount):
+        """Asks for confirmation if spending `extra_amount` (in BASE_CURRENCY) more would exceed the budget. Returns True to go ahead."""
+        overrun = self.budget_overrun(month, category, extra_amount)
+        if overrun is None:
+            return True
+        spent, budget = overrun
+        return messagebox.askyesno(
+            "Over Budget",
+            f"This brings '{category}' spending for {month} to {CURRENCY_SYMBOL}{spent:,.2f}, over its budget of {CURRENCY_SYMBOL}{budget:,.2f}.\n\nDo you want to continue anyway?",
+            icon='warning', parent=self.window)
+
+    def confirm_batch_within_budget(self, old_rows, new_rows):
+        """Like confirm_within_budget for replacing `old_rows` by `new_rows`, with a single question for all months and categories."""
+        extra = defaultdict(float)
+        for sign, rows in ((-1, old_rows), (1, new_rows)):
+            for trans in rows:
+                for budget_key, amount in self._budget_amounts(trans):
+                    extra[budget_key] += sign * amount
+        over_budget = []
+        for (month, category), amount in sorted(extra.items()):
+            budget = self.budget_for(month, category)
+            spent = self.category_spend.get((month, category), 0.0) + amount
+            if budget is not None and amount > 0.005 and spent > budget:
+                over_budget.append(f"  {category}, {month}: {CURRENCY_SYMBOL}{spent:,.2f} of {CURRENCY_SYMBOL}{budget:,.2f}")
+        if not over_budget:
+            return True
+        if len(over_budget) > 10:
+            over_budget = over_budget[:10] + [f"  ...and {len(over_budget) - 10} more"]
+        return messagebox.askyesno(
+            "Over Budget", "These changes go over budget for:\n" + "\n".join(over_budget) + "\n\nDo you want to continue anyway?",
+            icon='warning', parent=self.window)
+
+    def update_budget_remaining(self, *args):
+        """Shows what's left of the selected category's budget for the entry date's month."""
+        month = month_key(self.date_var.get())
+        category = self.transaction_category_var.get() or UNCATEGORIZED
+        budget = self.budget_for(month, category) if month else None
+        if budget is None or self.type_var.get() != TRANS_EXPENSE:
+            self.budget_remaining_var.set("")
+            return
+        remaining = budget - self.category_spend.get((month, category), 0.0)
+        self.budget_remaining_var.set(f"{CURRENCY_SYMBOL}{remaining:,.2f} left")
+        self.budget_remaining_label.config(bootstyle=SUCCESS if remaining >= 0 else DANGER)
+
+    def open_budget_manager(self):
+        """Opens the dialog to set monthly category budgets."""
+        dialog = BudgetDialog(self.window, "Monthly Budgets", self.categories, self.budgets, self.budget_overrides,
+                              lambda month, category: self.category_spend.get((month, category), 0.0))
+        if dialog.result:
+            self.budgets, self.budget_overrides = dialog.result
+            self.update_budget_remaining()
+            self.save_data()
+
+
+    # --- Categorization Rules ---
+    # Rules fill in the category of expenses entered as Uncategorized and can be re-applied
+    # to the whole history. See CategoryRules for how they are matched.
+
+    def _rule_replacements(self, rows, only_uncategorized=True):
+        """(old, new) pairs for the expenses in `rows` whose category the rules would change."""
+        category_for = self.category_rules.category_for
+        replacements = []
+        for trans in rows:
+            if trans.get('type') != TRANS_EXPENSE or trans.get('transfer_id') or trans.get('opening_balance') or trans.get('splits'):
+                continue # Split expenses have their categories chosen per split
+            if only_uncategorized and (trans.get('category') or UNCATEGORIZED) != UNCATEGORIZED:
+                continue
+            category = category_for(trans)
+            if category and category != trans.get('category') and category in self.categories:
+                replacements.append((trans, dict(trans, category=category)))
+        return replacements
+
+    def open_rules_manager(self):
+        """Opens the dialog to edit the categorization rules."""
+        dialog = CategoryRulesDialog(self.window, "Category Rules", self.category_rules.rules, self.accounts, self.categories)
+        if dialog.result is not None:
+            kept_ids = {rule.get("id") for rule in dialog.result}
+            self.removed_rule_ids.update(rule.get("id") for rule in self.category_rules.rules if rule.get("id") not in kept_ids)
+            self.category_rules = CategoryRules(dialog.result)
+            self.save_data()
+
+    def apply_rules_to_history(self):
+        """Re-categorizes past expenses with the rules, as one undoable change."""
+        if not self.category_rules.rules:
+            messagebox.showinfo("Apply Rules", "There are no category rules yet. Add some under \"Category Rules\".", parent=self.window)
+            return
+        answer = messagebox.askyesnocancel(
+            "Apply Rules to History",
+            "Re-categorize past expenses using the rules?\n\nYes: every expense a rule matches\nNo: only Uncategorized expenses",
+            parent=self.window)
+        if answer is None:
+            return
+        self._ensure_partitions_loaded() # The whole history, archived years included
+        replacements = self._rule_replacements(self.transactions, only_uncategorized=not answer)
+        if not replacements:
+            messagebox.showinfo("Apply Rules", "No expenses needed a new category.", parent=self.window)
+            return
+        with self.undo_history.command(f"Apply Rules to {len(replacements)}"):
+            self._replace_transactions(replacements)
+        self.apply_filters()
+        self.update_balances()
+        self.update_undo_buttons()
+        messagebox.showinfo("Apply Rules", f"{len(replacements)} expense(s) re-categorized.", parent=self.window)
+
+
+    # --- Statement Reconciliation ---
+    # Ledger rows matched to a bank statement line get a stored 'reconciled' flag (shown as ✓).
+    # Edits that change a reconciled row's date, account, type or amount clear the flag.
+
+    def _account_rows_between(self, account, start, end):
+        """Ledger rows of `account` dated start..end (ISO strings), loading archived years as needed."""
+        self._ensure_partitions_loaded(date.fromisoformat(start), date.fromisoformat(end))
+        rows, month, last_month = [], month_key(start), month_key(end)
+        while month <= last_month:
+            rows.extend(trans for trans in self.rows_by_month.get(month, ())
+                        if trans.get('account') == account and start <= trans.get('date', '') <= end)
+            month = next_month(month)
+        return rows
+
+    @staticmethod
+    def _unreconciled_if_changed(old_trans, new_trans):
+        """`new_trans` without its reconciled flag if the edit changed what the bank would show."""
+        if new_trans.get('reconciled') and transaction_checksum(old_trans) != transaction_checksum(new_trans):
+            new_trans = {key: value for key, value in new_trans.items() if key != 'reconciled'}
+        return new_trans
+
+    def reconcile_statement(self):
+        """Matches a bank statement against one account and marks the matched transactions reconciled."""
+        if not self.accounts:
+            messagebox.showwarning("Reconcile", "Add an account first.", parent=self.window)
+            return
+        dialog = ReconcileDialog(self.window, "Reconcile Statement", self.accounts, self.filter_account_var.get())
+        if not dialog.result:
+            return
+        account, lines, start, end = (dialog.result[key] for key in ("account", "lines", "start", "end"))
+        tolerance = dialog.result["tolerance"]
+        currency = self.account_currency(account)
+
+        # Ledger rows just outside the range can still match statement lines inside it
+        padding = timedelta(days=tolerance)
+        rows = self._account_rows_between(account, (date.fromisoformat(start) - padding).isoformat(),
+                                          (date.fromisoformat(end) + padding).isoformat())
+        lines = [line for line in lines if start <= line["date"] <= end]
+        try:
+            matches, ledger_only, statement_only = reconcile_statement(
+                [(self._balance_effect(trans)[1], trans['date']) for trans in rows],
+                [(line["amount"], line["date"]) for line in lines], tolerance)
+        except ValueError as e: # A ledger date that isn't YYYY-MM-DD
+            messagebox.showerror("Reconcile", f"Could not reconcile {account}: {e}", parent=self.window)
+            return
+        to_mark = [rows[i] for i, _ in matches if not rows[i].get('reconciled')]
+
+        # Balance comparison at the end of the range
+        closing_balance = dialog.result["closing_balance"]
+        if closing_balance is None:
+            with_balance = [line for line in lines if line["balance"] is not None]
+            if with_balance: closing_balance = max(with_balance, key=lambda line: line["date"])["balance"]
+        ledger_balance = self.balances_as_of(end)[0].get(account, 0.0)
+        summary = [f"{account}, {start} to {end} (dates within {tolerance} day(s))",
+                   f"Matched {len(matches)} of {len(lines)} statement line(s); {len(to_mark)} not yet reconciled.",
+                   f"Ledger balance on {end}: {format_money(ledger_balance, currency)}"]
+        if closing_balance is None:
+            summary.append("Statement balance: not given")
+        else:
+            summary.append(f"Statement balance: {format_money(closing_balance, currency)}"
+                           f"   (difference {format_money(closing_balance - ledger_balance, currency)})")
+
+        ledger_only = [rows[i] for i in ledger_only if start <= rows[i]['date'] <= end]
+        result = ReconcileResultDialog(
+            self.window, "Reconciliation", "\n".join(summary),
+            [f"{trans['date']}   {format_money(self._balance_effect(trans)[1], currency):>14}   {trans.get('description', '')}"
+             for trans in sorted(ledger_only, key=lambda trans: trans['date'])],
+            [f"{line['date']}   {format_money(line['amount'], currency):>14}   {line['description']}"
+             for line in sorted((lines[j] for j in statement_only), key=lambda line: line["date"])],
+            len(to_mark))
+        if not result.result:
+            return
+        with self.undo_history.command(f"Reconcile {len(to_mark)}"):
+            self._replace_transactions([(trans, dict(trans, reconciled=True)) for trans in to_mark])
+        self.apply_filters()
+        self.update_balances()
+        self.update_undo_buttons()
+
+
+    # --- Recurring Schedules ---
+    # Schedules live in the manifest. Occurrences up to today are added to the ledger in one
+    # batch (at startup and when the date changes); later ones stay virtual and only show up
+    # in projections such as balances as of a future date.
+
+    @staticmethod
+    def _schedule_transaction(schedule, occurrence_date):
+        """The transaction a schedule creates on `occurrence_date`. Its id is derived from both, so it's never added twice."""
+        trans = {
+            "date": occurrence_date, "account": schedule["account"], "description": schedule.get("description", ""),
+            "amount": schedule["amount"], "type": schedule["type"], "category": schedule.get("category"),
+            "id": f"rec_{schedule['id']}_{occurrence_date}", "schedule_id": schedule["id"],
+        }
+        if schedule.get("splits"): trans["splits"] = [list(split) for split in schedule["splits"]]
+        return trans
+
+    def materialize_due_schedules(self, today=None):
+        """Adds every schedule occurrence up to today that isn't in the ledger yet, as one batch. Returns the count."""
+        today_iso = (today or date.today()).isoformat()
+        self.schedules_checked_on = today_iso
+        batch, caught_up = [], []
+        for schedule in self.schedules:
+            try:
+                for occurrence in schedule_occurrences(schedule, after=schedule.get("materialized_through"), until=today_iso):
+                    batch.append(self._schedule_transaction(schedule, occurrence))
+            except (KeyError, ValueError, TypeError) as e:
+                print(f"Warning: Skipping invalid recurring schedule {schedule.get('id')}: {e}")
+                continue
+            if schedule["start"] <= today_iso:
+                caught_up.append(schedule)
+        batch = [trans for trans in batch if trans["id"] not in self.transactions_by_id] # Another instance may have added some
+        if batch:
+            try:
+                self._add_transactions(batch) # One bulk change, however long the app was closed
+            except ValueError as e: # Retried on the next start
+                print(f"Warning: Recurring transactions not added: {e}")
+                return 0
+        for schedule in caught_up:
+            schedule["materialized_through"] = today_iso
+        return len(batch)
+
+    def projected_transactions(self, until):
+        """Virtual (not yet added) schedule occurrences up to the ISO date `until`."""
+        projected = []
+        for schedule in self.schedules:
             try:
-                with open(FINANCE_DATA_FILE, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-
-                if isinstance(data, dict) and ("accounts" in data or "transactions" in data): # More flexible check
-                    # Load Accounts
-                    loaded_accounts = data.get("accounts", [])
-                    if not isinstance(loaded_accounts, list): loaded_accounts = []
-                    self.accounts = sorted(list(set(loaded_accounts))) # Ensure unique and sorted
-
-                    # Load Categories
-                    loaded_categories = data.get("categories", [UNCATEGORIZED]) # Default includes Uncategorized
-                    if not isinstance(loaded_categories, list): loaded_categories = [UNCATEGORIZED]
-                    self.categories = set(loaded_categories)
-                    self.categories.add(UNCATEGORIZED) # Ensure default is always present
-
-                    # Load Transactions
-                    loaded_transactions = data.get("transactions", [])
-                    if not isinstance(loaded_transactions, list): loaded_transactions = []
-
-                    valid_transactions = []
-                    valid_accounts_set = set(self.accounts)
-
-                    for i, trans in enumerate(loaded_transactions):
-                         if isinstance(trans, dict) and all(k in trans for k in ('date', 'account', 'description', 'amount', 'type')):
-                             # Check if transaction's account still exists (allow loading anyway for history)
-                             # if trans.get('account') not in valid_accounts_set:
-                             #     print(f"Warn: Loading trans for non-existent account '{trans.get('account')}': {trans}")
-                             #     # Keep it for history, but balance calc will ignore it
-
-                             try: trans['amount'] = float(trans['amount'])
-                             except (ValueError, TypeError): trans['amount'] = 0.0
-
-                             # Add 'id' if missing (important for editing/deleting)
-                             if 'id' not in trans or not isinstance(trans['id'], (int, float, str)): # Allow string IDs too
-                                 trans['id'] = datetime.now().timestamp() + i
-
-                             # Add 'category' field if missing (default to Uncategorized for old expense data)
-                             if 'category' not in trans:
-                                 trans['category'] = UNCATEGORIZED if trans.get('type') == TRANS_EXPENSE else None
-
-                             valid_transactions.append(trans)
-                         else:
-                             print(f"Warn: Skipping invalid trans data format idx {i}: {trans}")
-                    self.transactions = valid_transactions
-
-                elif isinstance(data, list): # Handle very old format (transactions only)
-                    print("Warning: Old data format detected (transactions only).")
-                    self._set_default_state() # Start with default accounts/categories
-                    # Try to load the transactions, assuming default account/category
-                    old_transactions = data
-                    valid_transactions = []
-                    if "Default" not in self.accounts: self.accounts.append("Default")
-                    valid_accounts_set = set(self.accounts)
-
-                    for i, trans in enumerate(old_transactions):
-                         if isinstance(trans, dict) and all(k in trans for k in ('date', 'description', 'amount', 'type')):
-                              try: trans['amount'] = float(trans['amount'])
-                              except (ValueError, TypeError): trans['amount'] = 0.0
-                              trans['account'] = "Default"
-                              trans['category'] = UNCATEGORIZED if trans.get('type') == TRANS_EXPENSE else None
-                              trans['id'] = datetime.now().timestamp() + i
-                              valid_transactions.append(trans)
-                         else:
-                              print(f"Warn: Skipping invalid old trans data idx {i}: {trans}")
-                    self.transactions = valid_transactions
+                for occurrence in schedule_occurrences(schedule, after=schedule.get("materialized_through"), until=until):
+                    projected.append(self._schedule_transaction(schedule, occurrence))
+            except (KeyError, ValueError, TypeError):
+                continue
+        return projected
 
-                else:
-                    raise ValueError("Unknown or empty data format in file.")
+    def _check_schedules(self):
+        """Runs periodically; adds the new day's recurring transactions after a date change."""
+        if not self.window.winfo_exists():
+            return
+        if date.today().isoformat() != self.schedules_checked_on and self.materialize_due_schedules():
+            self.apply_filters()
+            self.update_balances()
+        self.window.after(SCHEDULE_CHECK_INTERVAL_MS, self._check_schedules)
+
+    def open_schedule_manager(self):
+        """Opens the dialog to review and stop recurring schedules."""
+        if not self.schedules:
+            messagebox.showinfo("Recurring Transactions", "There are no recurring transactions.\nChoose a 'Repeat' option when adding a transaction to create one.", parent=self.window)
+            return
+        dialog = RecurringScheduleDialog(self.window, "Recurring Transactions", self.schedules, self.account_currency)
+        if dialog.result is not None and len(dialog.result) != len(self.schedules):
+            kept_ids = {schedule["id"] for schedule in dialog.result}
+            self.stopped_schedule_ids.update(schedule["id"] for schedule in self.schedules if schedule["id"] not in kept_ids)
+            self.schedules = dialog.result
+            self.update_balances() # Future-dated balances include the remaining schedules only
+            self.save_data()
+
+
+    # --- External Changes ---
+    # Every save bumps the manifest's revision. Saves made by another instance (or a script)
+    # are noticed by polling the manifest's mtime and size; only the years whose manifest
+    # entries changed are read and merged into the live ledger. Local unsaved edits win over
+    # conflicting external ones, and the conflicts are reported.
+
+    def _disk_signature(self):
+        """(mtime, size) of the manifest, or None if it doesn't exist."""
+        try:
+            stat = os.stat(self.data_file)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def _snapshot_synced_rows(self, year, rows):
+        """Remembers which objects match the file on disk, to tell local edits from external ones."""
+        self.synced_rows[year] = {str(trans.get('id')): trans for trans in rows}
+
+    @staticmethod
+    def _same_partition_entry(entry_a, entry_b):
+        if entry_a is None or entry_b is None:
+            return entry_a is entry_b
+        keys = ["file", "count", "balances", "first_date", "last_date"]
+        for key in ("checksum", "content_crc"): # Missing from older manifests
+            if key in entry_a and key in entry_b: keys.append(key)
+        return all(entry_a.get(key) == entry_b.get(key) for key in keys)
+
+    def _poll_external_changes(self):
+        if not self.window.winfo_exists():
+            return
+        try:
+            self.check_external_changes()
+        except Exception as e:
+            print(f"Warning: Could not check {self.data_file} for changes: {e}")
+        self.window.after(LEDGER_POLL_INTERVAL_MS, self._poll_external_changes)
+
+    def check_external_changes(self):
+        """Merges changes saved by another program since the last load or save. Returns True if any were merged."""
+        if self._disk_signature() == self.disk_signature:
+            return False
+        with LedgerLock(self.data_file, exclusive=False):
+            conflicts = self._merge_external_changes()
+        if conflicts is None:
+            return False
+        self._after_external_merge(conflicts)
+        return True
+
+    def _after_external_merge(self, conflicts):
+        """Refreshes the UI after a merge and reports conflicts."""
+        if self.window is None: # Headless: nothing to refresh
+            for conflict in conflicts:
+                print(f"Warning: {self.data_file} was changed by another program; kept the local change for {conflict}")
+            return
+        self.update_account_comboboxes()
+        self.update_category_comboboxes()
+        self.update_saved_view_choices()
+        self.apply_filters()
+        self.update_balances()
+        if conflicts:
+            shown = "\n".join(conflicts[:10]) + (f"\n... and {len(conflicts) - 10} more" if len(conflicts) > 10 else "")
+            messagebox.showwarning("Conflicting Changes",
+                                   f"{self.data_file} was changed by another program. Your unsaved changes were kept for:\n\n{shown}",
+                                   parent=self.window)
+
+    def _merge_external_changes(self):
+        """Merges the manifest's changed years into memory (caller holds the ledger lock).
+
+        Returns a list of conflict descriptions, or None if there was nothing new to merge.
+        """
+        signature = self._disk_signature()
+        try:
+            with open(self.data_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None # Missing or half-written by a program that doesn't lock; try again later
+        if not isinstance(data, dict) or data.get("format") != "partitioned" or data.get("revision", 0) == self.disk_revision:
+            self.disk_signature = signature
+            return None
+
+        conflicts = []
+        for account in data.get("accounts", []):
+            if account not in self.accounts: self.accounts.append(account)
+        self.accounts.sort()
+        self.categories.update(data.get("categories", []))
+        for account, currency in data.get("account_currencies", {}).items():
+            self.account_currencies.setdefault(account, currency)
+        for category, amount in data.get("budgets", {}).items():
+            self.budgets.setdefault(category, amount) # Budgets set elsewhere (ours win on conflict)
+        for month, amounts in data.get("budget_overrides", {}).items():
+            for category, amount in amounts.items():
+                self.budget_overrides.setdefault(month, {}).setdefault(category, amount)
+        local_rule_ids = {rule.get("id") for rule in self.category_rules.rules}
+        new_rules = [rule for rule in data.get("category_rules", []) if isinstance(rule, dict)
+                     and rule.get("id") not in local_rule_ids and rule.get("id") not in self.removed_rule_ids]
+        if new_rules: # Added elsewhere; they go after ours
+            self.category_rules = CategoryRules(self.category_rules.rules + new_rules)
+        for name, query_text in data.get("saved_views", {}).items():
+            self.saved_views.setdefault(name, query_text) # Views saved elsewhere (ours win on conflict)
+        local_schedules = {schedule["id"]: schedule for schedule in self.schedules}
+        for schedule in data.get("schedules", []):
+            if not isinstance(schedule, dict) or "id" not in schedule: continue
+            if schedule["id"] in self.stopped_schedule_ids:
+                continue
+            if schedule["id"] not in local_schedules:
+                self.schedules.append(schedule) # Created elsewhere
+            elif (schedule.get("materialized_through") or "") > (local_schedules[schedule["id"]].get("materialized_through") or ""):
+                local_schedules[schedule["id"]]["materialized_through"] = schedule["materialized_through"]
+
+        known_archives = {entry["file"] for entry in self.closed_periods}
+        for entry in data.get("closed_periods", []):
+            if isinstance(entry, dict) and "cutoff" in entry and entry.get("file") not in known_archives:
+                self.closed_periods.append(entry) # Closed elsewhere; its years disappear from the partitions below
+        self.closed_periods.sort(key=lambda entry: entry["cutoff"])
+
+        disk_partitions = data.get("partitions", {})
+        if not isinstance(disk_partitions, dict): disk_partitions = {}
+        dirty_before = set(self.dirty_partitions)
+        clean_years = []
+        for year in sorted(set(disk_partitions) | set(self.partitions) | set(self.synced_rows)):
+            old_entry, new_entry = self.partitions.get(year), disk_partitions.get(year)
+            if self._same_partition_entry(old_entry, new_entry):
+                continue
+            new_rows = self._read_partition(year, new_entry) if new_entry else []
+            if new_rows is None:
+                conflicts.append(f"{year}: could not read the changed file")
+                continue
+
+            if year in self.loaded_partitions or year in self.dirty_partitions:
+                year_conflicts = self._merge_partition_rows(year, new_rows)
+                conflicts.extend(year_conflicts)
+                if not year_conflicts and year not in dirty_before:
+                    clean_years.append(year)
+            else:
+                self._replace_partition_totals(year, new_rows)
+                if new_entry and self._is_active_partition(year):
+                    self.partitions[year] = new_entry
+                    self._load_partition(year)
+            if new_entry: self.partitions[year] = new_entry
+            else: self.partitions.pop(year, None)
+
+        # Years that only took external changes match the disk again
+        for year in clean_years:
+            self.dirty_partitions.discard(year)
+            self.partition_appends.pop(year, None)
+            self.partition_rewrites.discard(year)
+        self.disk_revision = data.get("revision", 0)
+        self.disk_signature = signature
+        return conflicts
+
+    def _synced_in_other_year(self, year, trans_id, trans):
+        """True if `trans` is the synced (or just merged) row of another year: it was moved between years elsewhere."""
+        return any(rows.get(trans_id) is trans for other_year, rows in self.synced_rows.items() if other_year != year)
+
+    def _merge_partition_rows(self, year, disk_rows):
+        """Three-way merge of a loaded year: last synced rows vs. memory vs. disk. Returns conflicts.
+
+        Years are merged one at a time, so a row moved to another year elsewhere shows up as an
+        addition in one year and a deletion in the other; neither side counts as a conflict.
+        """
+        base = self.synced_rows.get(year, {})
+        disk_by_id = {str(trans.get('id')): trans for trans in disk_rows}
+        new_base, conflicts = {}, []
+        to_add, to_replace, to_remove = [], [], set()
+        for trans_id, theirs in disk_by_id.items():
+            synced = base.get(trans_id)
+            if synced is not None and synced == theirs:
+                new_base[trans_id] = synced # Unchanged on disk
+                continue
+            new_base[trans_id] = theirs
+            mine = self.transactions_by_id.get(trans_id)
+            if mine is None:
+                if synced is None: to_add.append(theirs) # Added elsewhere
+                else: conflicts.append(f"{year}: '{synced.get('description', '')}' was edited elsewhere but deleted here")
+            elif mine is synced or (synced is None and self._synced_in_other_year(year, trans_id, mine)):
+                to_replace.append((mine, theirs)) # Edited (or moved here from another year) elsewhere only
+            elif mine != theirs:
+                conflicts.append(f"{year}: '{mine.get('description', '')}' was edited both here and elsewhere")
+        for trans_id, synced in base.items():
+            if trans_id in disk_by_id:
+                continue
+            mine = self.transactions_by_id.get(trans_id)
+            if mine is synced:
+                to_remove.add(trans_id) # Deleted elsewhere only
+            elif mine is not None and self._synced_in_other_year(year, trans_id, mine):
+                continue # Moved to a year merged before this one, where it was already replaced
+            elif mine is not None:
+                conflicts.append(f"{year}: '{mine.get('description', '')}' was edited here but deleted elsewhere")
+
+        if to_remove: self._remove_transactions(to_remove)
+        for mine, theirs in to_replace: self._replace_transaction(mine, theirs)
+        if to_add: self._add_transactions(to_add)
+        self.synced_rows[year] = new_base
+        return conflicts
+
+    def _checkpoint_totals_through(self, month):
+        """Cumulative checkpoint totals through the end of `month` (empty before the first checkpoint)."""
+        position = bisect_right(self.checkpoint_months, month)
+        if position == 0:
+            return {"balances": {}, "count": 0, "checksum": 0}
+        return self.checkpoints[self.checkpoint_months[position - 1]]
+
+    def _replace_partition_totals(self, year, new_rows):
+        """Swaps an unloaded, unchanged year's share of the running balances and checkpoints for `new_rows`.
+
+        The old share is read off the checkpoints (the year has no local changes), so the old
+        rows never need to be loaded.
+        """
+        months = [f"{year}-{mon:02d}" for mon in range(1, 13)]
+        diffs = {month: [defaultdict(float), 0, 0] for month in months}
+        previous = self._checkpoint_totals_through(previous_month(months[0]))
+        for month in months:
+            current = self._checkpoint_totals_through(month)
+            diff = diffs[month]
+            for account in set(current["balances"]) | set(previous["balances"]):
+                diff[0][account] -= current["balances"].get(account, 0.0) - previous["balances"].get(account, 0.0)
+            diff[1] -= current["count"] - previous["count"]
+            diff[2] -= current["checksum"] - previous["checksum"]
+            previous = current
+        for trans in new_rows:
+            month = month_key(trans.get('date'))
+            if month in diffs:
+                account, amount = self._balance_effect(trans)
+                diffs[month][0][account] += amount
+                diffs[month][1] += 1
+                diffs[month][2] += transaction_checksum(trans)
+                self._ensure_checkpoint_month(month)
+
+        running = [defaultdict(float), 0, 0]
+        for month in self.checkpoint_months[bisect_left(self.checkpoint_months, months[0]):]:
+            if month in diffs:
+                for account, amount in diffs[month][0].items(): running[0][account] += amount
+                running[1] += diffs[month][1]
+                running[2] += diffs[month][2]
+            checkpoint = self.checkpoints[month]
+            for account, amount in running[0].items(): checkpoint["balances"][account] += amount
+            checkpoint["count"] += running[1]
+            checkpoint["checksum"] = (checkpoint["checksum"] + running[2]) % CHECKSUM_MODULUS
+        for account, amount in running[0].items(): self.running_balances[account] += amount
+        self.ledger_count += running[1]
+        self.ledger_checksum = (self.ledger_checksum + running[2]) % CHECKSUM_MODULUS
+        self.ledger_version += 1
+        self.query_cache.clear()
+        self.history_views.clear()
+
+
+    # --- Data Persistence ---
+    # The main data file is a small manifest (accounts, categories and one entry per year with
+    # its row count and per-account net totals). Transactions live in one file per year under
+    # the partition directory. Recent years load at startup, older ones when a filter needs them.
+    # Each year's entry also records the schema version and CRC-32 of the file as written; a
+    # file that still matches both is used as-is, anything else is validated row by row.
+
+    def _show_error(self, title, message):
+        """Error dialog; printed instead when there is no window (headless or already closed)."""
+        if self.window is None:
+            print(f"{title}: {message}")
+        else:
+            messagebox.showerror(title, message, parent=self.window if self.window.winfo_exists() else None)
+
+    def load_data(self, repair=False):
+        """Loads accounts, categories, and transactions from the JSON data file.
+
+        With `repair`, every year is loaded and validated row by row (ignoring checksums and
+        saved balance checkpoints) and marked to be rewritten.
+        """
+        self.partitions = {}            # year -> manifest entry (file, count, balances, first/last date)
+        self.loaded_partitions = set()  # years whose transactions are in self.transactions
+        self.dirty_partitions = set()   # years changed since the last save
+        self.partition_appends = {}     # year -> rows added since the last save
+        self.partition_rewrites = set() # years with edits/deletes since the last save (can't just append)
+        self.archive_lru = OrderedDict() # loaded archived years -> row count, least recently used first
+        self.rows_by_month = defaultdict(list) # 'YYYY-MM' -> loaded transactions in that month
+        self.synced_rows = {}           # year -> {str(id): transaction} as last read from / written to disk
+        self.disk_revision = 0          # Manifest revision we last loaded or saved
+        self.disk_signature = None      # Manifest (mtime, size) we last loaded or saved
+        checkpoint_data = None
+        if os.path.exists(self.data_file):
+            try:
+                with LedgerLock(self.data_file, exclusive=False): # Don't read while another instance is saving
+                    self.disk_signature = self._disk_signature()
+                    with open(self.data_file, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+
+                    if isinstance(data, dict) and data.get("format") == "partitioned":
+                        self._load_accounts_and_categories(data)
+                        partitions = data.get("partitions", {})
+                        self.partitions = partitions if isinstance(partitions, dict) else {}
+                        checkpoint_data = None if repair else data.get("checkpoints")
+                        self.disk_revision = data.get("revision", 0)
+                        self.transactions = []
+                        for year in sorted(self.partitions):
+                            if self._is_active_partition(year) or repair:
+                                rows = self._read_partition(year, repair=repair)
+                                if rows is not None:
+                                    self.transactions.extend(rows)
+                                    self.loaded_partitions.add(year)
+                                    if not self._is_active_partition(year): self.archive_lru[year] = len(rows)
+
+                    elif isinstance(data, dict) and ("accounts" in data or "transactions" in data): # More flexible check
+                        self._load_accounts_and_categories(data)
+
+                        # Load Transactions
+                        loaded_transactions = data.get("transactions", [])
+                        if not isinstance(loaded_transactions, list): loaded_transactions = []
+                        # Transactions for accounts that no longer exist are kept for history,
+                        # balance calculation ignores them.
+                        self.transactions = self._normalize_transactions(loaded_transactions)
+                        self._partition_all_loaded() # Single-file ledger: split into partitions on next save
+
+                    elif isinstance(data, list): # Handle very old format (transactions only)
+                        print("Warning: Old data format detected (transactions only).")
+                        self._set_default_state() # Start with default accounts/categories
+                        # Try to load the transactions, assuming default account/category
+                        old_transactions = data
+                        valid_transactions = []
+                        if "Default" not in self.accounts: self.accounts.append("Default")
+
+                        for i, trans in enumerate(old_transactions):
+                             if isinstance(trans, dict) and all(k in trans for k in ('date', 'description', 'amount', 'type')):
+                                  try: trans['amount'] = float(trans['amount'])
+                                  except (ValueError, TypeError): trans['amount'] = 0.0
+                                  trans['account'] = "Default"
+                                  trans['category'] = UNCATEGORIZED if trans.get('type') == TRANS_EXPENSE else None
+                                  trans['id'] = datetime.now().timestamp() + i
+                                  valid_transactions.append(trans)
+                             else:
+                                  print(f"Warn: Skipping invalid old trans data idx {i}: {trans}")
+                        self.transactions = valid_transactions
+                        self._partition_all_loaded()
+
+                    else:
+                        raise ValueError("Unknown or empty data format in file.")
 
             except json.JSONDecodeError:
-                messagebox.showerror("Load Error", f"Could not decode JSON from {FINANCE_DATA_FILE}. Starting fresh or with backup if available.", parent=self.window if self.window.winfo_exists() else None)
+                self._show_error("Load Error", f"Could not decode JSON from {self.data_file}. Starting fresh or with backup if available.")
                 self._set_default_state()
             except Exception as e:
-                 messagebox.showerror("Load Error", f"Failed to load data: {e}", parent=self.window if self.window.winfo_exists() else None)
+                 self._show_error("Load Error", f"Failed to load data: {e}")
                  self._set_default_state()
                  print(f"Error loading data: {e}")
         else:
-            print(f"Data file '{FINANCE_DATA_FILE}' not found. Starting with defaults.")
+            print(f"Data file '{self.data_file}' not found. Starting with defaults.")
             self._set_default_state()
 
+        self._rebuild_indexes() # Build lookup indexes for whatever was loaded
+        rows_by_year = defaultdict(list)
+        for trans in self.transactions:
+            rows_by_year[self._partition_key(trans)].append(trans)
+        for year in self.loaded_partitions:
+            if year in self.partitions and year not in self.dirty_partitions: # Matches its file on disk
+                self._snapshot_synced_rows(year, rows_by_year.get(year, []))
+        if repair:
+            self.dirty_partitions |= self.loaded_partitions
+            self.partition_rewrites |= self.loaded_partitions
+
+        # Balances: trust the saved checkpoints for now (verified once the UI is up), else compute them
+        self._verification = None
+        self.checkpoints_need_verification = self._load_balance_checkpoints(checkpoint_data) if checkpoint_data else False
+        if not self.checkpoints_need_verification:
+            self._rebuild_balance_checkpoints()
+
+    def _load_accounts_and_categories(self, data):
+        """Reads the account and category lists from a loaded data dict."""
+        # Load Accounts
+        loaded_accounts = data.get("accounts", [])
+        if not isinstance(loaded_accounts, list): loaded_accounts = []
+        self.accounts = sorted(list(set(loaded_accounts))) # Ensure unique and sorted
+
+        # Load Categories
+        loaded_categories = data.get("categories", [UNCATEGORIZED]) # Default includes Uncategorized
+        if not isinstance(loaded_categories, list): loaded_categories = [UNCATEGORIZED]
+        self.categories = set(loaded_categories)
+        self.categories.add(UNCATEGORIZED) # Ensure default is always present
+
+        currencies = data.get("account_currencies", {})
+        self.account_currencies = currencies if isinstance(currencies, dict) else {}
+        self.reporting_currency = data.get("reporting_currency") or BASE_CURRENCY
+
+        budgets = data.get("budgets", {})
+        self.budgets = budgets if isinstance(budgets, dict) else {}
+        overrides = data.get("budget_overrides", {})
+        self.budget_overrides = overrides if isinstance(overrides, dict) else {}
+
+        loaded_rules = data.get("category_rules", [])
+        self.category_rules = CategoryRules(loaded_rules if isinstance(loaded_rules, list) else [])
+        saved_views = data.get("saved_views", {})
+        self.saved_views = saved_views if isinstance(saved_views, dict) else {}
+
+        # Load recurring schedules
+        loaded_schedules = data.get("schedules", [])
+        self.schedules = [s for s in loaded_schedules if isinstance(s, dict) and "id" in s] if isinstance(loaded_schedules, list) else []
+
+        closed_periods = data.get("closed_periods", [])
+        self.closed_periods = [entry for entry in closed_periods if isinstance(entry, dict) and "file" in entry and "cutoff" in entry] \
+            if isinstance(closed_periods, list) else []
+
+    def _normalize_transactions(self, loaded_transactions):
+        """Validates transaction dicts read from disk, coercing amounts and backfilling id/category/transfer_id."""
+        valid_transactions = []
+        for i, trans in enumerate(loaded_transactions):
+             if isinstance(trans, dict) and all(k in trans for k in ('date', 'account', 'description', 'amount', 'type')):
+                 try: trans['amount'] = float(trans['amount'])
+                 except (ValueError, TypeError): trans['amount'] = 0.0
+
+                 # Add 'id' if missing (important for editing/deleting)
+                 if 'id' not in trans or not isinstance(trans['id'], (int, float, str)): # Allow string IDs too
+                     trans['id'] = datetime.now().timestamp() + i
+
+                 # Add 'category' field if missing (default to Uncategorized for old expense data)
+                 if 'category' not in trans:
+                     trans['category'] = UNCATEGORIZED if trans.get('type') == TRANS_EXPENSE else None
+
+                 if 'splits' in trans:
+                     try:
+                         if trans.get('type') != TRANS_EXPENSE: raise ValueError("only expenses can be split")
+                         trans['splits'] = validated_splits(trans['splits'], trans['amount'])
+                     except ValueError as e:
+                         print(f"Warn: Dropping the splits of transaction {trans.get('id')}: {e}")
+                         del trans['splits']
+
+                 self._migrate_transfer_id(trans)
+                 valid_transactions.append(trans)
+             else:
+                 print(f"Warn: Skipping invalid trans data format idx {i}: {trans}")
+        return valid_transactions
+
     def _set_default_state(self):
         """Sets the application to a default empty or sample state."""
         self.accounts = ["Cash", "Debit Card", "E-wallet"]
         self.categories = {UNCATEGORIZED, "Groceries", "Salary", "Utilities", "Rent", "Transport"} # Add some defaults
         self.transactions = []
         self.accounts.sort()
+        self.schedules = []
+        self.account_currencies = {}
+        self.reporting_currency = BASE_CURRENCY
+        self.budgets = {}
+        self.budget_overrides = {}
+        self.category_rules = CategoryRules()
+        self.saved_views = {}
+        self.closed_periods = []
+        self.partitions = {}
+        self.loaded_partitions = set()
+        self.dirty_partitions = set()
+        self.partition_appends = {}
+        self.partition_rewrites = set()
+        self.archive_lru = OrderedDict()
+        self.rows_by_month = defaultdict(list)
+        self.synced_rows = {}
+        self._reset_balance_state()
+
+    # --- Year Partitions ---
+
+    @staticmethod
+    def _partition_key(trans):
+        """Returns the partition (year) a transaction is stored in."""
+        return str(trans.get('date', ''))[:4] or "0000"
+
+    @staticmethod
+    def _is_active_partition(year):
+        """Recent (and future-dated) years are always kept in memory."""
+        try: return int(year) > date.today().year - ACTIVE_PARTITION_YEARS
+        except ValueError: return True
+
+    def _partition_dir(self):
+        return os.path.splitext(self.data_file)[0] + PARTITION_DIR_SUFFIX
+
+    def _partition_path(self, year):
+        entry = self.partitions.get(year, {})
+        return os.path.join(self._partition_dir(), entry.get("file") or f"{year}.json")
+
+    def _partition_all_loaded(self):
+        """Marks every year present in self.transactions as loaded and dirty (used after a full load)."""
+        self.partitions = {}
+        for trans in self.transactions:
+            year = self._partition_key(trans)
+            self.partitions.setdefault(year, {})
+        self.loaded_partitions = set(self.partitions)
+        self.dirty_partitions = set(self.partitions)
+        self.partition_rewrites = set(self.partitions)
+
+    def _read_partition(self, year, entry=None, repair=False, folder=None):
+        """Reads one partition file (as described by `entry`, default: our manifest). Returns the validated transactions, or None on failure.
+
+        Files whose schema version and checksum match the manifest were written by us and are
+        returned without per-row validation (unless `repair`). `folder` overrides the partition
+        directory (closed-period archives use the same entries).
+        """
+        path = os.path.join(folder or self._partition_dir(), entry["file"]) if entry else self._partition_path(year)
+        entry = entry or self.partitions.get(year, {})
+        try:
+            with LedgerLock(self.data_file, exclusive=False):
+                data, content_crc = read_ledger_file(path, with_checksum=True) # JSON or binary, detected from the file header
+            loaded_transactions = data.get("transactions", []) if isinstance(data, dict) else data
+            if not isinstance(loaded_transactions, list): raise ValueError("Partition has no transaction list.")
+            if (not repair and content_crc is not None and entry.get("content_crc") == content_crc
+                    and entry.get("schema") == LEDGER_SCHEMA_VERSION):
+                return loaded_transactions # Trusted: unchanged since we wrote it
+            return self._normalize_transactions(loaded_transactions)
+        except Exception as e:
+            # Leave it unloaded; its manifest totals still count and saving won't overwrite it
+            self._show_error("Load Error", f"Could not load transactions for {year} from {path}:\n{e}")
+            print(f"Error loading partition {year}: {e}")
+            return None
+
+    def _load_partition(self, year):
+        """Brings an archived partition into memory on demand."""
+        if year in self.loaded_partitions or year not in self.partitions:
+            return
+        rows = self._read_partition(year)
+        if rows is None:
+            return
+        self.transactions.extend(rows)
+        for trans in rows:
+            self._index_transaction(trans)
+        self._snapshot_synced_rows(year, rows)
+        self.loaded_partitions.add(year)
+        if not self._is_active_partition(year):
+            self.archive_lru[year] = len(rows)
+        self._invalidate_partition_queries(year)
+
+    def _require_loaded_years(self, years):
+        """Loads the given years; raises ValueError if one is on disk but couldn't be read.
+
+        Such a year must not change: saving it would replace its file with only the new rows.
+        """
+        for year in sorted(set(years)):
+            self._load_partition(year)
+            if year in self.partitions and year not in self.loaded_partitions:
+                raise ValueError(f"The transactions for {year} could not be read from {self._partition_path(year)}, "
+                                 "so that year can't be changed. Restore or fix the file and restart.")
+
+    def _evict_partition(self, year):
+        """Drops an unchanged archived partition from memory; its manifest totals remain."""
+        evicted = [t for t in self.transactions if self._partition_key(t) == year]
+        self.transactions = [t for t in self.transactions if self._partition_key(t) != year]
+        self._unindex_transactions(evicted)
+        self.loaded_partitions.discard(year)
+        self.synced_rows.pop(year, None)
+        self.archive_lru.pop(year, None)
+        self._invalidate_partition_queries(year)
+
+    def _invalidate_partition_queries(self, year):
+        """Drops cached query results that overlap the given year."""
+        old_version = self.ledger_version
+        self.ledger_version += 1
+        self.query_cache.invalidate_range(old_version, self.ledger_version, f"{year}-01-01", f"{year}-12-31")
+        views = self.history_views
+        start, end = views.filter_key[:2] if views.filter_key else (None, None)
+        outside = (start is not None and start > f"{year}-12-31") or (end is not None and end < f"{year}-01-01")
+        if views.version == old_version and views.filter_key is not None and outside:
+            views.version = self.ledger_version # Sort orders don't include this year, still valid
+        else:
+            views.clear()
+
+    def _partitions_between(self, start_date=None, end_date=None):
+        """Years of the ledger overlapping [start_date, end_date] (None = open-ended)."""
+        start_year = f"{start_date.year:04d}" if start_date else None
+        end_year = f"{end_date.year:04d}" if end_date else None
+        return [year for year in self.partitions
+                if (start_year is None or year >= start_year) and (end_year is None or year <= end_year)]
+
+    def _partitions_loaded(self, start_date=None, end_date=None):
+        """True if every year overlapping [start_date, end_date] is in memory (doesn't change anything)."""
+        return all(year in self.loaded_partitions for year in self._partitions_between(start_date, end_date))
+
+    def _ensure_partitions_loaded(self, start_date=None, end_date=None, skip=()):
+        """Loads every archived partition overlapping [start_date, end_date] (None = open-ended), except `skip`."""
+        wanted = self._partitions_between(start_date, end_date)
+        for year in sorted(wanted):
+            if year in self.loaded_partitions:
+                if year in self.archive_lru: self.archive_lru.move_to_end(year) # Recently used
+            elif year not in skip:
+                self._load_partition(year)
+        self._evict_archived_partitions(keep=set(wanted))
+
+    def _mapped_archives_between(self, start_date=None, end_date=None):
+        """Unloaded years overlapping [start_date, end_date] kept in memory-mapped files, which read-only
+        queries scan in place instead of loading."""
+        return [year for year in sorted(self._partitions_between(start_date, end_date))
+                if year not in self.loaded_partitions and self._partition_path(year).lower().endswith(MAPPED_LEDGER_EXT)]
+
+    def _mapped_rows_between(self, years, start_date=None, end_date=None):
+        """Validated rows of the memory-mapped `years` dated within [start_date, end_date]; the years stay unloaded."""
+        rows = []
+        with LedgerLock(self.data_file, exclusive=False):
+            for year in years:
+                with MappedLedger(self._partition_path(year)) as ledger:
+                    rows.extend(ledger.rows(ledger.date_range(start_date, end_date))) # Bisects the date-sorted records
+        return self._normalize_transactions(rows)
+
+    def _evict_archived_partitions(self, keep=()):
+        """Evicts least recently used archived partitions while over MAX_ARCHIVED_ROWS_LOADED."""
+        loaded_rows = sum(self.archive_lru.values())
+        for year in list(self.archive_lru):
+            if loaded_rows <= MAX_ARCHIVED_ROWS_LOADED:
+                break
+            if year in keep or year in self.dirty_partitions:
+                continue # Needed by the current view, or has unsaved changes
+            loaded_rows -= self.archive_lru[year]
+            self._evict_partition(year)
+
+    def _unloaded_partition_balances(self):
+        """Per-account net totals of partitions that are not in memory, from the manifest."""
+        balances = defaultdict(float)
+        for year, entry in self.partitions.items():
+            if year not in self.loaded_partitions:
+                for account, amount in entry.get("balances", {}).items():
+                    balances[account] += amount
+        return balances
+
+    @staticmethod
+    def _partition_entry(file_name, rows, base_entry=None, content_crc=None):
+        """Builds a manifest entry for `rows`; with base_entry, `rows` were appended to that partition.
+
+        `content_crc` is the CRC-32 of the file as written; with it the file loads without validation.
+        """
+        base_entry = base_entry or {}
+        balances = defaultdict(float, base_entry.get("balances", {}))
+        checksum = base_entry.get("checksum", 0)
+        for trans in rows:
+            checksum = (checksum + transaction_checksum(trans)) % CHECKSUM_MODULUS
+            if trans.get('type') == TRANS_INCOME: balances[trans.get('account')] += trans.get('amount', 0.0)
+            elif trans.get('type') == TRANS_EXPENSE: balances[trans.get('account')] -= trans.get('amount', 0.0)
+            else: balances[trans.get('account')] += 0.0 # Still record that the account is used
+        dates = [trans.get('date', '') for trans in rows]
+        dates += [base_entry[key] for key in ("first_date", "last_date") if key in base_entry]
+        entry = {"file": file_name, "count": base_entry.get("count", 0) + len(rows), "balances": dict(balances),
+                 "checksum": checksum, "first_date": min(dates), "last_date": max(dates)}
+        if content_crc is not None:
+            entry.update(schema=LEDGER_SCHEMA_VERSION, content_crc=content_crc)
+        return entry
+
+    def _write_partition(self, year, rows):
+        """Writes one partition file and returns its manifest entry."""
+        os.makedirs(self._partition_dir(), exist_ok=True)
+        extension = {"binary": BINARY_LEDGER_EXT, "mmap": MAPPED_LEDGER_EXT}.get(LEDGER_FORMAT, ".json")
+        file_name = f"{year}{extension}"
+        path = os.path.join(self._partition_dir(), file_name)
+        old_path = self._partition_path(year) if year in self.partitions else None
+
+        # Memory-mapped partitions that only gained rows are appended to instead of rewritten
+        appended = self.partition_appends.get(year)
+        if (LEDGER_FORMAT == "mmap" and appended and old_path == path and year not in self.partition_rewrites
+                and os.path.exists(path)):
+            entry = self.partitions[year]
+            with MappedLedger(path) as ledger:
+                can_append = len(ledger) + len(appended) == len(rows) # File holds exactly the older rows
+                if can_append: # The checksum is extended only if the older rows were ours to trust
+                    content_crc = ledger.append(appended, entry.get("content_crc") if entry.get("schema") == LEDGER_SCHEMA_VERSION else None)
+            if can_append:
+                return self._partition_entry(file_name, appended, entry, content_crc=content_crc)
+
+        if LEDGER_FORMAT == "mmap":
+            content_crc = MappedLedger.create(path, {"transactions": rows}, sort_by_date=True) # Sorted, so date lookups can bisect
+        else:
+            content_crc = write_ledger_file(path, {"transactions": rows}, fmt=LEDGER_FORMAT,
+                                            compression=LEDGER_COMPRESSION if LEDGER_FORMAT == "binary" else None)
+        if old_path and old_path != path:
+            remove_ledger_file(old_path) # LEDGER_FORMAT changed since this year was last written
+        return self._partition_entry(file_name, rows, content_crc=content_crc)
 
     def save_data(self):
-        """Saves the current accounts, categories, and transactions to JSON."""
-        data_to_save = {
-            "accounts": sorted(list(self.accounts)),
-            "categories": sorted(list(self.categories)), # Save categories as a sorted list
-            "transactions": self.transactions
-        }
+        """Saves accounts and categories to the manifest and changed years to their partition files.
+
+        Changes another program saved in the meantime are merged first instead of overwritten.
+        """
         try:
-            with open(FINANCE_DATA_FILE, 'w', encoding='utf-8') as f:
-                json.dump(data_to_save, f, indent=4, ensure_ascii=False)
+            conflicts = self._save_to_disk()
+            if conflicts is not None:
+                self._after_external_merge(conflicts)
         except IOError as e:
-             messagebox.showerror("Save Error", f"Could not save data to {FINANCE_DATA_FILE}:\n{e}", parent=self.window)
+             messagebox.showerror("Save Error", f"Could not save data to {self.data_file}:\n{e}", parent=self.window)
              print(f"Error saving data: {e}")
         except Exception as e:
              messagebox.showerror("Save Error", f"An unexpected error occurred during save: {e}", parent=self.window)
              print(f"Unexpected error saving data: {e}")
 
+    def _save_to_disk(self):
+        """Does the work of save_data; raises on failure. Returns the merge conflicts, or None if nothing was merged."""
+        conflicts = None
+        with LedgerLock(self.data_file): # Exclusive: no other instance reads or writes meanwhile
+            if self._disk_signature() != self.disk_signature:
+                conflicts = self._merge_external_changes()
+
+            # Group the loaded transactions of changed years in one pass
+            rows_by_year = {year: [] for year in self.dirty_partitions}
+            for trans in self.transactions if rows_by_year else ():
+                year = self._partition_key(trans)
+                if year in rows_by_year:
+                    rows_by_year[year].append(trans)
+
+            for year, rows in sorted(rows_by_year.items()):
+                if year in self.partitions and year not in self.loaded_partitions:
+                    print(f"Warning: Not saving {year}: its file could not be read, so its rows aren't in memory.")
+                    continue # Writing (or deleting) it would lose every row the file holds
+                if rows:
+                    self.partitions[year] = self._write_partition(year, rows)
+                    self.loaded_partitions.add(year)
+                    self._snapshot_synced_rows(year, rows)
+                elif year in self.partitions:
+                    path = self._partition_path(year)
+                    del self.partitions[year]
+                    self.synced_rows.pop(year, None)
+                    remove_ledger_file(path)
+
+            data_to_save = {
+                "format": "partitioned",
+                "revision": self.disk_revision + 1,
+                "accounts": sorted(list(self.accounts)),
+                "categories": sorted(list(self.categories)), # Save categories as a sorted list
+                "account_currencies": {account: currency for account, currency in self.account_currencies.items() if account in self.accounts},
+                "reporting_currency": self.reporting_currency,
+                "schedules": self.schedules,
+                "budgets": self.budgets,
+                "budget_overrides": self.budget_overrides,
+                "category_rules": self.category_rules.rules,
+                "saved_views": self.saved_views,
+                "partitions": {year: self.partitions[year] for year in sorted(self.partitions)},
+                "closed_periods": self.closed_periods,
+                "checkpoints": self._balance_checkpoints_for_save(),
+            }
+            temp_file = self.data_file + ".tmp"
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(data_to_save, f, indent=4, ensure_ascii=False)
+            os.replace(temp_file, self.data_file) # Readers that don't lock never see a half-written manifest
+            self.disk_revision += 1
+            self.disk_signature = self._disk_signature()
+            self.dirty_partitions.clear()
+            self.partition_appends.clear()
+            self.partition_rewrites.clear()
+        return conflicts
+
     def on_closing(self):
         """Handles window closing event, prompts to save."""
         if messagebox.askokcancel("Quit", "Do you want to save changes and quit?", parent=self.window):
              self.save_data()
+             self.log_query_cache_stats()
              self.window.destroy()
 
+    def log_query_cache_stats(self):
+        """Prints one line of query cache statistics, to see how well it serves the filters in use."""
+        stats = self.query_cache.stats()
+        print(f"Query cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate), "
+              f"{stats['entries']} entries ({stats['rows']} rows), {stats['evictions']} evictions, "
+              f"{stats['invalidations']} invalidations")
+
+    # --- Ledger Profiles ---
+    # Switching saves the ledger being left and puts its LEDGER_STATE attributes into
+    # self.profile_states; a ledger found there is swapped back in as it was and only merges
+    # what was saved elsewhere since. Others are read with load_data. The widgets stay; only
+    # their contents are refreshed. Exchange rates are shared by all profiles.
+
+    def _ledger_state(self):
+        return {name: getattr(self, name) for name in self.LEDGER_STATE}
+
+    def _restore_ledger_state(self, state):
+        for name in self.LEDGER_STATE:
+            setattr(self, name, state[name])
+
+    def _ledger_state_bytes(self):
+        """Rough memory held by the loaded ledger: its rows (sampled) times PROFILE_STATE_OVERHEAD."""
+        rows = self.transactions
+        if not rows:
+            return 0
+        sample = rows[::max(1, len(rows) // 100)]
+        row_bytes = sum(sys.getsizeof(trans) + sum(sys.getsizeof(value) for value in trans.values()) for trans in sample)
+        return int(row_bytes / len(sample) * len(rows) * PROFILE_STATE_OVERHEAD)
+
+    def _remember_profile(self):
+        """Lists the open ledger as a profile, makes it the one opened next time and shows it."""
+        self.data_file = self.profiles.add(self.data_file)
+        self.profiles.current = self.data_file
+        try:
+            self.profiles.save(PROFILES_FILE)
+        except OSError as e:
+            print(f"Warning: Could not save the ledger profiles to {PROFILES_FILE}: {e}")
+        self.profile_combo['values'] = [LedgerProfiles.label(path) for path in self.profiles.paths]
+        self.profile_var.set(LedgerProfiles.label(self.data_file))
+        self.window.title(f"Multi-Account Finance Tracker - {LedgerProfiles.label(self.data_file)}")
+
+    def switch_to_selected_profile(self, event=None):
+        index = self.profile_combo.current()
+        if 0 <= index < len(self.profiles.paths):
+            self.switch_profile(self.profiles.paths[index])
+
+    def switch_profile(self, ledger_path):
+        """Saves the open ledger and opens another one. Returns True if it switched."""
+        ledger_path = os.path.abspath(ledger_path)
+        if ledger_path == os.path.abspath(self.data_file):
+            return False
+        try:
+            self._save_to_disk() # Merges what was saved elsewhere, so nothing is lost either way
+        except Exception as e:
+            messagebox.showerror("Save Error", f"Could not save {self.data_file}, so it stays open:\n{e}", parent=self.window)
+            self.profile_var.set(LedgerProfiles.label(self.data_file))
+            return False
+        self.profile_states.put(self.data_file, self._ledger_state(), self._ledger_state_bytes())
+
+        state = self.profile_states.take(ledger_path)
+        if state is not None:
+            self._restore_ledger_state(state)
+            try:
+                self.check_external_changes()
+            except Exception as e:
+                print(f"Warning: Could not check {self.data_file} for changes: {e}")
+        else:
+            self.data_file = ledger_path
+            self._reset_ledger_state()
+            self.load_data()
+        if self.materialize_due_schedules(): # Also catches up a kept ledger that missed a date change
+            self.save_data()
+        if self._verification is not None or (state is None and self.checkpoints_need_verification):
+            self._start_balance_verification()
+
+        self._remember_profile()
+        self.displayed_key = None # Ledger versions of different profiles aren't comparable
+        self._set_pending_splits(None)
+        self.saved_view_var.set("")
+        self.reporting_currency_var.set(self.reporting_currency)
+        self.update_account_comboboxes()
+        self.update_category_comboboxes()
+        self.update_currency_choices()
+        self.update_saved_view_choices()
+        self.apply_filters()
+        self.update_balances()
+        self.update_budget_remaining()
+        self.update_undo_buttons()
+        self.refresh_charts()
+        return True
+
+    def open_profile(self):
+        path = filedialog.askopenfilename(title="Open Ledger", parent=self.window,
+                                          filetypes=[("Ledger files", "*.json"), ("All files", "*.*")])
+        if path:
+            self.switch_profile(path)
+
+    def new_profile(self):
+        path = filedialog.asksaveasfilename(title="New Ledger", parent=self.window, defaultextension=".json",
+                                            filetypes=[("Ledger files", "*.json")], confirmoverwrite=False)
+        if not path:
+            return
+        if os.path.exists(path):
+            messagebox.showerror("New Ledger", f"{path} already exists. Use \"Open...\" to open it.", parent=self.window)
+            return
+        if self.switch_profile(path):
+            self.save_data() # Creates the file, with the default accounts and categories
+
+    def remove_profile(self):
+        """Takes the open ledger off the list (its files stay) and switches to the first other one."""
+        current = os.path.abspath(self.data_file)
+        others = [path for path in self.profiles.paths if path != current]
+        if not others:
+            messagebox.showinfo("Remove Ledger", "This is the only ledger on the list. Open or create another one first.", parent=self.window)
+            return
+        if not messagebox.askyesno("Remove Ledger", f"Remove {LedgerProfiles.label(current)} from the list and switch to "
+                                   f"{LedgerProfiles.label(others[0])}?\n\nIts files are not deleted.", parent=self.window):
+            return
+        if self.switch_profile(others[0]):
+            self.profiles.remove(current)
+            self.profile_states.discard(current)
+            self._remember_profile()
+
+    # --- Closed Periods ---
+    # Closing a period moves every transaction dated before a cutoff into an archive file under
+    # the closed-period directory (written like a year file) and leaves one opening balance row
+    # per account, dated on the cutoff, in the ledger. Years before the cutoff's year disappear
+    # from the manifest, so loading, balances, filters and saves only see what is left. The
+    # manifest lists the archives with the usual partition entry plus the cutoff and, optionally,
+    # income and spending per category. Opening rows move balances but are neither income nor
+    # spending (summaries, charts, budgets and rules skip them). Archives are only read to search them.
+
+    def _closed_period_dir(self):
+        return os.path.splitext(self.data_file)[0] + CLOSED_PERIOD_DIR_SUFFIX
+
+    def closed_through(self):
+        """The latest cutoff: transactions before it are archived (None if no period was closed)."""
+        return max((entry["cutoff"] for entry in self.closed_periods), default=None)
+
+    def read_closed_period(self, entry):
+        """A closed period's transactions, read from its archive (None if it can't be read)."""
+        return self._read_partition(f"the period before {entry['cutoff']}", entry, folder=self._closed_period_dir())
+
+    def search_closed_periods(self, periods, query=None, loaded=None):
+        """Archived transactions of `periods` matching `query` (a FilterQuery, None = all).
+
+        Archives entirely outside the query's dates aren't read; `loaded` (file -> rows) keeps
+        the ones that were, for the next search.
+        """
+        start, end = query.date_range if query else (None, None)
+        found = []
+        for entry in periods:
+            if (start and entry.get("last_date", "") < start) or (end and entry.get("first_date", "") > end):
+                continue
+            rows = loaded.get(entry["file"]) if loaded is not None else None
+            if rows is None:
+                rows = self.read_closed_period(entry)
+                if rows is None:
+                    continue # Reported by _read_partition
+                if loaded is not None: loaded[entry["file"]] = rows
+            found.extend(rows if query is None else filter(query.matches, rows))
+        return found
+
+    def close_period(self, cutoff, category_totals=True):
+        """Archives every transaction dated before `cutoff` (YYYY-MM-DD) behind opening balances and saves.
+
+        Returns the archive's manifest entry. Raises ValueError if the date is invalid or there
+        is nothing to close, OSError if a file can't be written. Clears the undo history, which
+        could otherwise bring archived transactions back.
+        """
+        try: cutoff = datetime.strptime(cutoff, '%Y-%m-%d').strftime('%Y-%m-%d')
+        except (ValueError, TypeError): raise ValueError(f"Invalid date: '{cutoff}'. Use YYYY-MM-DD.")
+        if cutoff > date.today().isoformat():
+            raise ValueError("Only past transactions can be closed.")
+        if self.closed_through() and cutoff <= self.closed_through():
+            raise ValueError(f"Transactions before {self.closed_through()} are already closed.")
+
+        with LedgerLock(self.data_file): # Exclusive: nobody saves between reading the old years and dropping them
+            conflicts = self._save_to_disk() # Merges changes saved elsewhere and writes ours first
+            cutoff_year = cutoff[:4]
+            self._require_loaded_years([cutoff_year]) # Partly archived, partly kept
+            old_years = sorted(year for year in self.partitions if year < cutoff_year)
+            archived = [trans for trans in self.transactions if str(trans.get('date', '')) < cutoff]
+            for year in old_years:
+                if year not in self.loaded_partitions: # Read for the archive only, never indexed
+                    rows = self._read_partition(year)
+                    if rows is None:
+                        raise ValueError(f"The transactions of {year} could not be read, so the period can't be closed.")
+                    archived.extend(rows)
+            if not archived:
+                raise ValueError(f"There are no transactions before {cutoff} to close.")
+            archived.sort(key=lambda trans: str(trans.get('date', '')))
+            totals = {}
+            if category_totals:
+                try:
+                    total_income, _, expenses_by_category = self.summarize_transactions(archived)
+                except KeyError as e: # A currency without exchange rates
+                    raise ValueError(f"{e.args[0] if e.args else e} Import its rates, or close without category totals.")
+                totals = {"currency": self.reporting_currency, "income": round(total_income, 2),
+                          "expenses_by_category": {category: round(amount, 2) for category, amount in sorted(expenses_by_category.items())}}
+
+            # Archive file first: until the manifest is saved it's just an unused file
+            os.makedirs(self._closed_period_dir(), exist_ok=True)
+            fmt = "json" if LEDGER_FORMAT == "json" else "binary" # Written once, so never memory-mapped
+            file_name = f"before_{cutoff}{'.json' if fmt == 'json' else BINARY_LEDGER_EXT}"
+            content_crc = write_ledger_file(os.path.join(self._closed_period_dir(), file_name),
+                                            {"closed_before": cutoff, "accounts": sorted(self.accounts), "transactions": archived},
+                                            fmt=fmt, compression=LEDGER_COMPRESSION if fmt == "binary" else None)
+            entry = self._partition_entry(file_name, archived, content_crc=content_crc)
+            entry["cutoff"] = cutoff
+            entry.update(totals)
+
+            opening_balances = defaultdict(float)
+            for trans in archived:
+                account, amount = self._balance_effect(trans)
+                opening_balances[account] += amount
+            opening_rows = [{"date": cutoff, "account": account, "description": OPENING_BALANCE_DESCRIPTION,
+                             "amount": round(abs(amount), 2), "type": TRANS_INCOME if amount > 0 else TRANS_EXPENSE,
+                             "category": None, "id": f"open_{cutoff}_{account}", "opening_balance": True}
+                            for account, amount in sorted(opening_balances.items(), key=lambda item: str(item[0]))
+                            if account is not None and round(amount, 2)]
+
+            self._remove_transactions({str(trans.get('id')) for trans in self.transactions if str(trans.get('date', '')) < cutoff})
+            old_files = []
+            for year in old_years: # Fully archived: gone from the manifest, their files deleted once it's saved
+                old_files.append(self._partition_path(year))
+                del self.partitions[year]
+                for state in (self.loaded_partitions, self.dirty_partitions, self.partition_rewrites):
+                    state.discard(year)
+                for state in (self.partition_appends, self.archive_lru, self.synced_rows, self.archived_chart_days):
+                    state.pop(year, None)
+                self._invalidate_partition_queries(year)
+            self._add_transactions(opening_rows)
+            self.closed_periods.append(entry)
+            self.undo_history.clear()
+            self._rebuild_balance_checkpoints()
+            self._save_to_disk()
+            for path in old_files:
+                remove_ledger_file(path)
+        if conflicts is not None:
+            self._after_external_merge(conflicts)
+        return entry
+
+    def open_closed_periods(self):
+        """Shows the closed periods (searchable) and closes another one on request."""
+        dialog = ClosedPeriodsDialog(self.window, "Closed Periods", self.closed_periods, self.search_closed_periods)
+        if not dialog.result:
+            return
+        default_cutoff = f"{date.today().year - ACTIVE_PARTITION_YEARS + 1}-01-01" # The oldest year loaded at startup
+        options = ClosePeriodDialog(self.window, "Close Period", default_cutoff, self.closed_through()).result
+        if not options:
+            return
+        if not messagebox.askyesno("Confirm Close",
+                                   f"Move every transaction before {options['cutoff']} into an archive and replace them "
+                                   f"with opening balances?\n\nThis can't be undone.", parent=self.window):
+            return
+        try:
+            entry = self.close_period(options["cutoff"], options["category_totals"])
+        except (ValueError, OSError) as e:
+            messagebox.showerror("Close Period", f"Could not close the period:\n{e}", parent=self.window)
+            return
+        self.apply_filters()
+        self.update_balances()
+        self.update_undo_buttons()
+        messagebox.showinfo("Close Period", f"Archived {entry['count']:,} transaction(s) before {entry['cutoff']} in "
+                            f"{os.path.join(self._closed_period_dir(), entry['file'])}.", parent=self.window)
+
+
     # --- Account/Transfer Functions (Largely unchanged) ---
     def add_account(self):
         """Adds a new account to the list."""
@@ -1180,10 +7056,16 @@ class FinanceTrackerApp:
         if new_name in self.accounts:
             messagebox.showwarning("Input Error", f"Account '{new_name}' already exists.", parent=self.window)
             return
+        currency = self.new_account_currency_var.get().strip().upper() or BASE_CURRENCY
+        if not (len(currency) == 3 and currency.isalpha()):
+            messagebox.showwarning("Input Error", f"Invalid currency code: '{currency}'. Use a 3-letter code like USD.", parent=self.window)
+            return
 
         self.accounts.append(new_name)
         self.accounts.sort()
+        if currency != BASE_CURRENCY: self.account_currencies[new_name] = currency
         self.update_account_comboboxes()
+        self.update_currency_choices()
         self.update_balances() # Balances depend on accounts list
         self.new_account_name_var.set("")
         # self.save_data() # Save immediately or on close
@@ -1202,6 +7084,8 @@ class FinanceTrackerApp:
             if trans.get('account') == account_to_delete:
                 has_transactions = True
                 break
+        if account_to_delete in self._unloaded_partition_balances(): # Used in an archived year
+            has_transactions = True
 
         if has_transactions:
             messagebox.showerror("Deletion Prevented", f"Cannot delete account '{account_to_delete}' because it has existing transactions.\nPlease delete or reassign its transactions first (by editing them).", parent=self.window)
@@ -1211,6 +7095,7 @@ class FinanceTrackerApp:
         if messagebox.askyesno("Confirm Delete", f"Are you sure you want to permanently delete the account '{account_to_delete}'?\nThis account currently has no transactions.", parent=self.window):
             try:
                 self.accounts.remove(account_to_delete)
+                self.account_currencies.pop(account_to_delete, None)
                 self.update_account_comboboxes()
                 self.update_balances() # Re-calculate balances without the deleted account
                 self.apply_filters()   # Re-apply filters as available accounts changed
@@ -1223,6 +7108,47 @@ class FinanceTrackerApp:
                  messagebox.showerror("Error", f"An unexpected error occurred while deleting account: {e}", parent=self.window)
                  print(f"Error deleting account: {e}")
 
+    def _transfer_amount_in(self, amount, from_account, to_account, date_str):
+        """What `amount` leaving from_account adds to to_account (converted if their currencies differ)."""
+        from_currency, to_currency = self.account_currency(from_account), self.account_currency(to_account)
+        try:
+            return round(self.fx_rates.convert(amount, from_currency, to_currency, date_str), 2)
+        except KeyError as e:
+            raise ValueError(f"Can't transfer from {from_currency} to {to_currency}: {e.args[0]} Import exchange rates first.")
+
+    def _transfer_legs(self, date_str, from_account, to_account, amount):
+        """Validates a transfer (raises ValueError) and returns its (out, in) transactions."""
+        if not date_str: raise ValueError("Please select a valid date for the transfer.")
+        try: datetime.strptime(date_str, '%Y-%m-%d')
+        except ValueError: raise ValueError(f"Invalid date format: '{date_str}'. Use YYYY-MM-DD.")
+        if not from_account or not to_account: raise ValueError("Please select both 'From' and 'To' accounts.")
+        if from_account == to_account: raise ValueError("'From' and 'To' accounts cannot be the same.")
+        for account in (from_account, to_account):
+            if account not in self.accounts: raise ValueError(f"Unknown account: '{account}'.")
+        if amount <= 0: raise ValueError("Transfer amount must be positive.")
+        amount_in = self._transfer_amount_in(amount, from_account, to_account, date_str) # Differs across currencies
+
+        # Create Transfer transactions
+        transfer_time = datetime.now().timestamp()
+        transfer_id = f"tf_{transfer_time}" # Shared by both legs
+        transfer_id_out = f"tf_out_{transfer_time}"
+        transfer_id_in = f"tf_in_{transfer_time}"
+
+        # Transfers don't typically have user-defined categories
+        trans_out = {
+            "date": date_str, "account": from_account,
+            "description": TRANSFER_OUT_DESC.format(to_account),
+            "amount": amount, "type": TRANS_EXPENSE, "category": None, "id": transfer_id_out,
+            "transfer_id": transfer_id
+        }
+        trans_in = {
+            "date": date_str, "account": to_account,
+            "description": TRANSFER_IN_DESC.format(from_account),
+            "amount": amount_in, "type": TRANS_INCOME, "category": None, "id": transfer_id_in,
+            "transfer_id": transfer_id
+        }
+        return trans_out, trans_in
+
     def transfer_funds(self):
         """Creates two transactions to represent a transfer between accounts."""
         try:
@@ -1231,13 +7157,7 @@ class FinanceTrackerApp:
             to_account = self.transfer_to_account_var.get()
             amount = self.transfer_amount_var.get()
 
-            # Validation
-            if not date_str: raise ValueError("Please select a valid date for the transfer.")
-            try: datetime.strptime(date_str, '%Y-%m-%d')
-            except ValueError: raise ValueError(f"Invalid date format: '{date_str}'. Use YYYY-MM-DD.")
-            if not from_account or not to_account: raise ValueError("Please select both 'From' and 'To' accounts.")
-            if from_account == to_account: raise ValueError("'From' and 'To' accounts cannot be the same.")
-            if amount <= 0: raise ValueError("Transfer amount must be positive.")
+            trans_out, trans_in = self._transfer_legs(date_str, from_account, to_account, amount) # Validates
 
             # Insufficient Funds Check for Transfer Out
             account_balances, _ = self.calculate_balances() # Use full calculation
@@ -1246,36 +7166,21 @@ class FinanceTrackerApp:
                 # Use askyesno warning
                  if not messagebox.askyesno(
                      "Insufficient Funds",
-                     f"Cannot transfer {CURRENCY_SYMBOL}{amount:,.2f}.\nAccount '{from_account}' only has {CURRENCY_SYMBOL}{current_balance_from:,.2f}.\n\nProceed anyway (account will become negative)?",
+                     f"Cannot transfer {format_money(amount, self.account_currency(from_account))}.\nAccount '{from_account}' only has {format_money(current_balance_from, self.account_currency(from_account))}.\n\nProceed anyway (account will become negative)?",
                      icon='warning', parent=self.window):
                       return # Stop if user clicks No
 
-            # Create Transfer transactions
-            transfer_time = datetime.now().timestamp()
-            transfer_id_out = f"tf_out_{transfer_time}"
-            transfer_id_in = f"tf_in_{transfer_time}"
-
-            # Transfers don't typically have user-defined categories
-            trans_out = {
-                "date": date_str, "account": from_account,
-                "description": TRANSFER_OUT_DESC.format(to_account),
-                "amount": amount, "type": TRANS_EXPENSE, "category": None, "id": transfer_id_out
-            }
-            trans_in = {
-                "date": date_str, "account": to_account,
-                "description": TRANSFER_IN_DESC.format(from_account),
-                "amount": amount, "type": TRANS_INCOME, "category": None, "id": transfer_id_in
-            }
-            self.transactions.append(trans_out)
-            self.transactions.append(trans_in)
+            with self.undo_history.command("Transfer"):
+                self._add_transactions([trans_out, trans_in])
             self.apply_filters()   # Update view
             self.update_balances() # Update balances
+            self.update_undo_buttons()
             # self.save_data()
 
             self.transfer_amount_var.set(0.0)
             self.transfer_from_account_var.set("")
             self.transfer_to_account_var.set("")
-            messagebox.showinfo("Success", f"Transferred {CURRENCY_SYMBOL}{amount:,.2f} from '{from_account}' to '{to_account}'.", parent=self.window)
+            messagebox.showinfo("Success", f"Transferred {format_money(amount, self.account_currency(from_account))} from '{from_account}' to '{to_account}'.", parent=self.window)
         except ValueError as e:
             messagebox.showerror("Input Error", str(e), parent=self.window)
         except Exception as e:
@@ -1283,10 +7188,350 @@ class FinanceTrackerApp:
             print(f"Error transferring funds: {e}")
 
 
+# --- Local JSON API ---
+# `python finance_tracker.py --serve` runs the ledger without a window and answers JSON
+# requests on http://127.0.0.1:8765, one thread per request:
+#     GET  /balances[?as_of=YYYY-MM-DD]
+#     GET  /transactions?start=&end=&account=&category=&type=&exclude_transfers=1&q=&offset=&limit=
+#     GET  /summary?(same filters as /transactions)
+#     GET  /closed?q=&offset=&limit=
+#     POST /transactions  {"date", "account", "amount", "type", "description", "category", "splits", "force"}
+#     POST /transfers     {"date", "from", "to", "amount", "force"}
+# Reads share a ReadWriteLock and run in parallel. Loading an archived year, adding and
+# merging hold it alone, and a write is answered only once it is saved. Saves made by the
+# app or another program are merged every LEDGER_POLL_INTERVAL_MS.
+
+class LedgerAPIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, app):
+        super().__init__(address, LedgerAPIHandler)
+        self.app = app # A headless FinanceTrackerApp
+        self.lock = ReadWriteLock()
+        self.stopping = threading.Event()
+
+    def poll_changes(self):
+        """Background thread: merges external saves and adds recurring transactions once they're due."""
+        while not self.stopping.wait(LEDGER_POLL_INTERVAL_MS / 1000):
+            try:
+                with self.lock.write():
+                    self.app.check_external_changes()
+                    if date.today().isoformat() != self.app.schedules_checked_on and self.app.materialize_due_schedules():
+                        self.app._save_to_disk()
+            except Exception as e:
+                print(f"Warning: Could not check {self.app.data_file} for changes: {e}")
+
+
+class LedgerAPIHandler(BaseHTTPRequestHandler):
+    server_version = "FinanceTrackerAPI/1"
+    protocol_version = "HTTP/1.1" # Keep-alive, so clients can reuse connections
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        routes = {"/balances": self.get_balances, "/transactions": self.get_transactions, "/summary": self.get_summary,
+                  "/closed": self.get_closed}
+        self._dispatch(routes.get(url.path.rstrip("/")), params)
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(body, dict): raise ValueError("The request body must be a JSON object.")
+        except ValueError as e:
+            self._send(400, {"error": f"Invalid JSON body: {e}"})
+            return
+        routes = {"/transactions": self.post_transaction, "/transfers": self.post_transfer}
+        self._dispatch(routes.get(urlsplit(self.path).path.rstrip("/")), body)
+
+    def _dispatch(self, handler, argument):
+        if handler is None:
+            self._send(404, {"error": f"No such endpoint: {self.command} {urlsplit(self.path).path}"})
+            return
+        try:
+            status, payload = handler(argument)
+        except ValueError as e:
+            status, payload = 400, {"error": str(e)}
+        except KeyError as e: # A currency without exchange rates
+            status, payload = 409, {"error": e.args[0] if e.args else str(e)}
+        except Exception as e:
+            print(f"Error answering {self.command} {self.path}: {e}")
+            status, payload = 500, {"error": f"An unexpected error occurred: {e}"}
+        self._send(status, payload)
+
+    def _send(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # One line per request would dominate the cost of small queries
+
+    # --- Reading ---
+
+    def _read(self, read, start_date=None, end_date=None):
+        """Runs read() under the shared lock, once the years in [start_date, end_date] are in memory."""
+        app, lock = self.server.app, self.server.lock
+        for attempt in range(3):
+            with lock.read():
+                if app._partitions_loaded(start_date, end_date):
+                    return read()
+            with lock.write(): # Loading a year changes the ledger
+                app._ensure_partitions_loaded(start_date, end_date)
+        with lock.write(): # Other requests keep evicting them; read while holding the lock alone
+            app._ensure_partitions_loaded(start_date, end_date)
+            return read()
+
+    @staticmethod
+    def _date_param(params, name):
+        value = params.get(name)
+        if not value:
+            return None
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            raise ValueError(f"Invalid {name}: '{value}'. Use YYYY-MM-DD.")
+
+    @staticmethod
+    def _int_param(params, name, default, minimum):
+        try:
+            value = int(params.get(name, default))
+        except ValueError:
+            raise ValueError(f"{name} must be a whole number.")
+        if value < minimum: raise ValueError(f"{name} must be at least {minimum}.")
+        return value
+
+    def _filtered_rows(self, params, read):
+        """Runs read(rows, filter_key) with the loaded transactions that pass the filters in `params`."""
+        start_date, end_date = self._date_param(params, "start"), self._date_param(params, "end")
+        if start_date and end_date and start_date > end_date:
+            raise ValueError("start cannot be after end.")
+        app = self.server.app
+        with self.server.lock.read(): # The category filter covers the category's subtree
+            filter_key = app._make_filter_key(
+                start_date, end_date, params.get("account"), params.get("category"), params.get("type"),
+                params.get("exclude_transfers", "").lower() in ("1", "true", "yes"), params.get("q", "").strip())
+        start_date, end_date = app._filter_key_dates(filter_key)
+        matches = FinanceTrackerApp._filter_matcher(filter_key)
+
+        def read_rows(mapped_years=()):
+            rows = app._rows_between(start_date, end_date)
+            if mapped_years: rows = rows + app._mapped_rows_between(mapped_years, start_date, end_date)
+            return read([trans for trans in rows if matches(trans)], filter_key)
+        with self.server.lock.read():
+            mapped = bool(app._mapped_archives_between(start_date, end_date))
+        if not mapped:
+            return self._read(read_rows, start_date, end_date)
+        with self.server.lock.write(): # Reading files takes the ledger lock, which isn't shared between threads
+            mapped_years = app._mapped_archives_between(start_date, end_date) # Scanned in place, never loaded
+            app._ensure_partitions_loaded(start_date, end_date, skip=mapped_years)
+            return read_rows(mapped_years)
+
+    def get_balances(self, params):
+        app = self.server.app
+        as_of = self._date_param(params, "as_of")
+
+        def read():
+            if as_of:
+                account_balances, _ = app.balances_as_of(as_of.isoformat())
+            else:
+                account_balances, _ = app.calculate_balances()
+            on_date = (as_of or date.today()).isoformat()
+            return {
+                "as_of": as_of.isoformat() if as_of else None,
+                "currency": app.reporting_currency,
+                "accounts": {account: {"balance": round(balance, 2), "currency": app.account_currency(account)}
+                             for account, balance in sorted(account_balances.items())},
+                "total": round(app.convert_balances(account_balances, on_date), 2),
+            }
+        if as_of:
+            return 200, self._read(read, as_of, as_of) # Balances as of a date read that month's rows
+        with self.server.lock.read(): # Current balances are kept up to date, nothing to load
+            return 200, read()
+
+    def get_transactions(self, params):
+        """A page of matching transactions, newest first like the history list."""
+        offset = self._int_param(params, "offset", 0, 0)
+        limit = min(self._int_param(params, "limit", API_PAGE_SIZE, 1), API_MAX_PAGE_SIZE)
+
+        def read(rows, filter_key):
+            page = heapq.nlargest(offset + limit, rows, key=FinanceTrackerApp._history_sort_key)[offset:]
+            return {"total": len(rows), "offset": offset, "limit": limit,
+                    "transactions": [dict(trans) for trans in page]}
+        return 200, self._filtered_rows(params, read)
+
+    def get_summary(self, params):
+        app = self.server.app
+
+        def read(rows, filter_key):
+            total_income, total_expense, expenses_by_category = app.summarize_transactions( # No cache key: the cache isn't shared
+                rows, only_categories=filter_key[3])
+            return {
+                "currency": app.reporting_currency, "count": len(rows),
+                "income": round(total_income, 2), "expense": round(total_expense, 2),
+                "net": round(total_income - total_expense, 2),
+                "expenses_by_category": {category: round(amount, 2) for category, amount in sorted(expenses_by_category.items())},
+                "category_totals": {category: round(amount, 2) # Including subcategories
+                                    for category, amount in sorted(CategoryTree.rollup(expenses_by_category).items())},
+            }
+        return 200, self._filtered_rows(params, read)
+
+    def get_closed(self, params):
+        """The closed periods, and a page of their archived transactions matching `q` (newest first)."""
+        app = self.server.app
+        offset = self._int_param(params, "offset", 0, 0)
+        limit = min(self._int_param(params, "limit", API_PAGE_SIZE, 1), API_MAX_PAGE_SIZE)
+        query_text = (params.get("q") or "").strip()
+        query = FilterQuery.get(query_text) if query_text else None
+        with self.server.lock.write(): # Reading files takes the ledger lock, which isn't shared between threads
+            periods = [dict(entry) for entry in app.closed_periods]
+            rows = app.search_closed_periods(periods, query)
+        page = heapq.nlargest(offset + limit, rows, key=FinanceTrackerApp._history_sort_key)[offset:]
+        return 200, {"periods": periods, "total": len(rows), "offset": offset, "limit": limit,
+                     "transactions": [dict(trans) for trans in page]}
+
+    # --- Writing ---
+
+    @staticmethod
+    def _amount(body):
+        amount = body.get("amount")
+        if isinstance(amount, bool) or not isinstance(amount, (int, float, str)):
+            raise ValueError("amount must be a number.")
+        try:
+            return round(float(amount), 2)
+        except ValueError:
+            raise ValueError("amount must be a number.")
+
+    def _save(self, added):
+        """Saves (caller holds the write lock). If that fails, `added` is taken out again so memory matches the disk."""
+        app = self.server.app
+        try:
+            conflicts = app._save_to_disk()
+        except Exception:
+            app._remove_transactions([str(trans["id"]) for trans in added])
+            raise
+        if conflicts is not None:
+            app._after_external_merge(conflicts)
+
+    def post_transaction(self, body):
+        app = self.server.app
+        amount = self._amount(body)
+        date_str, account = str(body.get("date") or date.today().isoformat()), str(body.get("account") or "")
+        description, trans_type = str(body.get("description") or "").strip(), str(body.get("type") or "")
+        with self.server.lock.write():
+            category = body.get("category")
+            category = app._validated_entry(date_str, account, description, amount, trans_type,
+                                            str(category) if category is not None else None)
+            splits = app._checked_splits(trans_type, body.get("splits"), amount)
+            if splits: category = split_category(splits)
+            if trans_type == TRANS_EXPENSE and not body.get("force"): # What the app would ask about
+                balance = app.calculate_balances()[0].get(account, 0.0)
+                if balance < amount:
+                    return 409, {"error": f"Insufficient funds: '{account}' has {balance:,.2f}. Send \"force\": true to add it anyway."}
+                probe = {"account": account, "date": date_str, "amount": amount, "type": trans_type, "category": category}
+                if splits: probe["splits"] = splits
+                for (month, budget_category), extra in app._budget_amounts(probe):
+                    overrun = app.budget_overrun(month, budget_category, extra)
+                    if overrun:
+                        return 409, {"error": f"Over budget: '{budget_category}' spending for {month} would be {overrun[0]:,.2f} of {overrun[1]:,.2f}. Send \"force\": true to add it anyway."}
+            transaction = {
+                "date": date_str, "account": account, "description": description,
+                "amount": amount, "type": trans_type, "category": category,
+                "id": datetime.now().timestamp()
+            }
+            if splits: transaction["splits"] = splits
+            app._add_transactions([transaction])
+            self._save([transaction])
+        return 201, {"transaction": transaction}
+
+    def post_transfer(self, body):
+        app = self.server.app
+        amount = self._amount(body)
+        date_str = str(body.get("date") or date.today().isoformat())
+        from_account, to_account = str(body.get("from") or ""), str(body.get("to") or "")
+        with self.server.lock.write():
+            legs = app._transfer_legs(date_str, from_account, to_account, amount)
+            balance = app.calculate_balances()[0].get(from_account, 0.0)
+            if balance < amount and not body.get("force"):
+                return 409, {"error": f"Insufficient funds: '{from_account}' has {balance:,.2f}. Send \"force\": true to transfer anyway."}
+            app._add_transactions(list(legs))
+            self._save(legs)
+        return 201, {"transactions": list(legs)}
+
+
+def serve_api(host=API_HOST, port=API_PORT, repair=False, data_file=None):
+    """Serves the JSON API over the ledger (FINANCE_DATA_FILE by default) until interrupted (Ctrl+C)."""
+    app = FinanceTrackerApp(None, repair=repair, data_file=data_file)
+    if app.dirty_partitions:
+        app._save_to_disk() # Recurring transactions added on startup, or a ledger just split into years
+    server = LedgerAPIServer((host, port), app)
+    threading.Thread(target=server.poll_changes, daemon=True).start()
+    print(f"Serving {app.data_file} on http://{host}:{server.server_port} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stopping.set()
+        server.server_close()
+        with server.lock.write():
+            if app.dirty_partitions: app._save_to_disk()
+
+
 # --- Main Execution ---
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-Account Finance Tracker")
+    parser.add_argument("--convert", nargs=2, metavar=("SOURCE", "TARGET"),
+                        help=f"Convert a ledger file between JSON and the binary format (TARGET ending in {BINARY_LEDGER_EXT} = binary) and exit")
+    parser.add_argument("--compression", choices=["gzip", "lzma"], default=None,
+                        help="Compression for binary output (used with --convert)")
+    parser.add_argument("--ledger", metavar="FILE",
+                        help=f"Ledger file to open (default: the profile open last, else {FINANCE_DATA_FILE})")
+    parser.add_argument("--repair", action="store_true",
+                        help="Validate every stored transaction (ignoring checksums) and rewrite the ledger files")
+    parser.add_argument("--serve", action="store_true",
+                        help="Run the local JSON API over the ledger instead of the window (see README)")
+    parser.add_argument("--host", default=API_HOST, help=f"Address for --serve (default {API_HOST})")
+    parser.add_argument("--port", type=int, default=API_PORT, help=f"Port for --serve (default {API_PORT})")
+    parser.add_argument("--close-before", metavar="YYYY-MM-DD",
+                        help="Archive every transaction before this date behind opening balances and exit")
+    parser.add_argument("--import-fx", metavar="CSV",
+                        help=f"Import exchange rates (date,currency,rate per 1 {BASE_CURRENCY}) into {FX_RATES_FILE} and exit")
+    args = parser.parse_args()
+
+    if args.import_fx:
+        fx_rates = FxRates.load(FX_RATES_FILE)
+        count = fx_rates.import_csv(args.import_fx)
+        fx_rates.save(FX_RATES_FILE)
+        print(f"Imported {count} exchange rate(s) into {FX_RATES_FILE}")
+        sys.exit(0)
+
+    if args.convert:
+        source_path, target_path = args.convert
+        converted = convert_ledger_file(source_path, target_path, compression=args.compression)
+        count = len(converted if isinstance(converted, list) else converted.get("transactions", []))
+        print(f"Converted {count} transaction(s): {source_path} -> {target_path}")
+        sys.exit(0)
+
+    if args.serve:
+        serve_api(args.host, args.port, repair=args.repair, data_file=args.ledger)
+        sys.exit(0)
+
+    if args.close_before:
+        app = FinanceTrackerApp(None, repair=args.repair, data_file=args.ledger)
+        try:
+            entry = app.close_period(args.close_before)
+        except (ValueError, OSError) as e:
+            print(f"Could not close the period: {e}")
+            sys.exit(1)
+        print(f"Archived {entry['count']} transaction(s) before {entry['cutoff']} in {os.path.join(app._closed_period_dir(), entry['file'])}")
+        sys.exit(0)
+
     # root = tk.Tk() # Use tk.Tk if ttkbootstrap Window causes issues with dialogs
     root = tb.Window(themename=DEFAULT_THEME)
     root.bell = lambda: None # Keep bell disabled
-    app = FinanceTrackerApp(root)
+    app = FinanceTrackerApp(root, repair=args.repair, data_file=args.ledger or LedgerProfiles.load(PROFILES_FILE).current)
     root.mainloop()
\ No newline at end of file
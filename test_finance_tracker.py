@@ -0,0 +1,413 @@
+"""Regression checks for the ledger logic of finance_tracker.py, run without a window:
+
+    python -m unittest test_finance_tracker
+"""
+import json
+import os
+import tempfile
+import unittest
+from datetime import date
+
+try:
+    import finance_tracker as ft
+except ImportError: # ttkbootstrap isn't installed
+    ft = None
+
+
+@unittest.skipIf(ft is None, "finance_tracker needs ttkbootstrap")
+class LedgerTestCase(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._folder = tempfile.TemporaryDirectory()
+        os.chdir(self._folder.name) # The ledger and exchange-rate files are looked up here
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._folder.cleanup()
+
+    @staticmethod
+    def write_ledger(rows, categories=("Uncategorized", "Food", "Home")):
+        with open(ft.FINANCE_DATA_FILE, 'w', encoding='utf-8') as f:
+            json.dump({"accounts": ["Cash"], "categories": list(categories), "transactions": rows}, f)
+
+    @staticmethod
+    def row(trans_id, day, amount=10.0, trans_type="Expense", category="Food"):
+        return {"id": trans_id, "date": day, "account": "Cash", "description": trans_id, "amount": amount,
+                "type": trans_type, "category": category if trans_type == "Expense" else None}
+
+
+class ExternalMergeTest(LedgerTestCase):
+    def test_row_moved_to_an_earlier_year_elsewhere(self):
+        this_year, last_year = date.today().year, date.today().year - 1
+        self.write_ledger([self.row("income", f"{this_year}-01-02", 500.0, "Income"),
+                           self.row("moved", f"{this_year}-02-01"), self.row("other", f"{this_year}-02-02"),
+                           self.row("old", f"{last_year}-05-01")])
+        here = ft.FinanceTrackerApp(None)
+        here._save_to_disk() # Split into yearly files
+        elsewhere = ft.FinanceTrackerApp(None)
+        moved = elsewhere.transactions_by_id["moved"]
+        elsewhere._replace_transaction(moved, dict(moved, date=f"{last_year}-12-30"))
+        elsewhere._save_to_disk()
+
+        with ft.LedgerLock(here.data_file, exclusive=False):
+            self.assertEqual(here._merge_external_changes(), []) # A move, not a conflict
+        self.assertEqual(here.transactions_by_id["moved"]["date"], f"{last_year}-12-30")
+        other = here.transactions_by_id["other"]
+        here._replace_transaction(other, dict(other, amount=20.0))
+        self.assertIsNone(here._save_to_disk())
+
+        reloaded = ft.FinanceTrackerApp(None)
+        self.assertEqual(reloaded.transactions_by_id["moved"]["date"], f"{last_year}-12-30")
+        self.assertEqual(sum(trans["id"] == "moved" for trans in reloaded.transactions), 1)
+
+    def test_row_moved_to_a_later_year_elsewhere(self):
+        this_year, last_year = date.today().year, date.today().year - 1
+        self.write_ledger([self.row("income", f"{last_year}-01-02", 500.0, "Income"),
+                           self.row("moved", f"{last_year}-02-01"), self.row("new", f"{this_year}-01-05")])
+        here = ft.FinanceTrackerApp(None)
+        here._save_to_disk()
+        elsewhere = ft.FinanceTrackerApp(None)
+        moved = elsewhere.transactions_by_id["moved"]
+        elsewhere._replace_transaction(moved, dict(moved, date=f"{this_year}-01-10"))
+        elsewhere._save_to_disk()
+
+        with ft.LedgerLock(here.data_file, exclusive=False):
+            self.assertEqual(here._merge_external_changes(), [])
+        self.assertEqual(here.transactions_by_id["moved"]["date"], f"{this_year}-01-10")
+        self.assertEqual(sum(trans["id"] == "moved" for trans in here.transactions), 1)
+
+
+class UnreadablePartitionTest(LedgerTestCase):
+    def test_year_that_could_not_be_read_is_never_overwritten(self):
+        this_year, last_year = date.today().year, date.today().year - 1
+        self.write_ledger([self.row("income", f"{this_year}-01-02", 500.0, "Income"),
+                           self.row("old", f"{last_year}-05-01"), self.row("older", f"{last_year}-06-01")])
+        ft.FinanceTrackerApp(None)._save_to_disk() # Split into yearly files
+        app = ft.FinanceTrackerApp(None)
+        path = app._partition_path(str(last_year))
+        with open(path, 'wb') as f:
+            f.write(b"{not json")
+        with open(path, 'rb') as f:
+            corrupt = f.read()
+
+        app = ft.FinanceTrackerApp(None)
+        self.assertNotIn(str(last_year), app.loaded_partitions)
+        with self.assertRaises(ValueError):
+            app._add_transactions([self.row("new", f"{last_year}-07-01")])
+        self.assertNotIn("new", app.transactions_by_id)
+        app.dirty_partitions.add(str(last_year)) # Even if something marked it changed
+        app._save_to_disk()
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), corrupt)
+
+
+class ClosePeriodTest(LedgerTestCase):
+    def test_closing_balance_rows(self):
+        old_year, this_year = date.today().year - 3, date.today().year
+        cutoff = f"{old_year + 1}-01-01"
+        rows = [self.row("pay", f"{old_year}-01-05", 1000.0, "Income"), self.row("food", f"{old_year}-02-01", 120.5),
+                dict(self.row("bank in", f"{old_year}-03-01", 300.0, "Income"), account="Bank"),
+                dict(self.row("bank out", f"{old_year}-04-01", 300.0), account="Bank"),
+                dict(self.row("card", f"{old_year}-05-01", 80.0), account="Card"),
+                self.row("kept", f"{this_year}-01-02", 10.0)]
+        with open(ft.FINANCE_DATA_FILE, 'w', encoding='utf-8') as f:
+            json.dump({"accounts": ["Bank", "Card", "Cash"], "categories": ["Uncategorized", "Food"], "transactions": rows}, f)
+        app = ft.FinanceTrackerApp(None)
+        balances_before, _ = app.calculate_balances()
+
+        entry = app.close_period(cutoff, category_totals=False)
+        self.assertEqual((entry["cutoff"], entry["count"]), (cutoff, 5))
+        opening = sorted((t["account"], t["type"], t["amount"], t["date"]) for t in app.transactions if t.get("opening_balance"))
+        self.assertEqual(opening, [("Card", "Expense", 80.0, cutoff), ("Cash", "Income", 879.5, cutoff)]) # Bank nets to zero
+        self.assertEqual(sorted(t["id"] for t in app.transactions if not t.get("opening_balance")), ["kept"])
+        self.assertEqual(app.calculate_balances()[0], balances_before)
+        with self.assertRaises(ValueError):
+            app.close_period(f"{old_year}-06-01")
+
+        reloaded = ft.FinanceTrackerApp(None)
+        self.assertEqual(reloaded.calculate_balances()[0], balances_before)
+        self.assertEqual(reloaded.closed_through(), cutoff)
+        self.assertEqual(len(reloaded.search_closed_periods(reloaded.closed_periods, None)), 5)
+
+
+@unittest.skipIf(ft is None, "finance_tracker needs ttkbootstrap")
+class BinaryLedgerTest(unittest.TestCase):
+    ROWS = [
+        {"date": "2025-01-02", "account": "Cash", "description": "Lunch", "amount": 12.5, "type": "Expense",
+         "category": "Food", "id": 1735776000.123456},
+        {"date": "2025-01-03", "account": "Cash", "description": "Salary", "amount": 900, "type": "Income",
+         "category": None, "id": "1735862400.000001"},
+        {"date": "2025-01-04", "account": "Cash", "description": "Transfer to Bank", "amount": 50.0, "type": "Expense",
+         "category": None, "id": "tf_out_1", "transfer_id": "tf_1"},
+        {"date": "2025-01-04", "account": "Bank", "description": "Transfer from Cash", "amount": 50.0, "type": "Income",
+         "category": None, "id": "tf_in_1", "transfer_id": "tf_1", "reconciled": True},
+        {"date": "2025-01-05", "account": "Cash", "description": "Rent", "amount": 300.0, "type": "Expense",
+         "category": "Home", "id": "rec_rent_2025-01-05", "schedule_id": "rent",
+         "splits": [["Home", 250.0], ["Food", 50.0]]},
+        {"date": "2025-1-6", "account": "Cash", "description": "Odd date", "amount": 1.0, "type": "Expense", "id": 7},
+        {"note": "not a transaction"},
+    ]
+
+    def test_round_trip(self):
+        for data in ({"transactions": self.ROWS, "accounts": ["Cash", "Bank"]}, self.ROWS, {"transactions": []}):
+            for compression in (None, "gzip", "lzma"):
+                with self.subTest(compression=compression):
+                    decoded = ft.decode_binary_ledger(ft.encode_binary_ledger(data, compression))
+                    self.assertEqual(decoded, data)
+                    if isinstance(data, dict) and data["transactions"]:
+                        self.assertEqual([type(t.get("id")) for t in decoded["transactions"]],
+                                         [type(t.get("id")) for t in self.ROWS])
+
+    def test_decoded_extras_are_not_shared(self):
+        rows = [dict(self.ROWS[3], id=f"tf_in_{n}") for n in range(2)] + [dict(self.ROWS[4], id=f"r{n}") for n in range(2)]
+        decoded = ft.decode_binary_ledger(ft.encode_binary_ledger(rows))
+        decoded[0]["reconciled"] = False
+        decoded[2]["splits"].append(["Food", 1.0])
+        self.assertTrue(decoded[1]["reconciled"])
+        self.assertEqual(decoded[3]["splits"], self.ROWS[4]["splits"])
+
+    def test_mapped_ledger_round_trip(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "2025.ftm")
+            ft.MappedLedger.create(path, {"transactions": self.ROWS[:4]})
+            with ft.MappedLedger(path) as ledger:
+                ledger.append(self.ROWS[4:])
+                self.assertEqual(ledger.to_ledger(), {"transactions": self.ROWS})
+
+
+class MappedPartitionTest(LedgerTestCase):
+    def setUp(self):
+        super().setUp()
+        self._format, ft.LEDGER_FORMAT = ft.LEDGER_FORMAT, "mmap"
+
+    def tearDown(self):
+        ft.LEDGER_FORMAT = self._format
+        super().tearDown()
+
+    def test_archived_years_are_summed_in_place(self):
+        old_year, this_year = date.today().year - 5, date.today().year
+        self.write_ledger([self.row("start", f"{old_year}-01-01", 1000.0, "Income"), self.row("a", f"{old_year}-02-10"),
+                           self.row("b", f"{old_year}-03-31", 25.0), self.row("c", f"{old_year + 1}-01-15", 40.0),
+                           self.row("new", f"{this_year}-01-02")])
+        ft.FinanceTrackerApp(None)._save_to_disk()
+        app = ft.FinanceTrackerApp(None)
+        series = app.net_worth_history(f"{old_year}-01-01", f"{old_year + 1}-02-28")
+        self.assertNotIn(str(old_year), app.loaded_partitions)
+        self.assertEqual(series["balances"]["Cash"][:3], [1000.0, 990.0, 965.0])
+        self.assertEqual(series["balances"]["Cash"][-2:], [925.0, 925.0])
+
+    def test_appends_keep_the_checksum(self):
+        this_year = date.today().year
+        self.write_ledger([self.row("a", f"{this_year}-01-02")])
+        ft.FinanceTrackerApp(None)._save_to_disk()
+        app = ft.FinanceTrackerApp(None)
+        app._add_transactions([self.row("b", f"{this_year}-01-03")])
+        app._save_to_disk()
+        entry = app.partitions[str(this_year)]
+        with ft.MappedLedger(app._partition_path(str(this_year))) as ledger:
+            self.assertEqual((len(ledger), ledger.content_crc()), (2, entry["content_crc"]))
+
+
+@unittest.skipIf(ft is None, "finance_tracker needs ttkbootstrap")
+class CategoryRulesTest(unittest.TestCase):
+    def test_group_number_references_are_rejected(self):
+        for pattern in (r"(a)\1", r"(a)(?(1)b|c)"):
+            with self.assertRaises(ValueError):
+                ft.CategoryRules.validate({"category": "B", "pattern": pattern})
+        ft.CategoryRules.validate({"category": "B", "pattern": r"\\1|\101"}) # Escaped backslash, octal escape
+
+    def test_saved_rule_with_a_backreference_is_skipped(self):
+        rules = ft.CategoryRules([{"category": "A", "keywords": ["zzz"]}, {"category": "B", "pattern": r"(a)\1"},
+                                  {"category": "C", "keywords": ["a"]}])
+        self.assertEqual(rules.category_for({"description": "aa", "account": "Cash", "amount": 1.0}), "C")
+
+
+@unittest.skipIf(ft is None, "finance_tracker needs ttkbootstrap")
+class DescriptionIndexTest(unittest.TestCase):
+    @staticmethod
+    def use(index, description, day):
+        index.update({"description": description, "date": day, "type": "Expense", "account": "Cash",
+                      "category": "Food", "amount": 1.0})
+
+    def test_matches_ranked_below_many_others_are_found(self):
+        index = ft.DescriptionIndex()
+        for i in range(ft.AUTOCOMPLETE_RANGE_SCAN * 3):
+            self.use(index, f"zshop {i}", "2026-05-01")
+        for i in range(ft.AUTOCOMPLETE_RANGE_SCAN + 10):
+            self.use(index, f"zz old {i}", "2012-05-01")
+        self.use(index, "zz old 7", "2012-06-01") # Used twice: ranks first among the old ones
+        self.assertEqual(index.suggest("zz", limit=2)[0][0], "zz old 7")
+        self.assertEqual(len(index.suggest("zz old", limit=5)), 5)
+        self.assertEqual(index.suggest("Z")[0][0].split()[0], "zshop")
+
+
+@unittest.skipIf(ft is None, "finance_tracker needs ttkbootstrap")
+class QueryCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = ft.QueryCache()
+        self.cache.put("march", 1, "m", date_range=("2026-03-01", "2026-03-31"))
+        self.cache.put("april", 1, "a", date_range=("2026-04-01", "2026-04-30"))
+        self.cache.put("from april", 1, "f", date_range=("2026-04-01", None))
+        self.cache.put("all", 1, "*")
+
+    def valid(self, version):
+        return sorted(key for key in ("march", "april", "from april", "all") if self.cache.get(key, version) is not None)
+
+    def test_only_entries_covering_a_changed_date_are_dropped(self):
+        self.cache.invalidate(1, 2, dates=["2026-03-31"])
+        self.assertEqual(self.valid(2), ["april", "from april"])
+        self.cache.invalidate(2, 3, dates=["2026-05-02", "2026-01-01"])
+        self.assertEqual(self.valid(3), ["april"])
+
+    def test_stale_entries_and_unknown_dates_drop_everything(self):
+        self.cache.invalidate(5, 6, dates=["2020-01-01"]) # Entries are at version 1, not 5
+        self.assertEqual(self.valid(6), [])
+        self.cache.put("march", 6, "m", date_range=("2026-03-01", "2026-03-31"))
+        self.cache.invalidate(6, 7) # Dates unknown
+        self.assertEqual(self.valid(7), [])
+
+    def test_range_invalidation_drops_overlapping_entries(self):
+        self.cache.invalidate_range(1, 2, "2026-02-15", "2026-03-01")
+        self.assertEqual(self.valid(2), ["april", "from april"])
+        self.cache.invalidate_range(2, 3, "2026-05-01", "2026-05-31")
+        self.assertEqual(self.valid(3), ["april"])
+        self.assertEqual(self.cache.stats()["entries"], 1)
+
+    def test_stats_count_hits_misses_and_drops(self):
+        self.cache.get("march", 1)
+        self.cache.get("march", 2) # Stale version
+        self.cache.invalidate(1, 2, dates=["2026-04-15"])
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["hit_rate"]), (1, 1, 0.5))
+        self.assertEqual((stats["entries"], stats["invalidations"]), (1, 3)) # Only march is outside April
+
+
+@unittest.skipIf(ft is None, "finance_tracker needs ttkbootstrap")
+class FilterQueryTest(unittest.TestCase):
+    @staticmethod
+    def trans(account="Cash", amount=50.0, day="2026-03-10", description="Lunch", **extra):
+        return dict({"date": day, "account": account, "description": description, "amount": amount,
+                     "type": "Expense", "category": "Food"}, **extra)
+
+    def matching(self, text, rows):
+        matches = ft.FilterQuery.get(text).matches
+        return [i for i, trans in enumerate(rows) if matches(trans)]
+
+    def test_and_binds_tighter_than_or(self):
+        rows = [self.trans("Cash", 50.0), self.trans("Bank", 50.0), self.trans("Bank", 500.0)]
+        self.assertEqual(self.matching("account = Cash or account = Bank and amount > 100", rows), [0, 2])
+        self.assertEqual(self.matching("(account = Cash or account = Bank) and amount > 100", rows), [2])
+        self.assertEqual(self.matching("not account = Cash and amount < 100", rows), [1])
+        self.assertEqual(ft.FilterQuery.get("account = Cash or account = Bank and amount > 100").text,
+                         "account = cash or (account = bank and amount > 100)")
+
+    def test_quoted_strings(self):
+        rows = [self.trans(description='Say "hi" to Grab'), self.trans(description="Grab ride"),
+                self.trans(category="Food & Drink")]
+        self.assertEqual(self.matching(r'desc ~ "say \"hi\""', rows), [0])
+        self.assertEqual(self.matching("desc = 'GRAB RIDE'", rows), [1])
+        self.assertEqual(self.matching('category in (Rent, "food & drink")', rows), [2])
+        self.assertEqual(self.matching('desc ~ "and"', rows), [])
+
+    def test_date_comparisons(self):
+        rows = [self.trans(day="2025-12-31"), self.trans(day="2026-03-01"), self.trans(day="2026-03-31"),
+                self.trans(day="2026-04-01")]
+        self.assertEqual(self.matching("date = 2026-03", rows), [1, 2])
+        self.assertEqual(self.matching("date >= 2026", rows), [1, 2, 3])
+        self.assertEqual(self.matching("date < 2026-03-31", rows), [0, 1])
+        self.assertEqual(self.matching("date != 2026-03", rows), [0, 3])
+        query = ft.FilterQuery.get("date >= 2025 and date < 2025-07-15")
+        self.assertEqual(query.date_range, ("2025-01-01", "2025-07-14"))
+        self.assertEqual(ft.FilterQuery.get("date = 2026-03 or amount > 5").date_range, (None, None))
+
+    def test_malformed_queries_are_rejected(self):
+        for text in ("amount >", "amount > abc", "(account = Cash", "amount = 5 )", "date = 2026-13", "foo = 1",
+                     "account < Cash", 'desc ~ "("', "and", '"unterminated', "transfer = maybe"):
+            with self.subTest(text=text), self.assertRaises(ValueError):
+                ft.FilterQuery.get(text)
+
+
+@unittest.skipIf(ft is None, "finance_tracker needs ttkbootstrap")
+class ReconcileStatementTest(unittest.TestCase):
+    @staticmethod
+    def reconcile(ledger, statement, tolerance_days=0):
+        """reconcile_statement's results in index order (it returns them in amount order)."""
+        return tuple(sorted(part) for part in ft.reconcile_statement(ledger, statement, tolerance_days))
+
+    def test_duplicates_pair_one_to_one(self):
+        ledger = [(-12.5, "2026-03-01"), (-12.5, "2026-03-01"), (-12.5, "2026-03-01")]
+        statement = [(-12.5, "2026-03-01"), (-12.5, "2026-03-01")]
+        matches, ledger_only, statement_only = ft.reconcile_statement(ledger, statement)
+        self.assertEqual(len(matches), 2)
+        self.assertEqual(len({i for i, _ in matches}), 2)
+        self.assertEqual(sorted(j for _, j in matches), [0, 1])
+        self.assertEqual(len(ledger_only), 1)
+        self.assertEqual(statement_only, [])
+
+    def test_amounts_match_to_the_cent(self):
+        ledger = [(0.1 + 0.2, "2026-03-01"), (-10.0, "2026-03-02")]
+        statement = [(0.3, "2026-03-01"), (-10.01, "2026-03-02")]
+        self.assertEqual(self.reconcile(ledger, statement), ([(0, 0)], [1], [1]))
+
+    def test_date_tolerance(self):
+        ledger = [(100.0, "2026-03-01"), (-5.0, "2026-03-10")]
+        statement = [(100.0, "2026-03-03"), (-5.0, "2026-03-14")]
+        self.assertEqual(self.reconcile(ledger, statement), ([], [0, 1], [0, 1]))
+        self.assertEqual(self.reconcile(ledger, statement, tolerance_days=2), ([(0, 0)], [1], [1]))
+        self.assertEqual(self.reconcile(ledger, statement, tolerance_days=4), ([(0, 0), (1, 1)], [], []))
+
+    def test_unmatched_rows_on_both_sides(self):
+        ledger = [(-20.0, "2026-03-05"), (-7.25, "2026-03-06"), (300.0, "2026-03-07")]
+        statement = [(-7.25, "2026-03-06"), (-3.0, "2026-03-08"), (300.0, "2026-03-07"), (45.0, "2026-03-09")]
+        self.assertEqual(self.reconcile(ledger, statement), ([(1, 0), (2, 2)], [0], [1, 3]))
+        self.assertEqual(self.reconcile([], statement), ([], [], [0, 1, 2, 3]))
+
+
+@unittest.skipIf(ft is None, "finance_tracker needs ttkbootstrap")
+class LttbDownsampleTest(unittest.TestCase):
+    def test_keeps_endpoints_and_peaks(self):
+        points = [(x, 0.0) for x in range(100)]
+        points[37] = (37, 50.0)
+        points[71] = (71, -50.0)
+        sampled = ft.lttb_downsample(points, 10)
+        self.assertEqual(len(sampled), 10)
+        self.assertEqual((sampled[0], sampled[-1]), (points[0], points[-1]))
+        self.assertIn((37, 50.0), sampled)
+        self.assertIn((71, -50.0), sampled)
+        self.assertEqual([x for x, _ in sampled], sorted(x for x, _ in sampled))
+
+    def test_small_inputs_are_returned_unchanged(self):
+        points = [(x, float(x * x)) for x in range(5)]
+        self.assertEqual(ft.lttb_downsample(points, 5), points)
+        self.assertEqual(ft.lttb_downsample(points, 2), points)
+        self.assertEqual(ft.lttb_downsample(points, 3), [points[0], points[2], points[4]])
+
+
+@unittest.skipIf(ft is None, "finance_tracker needs ttkbootstrap")
+class ScheduleOccurrencesTest(unittest.TestCase):
+    def occurrences(self, after=None, until=None, **schedule):
+        return list(ft.schedule_occurrences(schedule, after=after, until=until))
+
+    def test_month_ends_are_clamped(self):
+        self.assertEqual(self.occurrences(until="2026-05-31", frequency="Monthly", start="2026-01-31"),
+                         ["2026-01-31", "2026-02-28", "2026-03-31", "2026-04-30", "2026-05-31"])
+        self.assertEqual(self.occurrences(after="2024-02-29", until="2028-03-01", frequency="Yearly", start="2024-02-29"),
+                         ["2025-02-28", "2026-02-28", "2027-02-28", "2028-02-29"])
+
+    def test_bounds_interval_and_end(self):
+        schedule = dict(frequency="Weekly", start="2026-01-01", interval=2, end="2026-02-20")
+        self.assertEqual(self.occurrences(after="2026-01-01", **schedule), ["2026-01-15", "2026-01-29", "2026-02-12"])
+        self.assertEqual(self.occurrences(after="2026-01-14", until="2026-01-29", **schedule), ["2026-01-15", "2026-01-29"])
+        self.assertEqual(self.occurrences(after="2026-02-12", **schedule), [])
+
+    def test_late_after_skips_ahead(self):
+        days = self.occurrences(after="2026-06-09", until="2026-06-12", frequency="Daily", start="2000-01-01", interval=3)
+        self.assertEqual(days, ["2026-06-10"])
+
+    def test_unknown_frequency(self):
+        with self.assertRaises(ValueError):
+            self.occurrences(until="2026-01-01", frequency="Hourly", start="2025-01-01")
+
+
+if __name__ == "__main__":
+    unittest.main()